@@ -1,4 +1,23 @@
+import argparse
+
 from be import serve
 
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the bookstore backend")
+    parser.add_argument("--host", default=None, help="Listen address (default: BOOKSTORE_HOST or 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=None, help="Listen port (default: BOOKSTORE_PORT or 5000)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes; >1 serves with gunicorn (default: BOOKSTORE_WORKERS or 1)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Threads per worker; in asgi mode, WSGI bridge threads "
+                             "(default: BOOKSTORE_THREADS or 8 / BOOKSTORE_ASGI_BRIDGE_THREADS or 32)")
+    parser.add_argument("--mode", choices=["wsgi", "asgi"], default=None,
+                        help="Serving mode; asgi runs on uvicorn (default: BOOKSTORE_SERVE_MODE or wsgi)")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    serve.be_run()
+    args = parse_args()
+    serve.be_run(host=args.host, port=args.port, workers=args.workers, threads=args.threads,
+                  mode=args.mode)
@@ -0,0 +1,289 @@
+"""
+ASGI 服务入口：与 WSGI 版本暴露相同的路由与 JSON 协议。
+
+- /auth/* 与买家只读接口（book_detail、orders、search_books、search_books_advanced、suggest）
+  是原生异步接口，经 AsyncMongoClient 访问数据库，等待 MongoDB 时不占用线程，单进程即可同时挂起大量请求；
+  参数校验、查询构造与响应格式调用同步模型的纯函数（Buyer._search_request、user.new_user_doc 等），
+  异步版本只替换数据库访问
+- 其余路由（下单、支付、收货、取消、卖家上架/发货等多步写入流程）不提供异步版本，固定通过 WSGI 桥接
+  交给 create_app() 在线程池中执行，业务逻辑与补偿/事务语义只维护一份；桥接线程数为 Asgi_Bridge_Threads，
+  即这些写入路由同时执行的上限，超出的请求在事件循环中排队等待
+- 原生接口抛出的异常按模型层的规则转为 528（数据库）/530 响应
+
+运行：python -m be.app --mode asgi（需 pip install uvicorn）
+"""
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pymongo
+
+from be import conf
+from be.model import error
+from be.model import store
+from be.model.async_buyer import AsyncBuyer
+from be.model.async_user import AsyncUser
+
+
+class _Request:
+    def __init__(self, scope: dict, body: bytes):
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        self.body = body
+        self.json = None
+
+
+async def login(request: _Request):
+    u = AsyncUser()
+    code, message, token = await u.login(
+        user_id=request.json.get("user_id", ""),
+        password=request.json.get("password", ""),
+        terminal=request.json.get("terminal", ""),
+    )
+    return {"message": message, "token": token}, code
+
+
+async def logout(request: _Request):
+    u = AsyncUser()
+    code, message = await u.logout(user_id=request.json.get("user_id"), token=request.headers.get("token"))
+    return {"message": message}, code
+
+
+async def register(request: _Request):
+    u = AsyncUser()
+    code, message = await u.register(
+        user_id=request.json.get("user_id", ""), password=request.json.get("password", "")
+    )
+    return {"message": message}, code
+
+
+async def unregister(request: _Request):
+    u = AsyncUser()
+    code, message = await u.unregister(
+        user_id=request.json.get("user_id", ""), password=request.json.get("password", "")
+    )
+    return {"message": message}, code
+
+
+async def change_password(request: _Request):
+    u = AsyncUser()
+    code, message = await u.change_password(
+        user_id=request.json.get("user_id", ""),
+        old_password=request.json.get("oldPassword", ""),
+        new_password=request.json.get("newPassword", ""),
+    )
+    return {"message": message}, code
+
+
+async def get_book_detail(request: _Request):
+    b = AsyncBuyer()
+    code, message, result = await b.get_book_detail(request.json.get("book_id"))
+    return {"message": message, "result": result}, code
+
+
+async def query_orders(request: _Request):
+    b = AsyncBuyer()
+    code, message, result = await b.query_orders(
+        request.json.get("user_id"), request.json.get("status"), request.json.get("page", 1),
+        request.json.get("cursor"), request.json.get("with_total"),
+    )
+    return {"message": message, "result": result}, code
+
+
+async def search_books(request: _Request):
+    b = AsyncBuyer()
+    code, message, result = await b.search_books(
+        request.json.get("keyword"), request.json.get("store_id"), request.json.get("page", 1),
+        request.json.get("cursor"), request.json.get("with_total"), bool(request.json.get("facets", False)),
+        request.json.get("fields"),
+    )
+    return {"message": message, "result": result}, code
+
+
+async def search_books_advanced(request: _Request):
+    b = AsyncBuyer()
+    code, message, result = await b.search_books_advanced(
+        request.json.get("title_prefix"), request.json.get("tags"), request.json.get("store_id"),
+        request.json.get("page", 1), request.json.get("cursor"), request.json.get("with_total"),
+        bool(request.json.get("facets", False)), request.json.get("fields"),
+    )
+    return {"message": message, "result": result}, code
+
+
+async def suggest(request: _Request):
+    b = AsyncBuyer()
+    code, message, result = await b.suggest(request.json.get("prefix"), request.json.get("limit", 10))
+    return {"message": message, "result": result}, code
+
+
+ASYNC_ROUTES = {
+    ("POST", "/auth/login"): login,
+    ("POST", "/auth/logout"): logout,
+    ("POST", "/auth/register"): register,
+    ("POST", "/auth/unregister"): unregister,
+    ("POST", "/auth/password"): change_password,
+    ("POST", "/buyer/book_detail"): get_book_detail,
+    ("POST", "/buyer/orders"): query_orders,
+    ("POST", "/buyer/search_books"): search_books,
+    ("POST", "/buyer/search_books_advanced"): search_books_advanced,
+    ("POST", "/buyer/suggest"): suggest,
+}
+
+
+class AsgiApp:
+    """最小 ASGI 应用：原生异步路由优先，其余请求桥接到 WSGI 应用。"""
+
+    def __init__(self, wsgi_app, threads: int, on_startup=None, on_shutdown=None):
+        self.wsgi_app = wsgi_app
+        self.routes = dict(ASYNC_ROUTES)
+        self.on_startup = on_startup
+        self.on_shutdown = on_shutdown
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="be-wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        body = await self._read_body(receive)
+        handler = self.routes.get((scope["method"], scope["path"]))
+        if handler is None:
+            status, headers, payload = await self._call_wsgi(scope, body)
+        else:
+            status, headers, payload = await self._call_async(handler, scope, body)
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": payload})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # 异步客户端必须在服务的事件循环内创建
+                store.get_async_db()
+                if self.on_startup is not None:
+                    self.on_startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.on_shutdown is not None:
+                    self.on_shutdown()
+                await store.close_async_database()
+                self._executor.shutdown(wait=True)
+                store.close_database()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    @staticmethod
+    def _json_response(payload: dict, status: int):
+        # 与 Flask jsonify 的默认输出一致
+        body = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8") + b"\n"
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        return status, headers, body
+
+    async def _call_async(self, handler, scope, body: bytes):
+        request = _Request(scope, body)
+        if not request.headers.get("content-type", "").startswith("application/json"):
+            return self._json_response({"message": "Unsupported Media Type"}, 415)
+        try:
+            request.json = json.loads(body or b"null")
+        except ValueError:
+            return self._json_response({"message": "Bad Request"}, 400)
+        if not isinstance(request.json, dict):
+            return self._json_response({"message": "Bad Request"}, 400)
+        try:
+            payload, code = await handler(request)
+        except pymongo.errors.PyMongoError as e:
+            code, message, _ = error.exception_db_to_tuple3(e)
+            payload = {"message": message}
+        except Exception as e:
+            # 与模型层一致转为 530；不捕获 BaseException，让 CancelledError 等照常传播
+            code, message, _ = error.exception_to_tuple3(e)
+            payload = {"message": message}
+        return self._json_response(payload, code)
+
+    async def _call_wsgi(self, scope, body: bytes):
+        environ = self._build_environ(scope, body)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run_wsgi, environ)
+
+    def _run_wsgi(self, environ: dict):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            payload = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return response["status"], response["headers"], payload
+
+    @staticmethod
+    def _build_environ(scope: dict, body: bytes) -> dict:
+        server = scope.get("server") or ("127.0.0.1", conf.Serve_Port)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", ""),
+            "PATH_INFO": scope["path"],
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": str(server[0]),
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": "HTTP/{}".format(scope.get("http_version", "1.1")),
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for raw_name, raw_value in scope.get("headers", []):
+            name = raw_name.decode("latin-1").upper().replace("-", "_")
+            value = raw_value.decode("latin-1")
+            if name == "CONTENT_TYPE":
+                environ["CONTENT_TYPE"] = value
+            elif name != "CONTENT_LENGTH":
+                key = "HTTP_" + name
+                environ[key] = environ[key] + "," + value if key in environ else value
+        return environ
+
+
+def create_asgi_app(threads: int = None) -> AsgiApp:
+    """ASGI 应用工厂（uvicorn 多进程模式以 be.asgi:create_asgi_app 在每个工作进程中加载）。"""
+    from be import serve
+
+    on_startup = on_shutdown = None
+    if multiprocessing.parent_process() is not None:
+        # uvicorn 多进程模式的工作进程：端口由主进程监听，生命周期开始即就绪，
+        # /shutdown 请求主进程优雅退出
+        def on_startup():
+            serve.set_shutdown_handler(lambda: os.kill(os.getppid(), signal.SIGTERM))
+            serve._start_background_tasks()
+            serve.server_ready.set()
+
+        def on_shutdown():
+            serve.server_ready.clear()
+            serve._stop_background_tasks()
+
+    return AsgiApp(serve.create_app(), threads or conf.Asgi_Bridge_Threads, on_startup, on_shutdown)
@@ -0,0 +1,118 @@
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# 后端运行配置：默认值面向单机开发环境，均可用 BOOKSTORE_* 环境变量覆盖
+Mongo_URI = os.environ.get("BOOKSTORE_MONGO_URI", "mongodb://localhost:27017/")
+Mongo_DB = os.environ.get("BOOKSTORE_MONGO_DB", "bookstore")
+
+# 多文档事务模式：需要副本集/分片集群；关闭时沿用手写补偿逻辑
+Use_Transaction = _env_bool("BOOKSTORE_USE_TRANSACTION", False)
+
+# 库存存储布局："embedded"（Stores.inventory 数组）或 "collection"（独立 Inventory 集合）
+# 切换到 collection 前先执行 script/migrate_inventory_layout.py
+Inventory_Layout = os.environ.get("BOOKSTORE_INVENTORY_LAYOUT", "embedded")
+
+# 下单即预占库存（条件 $inc 扣减），取消/超时释放，发货仅确认；默认关闭，保持“发货时校验并扣减”的库存语义
+Stock_Reservation = _env_bool("BOOKSTORE_STOCK_RESERVATION", False)
+
+# check_token 验证结果缓存：条目数上限与有效期（秒），任一为 0 关闭缓存
+# 多进程部署时失效只作用于当前进程，TTL 即为其他进程感知登出/改密的最长延迟
+Token_Cache_Size = int(os.environ.get("BOOKSTORE_TOKEN_CACHE_SIZE", "10000"))
+Token_Cache_TTL = float(os.environ.get("BOOKSTORE_TOKEN_CACHE_TTL", "30"))
+
+# 认证模式："session"（token 存于 Users.token，校验时查库比对，每个用户只有一个有效终端）
+# 或 "stateless"（服务端密钥签名、带 exp 与版本号，校验只对照进程内版本表；支持多终端，登出/改密使该用户全部 token 失效）
+Auth_Mode = os.environ.get("BOOKSTORE_AUTH_MODE", "session")
+# stateless 模式的签名密钥；为空时从 Settings 集合读取（首次使用时生成），多进程/多实例共用
+Auth_Secret = os.environ.get("BOOKSTORE_AUTH_SECRET", "")
+# 版本表增量刷新与全量重载间隔（秒）：其他进程的登出/改密最迟 Auth_Version_Refresh 秒后生效，
+# 注销最迟 Auth_Version_Reload 秒后生效（本进程立即生效）
+Auth_Version_Refresh = float(os.environ.get("BOOKSTORE_AUTH_VERSION_REFRESH", "5"))
+Auth_Version_Reload = float(os.environ.get("BOOKSTORE_AUTH_VERSION_RELOAD", "300"))
+
+# 搜索结果缓存：条目数上限与有效期（秒），任一为 0 关闭缓存
+# 上架新书时按店铺版本号失效；多进程部署时失效只作用于当前进程，TTL 即其他进程结果陈旧的上限
+Search_Cache_Size = int(os.environ.get("BOOKSTORE_SEARCH_CACHE_SIZE", "4096"))
+Search_Cache_TTL = float(os.environ.get("BOOKSTORE_SEARCH_CACHE_TTL", "30"))
+
+# HTTP 服务：Serve_Workers 为 1 时在当前进程内以线程池服务（测试/开发，支持 /shutdown）；
+# 大于 1 时使用 gunicorn 多进程（每个进程 Serve_Threads 个线程），需 pip install gunicorn
+Serve_Host = os.environ.get("BOOKSTORE_HOST", "127.0.0.1")
+Serve_Port = int(os.environ.get("BOOKSTORE_PORT", "5000"))
+Serve_Workers = int(os.environ.get("BOOKSTORE_WORKERS", "1"))
+Serve_Threads = int(os.environ.get("BOOKSTORE_THREADS", "8"))
+# 服务模式："wsgi"（Flask，线程/gunicorn 多进程）或 "asgi"（uvicorn，认证与书籍详情走异步驱动），需 pip install uvicorn
+Serve_Mode = os.environ.get("BOOKSTORE_SERVE_MODE", "wsgi")
+# asgi 模式下 WSGI 桥接（下单、支付、发货等未异步化的写入路由）的线程数，即这些路由同时执行的上限；
+# 原生异步路由不受此限制
+Asgi_Bridge_Threads = int(os.environ.get("BOOKSTORE_ASGI_BRIDGE_THREADS", "32"))
+# 优雅退出：收到 SIGTERM 后等待在途请求完成的最长时间（秒）
+Serve_Graceful_Timeout = int(os.environ.get("BOOKSTORE_GRACEFUL_TIMEOUT", "30"))
+
+# 搜索结果计数上限：超过上限时停止计数，只返回 total_count_at_least（上限 + 1）且不给出 total_pages，
+# 避免对大结果集全量计数；0 表示精确计数
+Search_Count_Limit = int(os.environ.get("BOOKSTORE_SEARCH_COUNT_LIMIT", "1000"))
+
+# 店铺内搜索的范围条件："inventory"（读取店铺书目后以 $in 过滤）或 "store_ids"（Books.store_ids 上的索引谓词）
+# store_ids 需显式开启：已有数据先执行 script/backfill_book_store_ids.py，否则回填前上架的书搜不到；
+# 新部署的数据由 add_book 维护 store_ids，可直接开启
+Search_Store_Filter = os.environ.get("BOOKSTORE_SEARCH_STORE_FILTER", "inventory")
+
+# 关键字搜索后端："mongo"（Books 上的 $text 文本索引）或 "memory"（进程内倒排索引，CJK 二元组分词 + BM25）
+# memory 模式首次搜索时从 Books 构建索引，此后每 Search_Index_Refresh 秒重建一次以吸收其他进程的写入（0 表示不重建）
+Search_Backend = os.environ.get("BOOKSTORE_SEARCH_BACKEND", "mongo")
+Search_Index_Refresh = float(os.environ.get("BOOKSTORE_SEARCH_INDEX_REFRESH", "300"))
+
+# 输入联想（/buyer/suggest）索引的条目上限（书名/作者/标签键的总数），构建时优先保留热度高的书
+Suggest_Max_Entries = int(os.environ.get("BOOKSTORE_SUGGEST_MAX_ENTRIES", "200000"))
+
+# 搜索分面（facets=true）：标签/出版社各返回计数最多的前 N 项
+Search_Facet_Limit = int(os.environ.get("BOOKSTORE_SEARCH_FACET_LIMIT", "20"))
+
+# 书籍图片外置存储："gridfs"（MongoDB GridFS 桶 pictures）或 "filesystem"（Picture_Dir 目录）
+# 缩略图最长边像素（需 pip install Pillow，0 表示不生成）；/book/picture 响应的浏览器缓存时长（秒）
+# 已有内嵌图片的 Books 用 script/migrate_pictures.py 迁出
+Picture_Store = os.environ.get("BOOKSTORE_PICTURE_STORE", "gridfs")
+Picture_Dir = os.environ.get("BOOKSTORE_PICTURE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pictures"))
+Picture_Thumb_Size = int(os.environ.get("BOOKSTORE_PICTURE_THUMB_SIZE", "200"))
+Picture_Max_Age = int(os.environ.get("BOOKSTORE_PICTURE_MAX_AGE", "31536000"))
+
+# 批量接口（/seller/add_books、/seller/add_stock_levels）单次请求的条目上限
+Bulk_Max_Items = int(os.environ.get("BOOKSTORE_BULK_MAX_ITEMS", "1000"))
+
+# 超时未支付订单自动取消（/buyer/auto_cancel_timeout）：超时秒数、每批 update_many 的订单数、单次运行处理上限（必须为正整数）
+Order_Unpaid_Timeout = float(os.environ.get("BOOKSTORE_ORDER_UNPAID_TIMEOUT", str(24 * 3600)))
+Auto_Cancel_Batch_Size = int(os.environ.get("BOOKSTORE_AUTO_CANCEL_BATCH_SIZE", "500"))
+Auto_Cancel_Max_Orders = int(os.environ.get("BOOKSTORE_AUTO_CANCEL_MAX_ORDERS", "10000"))
+# 未开启事务时，已取消但库存归还未完成（release_pending）超过该秒数的订单由下一次运行补做归还
+Auto_Cancel_Release_Grace = float(os.environ.get("BOOKSTORE_AUTO_CANCEL_RELEASE_GRACE", "60"))
+
+# 订单超时调度器（be_run 启动的后台线程，到期即取消）：是否启用、增量拉取其他进程新订单的周期（秒）、
+# 主节点租约时长（秒，多进程时只有持有租约的进程执行取消，持有者每 1/3 租约时长续约一次）
+Order_Timeout_Scheduler = _env_bool("BOOKSTORE_ORDER_TIMEOUT_SCHEDULER", True)
+Order_Timeout_Refresh = float(os.environ.get("BOOKSTORE_ORDER_TIMEOUT_REFRESH", "30"))
+Order_Timeout_Lease_TTL = float(os.environ.get("BOOKSTORE_ORDER_TIMEOUT_LEASE_TTL", "15"))
+
+# 余额记账方式："direct"（直接 $inc Users.balance）或 "ledger"（入账追加到 Ledger 流水集合，组提交 insert_many，
+# 扣款余额不足时及每 Ledger_Materialize_Interval 秒把流水物化进 Users.balance，0 表示只在扣款时物化）
+Balance_Mode = os.environ.get("BOOKSTORE_BALANCE_MODE", "direct")
+Ledger_Materialize_Interval = float(os.environ.get("BOOKSTORE_LEDGER_MATERIALIZE_INTERVAL", "5"))
+
+# 密码哈希（见 be/model/password_hash.py）：KDF 为 "scrypt" 或 "pbkdf2_sha256"，参数随记录保存；
+# 历史明文/参数过时的记录在登录成功时改写；KDF 计算线程数；校验成功结果的进程内缓存容量与有效期（秒，0 关闭）
+Password_KDF = os.environ.get("BOOKSTORE_PASSWORD_KDF", "scrypt")
+Password_Scrypt_N = int(os.environ.get("BOOKSTORE_PASSWORD_SCRYPT_N", str(2 ** 14)))
+Password_Scrypt_R = int(os.environ.get("BOOKSTORE_PASSWORD_SCRYPT_R", "8"))
+Password_Scrypt_P = int(os.environ.get("BOOKSTORE_PASSWORD_SCRYPT_P", "1"))
+Password_PBKDF2_Iterations = int(os.environ.get("BOOKSTORE_PASSWORD_PBKDF2_ITERATIONS", "600000"))
+Password_Rehash_On_Login = _env_bool("BOOKSTORE_PASSWORD_REHASH_ON_LOGIN", True)
+Password_Hash_Threads = int(os.environ.get("BOOKSTORE_PASSWORD_HASH_THREADS", "4"))
+Password_Cache_Size = int(os.environ.get("BOOKSTORE_PASSWORD_CACHE_SIZE", "10000"))
+Password_Cache_TTL = float(os.environ.get("BOOKSTORE_PASSWORD_CACHE_TTL", "300"))
@@ -0,0 +1,185 @@
+import asyncio
+
+import pymongo
+
+from be import conf
+from be.model import error
+from be.model import inventory
+from be.model import search_cache
+from be.model import store
+from be.model import suggest
+from be.model.async_db_conn import AsyncDBConn
+from be.model.buyer import Buyer
+
+
+class AsyncBuyer(AsyncDBConn):
+    """
+    Buyer 只读接口的异步版本：查询条件、分页与响应格式复用同步实现（Buyer._search_plan 等），
+    这里只把数据库访问换成 AsyncMongoClient。
+    - 搜索缓存与同步实现共用同一个进程内缓存
+    - Search_Backend = "memory" 的倒排索引与联想索引在进程内构建，构建/重建经线程池用同步连接执行
+    """
+
+    async def get_book_detail(self, book_id: str) -> (int, str, dict):
+        try:
+            if book_id is None or book_id.strip() == "":
+                return error.error_and_message(400, "书籍ID不能为空") + ({},)
+
+            book_doc = await self.db["Books"].find_one({"_id": book_id.strip()})
+            if book_doc is None:
+                return error.error_and_message(404, "书籍不存在") + ({},)
+            book_detail = Buyer.format_book_detail(book_doc)
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg, {}
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg, {}
+
+        return 200, "ok", book_detail
+
+    async def _id_exist(self, name: str, _id) -> bool:
+        return await self.db[name].find_one({"_id": _id}, {"_id": 1}) is not None
+
+    async def get_order(self, user_id: str, order_id: str) -> (int, str, dict):
+        try:
+            order_doc = await self.db["Orders"].find_one({"_id": order_id})
+            if order_doc is None:
+                return error.error_invalid_order_id(order_id) + ({},)
+            if order_doc.get("buyer_id") != user_id:
+                return error.error_authorization_fail() + ({},)
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg, {}
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg, {}
+        return 200, "ok", order_doc
+
+    async def query_orders(self, user_id: str, status: str = None, page: int = 1,
+                           cursor: str = None, with_total: bool = None) -> (int, str, dict):
+        try:
+            if user_id is None:
+                return error.error_and_message(400, "参数不能为空") + ({},)
+            if not await self._id_exist("Users", user_id):
+                return error.error_non_exist_user_id(user_id) + ({},)
+
+            plan = Buyer._orders_plan(user_id, status, page, cursor, with_total)
+            if plan[0] != 200:
+                return plan
+            plan = plan[2]
+
+            total_count = None
+            if plan["count"] is not None:
+                total_count = await self.db["Orders"].count_documents(plan["count"])
+            orders_cursor = self.db["Orders"].find(plan["query"], Buyer.ORDER_FIELDS).sort(Buyer.ORDER_SORT)
+            if plan["skip"] is not None:
+                orders_cursor = orders_cursor.skip(plan["skip"])
+            order_docs = await orders_cursor.limit(Buyer.ORDER_PAGE_SIZE + 1).to_list(None)
+            result = Buyer._orders_result(plan, order_docs, total_count)
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg, {}
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg, {}
+        return 200, "ok", result
+
+    async def search_books(self, keyword: str = None, store_id: str = None, page: int = 1,
+                           cursor: str = None, with_total: bool = None, facets: bool = False,
+                           fields=None) -> (int, str, dict):
+        if conf.Search_Backend == "memory":
+            # 进程内倒排索引：检索本身是 CPU 计算，连同索引构建一起在线程池中执行
+            return await asyncio.get_running_loop().run_in_executor(
+                None, lambda: Buyer().search_books(keyword, store_id, page, cursor, with_total, facets, fields))
+        try:
+            request = Buyer._search_request(keyword, store_id, page, cursor, with_total, facets, fields)
+            if request[0] != 200:
+                return request
+            result = await self._search(request[2])
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg, {}
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg, {}
+        return result
+
+    async def search_books_advanced(self, title_prefix: str = None, tags: list = None, store_id: str = None,
+                                    page: int = 1, cursor: str = None, with_total: bool = None,
+                                    facets: bool = False, fields=None) -> (int, str, dict):
+        try:
+            request = Buyer._advanced_search_request(title_prefix, tags, store_id, page, cursor, with_total,
+                                                     facets, fields)
+            if request[0] != 200:
+                return request
+            result = await self._search(request[2])
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg, {}
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg, {}
+        return result
+
+    async def _search(self, request: dict) -> (int, str, dict):
+        """按 Buyer._search_request 构造的请求执行检索：查缓存、限定店铺、取一页并写回缓存。"""
+        cached = search_cache.get(request["cache_key"])
+        if cached is not None:
+            return 200, "ok", cached
+
+        store_filter = None
+        if request["store_id"]:
+            if not await self._id_exist("Stores", request["store_id"]):
+                return error.error_non_exist_store_id(request["store_id"]) + ({},)
+            store_filter = await self._store_filter(request["store_id"])
+            if store_filter is None:
+                return 200, "ok", Buyer._empty_search_page(request)
+
+        result = await self._search_page(Buyer._scoped_query(request, store_filter), **request["page_args"])
+        search_cache.put(request["cache_key"], result)
+        return 200, "ok", result
+
+    async def suggest(self, prefix: str, limit: int = 10) -> (int, str, dict):
+        try:
+            if prefix is None or prefix.strip() == "":
+                return error.error_and_message(400, "搜索前缀不能为空") + ({},)
+            try:
+                limit = max(1, int(limit)) if limit else 10
+            except (ValueError, TypeError):
+                return error.error_and_message(400, "数量参数无效") + ({},)
+            if suggest.needs_build():
+                await asyncio.get_running_loop().run_in_executor(None, suggest.get_index, store.get_db())
+            suggestions = suggest.suggest_index.suggest(prefix, limit)
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg, {}
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg, {}
+        return 200, "ok", {"suggestions": suggestions}
+
+    async def _store_filter(self, store_id: str):
+        """同 Buyer._store_filter，书目 ID 的查询取自库存布局（inventory.get_layout）。"""
+        if conf.Search_Store_Filter == "store_ids":
+            return {"store_ids": store_id}
+        layout = inventory.get_layout()
+        name, query, projection = layout.book_ids_lookup(store_id)
+        docs = await self.db[name].find(query, projection).to_list(None)
+        return Buyer._book_ids_filter(layout.book_ids_from(docs))
+
+    async def _search_page(self, search_query: dict, text_search: bool, page: int, after: list, with_total: bool,
+                           sort_fields: list = None, facets: bool = False, fields: tuple = None) -> dict:
+        plan = Buyer._search_plan(search_query, text_search, page, after, with_total, sort_fields, facets, fields)
+        total_count, lower_bound = None, False
+        if plan["count"] is not None:
+            total_count, lower_bound = Buyer._count_result(
+                await self.db["Books"].count_documents(plan["count"], **Buyer._count_options()))
+        if plan["pipeline"] is not None:
+            rows = await (await self.db["Books"].aggregate(plan["pipeline"])).to_list(None)
+        else:
+            books_cursor = self.db["Books"].find(plan["query"], plan["projection"]).sort(plan["sort"])
+            if plan["skip"] is not None:
+                books_cursor = books_cursor.skip(plan["skip"])
+            rows = await books_cursor.limit(Buyer.SEARCH_PAGE_SIZE + 1).to_list(None)
+        return Buyer._finish_search_page(plan, rows, total_count, lower_bound)
@@ -0,0 +1,8 @@
+from be.model.store import get_async_db
+
+
+class AsyncDBConn:
+    """DBConn 的异步版本：基于 AsyncMongoClient，供 ASGI 服务的原生异步接口使用。"""
+
+    def __init__(self):
+        self.db = get_async_db()
@@ -0,0 +1,165 @@
+import time
+
+import pymongo
+
+from be import conf
+from be.model import error
+from be.model import password_hash
+from be.model import token_auth
+from be.model.async_db_conn import AsyncDBConn
+from be.model.user import User, jwt_encode, new_terminal_token, new_user_doc, revoke_update, token_cache, \
+    token_expire_at
+
+
+class AsyncUser(AsyncDBConn):
+    """User 的异步版本：返回值、错误码与 token 缓存的失效规则与同步实现一致。"""
+
+    token_lifetime: int = User.token_lifetime
+
+    async def register(self, user_id: str, password: str) -> (int, str):
+        try:
+            await self.db["Users"].insert_one(new_user_doc(user_id, await password_hash.hash_password_async(password)))
+            token_auth.versions.forget(user_id)
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg
+        return 200, "ok"
+
+    async def check_token(self, user_id: str, token: str) -> (int, str):
+        if token_auth.enabled():
+            if not await token_auth.check_async(user_id, token):
+                return error.error_authorization_fail()
+            return 200, "ok"
+
+        key = (user_id, token)
+        expire_at = token_cache.get(key)
+        if expire_at is not None and time.time() < expire_at:
+            return 200, "ok"
+
+        # 读库前取分组代数：读取期间若有登出/登录/改密使缓存失效，本次结果不写回缓存
+        generation = token_cache.generation(user_id)
+        user_doc = await self.db["Users"].find_one({"_id": user_id}, {"token": 1})
+        if user_doc is None:
+            return error.error_authorization_fail()
+        expire_at = token_expire_at(user_id, user_doc.get("token"), token, self.token_lifetime)
+        if expire_at is None:
+            return error.error_authorization_fail()
+        token_cache.set(key, expire_at, group=user_id, ttl=expire_at - time.time(), generation=generation)
+        return 200, "ok"
+
+    async def check_password(self, user_id: str, password: str, rehash: bool = False) -> (int, str):
+        code, message, _ = await self.__authenticate__(user_id, password, rehash)
+        return code, message
+
+    async def __authenticate__(self, user_id: str, password: str, rehash: bool = False) -> (int, str, dict):
+        user_doc = await self.db["Users"].find_one({"_id": user_id}, {"password": 1, "token_version": 1})
+        if user_doc is None:
+            return error.error_authorization_fail() + (None,)
+        db_password = user_doc.get("password")
+        ok, needs_rehash = await password_hash.verify_async(user_id, password, db_password)
+        if not ok:
+            return error.error_authorization_fail() + (None,)
+        if rehash and needs_rehash and conf.Password_Rehash_On_Login:
+            await self.db["Users"].update_one(
+                {"_id": user_id, "password": db_password},
+                {"$set": {"password": await password_hash.hash_password_async(password)}}
+            )
+        return 200, "ok", user_doc
+
+    async def __revoke_tokens__(self, user_id: str, update: dict = None) -> None:
+        update, version = revoke_update(update)
+        await self.db["Users"].update_one({"_id": user_id}, update)
+        token_auth.versions.advance(user_id, version)
+
+    async def login(self, user_id: str, password: str, terminal: str) -> (int, str, str):
+        token = ""
+        try:
+            code, message, user_doc = await self.__authenticate__(user_id, password, rehash=True)
+            if code != 200:
+                return code, message, ""
+
+            if token_auth.enabled():
+                version = user_doc.get("token_version", 0)
+                token_auth.versions.advance(user_id, version)
+                return 200, "ok", token_auth.encode(user_id, terminal, version, self.token_lifetime)
+
+            token = jwt_encode(user_id, terminal)
+            await self.db["Users"].update_one({"_id": user_id}, {"$set": {"token": token}})
+            token_cache.invalidate_group(user_id)
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg, ""
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg, ""
+        return 200, "ok", token
+
+    async def logout(self, user_id: str, token: str) -> (int, str):
+        try:
+            code, message = await self.check_token(user_id, token)
+            if code != 200:
+                return code, message
+
+            if token_auth.enabled():
+                await self.__revoke_tokens__(user_id)
+                return 200, "ok"
+
+            terminal, dummy_token = new_terminal_token(user_id)
+            await self.db["Users"].update_one(
+                {"_id": user_id},
+                {"$set": {"token": dummy_token, "terminal": terminal}}
+            )
+            token_cache.invalidate_group(user_id)
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg
+        return 200, "ok"
+
+    async def unregister(self, user_id: str, password: str) -> (int, str):
+        try:
+            code, message = await self.check_password(user_id, password)
+            if code != 200:
+                return code, message
+
+            await self.db["Users"].delete_one({"_id": user_id})
+            token_cache.invalidate_group(user_id)
+            password_hash.invalidate(user_id)
+            token_auth.versions.revoke(user_id)
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg
+        return 200, "ok"
+
+    async def change_password(self, user_id: str, old_password: str, new_password: str) -> (int, str):
+        try:
+            code, message = await self.check_password(user_id, old_password)
+            if code != 200:
+                return code, message
+
+            if token_auth.enabled():
+                new_hash = await password_hash.hash_password_async(new_password)
+                await self.__revoke_tokens__(user_id, {"$set": {"password": new_hash}})
+                password_hash.invalidate(user_id)
+                return 200, "ok"
+
+            terminal, token = new_terminal_token(user_id)
+            new_hash = await password_hash.hash_password_async(new_password)
+            await self.db["Users"].update_one(
+                {"_id": user_id},
+                {"$set": {"password": new_hash, "token": token, "terminal": terminal}}
+            )
+            token_cache.invalidate_group(user_id)
+            password_hash.invalidate(user_id)
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg
+        return 200, "ok"
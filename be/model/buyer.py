@@ -3,142 +3,161 @@ import uuid
 import logging
 import time
 from pymongo import ReturnDocument
+from be import conf
 from be.model import db_conn
 from be.model import error
+from be.model import ledger
+from be.model import order_timeout
+from be.model import pagination
+from be.model import password_hash
+from be.model import picture
+from be.model import search_cache
+from be.model import search_engine
+from be.model import search_index
+from be.model import suggest
 
 class Buyer(db_conn.DBConn):
+    SEARCH_PAGE_SIZE = 10
+    EMPTY_FACETS = {"tags": [], "publishers": []}
+    # 搜索结果视图：full 为默认列表字段，card 为紧凑卡片；也可传字段列表（限 SEARCH_FIELDS）
+    SEARCH_VIEWS = {
+        "full": ("title", "author", "book_intro", "tags"),
+        "card": ("title", "author", "tags"),
+    }
+    # 可在结果列表中返回的字段；content/author_intro/pictures 体积大，只在详情接口返回
+    SEARCH_FIELDS = ("title", "author", "publisher", "translator", "pub_year", "pages", "binding", "isbn",
+                     "book_intro", "tags")
+
     def __init__(self):
         super().__init__()
     
     def new_order(
         self, user_id: str, store_id, id_and_count: [(str, int)]
     ) -> (int, str, str):
-        order_id = ""
+        # 非事务模式下记录已预占的库存，失败时据此释放
+        reserved = []
         try:
-            if not self.user_id_exist(user_id):
-                return error.error_non_exist_user_id(user_id) + (order_id,)
-            if not self.store_id_exist(store_id):
-                return error.error_non_exist_store_id(store_id) + (order_id,)
-            uid = "{}_{}_{}".format(user_id, store_id, str(uuid.uuid1()))
-            db = self.db
-
-            total_amount = 0
-            items = []
-            for book_id, count in id_and_count:
-                # 获取店铺库存并匹配该书，使用 $elemMatch + 投影仅返回匹配的库存项
-                store_doc = db["Stores"].find_one(
-                    {"_id": store_id, "inventory": {"$elemMatch": {"book_id": book_id}}},
-                    {"inventory.$": 1}
-                )
-                if store_doc is None or "inventory" not in store_doc or not store_doc["inventory"]:
-                    return error.error_non_exist_book_id(book_id) + (order_id,)
-                inv_item = store_doc["inventory"][0]
-                store_level = inv_item.get("stock_level", 0)
-                # 归一化价格为 0（防止 None 导致计算异常）
-                price = inv_item.get("price", 0) or 0
-                # 从 Books 获取快照信息
-                book_doc = db["Books"].find_one(
-                    {"_id": book_id},
-                    {"title": 1, "tags": 1, "content": 1}
-                )
-                # 生成 tag（取第一个标签）
-                tag_val = None
-                tags = book_doc.get("tags") if book_doc else None
-                if isinstance(tags, list):
-                    tag_val = tags[0] if tags else None
-                elif isinstance(tags, str):
-                    parts = [t.strip() for t in tags.replace("\n", ",").split(",") if t.strip()]
-                    tag_val = parts[0] if parts else None
-                # 生成 content
-                content_val = None
-                if book_doc:
-                    content_val = book_doc.get("content")
-                book_info = {
-                    "title": book_doc.get("title") if book_doc else None,
-                    "tag": tag_val,
-                    "content": content_val,
-                }
-                if store_level < count:
-                    return error.error_stock_level_low(book_id) + (order_id,)
-                items.append({
-                    "book_id": book_id,
-                    "quantity": count,
-                    "unit_price": price,
-                    "book_snapshot": book_info
-                })
-                total_amount += count * price
-            
-            order = {
-                "_id": uid,
-                "buyer_id": user_id,
-                "store_id": store_id,
-                "total_amount": total_amount,
-                "status": "unpaid",
-                "create_time": time.time(),
-                "items": items
-            }
-            order_id = uid
-            db["Orders"].insert_one(order)
+            code, msg, order_id = self.run_in_transaction(
+                lambda session: self._new_order(user_id, store_id, id_and_count, reserved, session)
+            )
+            if code == 200:
+                # 提交后入堆；以当前时间计算到期时间，不早于订单实际的 create_time
+                order_timeout.scheduler.schedule(order_id, time.time())
+            return code, msg, order_id
         except pymongo.errors.PyMongoError as e:
+            self._release_stock(store_id, reserved)
             return error.exception_db_to_tuple3(e)
         except BaseException as e:
+            self._release_stock(store_id, reserved)
             return error.exception_to_tuple3(e)
+
+    def _new_order(
+        self, user_id: str, store_id, id_and_count: [(str, int)], reserved: list, session=None
+    ) -> (int, str, str):
+        order_id = ""
+        docs = self.loader(session)
+        if not docs.exists("Users", user_id):
+            return error.error_non_exist_user_id(user_id) + (order_id,)
+        if not docs.exists("Stores", store_id):
+            return error.error_non_exist_store_id(store_id) + (order_id,)
+        uid = "{}_{}_{}".format(user_id, store_id, str(uuid.uuid1()))
+
+        total_amount = 0
+        items = []
+        # 批量取回本单涉及的库存项与书籍快照，避免逐项往返数据库
+        book_ids = list(dict.fromkeys(book_id for book_id, _ in id_and_count))
+        inventory = self.inventory.get_items(store_id, book_ids, session=session)
+        book_docs = self._load_book_snapshots(book_ids)
+        for book_id, count in id_and_count:
+            inv_item = inventory.get(book_id)
+            if inv_item is None:
+                return error.error_non_exist_book_id(book_id) + (order_id,)
+            store_level = inv_item.get("stock_level", 0)
+            # 归一化价格为 0（防止 None 导致计算异常）
+            price = inv_item.get("price", 0) or 0
+            book_info = self._book_snapshot(book_docs.get(book_id))
+            if store_level < count:
+                return error.error_stock_level_low(book_id) + (order_id,)
+            items.append({
+                "book_id": book_id,
+                "quantity": count,
+                "unit_price": price,
+                "book_snapshot": book_info
+            })
+            total_amount += count * price
+
+        stock_reserved = conf.Stock_Reservation
+        if stock_reserved:
+            # 预占库存：条件 $inc 原子扣减，读到的库存在并发下可能已被他人占用
+            for item in items:
+                if not self.inventory.reserve(store_id, item["book_id"], item["quantity"], session=session):
+                    self._release_stock(store_id, reserved)
+                    return self.abort(session, error.error_stock_level_low(item["book_id"]) + (order_id,))
+                if session is None:
+                    reserved.append({"book_id": item["book_id"], "quantity": item["quantity"]})
+
+        order = {
+            "_id": uid,
+            "buyer_id": user_id,
+            "store_id": store_id,
+            "total_amount": total_amount,
+            "status": "unpaid",
+            "create_time": time.time(),
+            "items": items
+        }
+        if stock_reserved:
+            # 标记库存已在下单时扣减：取消/超时需释放，发货只需确认
+            order["stock_reserved"] = True
+        order_id = uid
+        self.col("Orders", session).insert_one(order)
         
         return 200, "ok", order_id
-    def payment(self, user_id: str, password: str, order_id: str) -> (int, str):
-        try:
-            db = self.db
-            # 根据order_id获取订单信息
-            if not self.order_id_exist(order_id):
-                return error.error_invalid_order_id(order_id)
-            order_doc = db["Orders"].find_one({"_id": order_id})
-            if order_doc is None:
-                return error.error_invalid_order_id(order_id)
-            buyer_id = order_doc.get("buyer_id")
-            total_amount = order_doc.get("total_amount", 0)
 
-            # 根据buyer_id获取balance,password，并鉴权
-            if buyer_id != user_id:
-                return error.error_authorization_fail()
-            user_doc = db["Users"].find_one({"_id": buyer_id})
-            if user_doc is None:
-                return error.error_non_exist_user_id(buyer_id)
-            balance = user_doc.get("balance", 0)
-            if password != user_doc.get("password"):
-                return error.error_authorization_fail()
+    def _release_stock(self, store_id: str, items: list, session=None) -> None:
+        """释放预占的库存（items 为 {"book_id", "quantity"} 列表），释放后清空列表。"""
+        for item in items:
+            self.inventory.inc_stock(store_id, item["book_id"], item["quantity"], session=session)
+        items.clear()
 
-            # 防重复支付：根据订单状态返回更精确的业务错误
-            status = order_doc.get("status")
-            if status != "unpaid":
-                if status == "cancelled":
-                    return error.error_order_cancelled(order_id)
-                if status in ("paid", "completed"):
-                    return error.error_order_completed(order_id)
-                return error.error_order_status_mismatch(order_id)
-
-            if balance < total_amount:
-                return error.error_not_sufficient_funds(order_id)
-
-            # 买家扣款（一次且带余额条件，防止并发超扣）
-            res = db["Users"].update_one(
-                {"_id": buyer_id, "balance": {"$gte": total_amount}},
-                {"$inc": {"balance": -total_amount}}
-            )
-            if res.matched_count == 0:
-                return error.error_not_sufficient_funds(order_id)
-            # 更新订单状态
-            updated = db["Orders"].update_one(
-                {"_id": order_id, "status": "unpaid"},
-                {"$set": {"status": "paid", "pay_time": time.time()}}
+    def _load_book_snapshots(self, book_ids: list) -> dict:
+        """一次 $in 查询取回快照所需的书籍字段，返回 {book_id: 书籍文档}。"""
+        if not book_ids:
+            return {}
+        cursor = self.db["Books"].find(
+            {"_id": {"$in": book_ids}},
+            {"title": 1, "tags": 1, "content": 1}
+        )
+        return {book_doc["_id"]: book_doc for book_doc in cursor}
+
+    @staticmethod
+    def _book_snapshot(book_doc) -> dict:
+        """由书籍文档生成订单项中的 book_snapshot（title / 首个 tag / content）。"""
+        # 生成 tag（取第一个标签）
+        tag_val = None
+        tags = book_doc.get("tags") if book_doc else None
+        if isinstance(tags, list):
+            tag_val = tags[0] if tags else None
+        elif isinstance(tags, str):
+            parts = [t.strip() for t in tags.replace("\n", ",").split(",") if t.strip()]
+            tag_val = parts[0] if parts else None
+        # 生成 content
+        content_val = None
+        if book_doc:
+            content_val = book_doc.get("content")
+        return {
+            "title": book_doc.get("title") if book_doc else None,
+            "tag": tag_val,
+            "content": content_val,
+        }
+
+    def payment(self, user_id: str, password: str, order_id: str) -> (int, str):
+        try:
+            code, msg = self.run_in_transaction(
+                lambda session: self._payment(user_id, password, order_id, session)
             )
-            if updated.matched_count == 0:
-                # 简单补偿：状态更新失败则回滚扣款
-                db["Users"].update_one({
-                    "_id": buyer_id
-                }, {
-                    "$inc": {"balance": total_amount}
-                })
-                return error.error_invalid_order_id(order_id)
+            if code == 200:
+                order_timeout.scheduler.discard(order_id)
+            return code, msg
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
             return code, msg
@@ -146,16 +165,65 @@ class Buyer(db_conn.DBConn):
             code, msg, _ = error.exception_to_tuple3(e)
             return code, msg
 
+    def _payment(self, user_id: str, password: str, order_id: str, session=None) -> (int, str):
+        docs = self.loader(session)
+        # 根据order_id获取订单信息（一次读取同时完成存在性检查）
+        order_doc = docs.get("Orders", order_id)
+        if order_doc is None:
+            return error.error_invalid_order_id(order_id)
+        buyer_id = order_doc.get("buyer_id")
+        total_amount = order_doc.get("total_amount", 0)
+
+        # 根据buyer_id获取balance,password，并鉴权
+        if buyer_id != user_id:
+            return error.error_authorization_fail()
+        user_doc = docs.get("Users", buyer_id, ("balance", "password"))
+        if user_doc is None:
+            return error.error_non_exist_user_id(buyer_id)
+        balance = user_doc.get("balance", 0)
+        if not password_hash.verify(buyer_id, password, user_doc.get("password"))[0]:
+            return error.error_authorization_fail()
+
+        # 防重复支付：根据订单状态返回更精确的业务错误
+        status = order_doc.get("status")
+        if status != "unpaid":
+            if status == "cancelled":
+                return error.error_order_cancelled(order_id)
+            if status in ("paid", "completed"):
+                return error.error_order_completed(order_id)
+            return error.error_order_status_mismatch(order_id)
+
+        if balance < total_amount and (
+                not ledger.enabled() or balance + ledger.pending(self.db, buyer_id) < total_amount):
+            return error.error_not_sufficient_funds(order_id)
+
+        # 买家扣款（一次且带余额条件，防止并发超扣）
+        if not self._debit(buyer_id, total_amount, session):
+            return error.error_not_sufficient_funds(order_id)
+        # 更新订单状态
+        updated = self.col("Orders", session).update_one(
+            {"_id": order_id, "status": "unpaid"},
+            {"$set": {"status": "paid", "pay_time": time.time()}}
+        )
+        if updated.matched_count == 0:
+            if session is None:
+                # 简单补偿：状态更新失败则回滚扣款
+                self.db["Users"].update_one({
+                    "_id": buyer_id
+                }, {
+                    "$inc": {"balance": total_amount}
+                })
+            return self.abort(session, error.error_invalid_order_id(order_id))
+
         return 200, "ok"
     
     def add_funds(self, user_id, password, add_value) -> (int, str):
         try:
-            db = self.db
-            user_doc = db["Users"].find_one({"_id": user_id})
+            user_doc = self.loader().get("Users", user_id, ("password",))
             if user_doc is None:
                 # sqlite这边是error.error_authorization_fail()，但我感觉是error_non_exist_user_id
                 return error.error_non_exist_user_id(user_id) 
-            if password != user_doc.get("password"):
+            if not password_hash.verify(user_id, password, user_doc.get("password"))[0]:
                 return error.error_authorization_fail()
             
             # 转换add_value为整数
@@ -167,18 +235,11 @@ class Buyer(db_conn.DBConn):
             # 允许负值作为扣款，但不允许余额变为负数
             if add_value < 0:
                 # 原子性扣款：仅当余额 >= 需要扣减的绝对值时才扣款
-                result = db["Users"].update_one(
-                    {"_id": user_id, "balance": {"$gte": -add_value}},
-                    {"$inc": {"balance": add_value}}
-                )
-                if result.modified_count == 0:
+                if not self._debit(user_id, -add_value):
                     return error.error_and_message(400, "余额不足，扣款失败")
             else:
                 # 正值或零：直接充值/不变
-                db["Users"].update_one(
-                    {"_id": user_id},
-                    {"$inc": {"balance": add_value}}
-                )
+                self._credit(user_id, add_value, "deposit")
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
             return code, msg
@@ -190,57 +251,76 @@ class Buyer(db_conn.DBConn):
 
     def receive_order(self, user_id: str, order_id: str) -> (int, str):
         try:
-            if not self.user_id_exist(user_id):
-                return error.error_non_exist_user_id(user_id)
-        
-            if not self.order_id_exist(order_id):
-                return error.error_invalid_order_id(order_id)
-            
-            order_doc = self.db["Orders"].find_one({
-                "_id": order_id,
-                "buyer_id": user_id
-            })
-            if order_doc is None:
-                return error.error_authorization_fail()
-            
-            if order_doc.get("status") != "shipped":
-                return error.error_order_status_mismatch(order_id)
-            
-            # 更新订单状态为已收货，同时给卖家转账
-            total_amount = order_doc.get("total_amount", 0)
-            store_id = order_doc.get("store_id")
-            
-            store_doc = self.db["Stores"].find_one({"_id": store_id})
-            if store_doc is None:
-                return error.error_non_exist_store_id(store_id)
-            seller_id = store_doc.get("user_id")
-
-            result = self.db["Orders"].update_one(
-                {"_id": order_id, "status": "shipped"},
-                {
-                    "$set": {
-                        "status": "delivered", 
-                        "deliver_time": time.time()
-                    }
-                }
-            )
-            
-            if result.modified_count == 0:
-                return error.error_order_status_mismatch(order_id)
-
-            self.db["Users"].update_one(
-                {"_id": seller_id},
-                {"$inc": {"balance": total_amount}}
+            return self.run_in_transaction(
+                lambda session: self._receive_order(user_id, order_id, session)
             )
-                
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
             return code, msg
         except BaseException as e:
             code, msg, _ = error.exception_to_tuple3(e)
             return code, msg
+
+    def _receive_order(self, user_id: str, order_id: str, session=None) -> (int, str):
+        docs = self.loader(session)
+        if not docs.exists("Users", user_id):
+            return error.error_non_exist_user_id(user_id)
+
+        order_doc = docs.get("Orders", order_id)
+        if order_doc is None:
+            return error.error_invalid_order_id(order_id)
+        if order_doc.get("buyer_id") != user_id:
+            return error.error_authorization_fail()
+
+        if order_doc.get("status") != "shipped":
+            return error.error_order_status_mismatch(order_id)
+
+        # 更新订单状态为已收货，同时给卖家转账
+        total_amount = order_doc.get("total_amount", 0)
+        store_id = order_doc.get("store_id")
+
+        store_doc = docs.get("Stores", store_id, ("user_id",))
+        if store_doc is None:
+            return error.error_non_exist_store_id(store_id)
+        seller_id = store_doc.get("user_id")
+
+        result = self.col("Orders", session).update_one(
+            {"_id": order_id, "status": "shipped"},
+            {
+                "$set": {
+                    "status": "delivered",
+                    "deliver_time": time.time()
+                }
+            }
+        )
         
+        if result.modified_count == 0:
+            return error.error_order_status_mismatch(order_id)
+
+        # 事务模式下与订单状态变更一同提交，避免“已收货但卖家未入账”
+        self._credit(seller_id, total_amount, "payout", order_id, session)
+
         return 200, "ok"
+
+    def _credit(self, user_id: str, amount: int, kind: str, ref: str = None, session=None) -> bool:
+        """入账：ledger 模式追加流水（不写用户文档），否则直接 $inc；返回是否入账成功。"""
+        if ledger.enabled():
+            ledger.credit(self, user_id, amount, kind, ref, session)
+            return True
+        result = self.col("Users", session).update_one(
+            {"_id": user_id},
+            {"$inc": {"balance": amount}}
+        )
+        return result.modified_count > 0
+
+    def _debit(self, user_id: str, amount: int, session=None) -> bool:
+        """带余额条件的扣款；ledger 模式下余额不足时先物化该用户的待入账流水再重试一次。"""
+        query = {"_id": user_id, "balance": {"$gte": amount}}
+        update = {"$inc": {"balance": -amount}}
+        result = self.col("Users", session).update_one(query, update)
+        if result.matched_count == 0 and ledger.enabled() and ledger.materialize(self, user_id, session):
+            result = self.col("Users", session).update_one(query, update)
+        return result.matched_count > 0
     
     # 订单查询
     def get_order(self, user_id: str, order_id: str) -> (int, str, dict):
@@ -258,7 +338,23 @@ class Buyer(db_conn.DBConn):
         except BaseException as e:
             code, msg, _ = error.exception_to_tuple3(e)
             return code, msg
-    def query_orders(self, user_id: str, status: str = None, page: int = 1) -> (int, str, dict):
+    ORDER_PAGE_SIZE = 10
+    ORDER_SORT = [("create_time", -1), ("_id", -1)]
+    ORDER_FIELDS = {
+        "_id": 1, "store_id": 1, "status": 1, "total_amount": 1,
+        "create_time": 1, "pay_time": 1, "ship_time": 1, "deliver_time": 1,
+        "items": 1
+    }
+
+    def query_orders(self, user_id: str, status: str = None, page: int = 1,
+                     cursor: str = None, with_total: bool = None) -> (int, str, dict):
+        """查询买家订单，按创建时间倒序。
+
+        两种分页方式：
+        - page：兼容旧接口的页码分页（skip/limit），默认返回 total_count
+        - cursor：键集分页，从上一页返回的 next_cursor 处继续，深翻页与首页代价相同；
+          默认不统计总数，with_total=True 时才附带 total_count
+        """
         try:
             if user_id is None:
                 return error.error_and_message(400, "参数不能为空") + ({},)
@@ -266,58 +362,17 @@ class Buyer(db_conn.DBConn):
             if not self.user_id_exist(user_id):
                 return error.error_non_exist_user_id(user_id) + ({},)
 
-            page_size = 10
-            try:
-                page = max(1, int(page)) if page else 1
-            except (ValueError, TypeError):
-                return error.error_and_message(400, "页码参数无效") + ({},)
-            skip = (page - 1) * page_size
-            
-            # 利用复合索引 (buyer_id, status, create_time)
-            query = {"buyer_id": user_id}
-            if status and status.strip():
-                query["status"] = status.strip()
-            
-            total_count = self.db["Orders"].count_documents(query)
-            
-            # 查询订单列表，按创建时间倒序
-            orders_cursor = self.db["Orders"].find(
-                query,
-                {
-                    "_id": 1, "store_id": 1, "status": 1, "total_amount": 1,
-                    "create_time": 1, "pay_time": 1, "ship_time": 1, "deliver_time": 1,
-                    "items": 1
-                }
-            ).sort("create_time", -1).skip(skip).limit(page_size)
-            
-            orders = []
-            for order_doc in orders_cursor:
-                order_info = {
-                    "order_id": order_doc["_id"],
-                    "store_id": order_doc["store_id"],
-                    "status": order_doc["status"],
-                    "total_amount": order_doc["total_amount"],
-                    "create_time": order_doc.get("create_time"),
-                    "pay_time": order_doc.get("pay_time"),
-                    "ship_time": order_doc.get("ship_time"),
-                    "deliver_time": order_doc.get("deliver_time"),
-                    "items": order_doc.get("items", [])
-                }
-                orders.append(order_info)
-            
-            # 分页
-            total_pages = (total_count + page_size - 1) // page_size
-            result = {
-                "orders": orders,
-                "pagination": {
-                    "page": page,
-                    "page_size": page_size,
-                    "total_count": total_count,
-                    "total_pages": total_pages,
-                    "has_next": page < total_pages,
-                    "has_prev": page > 1
-                }
-            }
+            plan = self._orders_plan(user_id, status, page, cursor, with_total)
+            if plan[0] != 200:
+                return plan
+            plan = plan[2]
+
+            total_count = self.db["Orders"].count_documents(plan["count"]) if plan["count"] is not None else None
+            orders_cursor = self.db["Orders"].find(plan["query"], self.ORDER_FIELDS).sort(self.ORDER_SORT)
+            if plan["skip"] is not None:
+                orders_cursor = orders_cursor.skip(plan["skip"])
+            order_docs = list(orders_cursor.limit(self.ORDER_PAGE_SIZE + 1))
+            result = self._orders_result(plan, order_docs, total_count)
             
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
@@ -328,49 +383,143 @@ class Buyer(db_conn.DBConn):
         
         return 200, "ok", result
 
+    @classmethod
+    def _orders_plan(cls, user_id: str, status: str, page, cursor: str, with_total) -> (int, str, dict):
+        """解析 query_orders 的分页参数，生成查询条件（同步/异步实现共用）。"""
+        after = None
+        if cursor:
+            try:
+                after = pagination.decode_cursor(cursor, len(cls.ORDER_SORT))
+            except ValueError:
+                return error.error_and_message(400, "游标参数无效") + ({},)
+            if with_total is None:
+                with_total = False
+        else:
+            try:
+                page = max(1, int(page)) if page else 1
+            except (ValueError, TypeError):
+                return error.error_and_message(400, "页码参数无效") + ({},)
+            if with_total is None:
+                with_total = True
+
+        # (buyer_id, create_time, _id) 索引同时提供过滤与排序，游标条件直接落在索引区间上
+        query = {"buyer_id": user_id}
+        if status and status.strip():
+            query["status"] = status.strip()
+        count = dict(query) if with_total else None
+        if after is not None:
+            query.update(pagination.after_key(cls.ORDER_SORT, after))
+        # 多取一条用于判断是否还有下一页
+        return 200, "ok", {
+            "query": query,
+            "count": count,
+            "skip": (page - 1) * cls.ORDER_PAGE_SIZE if after is None else None,
+            "page": page,
+            "after": after,
+            "with_total": with_total,
+        }
+
+    @classmethod
+    def _orders_result(cls, plan: dict, order_docs: list, total_count: int) -> dict:
+        page_size = cls.ORDER_PAGE_SIZE
+        has_next = len(order_docs) > page_size
+        order_docs = order_docs[:page_size]
+
+        orders = []
+        for order_doc in order_docs:
+            order_info = {
+                "order_id": order_doc["_id"],
+                "store_id": order_doc["store_id"],
+                "status": order_doc["status"],
+                "total_amount": order_doc["total_amount"],
+                "create_time": order_doc.get("create_time"),
+                "pay_time": order_doc.get("pay_time"),
+                "ship_time": order_doc.get("ship_time"),
+                "deliver_time": order_doc.get("deliver_time"),
+                "items": order_doc.get("items", [])
+            }
+            orders.append(order_info)
+
+        next_cursor = None
+        if has_next:
+            last = order_docs[-1]
+            next_cursor = pagination.encode_cursor(pagination.key_of(last, cls.ORDER_SORT))
+
+        # 分页
+        page = plan["page"]
+        if plan["after"] is None:
+            page_info = {
+                "page": page,
+                "page_size": page_size,
+                "has_next": has_next,
+                "has_prev": page > 1,
+                "next_cursor": next_cursor,
+            }
+            if plan["with_total"]:
+                page_info["total_count"] = total_count
+                page_info["total_pages"] = (total_count + page_size - 1) // page_size
+        else:
+            page_info = {
+                "page_size": page_size,
+                "has_next": has_next,
+                "next_cursor": next_cursor,
+            }
+            if plan["with_total"]:
+                page_info["total_count"] = total_count
+        return {"orders": orders, "pagination": page_info}
+
     def cancel_order(self, user_id: str, order_id: str) -> (int, str):
         try:
-            if not self.user_id_exist(user_id):
-                return error.error_non_exist_user_id(user_id)
-                
-            if not self.order_id_exist(order_id):
-                return error.error_invalid_order_id(order_id)
-            
-            # 获取订单信息
-            order_doc = self.db["Orders"].find_one({"_id": order_id})
-            if order_doc is None:
-                return error.error_invalid_order_id(order_id)
-
-            if order_doc["buyer_id"] != user_id:
-                return error.error_authorization_fail()
-            
-            status = order_doc.get("status")
-            if status not in ["unpaid", "paid"]:
-                return error.error_and_message(400, "订单状态不允许取消")
-
-            # 原子性更新订单状态，避免退款与状态变更不一致
-            updated_order = self.db["Orders"].find_one_and_update(
-                {"_id": order_id, "buyer_id": user_id, "status": status},
-                {
-                    "$set": {
-                        "status": "cancelled",
-                        "cancel_time": time.time()
-                    }
-                },
-                return_document=ReturnDocument.BEFORE
+            code, msg = self.run_in_transaction(
+                lambda session: self._cancel_order(user_id, order_id, session)
             )
+            if code == 200:
+                order_timeout.scheduler.discard(order_id)
+            return code, msg
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg
+
+    def _cancel_order(self, user_id: str, order_id: str, session=None) -> (int, str):
+        docs = self.loader(session)
+        if not docs.exists("Users", user_id):
+            return error.error_non_exist_user_id(user_id)
+
+        # 获取订单信息（一次读取同时完成存在性检查）
+        order_doc = docs.get("Orders", order_id)
+        if order_doc is None:
+            return error.error_invalid_order_id(order_id)
+
+        if order_doc["buyer_id"] != user_id:
+            return error.error_authorization_fail()
+
+        status = order_doc.get("status")
+        if status not in ["unpaid", "paid"]:
+            return error.error_and_message(400, "订单状态不允许取消")
 
-            if updated_order is None:
-                return error.error_and_message(400, "订单状态已变更，取消失败")
-
-            # 如果是已支付订单，需要退款
-            if updated_order.get("status") == "paid":
-                total_amount = updated_order.get("total_amount", 0)
-                refund_result = self.db["Users"].update_one(
-                    {"_id": user_id},
-                    {"$inc": {"balance": total_amount}}
-                )
-                if refund_result.modified_count == 0:
+        # 原子性更新订单状态，避免退款与状态变更不一致
+        updated_order = self.col("Orders", session).find_one_and_update(
+            {"_id": order_id, "buyer_id": user_id, "status": status},
+            {
+                "$set": {
+                    "status": "cancelled",
+                    "cancel_time": time.time()
+                }
+            },
+            return_document=ReturnDocument.BEFORE
+        )
+
+        if updated_order is None:
+            return error.error_and_message(400, "订单状态已变更，取消失败")
+
+        # 如果是已支付订单，需要退款
+        if updated_order.get("status") == "paid":
+            total_amount = updated_order.get("total_amount", 0)
+            if not self._credit(user_id, total_amount, "refund", order_id, session):
+                if session is None:
                     # 尝试恢复订单状态，保持资金一致
                     self.db["Orders"].update_one(
                         {"_id": order_id, "status": "cancelled"},
@@ -379,283 +528,525 @@ class Buyer(db_conn.DBConn):
                             "$unset": {"cancel_time": ""}
                         }
                     )
-                    return error.error_non_exist_user_id(user_id)
+                return self.abort(session, error.error_non_exist_user_id(user_id))
+
+        # 释放下单时预占的库存
+        if updated_order.get("stock_reserved"):
+            self._release_stock(updated_order["store_id"], list(updated_order.get("items", [])), session=session)
 
-        except pymongo.errors.PyMongoError as e:
-            code, msg, _ = error.exception_db_to_tuple3(e)
-            return code, msg
-        except BaseException as e:
-            code, msg, _ = error.exception_to_tuple3(e)
-            return code, msg
-        
         return 200, "ok"
 
     @staticmethod
-    def auto_cancel_timeout_orders() -> (int, str, int):
-        # 自动取消超时订单：扫描未支付且超过24小时的订单
-        # 使用索引 (status, create_time) 进行高效扫描
-        try:
-            from be.model.store import get_db
-            db = get_db()
-            timeout_threshold = time.time() - 24 * 3600
+    def auto_cancel_timeout_orders(limit: int = None) -> (int, str, int):
+        code, msg, stats = Buyer.sweep_timeout_orders(limit)
+        return code, msg, stats.get("cancelled", 0)
 
-            timeout_orders = db["Orders"].find({
-                "status": "unpaid",
-                "create_time": {"$lt": timeout_threshold}
-            })
-            
-            cancelled_count = 0
-            current_time = time.time()
-            
-            for order in timeout_orders:
-                # 更新订单状态，记录自动取消时间
-                result = db["Orders"].update_one(
-                    {"_id": order["_id"], "status": "unpaid"},
-                    {
-                        "$set": {
-                            "status": "cancelled",
-                            "timeout_at": current_time
-                        }
-                    }
-                )
-                if result.modified_count > 0:
-                    cancelled_count += 1
-                    
+    @staticmethod
+    def sweep_timeout_orders(limit: int = None) -> (int, str, dict):
+        # 自动取消超过 Order_Unpaid_Timeout 仍未支付的订单：沿 (status, create_time) 索引分批
+        # update_many，单次最多处理 limit 个（默认 Auto_Cancel_Max_Orders，须为正整数），见 order_sweeper
+        if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit <= 0):
+            return error.error_and_message(400, "limit 参数无效") + ({},)
+        try:
+            from be.model.order_sweeper import OrderSweeper
+            stats = OrderSweeper().sweep(limit)
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
-            return code, msg, 0
+            return code, msg, {}
         except BaseException as e:
             code, msg, _ = error.exception_to_tuple3(e)
-            return code, msg, 0
-        
-        return 200, "ok", cancelled_count
+            return code, msg, {}
+        return 200, "ok", stats
 
-    def search_books(self, keyword: str = None, store_id: str = None, page: int = 1) -> (int, str, dict):
+    def search_books(self, keyword: str = None, store_id: str = None, page: int = 1,
+                     cursor: str = None, with_total: bool = None, facets: bool = False,
+                     fields=None) -> (int, str, dict):
         """
         书籍搜索
         全站搜索：在books集合中设置文本索引，满足"题目、标签、目录/内容"的关键字搜索
-        店铺内搜索：先取店铺的book_id列表，在Books上$text或前缀/标签过滤，并限制_id in 店铺书目列表
+        店铺内搜索：在Books上$text过滤，并以 store_ids 限定店铺（见 _store_filter）
+        分页：page 页码分页，或 cursor 从上一页的 next_cursor 继续；with_total 控制是否计数
+        分面：facets=True 时附带命中集合的标签/出版社计数，与当前页在同一次聚合中返回
+        字段：fields 为视图名（full/card）或字段列表，只从 Books 读取这些字段
         """
         try:
-            if keyword is None or keyword.strip() == "":
-                return error.error_and_message(400, "搜索关键字不能为空") + ({},)
-            
-            keyword = keyword.strip()
-            page_size = 10
-            
-            try:
-                page = max(1, int(page)) if page else 1
-            except (ValueError, TypeError):
-                return error.error_and_message(400, "页码参数无效") + ({},)
-            
-            skip = (page - 1) * page_size
-            
-            if store_id and store_id.strip():
+            request = self._search_request(keyword, store_id, page, cursor, with_total, facets, fields)
+            if request[0] != 200:
+                return request
+            request = request[2]
+            cached = search_cache.get(request["cache_key"])
+            if cached is not None:
+                return 200, "ok", cached
+
+            store_filter = {}
+            if request["store_id"]:
                 # 店铺内搜索
-                if not self.store_id_exist(store_id):
-                    return error.error_non_exist_store_id(store_id) + ({},)
-                
-                store_doc = self.db["Stores"].find_one({"_id": store_id}, {"inventory": 1})
-                if not store_doc or "inventory" not in store_doc:
-                    return 200, "ok", {
-                        "books": [],
-                        "pagination": {
-                            "page": page,
-                            "page_size": page_size,
-                            "total_count": 0,
-                            "total_pages": 0,
-                            "has_next": False,
-                            "has_prev": False
-                        }
-                    }
-                
-                book_ids = [item["book_id"] for item in store_doc["inventory"]]
-                if not book_ids:
-                    return 200, "ok", {
-                        "books": [],
-                        "pagination": {
-                            "page": page,
-                            "page_size": page_size,
-                            "total_count": 0,
-                            "total_pages": 0,
-                            "has_next": False,
-                            "has_prev": False
-                        }
-                    }
-                
-                # 在Books集合中搜索
-                search_query = {
-                    "_id": {"$in": book_ids},
-                    "$text": {"$search": keyword}
-                }
-                
-                # 按textScore排序分页
-                total_count = self.db["Books"].count_documents(search_query)
-                books_cursor = self.db["Books"].find(
-                    search_query,
-                    {"score": {"$meta": "textScore"}}
-                ).sort([("score", {"$meta": "textScore"})]).skip(skip).limit(page_size)
-                
+                if not self.store_id_exist(request["store_id"]):
+                    return error.error_non_exist_store_id(request["store_id"]) + ({},)
+
+                store_filter = self._store_filter(request["store_id"])
+                if store_filter is None:
+                    return 200, "ok", self._empty_search_page(request)
+
+            args = request["page_args"]
+            if conf.Search_Backend == "memory":
+                result = self._search_page_memory(request["keyword"], store_filter, args["page"], args["after"],
+                                                  args["with_total"], args["facets"], args["fields"])
             else:
-                # 全站搜索
-                search_query = {"$text": {"$search": keyword}}
-                
-                # 按textScore排序分页
-                total_count = self.db["Books"].count_documents(search_query)
-                books_cursor = self.db["Books"].find(
-                    search_query,
-                    {"score": {"$meta": "textScore"}}
-                ).sort([("score", {"$meta": "textScore"})]).skip(skip).limit(page_size)
-            
-            books = []
-            for book_doc in books_cursor:
-                book_info = {
-                    "id": book_doc["_id"],
-                    "title": book_doc.get("title", ""),
-                    "author": book_doc.get("author", ""),
-                    "book_intro": book_doc.get("book_intro", ""),
-                    "tags": book_doc.get("tags", [])
-                }
-                if "score" in book_doc:
-                    book_info["text_score"] = book_doc["score"]
-                books.append(book_info)
-            
-            total_pages = (total_count + page_size - 1) // page_size
-            result = {
-                "books": books,
-                "pagination": {
-                    "page": page,
-                    "page_size": page_size,
-                    "total_count": total_count,
-                    "total_pages": total_pages,
-                    "has_next": page < total_pages,
-                    "has_prev": page > 1
-                }
-            }
-            
+                # 在Books集合中搜索
+                result = self._search_page(self._scoped_query(request, store_filter), **args)
+            search_cache.put(request["cache_key"], result)
+
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
             return code, msg, {}
         except BaseException as e:
             code, msg, _ = error.exception_to_tuple3(e)
             return code, msg, {}
-        
+
         return 200, "ok", result
 
-    def search_books_advanced(self, title_prefix: str = None, tags: list = None, store_id: str = None, page: int = 1) -> (int, str, dict):
+    def search_books_advanced(self, title_prefix: str = None, tags: list = None, store_id: str = None, page: int = 1,
+                              cursor: str = None, with_total: bool = None, facets: bool = False,
+                              fields=None) -> (int, str, dict):
         """
         参数化搜索：对高频两项设置前缀/精确索引
-        search_index.title_lower: 题目前缀/不区分大小写匹配
+        search_index.title_lower: 题目前缀/不区分大小写匹配，转换为索引区间查询（见 search_index.prefix_range）
         search_index.tags_lower: 标签精确或包含匹配
+        分页、分面与返回字段参数同 search_books
         """
         try:
-            if (not title_prefix or title_prefix.strip() == "") and (not tags or len(tags) == 0):
-                return error.error_and_message(400, "搜索条件不能为空") + ({},)
-            
-            page_size = 10
-            
-            try:
-                page = max(1, int(page)) if page else 1
-            except (ValueError, TypeError):
-                return error.error_and_message(400, "页码参数无效") + ({},)
-            
-            skip = (page - 1) * page_size
-            
-            search_conditions = []
-            
-            if title_prefix and title_prefix.strip():
-                title_lower = title_prefix.strip().lower()
+            request = self._advanced_search_request(title_prefix, tags, store_id, page, cursor, with_total,
+                                                    facets, fields)
+            if request[0] != 200:
+                return request
+            request = request[2]
+            cached = search_cache.get(request["cache_key"])
+            if cached is not None:
+                return 200, "ok", cached
+
+            store_filter = None
+            if request["store_id"]:
+                # 店铺内搜索
+                if not self.store_id_exist(request["store_id"]):
+                    return error.error_non_exist_store_id(request["store_id"]) + ({},)
+
+                store_filter = self._store_filter(request["store_id"])
+                if store_filter is None:
+                    return 200, "ok", self._empty_search_page(request)
+
+            result = self._search_page(self._scoped_query(request, store_filter), **request["page_args"])
+            search_cache.put(request["cache_key"], result)
+
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg, {}
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg, {}
+
+        return 200, "ok", result
+
+    @classmethod
+    def _search_request(cls, keyword, store_id, page, cursor, with_total, facets, fields) -> (int, str, dict):
+        """
+        search_books 的参数校验与查询构造，只做计算不访问数据库，同步/异步实现共用
+        返回 keyword、store_id、Books 查询条件 query、缓存键 cache_key，以及 _search_page 的其余参数 page_args
+        """
+        if keyword is None or keyword.strip() == "":
+            return error.error_and_message(400, "搜索关键字不能为空") + ({},)
+
+        keyword = keyword.strip()
+        paging = cls._parse_search_paging(page, cursor, with_total, 2)
+        if paging[0] != 200:
+            return paging
+        page, after, with_total = paging[2]
+        fields = cls._parse_search_fields(fields)
+        if fields is None:
+            return error.error_and_message(400, "返回字段参数无效") + ({},)
+
+        store_id = store_id.strip() if store_id and store_id.strip() else None
+        return 200, "ok", {
+            "keyword": keyword,
+            "store_id": store_id,
+            "query": {"$text": {"$search": keyword}},
+            "cache_key": search_cache.make_key(
+                "search", store_id, " ".join(keyword.lower().split()),
+                page, tuple(after) if after else None, with_total, bool(facets), fields),
+            "page_args": {"text_search": True, "page": page, "after": after, "with_total": with_total,
+                          "sort_fields": None, "facets": facets, "fields": fields},
+        }
+
+    @classmethod
+    def _advanced_search_request(cls, title_prefix, tags, store_id, page, cursor, with_total, facets,
+                                 fields) -> (int, str, dict):
+        """search_books_advanced 的参数校验与查询构造，返回格式同 _search_request。"""
+        if (not title_prefix or title_prefix.strip() == "") and (not tags or len(tags) == 0):
+            return error.error_and_message(400, "搜索条件不能为空") + ({},)
+
+        search_conditions = []
+        # 有标题前缀时按 (title_lower, _id) 即索引顺序返回，游标沿索引区间续读
+        sort_fields = [("_id", 1)]
+
+        if title_prefix and title_prefix.strip():
+            search_conditions.append({
+                "search_index.title_lower": search_index.prefix_range(title_prefix.strip())
+            })
+            sort_fields = [("search_index.title_lower", 1), ("_id", 1)]
+
+        paging = cls._parse_search_paging(page, cursor, with_total, len(sort_fields))
+        if paging[0] != 200:
+            return paging
+        page, after, with_total = paging[2]
+        fields = cls._parse_search_fields(fields)
+        if fields is None:
+            return error.error_and_message(400, "返回字段参数无效") + ({},)
+
+        tags_lower = []
+        if tags and len(tags) > 0:
+            # 标签精确或包含匹配
+            tags_lower = search_index.fold_tags(tags)
+            if tags_lower:
                 search_conditions.append({
-                    "search_index.title_lower": {"$regex": "^" + title_lower}
+                    "search_index.tags_lower": {"$in": tags_lower}
                 })
-            
-            if tags and len(tags) > 0:
-                # 标签精确或包含匹配
-                tags_lower = [tag.lower() for tag in tags if tag.strip()]
-                if tags_lower:
-                    search_conditions.append({
-                        "search_index.tags_lower": {"$in": tags_lower}
-                    })
-            
-            if not search_conditions:
-                return error.error_and_message(400, "搜索条件不能为空") + ({},)
-            
-            if len(search_conditions) == 1:
-                search_query = search_conditions[0]
+
+        if not search_conditions:
+            return error.error_and_message(400, "搜索条件不能为空") + ({},)
+
+        if len(search_conditions) == 1:
+            search_query = search_conditions[0]
+        else:
+            search_query = {"$and": search_conditions}
+
+        store_id = store_id.strip() if store_id and store_id.strip() else None
+        return 200, "ok", {
+            "store_id": store_id,
+            "query": search_query,
+            "cache_key": search_cache.make_key(
+                "advanced", store_id, search_index.fold((title_prefix or "").strip()),
+                tuple(sorted(set(tags_lower))) if tags else (),
+                page, tuple(after) if after else None, with_total, bool(facets), fields),
+            "page_args": {"text_search": False, "page": page, "after": after, "with_total": with_total,
+                          "sort_fields": sort_fields, "facets": facets, "fields": fields},
+        }
+
+    @staticmethod
+    def _scoped_query(request: dict, store_filter: dict) -> dict:
+        """把店铺范围条件加到搜索条件上：$text 查询直接合并（$text 须在顶层），其余用 $and 组合。"""
+        if not store_filter:
+            return request["query"]
+        if request["page_args"]["text_search"]:
+            return dict(request["query"], **store_filter)
+        return {"$and": [request["query"], store_filter]}
+
+    @classmethod
+    def _empty_search_page(cls, request: dict) -> dict:
+        """店铺内没有任何书目时的空结果页。"""
+        args = request["page_args"]
+        return cls._search_result([], args["page"], args["after"], args["with_total"], False, None, 0,
+                                  facets=cls.EMPTY_FACETS if args["facets"] else None)
+
+    def _store_filter(self, store_id: str):
+        """店铺范围条件：store_ids 模式下是 Books 上的索引谓词，不需要读取店铺书目；
+        inventory 模式下读取书目 ID 拼成 $in 列表，店铺无书时返回 None。"""
+        if conf.Search_Store_Filter == "store_ids":
+            return {"store_ids": store_id}
+        return self._book_ids_filter(self.inventory.list_book_ids(store_id))
+
+    @staticmethod
+    def _book_ids_filter(book_ids: list):
+        if not book_ids:
+            return None
+        return {"_id": {"$in": book_ids}}
+
+    @classmethod
+    def _parse_search_fields(cls, fields) -> tuple:
+        """fields 参数 -> 返回字段元组；缺省为 full 视图，无效时返回 None。"""
+        if fields is None or fields == "":
+            return cls.SEARCH_VIEWS["full"]
+        if isinstance(fields, str):
+            return cls.SEARCH_VIEWS.get(fields)
+        if not isinstance(fields, list) or not fields:
+            return None
+        if not all(isinstance(field, str) and field in cls.SEARCH_FIELDS for field in fields):
+            return None
+        return tuple(dict.fromkeys(fields))
+
+    @staticmethod
+    def _search_projection(fields: tuple, sort_fields: list) -> dict:
+        """只读取结果字段与游标所需的排序键，不再拉取整篇 Books 文档（content、pictures 等）。"""
+        projection = {field: 1 for field in fields}
+        for field, _ in sort_fields:
+            if field not in ("_id", "score"):
+                projection[field] = 1
+        return projection
+
+    @staticmethod
+    def _format_search_book(book_doc: dict, fields: tuple) -> dict:
+        book_info = {"id": book_doc["_id"]}
+        for field in fields:
+            book_info[field] = book_doc.get(field, [] if field == "tags" else "")
+        return book_info
+
+    @staticmethod
+    def _parse_search_paging(page, cursor, with_total, key_length: int) -> (int, str, tuple):
+        """解析分页参数 -> (page, 游标排序键或 None, with_total)。
+
+        页码分页默认计数（兼容旧接口），游标分页默认不计数。
+        """
+        if cursor:
+            try:
+                after = pagination.decode_cursor(cursor, key_length)
+            except ValueError:
+                return error.error_and_message(400, "游标参数无效") + ({},)
+            return 200, "ok", (None, after, bool(with_total))
+        try:
+            page = max(1, int(page)) if page else 1
+        except (ValueError, TypeError):
+            return error.error_and_message(400, "页码参数无效") + ({},)
+        return 200, "ok", (page, None, True if with_total is None else bool(with_total))
+
+    def _search_page(self, search_query: dict, text_search: bool, page: int, after: list, with_total: bool,
+                     sort_fields: list = None, facets: bool = False, fields: tuple = None) -> dict:
+        """执行一页搜索：$text 按 (textScore 倒序, _id) 排序，其余按 sort_fields（默认 _id）排序。
+
+        多取一条判断 has_next，并以最后一条的排序键生成 next_cursor。
+        """
+        plan = self._search_plan(search_query, text_search, page, after, with_total, sort_fields, facets, fields)
+        total_count, lower_bound = None, False
+        if plan["count"] is not None:
+            total_count, lower_bound = self._count_books(plan["count"])
+        if plan["pipeline"] is not None:
+            rows = list(self.db["Books"].aggregate(plan["pipeline"]))
+        else:
+            books_cursor = self.db["Books"].find(plan["query"], plan["projection"]).sort(plan["sort"])
+            if plan["skip"] is not None:
+                books_cursor = books_cursor.skip(plan["skip"])
+            rows = list(books_cursor.limit(self.SEARCH_PAGE_SIZE + 1))
+        return self._finish_search_page(plan, rows, total_count, lower_bound)
+
+    @classmethod
+    def _search_plan(cls, search_query: dict, text_search: bool, page: int, after: list, with_total: bool,
+                     sort_fields: list = None, facets: bool = False, fields: tuple = None) -> dict:
+        """生成一页搜索要执行的查询：pipeline（聚合）或 query/projection/sort/skip（find），
+        以及需要单独计数时的 count 条件。不访问数据库，同步/异步实现共用。"""
+        page_size = cls.SEARCH_PAGE_SIZE
+        if text_search:
+            sort_fields = [("score", -1), ("_id", 1)]
+        elif sort_fields is None:
+            sort_fields = [("_id", 1)]
+        fields = fields or cls.SEARCH_VIEWS["full"]
+        projection = cls._search_projection(fields, sort_fields)
+        plan = {
+            "page": page, "after": after, "with_total": with_total, "facets": facets,
+            "fields": fields, "sort_fields": sort_fields,
+            "count": search_query if with_total and not facets else None,
+            "pipeline": None, "query": None, "projection": None, "sort": None, "skip": None,
+        }
+
+        if facets:
+            # 分面与当前页、精确总数同在一次 $facet 聚合中返回
+            plan["pipeline"] = cls._facet_pipeline(search_query, text_search, sort_fields, page, after,
+                                                   with_total, projection)
+        elif text_search and after is not None:
+            # textScore 不能出现在 find 的过滤条件里，游标续读需经聚合先物化分数
+            plan["pipeline"] = [
+                {"$match": search_query},
+                {"$addFields": {"score": {"$meta": "textScore"}}},
+                {"$match": pagination.after_key(sort_fields, after)},
+                {"$sort": {"score": -1, "_id": 1}},
+                {"$limit": page_size + 1},
+                {"$project": dict(projection, score=1)},
+            ]
+        else:
+            query = search_query
+            if after is not None:
+                query = {"$and": [search_query, pagination.after_key(sort_fields, after)]}
+            plan["query"] = query
+            if text_search:
+                plan["projection"] = dict(projection, score={"$meta": "textScore"})
+                plan["sort"] = [("score", {"$meta": "textScore"}), ("_id", 1)]
             else:
-                search_query = {"$and": search_conditions}
-            
-            if store_id and store_id.strip():
-                # 店铺内搜索
-                if not self.store_id_exist(store_id):
-                    return error.error_non_exist_store_id(store_id) + ({},)
-                
-                store_doc = self.db["Stores"].find_one({"_id": store_id}, {"inventory": 1})
-                if not store_doc or "inventory" not in store_doc:
-                    return 200, "ok", {
-                        "books": [],
-                        "pagination": {
-                            "page": page,
-                            "page_size": page_size,
-                            "total_count": 0,
-                            "total_pages": 0,
-                            "has_next": False,
-                            "has_prev": False
-                        }
-                    }
-                
-                book_ids = [item["book_id"] for item in store_doc["inventory"]]
-                if not book_ids:
-                    return 200, "ok", {
-                        "books": [],
-                        "pagination": {
-                            "page": page,
-                            "page_size": page_size,
-                            "total_count": 0,
-                            "total_pages": 0,
-                            "has_next": False,
-                            "has_prev": False
-                        }
-                    }
-                
-                # 添加店铺限制条件
-                search_query = {"$and": [search_query, {"_id": {"$in": book_ids}}]}
-            
-            total_count = self.db["Books"].count_documents(search_query)
-            books_cursor = self.db["Books"].find(search_query).skip(skip).limit(page_size)
-            
-            books = []
-            for book_doc in books_cursor:
-                book_info = {
-                    "id": book_doc["_id"],
-                    "title": book_doc.get("title", ""),
-                    "author": book_doc.get("author", ""),
-                    "book_intro": book_doc.get("book_intro", ""),
-                    "tags": book_doc.get("tags", [])
-                }
-                books.append(book_info)
-            
-            total_pages = (total_count + page_size - 1) // page_size
-            result = {
-                "books": books,
-                "pagination": {
-                    "page": page,
-                    "page_size": page_size,
-                    "total_count": total_count,
-                    "total_pages": total_pages,
-                    "has_next": page < total_pages,
-                    "has_prev": page > 1
-                }
+                plan["projection"] = projection
+                plan["sort"] = sort_fields
+            if after is None:
+                plan["skip"] = (page - 1) * page_size
+        return plan
+
+    @classmethod
+    def _finish_search_page(cls, plan: dict, rows: list, total_count: int, lower_bound: bool) -> dict:
+        page_size = cls.SEARCH_PAGE_SIZE
+        facet_counts = None
+        if plan["facets"]:
+            book_docs, facet_counts, total_count = cls._parse_facet_row(next(iter(rows), {}))
+        else:
+            book_docs = rows
+
+        has_next = len(book_docs) > page_size
+        book_docs = book_docs[:page_size]
+        books = []
+        for book_doc in book_docs:
+            book_info = cls._format_search_book(book_doc, plan["fields"])
+            if "score" in book_doc:
+                book_info["text_score"] = book_doc["score"]
+            books.append(book_info)
+
+        next_cursor = None
+        if has_next:
+            last = book_docs[-1]
+            next_cursor = pagination.encode_cursor(pagination.key_of(last, plan["sort_fields"]))
+        return cls._search_result(books, plan["page"], plan["after"], plan["with_total"], has_next, next_cursor,
+                                  total_count, lower_bound, facet_counts)
+
+    @classmethod
+    def _facet_pipeline(cls, search_query: dict, text_search: bool, sort_fields: list, page: int,
+                        after: list, with_total: bool, projection: dict) -> list:
+        """一次 $facet 聚合同时取回当前页、标签/出版社分面与总数，只往返一次。"""
+        page_size = cls.SEARCH_PAGE_SIZE
+        limit = conf.Search_Facet_Limit
+        page_pipeline = []
+        if after is not None:
+            page_pipeline.append({"$match": pagination.after_key(sort_fields, after)})
+        page_pipeline.append({"$sort": dict(sort_fields)})
+        if after is None:
+            page_pipeline.append({"$skip": (page - 1) * page_size})
+        page_pipeline.append({"$limit": page_size + 1})
+        page_pipeline.append({"$project": dict(projection, score=1) if text_search else projection})
+        facet = {
+            "page": page_pipeline,
+            "tags": [
+                {"$unwind": "$search_index.tags_lower"},
+                {"$group": {"_id": "$search_index.tags_lower", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$limit": limit},
+            ],
+            "publishers": [
+                {"$match": {"publisher": {"$nin": [None, ""]}}},
+                {"$group": {"_id": "$publisher", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$limit": limit},
+            ],
+        }
+        if with_total:
+            facet["total"] = [{"$count": "count"}]
+
+        pipeline = [{"$match": search_query}]
+        if text_search:
+            pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+        pipeline.append({"$facet": facet})
+        return pipeline
+
+    @staticmethod
+    def _parse_facet_row(row: dict) -> (list, dict, int):
+        facet_counts = {
+            name: [{"value": item["_id"], "count": item["count"]} for item in row.get(name, [])]
+            for name in ("tags", "publishers")
+        }
+        total = row.get("total") or [{"count": 0}]
+        return row.get("page", []), facet_counts, total[0]["count"]
+
+    def _search_page_memory(self, keyword: str, store_filter: dict, page: int, after: list, with_total: bool,
+                            facets: bool = False, fields: tuple = None) -> dict:
+        """进程内倒排索引执行一页搜索，排序键与游标格式同 $text 路径 (score, _id)。"""
+        fields = fields or self.SEARCH_VIEWS["full"]
+        page_size = self.SEARCH_PAGE_SIZE
+        book_ids = None
+        if "_id" in store_filter:
+            book_ids = set(store_filter["_id"]["$in"])
+        index = search_engine.get_index(self.db)
+        hits = index.search(keyword, store_filter.get("store_ids"), book_ids)
+
+        start = (page - 1) * page_size if after is None else search_engine.page_after(hits, after)
+        window = hits[start:start + page_size + 1]
+        has_next = len(window) > page_size
+        window = window[:page_size]
+
+        docs = {}
+        if window:
+            books_cursor = self.db["Books"].find(
+                {"_id": {"$in": [book_id for _, book_id in window]}},
+                {field: 1 for field in fields}
+            )
+            docs = {doc["_id"]: doc for doc in books_cursor}
+        books = []
+        for score, book_id in window:
+            book_doc = docs.get(book_id)
+            if book_doc is None:
+                # 索引重建前已被删除的书
+                continue
+            book_info = self._format_search_book(book_doc, fields)
+            book_info["text_score"] = score
+            books.append(book_info)
+
+        next_cursor = pagination.encode_cursor(list(window[-1])) if has_next else None
+        facet_counts = None
+        if facets:
+            facet_counts = index.facet_counts([book_id for _, book_id in hits], conf.Search_Facet_Limit)
+        return self._search_result(books, page, after, with_total, has_next, next_cursor, len(hits),
+                                   facets=facet_counts)
+
+    def _count_books(self, search_query: dict) -> (int, bool):
+        """结果计数 -> (数量, 是否为下限)；超过 Search_Count_Limit 时数到上限 + 1 即停止，
+        此时只知道总数不少于该值。"""
+        return self._count_result(self.db["Books"].count_documents(search_query, **self._count_options()))
+
+    @staticmethod
+    def _count_options() -> dict:
+        limit = conf.Search_Count_Limit
+        return {"limit": limit + 1} if limit > 0 else {}
+
+    @staticmethod
+    def _count_result(count: int) -> (int, bool):
+        return count, 0 < conf.Search_Count_Limit < count
+
+    @classmethod
+    def _search_result(cls, books: list, page: int, after: list, with_total: bool, has_next: bool,
+                       next_cursor: str, total_count: int, lower_bound: bool = False, facets: dict = None) -> dict:
+        page_size = cls.SEARCH_PAGE_SIZE
+        if after is None:
+            page_info = {
+                "page": page,
+                "page_size": page_size,
+                "has_next": has_next,
+                "has_prev": page > 1,
+                "next_cursor": next_cursor,
             }
-            
+        else:
+            page_info = {
+                "page_size": page_size,
+                "has_next": has_next,
+                "next_cursor": next_cursor,
+            }
+        if with_total and lower_bound:
+            # 计数在上限处停止：只给出下限，不推算末页
+            page_info["total_count_at_least"] = total_count
+        elif with_total:
+            page_info["total_count"] = total_count
+            if after is None:
+                page_info["total_pages"] = (total_count + page_size - 1) // page_size
+        result = {"books": books, "pagination": page_info}
+        if facets is not None:
+            result["facets"] = facets
+        return result
+
+    def suggest(self, prefix: str, limit: int = 10) -> (int, str, dict):
+        """输入联想：按书名/作者/标签前缀返回热度最高的书名（进程内索引，见 suggest.SuggestIndex）。"""
+        try:
+            if prefix is None or prefix.strip() == "":
+                return error.error_and_message(400, "搜索前缀不能为空") + ({},)
+            try:
+                limit = max(1, int(limit)) if limit else 10
+            except (ValueError, TypeError):
+                return error.error_and_message(400, "数量参数无效") + ({},)
+            suggestions = suggest.get_index(self.db).suggest(prefix, limit)
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
             return code, msg, {}
         except BaseException as e:
             code, msg, _ = error.exception_to_tuple3(e)
             return code, msg, {}
-        
-        return 200, "ok", result
+        return 200, "ok", {"suggestions": suggestions}
 
     def get_book_detail(self, book_id: str) -> (int, str, dict):
         #  获取书籍详情信息
@@ -669,25 +1060,7 @@ class Buyer(db_conn.DBConn):
             if book_doc is None:
                 return error.error_and_message(404, "书籍不存在") + ({},)
             
-            book_detail = {
-                "id": book_doc["_id"],
-                "title": book_doc.get("title", ""),
-                "author": book_doc.get("author", ""),
-                "publisher": book_doc.get("publisher", ""),
-                "original_title": book_doc.get("original_title", ""),
-                "translator": book_doc.get("translator", ""),
-                "pub_year": book_doc.get("pub_year", ""),
-                "pages": book_doc.get("pages", 0),
-                "price": book_doc.get("price", 0),
-                "currency_unit": book_doc.get("currency_unit", ""),
-                "binding": book_doc.get("binding", ""),
-                "isbn": book_doc.get("isbn", ""),
-                "author_intro": book_doc.get("author_intro", ""),
-                "book_intro": book_doc.get("book_intro", ""),
-                "content": book_doc.get("content", ""),
-                "tags": book_doc.get("tags", []),
-                "pictures": book_doc.get("pictures", [])
-            }
+            book_detail = self.format_book_detail(book_doc)
             
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
@@ -696,4 +1069,53 @@ class Buyer(db_conn.DBConn):
             code, msg, _ = error.exception_to_tuple3(e)
             return code, msg, {}
         
-        return 200, "ok", book_detail
\ No newline at end of file
+        return 200, "ok", book_detail
+
+    def get_picture(self, picture_id: str, variant: str = picture.ORIGINAL) -> (int, str, tuple):
+        """读取图片 -> (文件对象, 长度, MIME 类型, ETag)，由视图流式返回。"""
+        try:
+            if variant not in picture.VARIANTS:
+                return error.error_and_message(400, "图片尺寸参数无效") + (None,)
+            found = picture.open_picture(self.db, picture_id, variant)
+            if found is None:
+                return error.error_and_message(404, "图片不存在") + (None,)
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg, None
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg, None
+
+        return 200, "ok", found
+
+    @staticmethod
+    def format_book_detail(book_doc: dict) -> dict:
+        """Books 文档 -> 书籍详情响应（同步/异步模型共用）。
+
+        图片以 /book/picture/<id> 地址返回；尚未执行 script/migrate_pictures.py 的旧文档
+        仍原样返回内嵌的 base64 图片。
+        """
+        if "picture_ids" in book_doc:
+            pictures, thumbnails = picture.urls(book_doc["picture_ids"])
+        else:
+            pictures, thumbnails = book_doc.get("pictures", []), []
+        return {
+            "id": book_doc["_id"],
+            "title": book_doc.get("title", ""),
+            "author": book_doc.get("author", ""),
+            "publisher": book_doc.get("publisher", ""),
+            "original_title": book_doc.get("original_title", ""),
+            "translator": book_doc.get("translator", ""),
+            "pub_year": book_doc.get("pub_year", ""),
+            "pages": book_doc.get("pages", 0),
+            "price": book_doc.get("price", 0),
+            "currency_unit": book_doc.get("currency_unit", ""),
+            "binding": book_doc.get("binding", ""),
+            "isbn": book_doc.get("isbn", ""),
+            "author_intro": book_doc.get("author_intro", ""),
+            "book_intro": book_doc.get("book_intro", ""),
+            "content": book_doc.get("content", ""),
+            "tags": book_doc.get("tags", []),
+            "pictures": pictures,
+            "thumbnails": thumbnails,
+        }
\ No newline at end of file
@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    进程内有界缓存：LRU 淘汰 + 条目过期时间，线程安全。
+    - 条目可挂在一个分组下（如 user_id），invalidate_group 一次清除该组全部条目
+    - 每个分组有一个代数，invalidate_group 时加一：调用方在读库前取 generation(group)，
+      写入时带上该代数，期间发生过失效则丢弃这次写入，避免失效前读到的旧数据被写回缓存
+    - 记录命中/未命中次数，stats() 供基准测试与监控读取
+    多进程部署时各进程各自持有一份缓存，失效只作用于本进程，
+    因此 ttl 同时也是跨进程数据可能陈旧的上限。
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expire_at, group, value)
+        self._groups = {}  # group -> set(key)
+        self._generations = {}  # group -> 失效次数；未失效过的分组为 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING:
+                self.misses += 1
+                return default
+            if entry[0] <= now:
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def generation(self, group) -> int:
+        with self._lock:
+            return self._generations.get(group, 0)
+
+    def set(self, key, value, group=None, ttl: float = None, generation: int = None) -> None:
+        if not self.enabled:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and self._generations.get(group, 0) != generation:
+                # 读取之后该分组已失效，value 可能已过时
+                return
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + ttl, group, value)
+            if group is not None:
+                self._groups.setdefault(group, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def invalidate_group(self, group) -> None:
+        with self._lock:
+            self._generations[group] = self._generations.get(group, 0) + 1
+            for key in list(self._groups.get(group, ())):
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._groups.clear()
+            self._generations.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+    def _remove(self, key) -> None:
+        # 调用方需持有锁
+        _, group, _ = self._data.pop(key)
+        if group is not None:
+            keys = self._groups.get(group)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._groups[group]
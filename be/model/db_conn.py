@@ -1,35 +1,124 @@
+import functools
+
+from be import conf
+from be.model import error
+from be.model import inventory
 from be.model.store import get_db
 
 
+class _SessionBoundCollection:
+    """为集合的每次调用自动附带 session 参数。"""
+
+    def __init__(self, collection, session):
+        self._collection = collection
+        self._session = session
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if callable(attr):
+            return functools.partial(attr, session=self._session)
+        return attr
+
+
 class DBConn:
     def __init__(self):
         self.db = get_db()
+        # 库存读写统一经由存储布局对象，模型层不感知内嵌数组/独立集合的差异
+        self.inventory = inventory.get_inventory(self)
+
+    def col(self, name: str, session=None):
+        """获取集合；事务模式下返回绑定 session 的集合代理。"""
+        collection = self.db[name]
+        if session is None:
+            return collection
+        return _SessionBoundCollection(collection, session)
+
+    def run_in_transaction(self, callback):
+        """
+        执行 callback(session) 并返回其结果：
+        - conf.Use_Transaction 关闭时以 session=None 直接执行，调用方自行补偿
+        - 开启时使用 ClientSession.with_transaction（需副本集），
+          TransientTransactionError / UnknownTransactionCommitResult 由驱动自动重试
+        - 回调内抛出 error.TransactionAbort 时事务回滚，并返回其携带的结果
+        """
+        if not conf.Use_Transaction:
+            return callback(None)
+        with self.db.client.start_session() as session:
+            try:
+                return session.with_transaction(callback)
+            except error.TransactionAbort as e:
+                return e.result
+
+    @staticmethod
+    def abort(session, result):
+        """业务失败出口：事务中抛出以回滚已做的写入，否则直接返回结果。"""
+        if session is not None:
+            raise error.TransactionAbort(result)
+        return result
+
+    def loader(self, session=None) -> "DocumentLoader":
+        """新建一个请求内的文档加载器（模型对象可能被复用，缓存不能跨调用共享）。"""
+        return DocumentLoader(self, session)
+
+    # 以下存在性检查只取 _id 字段，不传输整个文档
     # 检查user_id是否存在
     def user_id_exist(self, user_id):
-        cursor = self.db["Users"].find_one({"_id": user_id})
-        if cursor is None:
-            return False
-        else:
-            return True
+        return self._id_exist("Users", user_id)
+
     # 检查store_id是否存在
     def store_id_exist(self, store_id):
-        cursor = self.db["Stores"].find_one({"_id": store_id})
-        if cursor is None:
-            return False
-        else:
-            return True
+        return self._id_exist("Stores", store_id)
 
     # 检查book_id是否存在
     def book_id_exist(self, book_id):
-        cursor = self.db["Books"].find_one({"_id": book_id})
-        if cursor is None:
-            return False
-        else:
-            return True
+        return self._id_exist("Books", book_id)
+
     # 检查order_id是否存在
     def order_id_exist(self, order_id):
-        cursor = self.db["Orders"].find_one({"_id": order_id})
-        if cursor is None:
-            return False
+        return self._id_exist("Orders", order_id)
+
+    def _id_exist(self, name: str, _id) -> bool:
+        return self.db[name].find_one({"_id": _id}, {"_id": 1}) is not None
+
+
+class DocumentLoader:
+    """
+    请求内按 _id 读取文档：同一 (集合, _id) 只查询一次，后续读取与存在性判断直接命中缓存。
+    - get(name, _id, fields) 可只取部分字段；已缓存的文档覆盖所需字段时不再查询
+    - exists(name, _id) 只取 _id 字段
+    写入后如需重新读取，调用 forget。
+    """
+
+    def __init__(self, conn: DBConn, session=None):
+        self._conn = conn
+        self._session = session
+        # (name, _id) -> (文档或 None, 已取字段集合；None 表示整个文档)
+        self._docs = {}
+        self._exists = {}
+
+    def get(self, name: str, _id, fields=None):
+        key = (name, _id)
+        cached = self._docs.get(key)
+        if cached is not None:
+            doc, loaded = cached
+            if doc is None or loaded is None or (fields is not None and loaded.issuperset(fields)):
+                return doc
+        if fields is None:
+            doc = self._conn.col(name, self._session).find_one({"_id": _id})
+            loaded = None
         else:
-            return True
\ No newline at end of file
+            loaded = frozenset(fields)
+            doc = self._conn.col(name, self._session).find_one({"_id": _id}, {field: 1 for field in loaded})
+        self._docs[key] = (doc, loaded)
+        self._exists[key] = doc is not None
+        return doc
+
+    def exists(self, name: str, _id) -> bool:
+        key = (name, _id)
+        if key not in self._exists:
+            self.get(name, _id, fields=("_id",))
+        return self._exists[key]
+
+    def forget(self, name: str, _id) -> None:
+        self._docs.pop((name, _id), None)
+        self._exists.pop((name, _id), None)
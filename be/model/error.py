@@ -142,3 +142,14 @@ def exception_db_to_tuple3(e: BaseException):
     """数据库异常专用助手：记录日志并返回 528 统一格式三元组。"""
     logging.exception("Database exception: %s", e)
     return 528, error_code[528].format(str(e)), ""
+
+
+class TransactionAbort(Exception):
+    """
+    事务回调内的业务失败：携带 (code, message) 抛出，
+    由 DBConn.run_in_transaction 捕获后中止事务并原样返回该结果。
+    """
+
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
@@ -0,0 +1,217 @@
+import pymongo
+
+from be import conf
+
+
+class EmbeddedInventory:
+    """
+    内嵌布局：库存项保存在 Stores.inventory 数组中
+    {"book_id", "stock_level", "price"}，依赖 Stores.inventory.book_id 多键索引。
+    """
+
+    def __init__(self, conn):
+        # conn 为 DBConn，借用其 col(name, session) 获取（可绑定事务的）集合
+        self.conn = conn
+
+    def get_item(self, store_id: str, book_id: str, session=None):
+        """返回单个库存项，不存在时返回 None。"""
+        store_doc = self.conn.col("Stores", session).find_one(
+            {"_id": store_id, "inventory": {"$elemMatch": {"book_id": book_id}}},
+            {"inventory.$": 1}
+        )
+        if store_doc is None or not store_doc.get("inventory"):
+            return None
+        return store_doc["inventory"][0]
+
+    def get_items(self, store_id: str, book_ids: list, session=None) -> dict:
+        """一次聚合取回店铺中指定书目的库存项，返回 {book_id: 库存项}。"""
+        if not book_ids:
+            return {}
+        # $filter 在服务端裁剪 inventory 数组，只把需要的条目传回
+        cursor = self.conn.col("Stores", session).aggregate([
+            {"$match": {"_id": store_id}},
+            {"$project": {
+                "_id": 0,
+                "inventory": {
+                    "$filter": {
+                        "input": "$inventory",
+                        "as": "item",
+                        "cond": {"$in": ["$$item.book_id", book_ids]},
+                    }
+                },
+            }},
+        ])
+        result = {}
+        for store_doc in cursor:
+            for item in store_doc.get("inventory") or []:
+                # 与 $elemMatch 语义一致：同一本书取第一条匹配项
+                result.setdefault(item.get("book_id"), item)
+        return result
+
+    def add_item(self, store_id: str, book_id: str, stock_level: int, price, session=None) -> bool:
+        """新增库存项；调用方已确认不存在。"""
+        self.conn.col("Stores", session).update_one(
+            {"_id": store_id},
+            {"$push": {"inventory": {
+                "book_id": book_id,
+                "stock_level": stock_level,
+                "price": price,
+            }}}
+        )
+        return True
+
+    def add_items(self, store_id: str, items: list, session=None) -> list:
+        """批量新增库存项 [(book_id, stock_level, price)]，一次 $push $each；调用方已确认均不存在。
+        返回成功写入的 book_id 列表。"""
+        if not items:
+            return []
+        self.conn.col("Stores", session).update_one(
+            {"_id": store_id},
+            {"$push": {"inventory": {"$each": [
+                {"book_id": book_id, "stock_level": stock_level, "price": price}
+                for book_id, stock_level, price in items
+            ]}}}
+        )
+        return [book_id for book_id, _, _ in items]
+
+    def inc_stocks(self, store_id: str, deltas: dict, session=None) -> None:
+        """批量调整库存 {book_id: delta}，一次 bulk_write。"""
+        if not deltas:
+            return
+        self.conn.col("Stores", session).bulk_write([
+            pymongo.UpdateOne({"_id": store_id, "inventory.book_id": book_id},
+                              {"$inc": {"inventory.$.stock_level": delta}})
+            for book_id, delta in deltas.items()
+        ], ordered=False)
+
+    def inc_stock(self, store_id: str, book_id: str, delta: int, session=None) -> bool:
+        """调整库存（delta 可为负），返回是否有库存项被修改。"""
+        # 使用位置操作符 $ 更新匹配的数组元素
+        result = self.conn.col("Stores", session).update_one(
+            {"_id": store_id, "inventory.book_id": book_id},
+            {"$inc": {"inventory.$.stock_level": delta}}
+        )
+        return result.modified_count > 0
+
+    def reserve(self, store_id: str, book_id: str, count: int, session=None) -> bool:
+        """条件扣减：仅当该书库存 >= count 时原子地扣减，返回是否成功。"""
+        # $elemMatch 保证库存条件与位置操作符作用于同一个数组元素
+        result = self.conn.col("Stores", session).update_one(
+            {"_id": store_id, "inventory": {"$elemMatch": {"book_id": book_id, "stock_level": {"$gte": count}}}},
+            {"$inc": {"inventory.$.stock_level": -count}}
+        )
+        return result.matched_count > 0
+
+    def list_book_ids(self, store_id: str) -> list:
+        """店铺内全部书目 ID。"""
+        name, query, projection = self.book_ids_lookup(store_id)
+        return self.book_ids_from(self.conn.col(name).find(query, projection))
+
+    @staticmethod
+    def book_ids_lookup(store_id: str) -> (str, dict, dict):
+        """list_book_ids 的查询 (集合名, 条件, 投影)，异步读路径（AsyncBuyer）用同一查询。"""
+        return "Stores", {"_id": store_id}, {"_id": 0, "inventory.book_id": 1}
+
+    @staticmethod
+    def book_ids_from(docs) -> list:
+        return [item["book_id"] for doc in docs for item in doc.get("inventory", [])]
+
+
+class CollectionInventory:
+    """
+    独立集合布局：每个库存项是 Inventory 集合中的一个文档
+    {"store_id", "book_id", "stock_level", "price"}，(store_id, book_id) 唯一复合索引。
+    库存更新只改写单个小文档，同店铺不同书目之间不再争用同一个 Stores 文档。
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def get_item(self, store_id: str, book_id: str, session=None):
+        return self.conn.col("Inventory", session).find_one(
+            {"store_id": store_id, "book_id": book_id},
+            {"_id": 0, "book_id": 1, "stock_level": 1, "price": 1}
+        )
+
+    def get_items(self, store_id: str, book_ids: list, session=None) -> dict:
+        if not book_ids:
+            return {}
+        cursor = self.conn.col("Inventory", session).find(
+            {"store_id": store_id, "book_id": {"$in": book_ids}},
+            {"_id": 0, "book_id": 1, "stock_level": 1, "price": 1}
+        )
+        return {item["book_id"]: item for item in cursor}
+
+    def add_item(self, store_id: str, book_id: str, stock_level: int, price, session=None) -> bool:
+        """新增库存项；唯一索引冲突（并发重复上架）时返回 False。"""
+        try:
+            self.conn.col("Inventory", session).insert_one({
+                "store_id": store_id,
+                "book_id": book_id,
+                "stock_level": stock_level,
+                "price": price,
+            })
+        except pymongo.errors.DuplicateKeyError:
+            return False
+        return True
+
+    def add_items(self, store_id: str, items: list, session=None) -> list:
+        """批量插入（无序 insert_many）；唯一索引冲突的条目跳过，返回成功写入的 book_id 列表。"""
+        if not items:
+            return []
+        docs = [{"store_id": store_id, "book_id": book_id, "stock_level": stock_level, "price": price}
+                for book_id, stock_level, price in items]
+        try:
+            self.conn.col("Inventory", session).insert_many(docs, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in write_errors):
+                raise
+            failed = {err["index"] for err in write_errors}
+            return [doc["book_id"] for i, doc in enumerate(docs) if i not in failed]
+        return [doc["book_id"] for doc in docs]
+
+    def inc_stocks(self, store_id: str, deltas: dict, session=None) -> None:
+        if not deltas:
+            return
+        self.conn.col("Inventory", session).bulk_write([
+            pymongo.UpdateOne({"store_id": store_id, "book_id": book_id}, {"$inc": {"stock_level": delta}})
+            for book_id, delta in deltas.items()
+        ], ordered=False)
+
+    def inc_stock(self, store_id: str, book_id: str, delta: int, session=None) -> bool:
+        result = self.conn.col("Inventory", session).update_one(
+            {"store_id": store_id, "book_id": book_id},
+            {"$inc": {"stock_level": delta}}
+        )
+        return result.modified_count > 0
+
+    def reserve(self, store_id: str, book_id: str, count: int, session=None) -> bool:
+        result = self.conn.col("Inventory", session).update_one(
+            {"store_id": store_id, "book_id": book_id, "stock_level": {"$gte": count}},
+            {"$inc": {"stock_level": -count}}
+        )
+        return result.matched_count > 0
+
+    def list_book_ids(self, store_id: str) -> list:
+        name, query, projection = self.book_ids_lookup(store_id)
+        return self.book_ids_from(self.conn.col(name).find(query, projection))
+
+    @staticmethod
+    def book_ids_lookup(store_id: str) -> (str, dict, dict):
+        return "Inventory", {"store_id": store_id}, {"_id": 0, "book_id": 1}
+
+    @staticmethod
+    def book_ids_from(docs) -> list:
+        return [item["book_id"] for item in docs]
+
+
+def get_layout():
+    """按 conf.Inventory_Layout 选择库存存储布局类。"""
+    if conf.Inventory_Layout == "collection":
+        return CollectionInventory
+    return EmbeddedInventory
+
+
+def get_inventory(conn):
+    return get_layout()(conn)
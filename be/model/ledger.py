@@ -0,0 +1,263 @@
+"""
+余额流水（Balance_Mode = "ledger"）。
+
+入账（取消退款、收货后给卖家结算、充值）不再 $inc Users.balance，而是向 Ledger 集合追加一条流水
+{user_id, amount, kind, ref, time, applied}：
+- 追加只插入新文档，热门卖家同时收到大量入账也不会争用同一个用户文档
+- 非事务模式下由写入线程合并并发请求的流水，一次 insert_many 组提交，请求在写入确认后返回；
+  事务模式下随事务 insert_one
+- 物化：把某用户未入账的流水一次 $inc 进 Users.balance（即缓存的累计余额）。
+  扣款余额不足时按用户物化；服务进程另有物化线程每 Ledger_Materialize_Interval 秒物化全部（周期，
+  由 serve 与调度器一同启动，与写入线程及是否开启事务无关）
+- 物化：Use_Transaction 开启时 $inc 与标记入账在同一事务中提交；关闭时以 Users 文档上的批次记录
+  串行化并作为入账标记（见 _materialize_with_marker），中途失败时接手同一批次不会重复入账
+
+可用余额 = Users.balance + 未认领流水之和：支付在 Users.balance 不足时才加上 pending 判断，
+扣款仍是 Users.balance 上的条件 $inc。
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+
+import pymongo
+
+from be import conf
+from be.model import db_conn
+
+# 批次记录超过该时长仍未删除视为物化中断，由周期物化接手
+_STALE_BATCH = 60
+# 单批物化的流水条数上限，Users.ledger_batch_ids 随之有界
+_BATCH_LIMIT = 5000
+
+_PENDING = {"applied": False}
+
+
+def enabled() -> bool:
+    return conf.Balance_Mode == "ledger"
+
+
+def credit(conn, user_id: str, amount: int, kind: str, ref: str = None, session=None) -> None:
+    """追加一条入账流水；conn 为 DBConn（事务模式下随 session 写入）。"""
+    if not amount:
+        return
+    entry = {"user_id": user_id, "amount": amount, "kind": kind, "ref": ref, "time": time.time(), "applied": False}
+    if session is not None:
+        conn.col("Ledger", session).insert_one(entry)
+    else:
+        writer.append(conn.db, [entry])
+
+
+def pending(db, user_id: str) -> int:
+    """
+    尚未物化的入账之和。无事务物化在 $inc 与标记入账之间时，这批流水仍会计入：
+    只影响支付前的余额预检，扣款本身是 Users.balance 上的条件 $inc。
+    """
+    rows = db["Ledger"].aggregate([
+        {"$match": dict(_PENDING, user_id=user_id)},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
+    ])
+    return sum(row["total"] for row in rows)
+
+
+def materialize(conn, user_id: str, session=None) -> int:
+    """把该用户未入账的流水计入 Users.balance，返回本次计入的金额；conn 为 DBConn，调用方在事务中时随 session 写入。"""
+    if session is not None:
+        return _materialize_in_transaction(conn, user_id, session)
+    if conf.Use_Transaction:
+        return conn.run_in_transaction(lambda session: _materialize_in_transaction(conn, user_id, session))
+    return _materialize_with_marker(conn.db, user_id)
+
+
+def _pending_entries(ledger_col, user_id: str) -> (list, int):
+    entries = list(ledger_col.find(dict(_PENDING, user_id=user_id), {"amount": 1}).limit(_BATCH_LIMIT))
+    return [entry["_id"] for entry in entries], sum(entry["amount"] for entry in entries)
+
+
+def _materialize_in_transaction(conn, user_id: str, session) -> int:
+    # $inc 与标记入账同一事务提交；并发物化同一批流水时写冲突，由驱动重试的一方读不到待入账流水
+    ids, total = _pending_entries(conn.col("Ledger", session), user_id)
+    if not ids:
+        return 0
+    conn.col("Users", session).update_one({"_id": user_id}, {"$inc": {"balance": total}})
+    conn.col("Ledger", session).update_many({"_id": {"$in": ids}}, {"$set": {"applied": True}})
+    return total
+
+
+def _materialize_with_marker(db, user_id: str) -> int:
+    """
+    无事务：Users 文档上的批次记录 {ledger_batch, ledger_batch_ids, ledger_batch_at} 串行化该用户的物化，
+    同时充当不过期的入账标记：
+    1. 以 ledger_batch 不存在为条件写入批次号（每个用户同一时刻只有一个批次）
+    2. 读取待入账流水，以批次号且 ledger_batch_ids 不存在为条件 $inc，同时记下流水 _id
+    3. 标记这些流水已入账，最后按批次号删除批次记录
+    任一步后中断时由 materialize_pending 接手：已 $inc 的批次补做 3，未 $inc 的批次直接删除记录
+    """
+    token = uuid.uuid4().hex
+    acquired = db["Users"].update_one(
+        {"_id": user_id, "ledger_batch": {"$exists": False}},
+        {"$set": {"ledger_batch": token, "ledger_batch_at": time.time()}}
+    )
+    if acquired.modified_count == 0:
+        # 用户不存在，或已有批次在物化/等待接手
+        return 0
+    ids, total = _pending_entries(db["Ledger"], user_id)
+    if not ids:
+        _release(db, user_id, token)
+        return 0
+    applied = db["Users"].update_one(
+        {"_id": user_id, "ledger_batch": token, "ledger_batch_ids": {"$exists": False}},
+        {"$inc": {"balance": total}, "$set": {"ledger_batch_ids": ids, "ledger_batch_at": time.time()}}
+    )
+    if applied.modified_count == 0:
+        # 停顿过久，批次记录已被当作中断删除：本次未入账，流水留给下一次物化
+        return 0
+    _finish(db, user_id, token, ids)
+    return total
+
+
+def _finish(db, user_id: str, token: str, ids: list) -> None:
+    db["Ledger"].update_many({"_id": {"$in": ids}}, {"$set": {"applied": True}})
+    _release(db, user_id, token)
+
+
+def _release(db, user_id: str, token: str, unapplied_only: bool = False) -> None:
+    query = {"_id": user_id, "ledger_batch": token}
+    if unapplied_only:
+        query["ledger_batch_ids"] = {"$exists": False}
+    db["Users"].update_one(query, {"$unset": {"ledger_batch": "", "ledger_batch_ids": "", "ledger_batch_at": ""}})
+
+
+def materialize_pending(conn, limit: int = 1000) -> (int, int):
+    """接手中断的批次，再物化最多 limit 个有待入账流水的用户；返回 (用户数, 金额)。"""
+    db = conn.db
+    for user_doc in db["Users"].find({"ledger_batch_at": {"$lt": time.time() - _STALE_BATCH}},
+                                     {"ledger_batch": 1, "ledger_batch_ids": 1}):
+        if "ledger_batch_ids" in user_doc:
+            _finish(db, user_doc["_id"], user_doc["ledger_batch"], user_doc["ledger_batch_ids"])
+        else:
+            # 未 $inc 即中断：条件删除，与恰好此时完成 $inc 的物化互斥
+            _release(db, user_doc["_id"], user_doc["ledger_batch"], unapplied_only=True)
+
+    users = [row["_id"] for row in db["Ledger"].aggregate([
+        {"$match": _PENDING},
+        {"$group": {"_id": "$user_id"}},
+        {"$limit": limit},
+    ])]
+    amount = sum(materialize(conn, user_id) for user_id in users)
+    return len(users), amount
+
+
+class _Append:
+    __slots__ = ("db", "entries", "done", "error")
+
+    def __init__(self, db, entries: list):
+        self.db = db
+        self.entries = entries
+        self.done = threading.Event()
+        self.error = None
+
+
+class LedgerWriter:
+    """
+    组提交：请求线程入队后等待，写入线程把上一次写入期间积累的流水一次 insert_many 写入。
+    低负载时每批只有一条，不额外等待；并发越高每批合并的流水越多。
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._queue = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = os.getpid()
+        self.flushes = 0
+        self.entries = 0
+
+    def append(self, db, entries: list) -> None:
+        if self._pid != os.getpid():
+            # fork 出的子进程没有写入线程，丢弃继承来的状态
+            self._reset()
+        request = _Append(db, entries)
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+                self._thread.start()
+            self._queue.append(request)
+            self._cond.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                batch, self._queue = self._queue, []
+            self._flush(batch)
+
+    def _flush(self, batch: list) -> None:
+        groups = {}
+        for request in batch:
+            groups.setdefault(id(request.db), []).append(request)
+        for requests in groups.values():
+            db = requests[0].db
+            docs = [entry for request in requests for entry in request.entries]
+            failed_from = None
+            error = None
+            try:
+                db["Ledger"].insert_many(docs, ordered=True)
+            except pymongo.errors.BulkWriteError as e:
+                # 有序写入在第一条失败处停止，之前的流水已写入
+                write_errors = e.details.get("writeErrors") or [{"index": 0}]
+                failed_from, error = write_errors[0]["index"], e
+            except Exception as e:
+                failed_from, error = 0, e
+            self.flushes += 1
+            self.entries += len(docs)
+            offset = 0
+            for request in requests:
+                end = offset + len(request.entries)
+                if failed_from is not None and end > failed_from:
+                    request.error = error
+                offset = end
+                request.done.set()
+
+
+class LedgerMaterializer:
+    """周期物化线程：每 Ledger_Materialize_Interval 秒物化全部待入账流水（多进程各自运行，批次认领保证不重复入账）。"""
+
+    def __init__(self):
+        self._thread = None
+        self._stop = threading.Event()
+        self.runs = 0
+
+    def start(self) -> None:
+        if not enabled() or conf.Ledger_Materialize_Interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ledger-materializer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(conf.Ledger_Materialize_Interval):
+            try:
+                materialize_pending(db_conn.DBConn())
+                self.runs += 1
+            except pymongo.errors.PyMongoError as e:
+                logging.warning(f"余额流水物化失败: {e}")
+
+
+writer = LedgerWriter()
+materializer = LedgerMaterializer()
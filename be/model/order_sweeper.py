@@ -0,0 +1,157 @@
+"""
+超时未支付订单的批量取消。
+
+按 orders_status_create_time 索引从最早的超时订单开始，每批：
+- 一次 find 取回一批订单（只读取释放库存需要的字段）
+- 一次 update_many 把仍为 unpaid 的订单置为 cancelled，并写入本轮的 timeout_at
+- 预占了库存的订单按店铺汇总，每个店铺一次 bulk_write 归还库存（见 inventory.inc_stocks）
+每批独立提交，已取消的订单不再满足查询条件：单次运行受 limit 限制，中断或未扫完时
+再次运行即从剩余的超时订单继续，无需保存进度。
+
+取消与归还库存是两次写入：
+- Use_Transaction 开启时每批的取消与归还在同一个事务中提交
+- 关闭时取消的同时写入 release_pending（取消时间），每个店铺归还后清除；
+  进程在两者之间中断时，之后的 sweep 先补完 release_pending 超过 Auto_Cancel_Release_Grace 秒的订单。
+  补做前逐单改写 release_pending 认领，并发的 sweep 不会重复归还；
+  归还已写入但标记未清除时中断，补做会再归还一次该店铺的这批订单（窗口仅一次 bulk_write 与 update_many 之间）
+"""
+import logging
+import time
+
+from be import conf
+from be.model import db_conn
+
+_FIELDS = {"_id": 1, "store_id": 1, "create_time": 1, "stock_reserved": 1, "items.book_id": 1, "items.quantity": 1}
+
+
+class OrderSweeper(db_conn.DBConn):
+    def __init__(self):
+        super().__init__()
+
+    @staticmethod
+    def _check_limit(limit: int = None) -> int:
+        """单次运行的处理上限：缺省取 Auto_Cancel_Max_Orders，必须为正整数，不提供“不限”。"""
+        limit = conf.Auto_Cancel_Max_Orders if limit is None else limit
+        if isinstance(limit, bool) or not isinstance(limit, int) or limit <= 0:
+            raise ValueError(f"超时订单单次处理上限必须为正整数: {limit!r}")
+        return limit
+
+    def sweep(self, limit: int = None, batch_size: int = None) -> dict:
+        """取消最多 limit 个超时订单，返回本轮统计。"""
+        limit = self._check_limit(limit)
+        batch_size = max(1, batch_size or conf.Auto_Cancel_Batch_Size)
+        start = time.time()
+        # 本轮所有订单共用同一个时间戳，既是截止时间的基准，也用于识别本轮取消的订单
+        now = start
+        threshold = now - conf.Order_Unpaid_Timeout
+        stats = {"cancelled": 0, "released_items": 0, "batches": 0, "has_more": False}
+        stats["recovered_items"] = self.finish_pending_releases(now, batch_size, limit)
+
+        while True:
+            size = min(batch_size, limit - stats["cancelled"])
+            orders = list(self.db["Orders"].find(
+                {"status": "unpaid", "create_time": {"$lt": threshold}}, _FIELDS
+            ).sort("create_time", 1).limit(size))
+            if not orders:
+                break
+            cancelled, released = self._process_batch(orders, now)
+            stats["batches"] += 1
+            stats["cancelled"] += len(cancelled)
+            stats["released_items"] += released
+            if len(orders) < size:
+                break
+            if stats["cancelled"] >= limit:
+                # 达到单轮上限，最后一批是满的：可能还有剩余
+                stats["has_more"] = True
+                break
+            if not cancelled:
+                # 整批都被并发支付/取消抢先，剩余订单留给下一轮
+                stats["has_more"] = True
+                break
+
+        stats["elapsed"] = round(time.time() - start, 3)
+        stats["orders_per_sec"] = round(stats["cancelled"] / stats["elapsed"], 1) if stats["elapsed"] else None
+        if stats["cancelled"] or stats["recovered_items"]:
+            logging.info(f"超时订单取消: {stats}")
+        return stats
+
+    def cancel_orders(self, order_ids: list, now: float = None) -> list:
+        """取消指定订单中已超时且仍未支付的部分（调度器到期触发），返回实际取消的订单。"""
+        now = time.time() if now is None else now
+        orders = list(self.db["Orders"].find({
+            "_id": {"$in": order_ids},
+            "status": "unpaid",
+            "create_time": {"$lt": now - conf.Order_Unpaid_Timeout},
+        }, _FIELDS))
+        if not orders:
+            return []
+        return self._process_batch(orders, now)[0]
+
+    def finish_pending_releases(self, now: float = None, batch_size: int = None, limit: int = None) -> int:
+        """补完此前中断的归还：认领 release_pending 早于宽限期的已取消订单并归还，返回归还的订单项数。
+        单次最多检查 limit 个订单（同 sweep），剩余的留给下一次运行。"""
+        now = time.time() if now is None else now
+        batch_size = max(1, batch_size or conf.Auto_Cancel_Batch_Size)
+        limit = self._check_limit(limit)
+        cutoff = now - conf.Auto_Cancel_Release_Grace
+        released = 0
+        while limit > 0:
+            size = min(batch_size, limit)
+            orders = list(self.db["Orders"].find(
+                {"status": "cancelled", "release_pending": {"$lt": cutoff}}, dict(_FIELDS, release_pending=1)
+            ).limit(size))
+            if not orders:
+                return released
+            limit -= len(orders)
+            # 逐单认领：把标记改为本轮时间，只有改写成功的进程负责归还
+            claimed = [order for order in orders if self.db["Orders"].update_one(
+                {"_id": order["_id"], "release_pending": order["release_pending"]},
+                {"$set": {"release_pending": now}}
+            ).modified_count]
+            released += self._release_batch(claimed)
+            if len(orders) < size:
+                return released
+        return released
+
+    def _process_batch(self, orders: list, now: float):
+        """取消一批订单并归还其预占库存，返回 (取消的订单, 归还的订单项数)。"""
+        def callback(session):
+            cancelled = self._cancel_batch(orders, now, session)
+            return cancelled, self._release_batch(cancelled, session)
+
+        return self.run_in_transaction(callback)
+
+    def _cancel_batch(self, orders: list, now: float, session=None) -> list:
+        """一次 update_many 完成状态迁移，返回确实由本轮取消的订单。"""
+        order_ids = [order["_id"] for order in orders]
+        update = {"status": "cancelled", "timeout_at": now}
+        if session is None:
+            # 无事务：归还完成前留下标记，中断后由 finish_pending_releases 补做
+            update["release_pending"] = now
+        result = self.col("Orders", session).update_many({"_id": {"$in": order_ids}, "status": "unpaid"},
+                                                         {"$set": update})
+        if result.modified_count == len(orders):
+            return orders
+        # 部分订单在读取后被支付或取消：按本轮的 timeout_at 回读，只为真正取消的订单释放库存
+        mine = {doc["_id"] for doc in self.col("Orders", session).find(
+            {"_id": {"$in": order_ids}, "status": "cancelled", "timeout_at": now}, {"_id": 1}
+        )}
+        return [order for order in orders if order["_id"] in mine]
+
+    def _release_batch(self, orders: list, session=None) -> int:
+        """按店铺汇总预占数量，每个店铺一次批量归还；返回归还的订单项数。"""
+        per_store = {}
+        released = 0
+        for order in orders:
+            deltas, order_ids = per_store.setdefault(order["store_id"], ({}, []))
+            order_ids.append(order["_id"])
+            if not order.get("stock_reserved"):
+                continue
+            for item in order.get("items", []):
+                deltas[item["book_id"]] = deltas.get(item["book_id"], 0) + item["quantity"]
+                released += 1
+        for store_id, (deltas, order_ids) in per_store.items():
+            self.inventory.inc_stocks(store_id, deltas, session)
+            if session is None:
+                self.db["Orders"].update_many({"_id": {"$in": order_ids}}, {"$unset": {"release_pending": ""}})
+        return released
@@ -0,0 +1,256 @@
+"""
+订单超时调度器：到期即取消，不再依赖定期全量扫描。
+
+- 内存最小堆保存未支付订单的到期时间 create_time + Order_Unpaid_Timeout，
+  后台线程睡到堆顶到期，到期的一批订单交给 OrderSweeper.cancel_orders 一次取消
+- 成为主节点时：先用 OrderSweeper 清理积压的已超时订单，后台线程每轮只取消一批，
+  批与批之间照常续约；清理完毕且租约仍在时，再沿 (status, create_time) 索引
+  一次读取未超时的未支付订单建堆，此后才作为主节点接收入堆
+- 本进程的 new_order / payment / cancel_order 成功后即时入堆/出堆（出堆为惰性删除）；
+  其他工作进程创建的订单每 Order_Timeout_Refresh 秒按 create_time 增量拉取；
+  刷新不做全量 sweep，全量清理只在成为主节点时执行（见上），另可手动调用 /buyer/auto_cancel_timeout
+- 主节点选举：Leases 集合中的租约文档，持有者定期续约，过期后由其他进程接管；
+  gunicorn 多进程时只有持有租约的进程维护堆并执行取消
+- 指标见 stats()：待到期订单数、取消数与取消延迟（实际取消时间 - 到期时间）
+"""
+import heapq
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+import pymongo
+from pymongo import ReturnDocument
+
+from be import conf
+from be.model.store import get_db
+
+LEASE_NAME = "order_timeout"
+
+
+class Lease:
+    """基于 MongoDB 文档的租约：{_id: name, owner, expires_at}。"""
+
+    def __init__(self, db, name: str, ttl: float):
+        self.db = db
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self) -> bool:
+        """获取或续约；租约由他人持有且未过期时返回 False。"""
+        now = time.time()
+        try:
+            doc = self.db["Leases"].find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + self.ttl}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except pymongo.errors.DuplicateKeyError:
+            # 文档存在但条件不满足，upsert 插入同一 _id 冲突：他人持有
+            return False
+        return doc is not None and doc.get("owner") == self.owner
+
+    def release(self) -> None:
+        self.db["Leases"].delete_one({"_id": self.name, "owner": self.owner})
+
+
+class TimeoutScheduler:
+    def __init__(self):
+        self._heap = []  # [(deadline, order_id)]
+        self._deadlines = {}  # order_id -> deadline；不在其中的堆条目已失效
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lease = None
+        self._seen_until = None  # 增量拉取的 create_time 下界
+        self.is_leader = False
+        self._seeding = False  # 已取得租约，正在清理积压
+        self._cancelled = 0
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        self._lag_last = None
+
+    # ---- 请求线程调用 ----
+
+    def schedule(self, order_id: str, create_time: float) -> None:
+        if not self.is_leader:
+            return
+        deadline = create_time + conf.Order_Unpaid_Timeout
+        with self._cond:
+            self._push(order_id, deadline)
+            if self._heap[0][1] == order_id:
+                self._cond.notify()
+
+    def discard(self, order_id: str) -> None:
+        """订单已支付/取消：惰性删除，堆条目到期时跳过。"""
+        if not self.is_leader:
+            return
+        with self._cond:
+            self._deadlines.pop(order_id, None)
+            # 失效条目过多时重建堆，避免大量已支付订单长期占用内存
+            if len(self._heap) > 2 * len(self._deadlines) + 1024:
+                self._heap = [(deadline, order_id) for order_id, deadline in self._deadlines.items()]
+                heapq.heapify(self._heap)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "is_leader": self.is_leader,
+                "seeding": self._seeding,
+                "pending": len(self._deadlines),
+                "next_deadline": self._heap[0][0] if self._heap else None,
+                "cancelled": self._cancelled,
+                "lag_last": self._lag_last,
+                "lag_max": round(self._lag_max, 3),
+                "lag_avg": round(self._lag_total / self._cancelled, 3) if self._cancelled else None,
+            }
+
+    # ---- 生命周期 ----
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="order-timeout", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if (self.is_leader or self._seeding) and self._lease is not None:
+            try:
+                self._lease.release()
+            except pymongo.errors.PyMongoError as e:
+                logging.warning(f"释放订单超时调度租约失败: {e}")
+        self._demote()
+
+    # ---- 后台线程 ----
+
+    def _run(self) -> None:
+        renew_at = refresh_at = 0.0
+        while not self._stop.is_set():
+            try:
+                now = time.time()
+                if now >= renew_at:
+                    self._renew()
+                    renew_at = now + conf.Order_Timeout_Lease_TTL / 3
+                if self._seeding:
+                    self._seed_step()
+                    continue
+                if self.is_leader and now >= refresh_at:
+                    self._refresh(now)
+                    refresh_at = now + conf.Order_Timeout_Refresh
+                if self.is_leader and self._expire(time.time()):
+                    continue
+                wake_at = min(renew_at, refresh_at) if self.is_leader else renew_at
+                with self._cond:
+                    if self._heap and self.is_leader:
+                        wake_at = min(wake_at, self._heap[0][0])
+                    self._cond.wait(max(0.0, wake_at - time.time()))
+            except Exception as e:
+                # 数据库暂不可用等：稍后重试，期间不认为自己仍是主节点
+                logging.error(f"订单超时调度出错: {e}")
+                self._demote()
+                renew_at = refresh_at = 0.0
+                self._stop.wait(1)
+
+    def _renew(self) -> None:
+        if self._lease is None:
+            self._lease = Lease(get_db(), LEASE_NAME, conf.Order_Timeout_Lease_TTL)
+        leader = self._lease.acquire()
+        if leader and not self.is_leader and not self._seeding:
+            logging.info(f"订单超时调度：{self._lease.owner} 取得租约，开始清理积压")
+            self._seeding = True
+        elif not leader and (self.is_leader or self._seeding):
+            logging.warning(f"订单超时调度：{self._lease.owner} 失去租约")
+            self._demote()
+
+    def _seed_step(self) -> bool:
+        """清理一批积压的已超时订单，返回是否仍在清理；单批耗时远小于租约期限，由 _run 在批间续约。"""
+        from be.model.order_sweeper import OrderSweeper
+
+        if OrderSweeper().sweep(max(1, conf.Auto_Cancel_Batch_Size))["has_more"]:
+            return True
+        # 清理期间租约可能已过期并被他人接管：确认仍持有后才成为主节点
+        if not self._lease.acquire():
+            logging.warning(f"订单超时调度：{self._lease.owner} 清理积压期间失去租约")
+            self._demote()
+            return False
+        now = time.time()
+        docs = self._load(now - conf.Order_Unpaid_Timeout)
+        with self._cond:
+            self._heap = []
+            self._deadlines = {}
+            for order_id, deadline in docs:
+                self._push(order_id, deadline)
+            self._seen_until = now
+            self.is_leader = True
+            self._seeding = False
+        logging.info(f"订单超时调度：{self._lease.owner} 成为主节点")
+        return False
+
+    def _refresh(self, now: float) -> None:
+        """增量拉取其他进程创建的订单；窗口前移一个刷新周期，容忍写入与提交的时间差。
+        只读 create_time 窗口内的订单，不做全量 sweep（全量清理只在成为主节点时执行一次）。"""
+        docs = self._load(self._seen_until - conf.Order_Timeout_Refresh)
+        with self._cond:
+            for order_id, deadline in docs:
+                self._push(order_id, deadline)
+            self._seen_until = now
+
+    @staticmethod
+    def _load(since: float) -> list:
+        """create_time 不早于 since 的未支付订单 -> [(order_id, 到期时间)]。"""
+        cursor = get_db()["Orders"].find(
+            {"status": "unpaid", "create_time": {"$gte": since}}, {"_id": 1, "create_time": 1}
+        ).sort("create_time", 1)
+        return [(doc["_id"], doc["create_time"] + conf.Order_Unpaid_Timeout) for doc in cursor]
+
+    def _push(self, order_id: str, deadline: float) -> None:
+        if order_id in self._deadlines:
+            return
+        self._deadlines[order_id] = deadline
+        heapq.heappush(self._heap, (deadline, order_id))
+
+    def _expire(self, now: float) -> bool:
+        """取消已到期的一批订单；没有到期订单时返回 False。"""
+        from be.model.order_sweeper import OrderSweeper
+
+        due = {}
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now and len(due) < conf.Auto_Cancel_Batch_Size:
+                deadline, order_id = heapq.heappop(self._heap)
+                if self._deadlines.get(order_id) == deadline:
+                    del self._deadlines[order_id]
+                    due[order_id] = deadline
+        if not due:
+            return False
+        cancelled = OrderSweeper().cancel_orders(list(due), now)
+        with self._cond:
+            for order in cancelled:
+                lag = max(0.0, now - (order["create_time"] + conf.Order_Unpaid_Timeout))
+                self._cancelled += 1
+                self._lag_total += lag
+                self._lag_max = max(self._lag_max, lag)
+                self._lag_last = round(lag, 3)
+        return True
+
+    def _demote(self) -> None:
+        with self._cond:
+            self.is_leader = False
+            self._seeding = False
+            self._heap = []
+            self._deadlines = {}
+            self._seen_until = None
+
+
+scheduler = TimeoutScheduler()
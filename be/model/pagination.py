@@ -0,0 +1,53 @@
+"""
+键集（游标）分页的游标编解码。
+
+游标是上一页最后一条记录排序键的不透明编码（URL 安全 base64 的 JSON 数组），
+下一页从该排序键之后继续读取：借助与排序一致的索引，第 N 页与第 1 页代价相同，
+不再像 skip 那样逐条跳过前面的记录。
+"""
+import base64
+import json
+
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    """解析游标；格式不对或字段数不符时抛出 ValueError。"""
+    if not isinstance(cursor, str) or not cursor:
+        raise ValueError("invalid cursor")
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("invalid cursor")
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("invalid cursor")
+    return values
+
+
+def after_key(sort: list, values: list) -> dict:
+    """按复合排序键 sort=[(field, 1|-1), ...] 生成“位于 values 之后”的查询条件。
+
+    例如 sort=[("create_time", -1), ("_id", -1)] 时生成
+    {"$or": [{"create_time": {"$lt": t}}, {"create_time": t, "_id": {"$lt": i}}]}
+    """
+    branches = []
+    for i, (field, direction) in enumerate(sort):
+        branch = {sort[j][0]: values[j] for j in range(i)}
+        branch[field] = {"$lt" if direction == -1 else "$gt": values[i]}
+        branches.append(branch)
+    return {"$or": branches}
+
+
+def key_of(doc: dict, sort: list) -> list:
+    """取文档在排序键上的取值（支持 a.b 形式的嵌套字段），用于生成 next_cursor。"""
+    values = []
+    for field, _ in sort:
+        value = doc
+        for part in field.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        values.append(value)
+    return values
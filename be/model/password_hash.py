@@ -0,0 +1,143 @@
+"""
+密码哈希。
+
+Users.password 保存 KDF 结果而不是明文：
+- 格式 "scrypt$n$r$p$salt$hash" 或 "pbkdf2_sha256$iterations$salt$hash"（salt/hash 为 base64），
+  算法与参数由 Password_KDF 等配置决定，参数随记录保存，调整配置后旧记录仍可校验
+- 历史明文记录照常可以登录，登录成功时改写为当前 KDF（Password_Rehash_On_Login）；
+  参数已过时的哈希同样在登录时重算
+- KDF 在独立线程池中计算：限制同时进行的 scrypt 数量（每次占用约 128*n*r 字节内存），
+  异步服务中不阻塞事件循环
+- 校验成功的 (用户, 记录, 密码) 以进程随机密钥的 HMAC 为键短暂缓存，
+  payment/add_funds 等频繁校验同一密码时不必每次重算 KDF；改密/注销时按用户失效
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from be import conf
+from be.model.cache import TTLCache
+
+SCRYPT = "scrypt"
+PBKDF2 = "pbkdf2_sha256"
+
+verified_cache = TTLCache(maxsize=conf.Password_Cache_Size, ttl=conf.Password_Cache_TTL)
+
+# 缓存键的 HMAC 密钥：只存在于本进程内存，缓存中不出现可离线破解的密码摘要
+_cache_key_secret = os.urandom(32)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                # fork 出的子进程不继承线程，需重建线程池
+                _pool = ThreadPoolExecutor(max_workers=conf.Password_Hash_Threads, thread_name_prefix="kdf")
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.b64decode(text.encode("ascii"))
+
+
+def _current_params() -> tuple:
+    if conf.Password_KDF == PBKDF2:
+        return PBKDF2, (conf.Password_PBKDF2_Iterations,)
+    return SCRYPT, (conf.Password_Scrypt_N, conf.Password_Scrypt_R, conf.Password_Scrypt_P)
+
+
+def _derive(algorithm: str, params: tuple, password: str, salt: bytes) -> bytes:
+    secret = password.encode("utf-8")
+    if algorithm == PBKDF2:
+        return hashlib.pbkdf2_hmac("sha256", secret, salt, params[0])
+    n, r, p = params
+    return hashlib.scrypt(secret, salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + (1 << 20), dklen=32)
+
+
+def _parse(stored: str):
+    """-> (算法, 参数, salt, hash)；不是 KDF 格式（历史明文）时返回 None。"""
+    parts = stored.split("$") if isinstance(stored, str) else []
+    try:
+        if len(parts) == 4 and parts[0] == PBKDF2:
+            return PBKDF2, (int(parts[1]),), _b64decode(parts[2]), _b64decode(parts[3])
+        if len(parts) == 6 and parts[0] == SCRYPT:
+            return SCRYPT, (int(parts[1]), int(parts[2]), int(parts[3])), _b64decode(parts[4]), _b64decode(parts[5])
+    except ValueError:
+        return None
+    return None
+
+
+def _hash(password: str) -> str:
+    algorithm, params = _current_params()
+    salt = os.urandom(16)
+    derived = _derive(algorithm, params, password, salt)
+    return "$".join([algorithm, *map(str, params), _b64encode(salt), _b64encode(derived)])
+
+
+def _check(password: str, stored: str) -> (bool, bool):
+    parsed = _parse(stored)
+    if parsed is None:
+        # 历史明文记录
+        ok = isinstance(stored, str) and hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+        return ok, ok
+    algorithm, params, salt, expected = parsed
+    ok = hmac.compare_digest(_derive(algorithm, params, password, salt), expected)
+    return ok, ok and (algorithm, params) != _current_params()
+
+
+def _cache_key(user_id: str, password: str, stored: str) -> bytes:
+    message = "\0".join([user_id, stored, password]).encode("utf-8")
+    return hmac.new(_cache_key_secret, message, hashlib.sha256).digest()
+
+
+def hash_password(password: str) -> str:
+    """按当前配置计算密码记录（在 KDF 线程池中执行）。"""
+    return _executor().submit(_hash, password).result()
+
+
+def verify(user_id: str, password: str, stored) -> (bool, bool):
+    """校验密码 -> (是否正确, 是否需要按当前配置重算)。"""
+    if not isinstance(password, str) or not isinstance(stored, str):
+        return False, False
+    key = _cache_key(user_id, password, stored)
+    if verified_cache.get(key):
+        return True, False
+    ok, needs_rehash = _executor().submit(_check, password, stored).result()
+    if ok and not needs_rehash:
+        verified_cache.set(key, True, group=user_id)
+    return ok, needs_rehash
+
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_executor(), _hash, password)
+
+
+async def verify_async(user_id: str, password: str, stored) -> (bool, bool):
+    if not isinstance(password, str) or not isinstance(stored, str):
+        return False, False
+    key = _cache_key(user_id, password, stored)
+    if verified_cache.get(key):
+        return True, False
+    ok, needs_rehash = await asyncio.get_running_loop().run_in_executor(_executor(), _check, password, stored)
+    if ok and not needs_rehash:
+        verified_cache.set(key, True, group=user_id)
+    return ok, needs_rehash
+
+
+def invalidate(user_id: str) -> None:
+    """改密/注销后清除该用户的校验缓存。"""
+    verified_cache.invalidate_group(user_id)
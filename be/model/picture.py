@@ -0,0 +1,203 @@
+"""
+书籍图片的外置存储。
+
+图片不再以 base64 内嵌在 Books 文档中：
+- 内容寻址：图片 ID 为原图字节的 sha256，同一张图无论上传多少次只存一份，Books 只保存 picture_ids
+- 二进制存放在 GridFS（默认，随 MongoDB 部署与备份）或本地目录（Picture_Store = "filesystem"）
+- 保存原图时同时生成缩略图（需 pip install Pillow；未安装或无法解码时缩略图请求返回原图）
+- 详情接口返回 /book/picture/<id> 地址，由该接口流式读取，支持 ETag 与 Range
+"""
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+from be import conf
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None  # type: ignore
+
+ORIGINAL = "original"
+THUMB = "thumb"
+VARIANTS = (ORIGINAL, THUMB)
+
+URL_PREFIX = "/book/picture/"
+
+_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# 文件头 -> MIME 类型
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+def content_id(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_picture_id(picture_id) -> bool:
+    return isinstance(picture_id, str) and _ID_RE.match(picture_id) is not None
+
+
+def sniff_mimetype(head: bytes) -> str:
+    for signature, mimetype in _SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def make_thumbnail(data: bytes, size: int):
+    """按最长边 size 等比缩放；未安装 Pillow 或数据无法解码时返回 None。"""
+    if Image is None or size <= 0:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail((size, size))
+            out = io.BytesIO()
+            if image.mode in ("RGBA", "LA", "P"):
+                image.save(out, "PNG", optimize=True)
+            else:
+                image.convert("RGB").save(out, "JPEG", quality=80, optimize=True)
+            return out.getvalue()
+    except Exception:
+        return None
+
+
+def urls(picture_ids: list) -> (list, list):
+    """picture_ids -> (原图地址列表, 缩略图地址列表)。"""
+    return ([URL_PREFIX + picture_id for picture_id in picture_ids],
+            [URL_PREFIX + picture_id + "?size=" + THUMB for picture_id in picture_ids])
+
+
+class FileSystemStore:
+    """本地目录：<root>/<variant>/<id[:2]>/<id>，先写临时文件再原子改名，并发写入同一张图互不干扰。"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, picture_id: str, variant: str) -> str:
+        return os.path.join(self.root, variant, picture_id[:2], picture_id)
+
+    def exists(self, picture_id: str, variant: str) -> bool:
+        return os.path.exists(self._path(picture_id, variant))
+
+    def put(self, picture_id: str, variant: str, data: bytes) -> None:
+        path = self._path(picture_id, variant)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open(self, picture_id: str, variant: str):
+        """-> (可 seek 的只读文件对象, 长度)，不存在时返回 None。"""
+        try:
+            f = open(self._path(picture_id, variant), "rb")
+        except FileNotFoundError:
+            return None
+        return f, os.fstat(f.fileno()).st_size
+
+
+class GridFSStore:
+    """GridFS 桶 pictures，文件名为 <variant>/<id>。
+
+    并发上传同一张图可能各写一份，按文件名读取时取最新一份，内容相同，不影响正确性。
+    """
+
+    def __init__(self, db):
+        import gridfs
+
+        self.db = db
+        self.bucket = gridfs.GridFSBucket(db, bucket_name="pictures")
+
+    def exists(self, picture_id: str, variant: str) -> bool:
+        return self.db["pictures.files"].find_one({"filename": f"{variant}/{picture_id}"}, {"_id": 1}) is not None
+
+    def put(self, picture_id: str, variant: str, data: bytes) -> None:
+        self.bucket.upload_from_stream(f"{variant}/{picture_id}", data, metadata={"variant": variant})
+
+    def open(self, picture_id: str, variant: str):
+        import gridfs
+
+        try:
+            grid_out = self.bucket.open_download_stream_by_name(f"{variant}/{picture_id}")
+        except gridfs.errors.NoFile:
+            return None
+        return grid_out, grid_out.length
+
+
+def get_store(db):
+    if conf.Picture_Store == "filesystem":
+        return FileSystemStore(conf.Picture_Dir)
+    return GridFSStore(db)
+
+
+def save(db, data: bytes) -> str:
+    """保存一张图片（已存在则跳过），返回图片 ID。"""
+    picture_id = content_id(data)
+    store = get_store(db)
+    if not store.exists(picture_id, ORIGINAL):
+        thumbnail = make_thumbnail(data, conf.Picture_Thumb_Size)
+        if thumbnail is not None:
+            store.put(picture_id, THUMB, thumbnail)
+        # 原图最后写入：exists 以原图为准，中途失败时下次上传会补齐缩略图
+        store.put(picture_id, ORIGINAL, data)
+    return picture_id
+
+
+def save_base64_list(db, pictures) -> list:
+    """上架 JSON 中的 base64 图片列表 -> 去重后的图片 ID 列表（保持首次出现顺序）。
+
+    数据不是合法 base64 时抛出 ValueError。
+    """
+    if not pictures:
+        return []
+    if not isinstance(pictures, list):
+        raise ValueError("pictures must be a list")
+    picture_ids = []
+    decoded = {}
+    for encoded in pictures:
+        if not isinstance(encoded, str):
+            raise ValueError("picture must be a base64 string")
+        # 同一张图常被重复附上多次，相同的 base64 串只解码、保存一次
+        if encoded not in decoded:
+            try:
+                decoded[encoded] = save(db, base64.b64decode(encoded, validate=True))
+            except binascii.Error:
+                raise ValueError("invalid base64 picture")
+        picture_ids.append(decoded[encoded])
+    return list(dict.fromkeys(picture_ids))
+
+
+def open_picture(db, picture_id: str, variant: str = ORIGINAL):
+    """-> (文件对象, 长度, MIME 类型, ETag)；不存在时返回 None。缩略图缺失时退回原图。"""
+    if not is_picture_id(picture_id) or variant not in VARIANTS:
+        return None
+    store = get_store(db)
+    found = store.open(picture_id, variant)
+    if found is None and variant == THUMB:
+        variant = ORIGINAL
+        found = store.open(picture_id, variant)
+    if found is None:
+        return None
+    fileobj, length = found
+    head = fileobj.read(16)
+    fileobj.seek(0)
+    etag = picture_id if variant == ORIGINAL else f"{picture_id}-{variant}"
+    return fileobj, length, sniff_mimetype(head), etag
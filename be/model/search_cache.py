@@ -0,0 +1,48 @@
+"""
+搜索结果缓存。
+
+热门查询在短时间内大量重复，命中时直接返回上次的结果页，不再执行 $text 检索、排序与计数。
+- 键为归一化后的查询参数 (类型, 店铺, 关键字/条件, 页码或游标, with_total, facets)
+- 有界 LRU（见 cache.TTLCache），TTL 同时是跨进程数据可能陈旧的上限
+- 版本失效：键中带有查询时的目录版本号，Seller.add_book 递增对应店铺与全站的版本，
+  旧版本的条目不再可达，随 LRU 淘汰
+- 写入与命中时都深拷贝结果页：调用方（视图层、异步接口）修改返回的 dict 不会污染缓存条目
+"""
+import copy
+import threading
+
+from be import conf
+from be.model.cache import TTLCache
+
+result_cache = TTLCache(maxsize=conf.Search_Cache_Size, ttl=conf.Search_Cache_TTL)
+
+_versions = {}  # store_id -> 版本号；None 为全站版本
+_lock = threading.Lock()
+
+
+def version(store_id: str = None) -> int:
+    return _versions.get(store_id, 0)
+
+
+def bump(store_id: str) -> None:
+    """店铺上架新书：该店铺与全站的缓存结果一并失效。"""
+    with _lock:
+        _versions[store_id] = _versions.get(store_id, 0) + 1
+        _versions[None] = _versions.get(None, 0) + 1
+
+
+def make_key(kind: str, store_id: str, *params) -> tuple:
+    """查询前生成键，版本号在此时取得：执行查询期间发生的上架会使本次结果写入旧版本。"""
+    return (kind, store_id, version(store_id), conf.Search_Backend) + params
+
+
+def get(key):
+    if not result_cache.enabled:
+        return None
+    cached = result_cache.get(key)
+    return copy.deepcopy(cached) if cached is not None else None
+
+
+def put(key, result: dict) -> None:
+    if result_cache.enabled:
+        result_cache.set(key, copy.deepcopy(result))
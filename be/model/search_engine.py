@@ -0,0 +1,239 @@
+import logging
+import math
+import re
+import threading
+import time
+from bisect import bisect_right
+from collections import Counter
+
+from be import conf
+from be.model import search_index
+
+# 与 books_text 文本索引一致的字段权重
+FIELD_WEIGHTS = {
+    "title": 10,
+    "author": 7,
+    "tags": 5,
+    "book_intro": 2,
+    "content": 2,
+}
+FIELDS = tuple(FIELD_WEIGHTS)
+# 构建/补录时读取的字段：分词字段 + 店铺归属 + 分面（标签、出版社）
+PROJECTION = dict({field: 1 for field in FIELDS}, store_ids=1, search_index=1, publisher=1)
+
+# 连续的中日韩字符 或 连续的字母数字
+_TOKEN_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+|[0-9a-z]+")
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]")
+
+
+def tokenize(text) -> list:
+    """分词：中日韩字符按相邻二元组切分（单字成词），字母数字按整词、小写。"""
+    if not text:
+        return []
+    if isinstance(text, (list, tuple)):
+        text = " ".join(str(t) for t in text if t)
+    tokens = []
+    for run in _TOKEN_RE.findall(str(text).lower()):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class InvertedIndex:
+    """
+    进程内倒排索引：CJK 二元组分词 + BM25F 打分（字段权重同 books_text）。
+    - postings: term -> {book_id: (各字段词频...)}
+    - 店铺归属 store_ids 随文档保存，店铺内搜索在内存中过滤
+    - 标签/出版社随文档保存，命中集合的分面计数在内存中完成
+    - 由 Books 全量构建，之后随 add_book 增量更新；多进程部署时各进程各持一份，
+      按 Search_Index_Refresh 周期重建以吸收其他进程的写入
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._postings = {}  # term -> {book_id: tuple(tf per field)}
+        self._doc_terms = {}  # book_id -> set(term)，用于更新/删除时撤销旧词条
+        self._doc_lengths = {}  # book_id -> tuple(length per field)
+        self._length_sums = [0] * len(FIELDS)
+        self._store_ids = {}  # book_id -> set(store_id)
+        self._facets = {}  # book_id -> (tags_lower, publisher)
+        self._lock = threading.RLock()
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def build(self, db, batch_size: int = 1000) -> int:
+        """从 Books 全量重建，完成后原子替换现有数据。"""
+        fresh = InvertedIndex()
+        for doc in db["Books"].find({}, PROJECTION).batch_size(batch_size):
+            fresh.add(doc)
+        with self._lock:
+            self._postings = fresh._postings
+            self._doc_terms = fresh._doc_terms
+            self._doc_lengths = fresh._doc_lengths
+            self._length_sums = fresh._length_sums
+            self._store_ids = fresh._store_ids
+            self._facets = fresh._facets
+            self.built_at = time.monotonic()
+        return len(self)
+
+    def add(self, doc: dict) -> None:
+        """新增或覆盖一本书。"""
+        book_id = doc["_id"]
+        field_tokens = [tokenize(doc.get(field)) for field in FIELDS]
+        with self._lock:
+            self._remove(book_id)
+            term_freqs = {}
+            for i, tokens in enumerate(field_tokens):
+                for term in tokens:
+                    freqs = term_freqs.setdefault(term, [0] * len(FIELDS))
+                    freqs[i] += 1
+            for term, freqs in term_freqs.items():
+                self._postings.setdefault(term, {})[book_id] = tuple(freqs)
+            self._doc_terms[book_id] = set(term_freqs)
+            lengths = tuple(len(tokens) for tokens in field_tokens)
+            self._doc_lengths[book_id] = lengths
+            self._length_sums = [total + length for total, length in zip(self._length_sums, lengths)]
+            self._store_ids[book_id] = set(doc.get("store_ids") or [])
+            tags = (doc.get("search_index") or {}).get("tags_lower")
+            if tags is None:
+                tags = search_index.fold_tags(doc.get("tags"))
+            self._facets[book_id] = (tuple(dict.fromkeys(tags)), doc.get("publisher") or None)
+
+    def remove(self, book_id: str) -> None:
+        with self._lock:
+            self._remove(book_id)
+
+    def add_store(self, book_id: str, store_id: str) -> bool:
+        """登记店铺归属；书不在索引中时返回 False，由调用方决定是否补录。"""
+        with self._lock:
+            stores = self._store_ids.get(book_id)
+            if stores is None:
+                return False
+            stores.add(store_id)
+            return True
+
+    def _remove(self, book_id: str) -> None:
+        lengths = self._doc_lengths.pop(book_id, None)
+        if lengths is None:
+            return
+        self._length_sums = [total - length for total, length in zip(self._length_sums, lengths)]
+        for term in self._doc_terms.pop(book_id, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(book_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._store_ids.pop(book_id, None)
+        self._facets.pop(book_id, None)
+
+    def search(self, keyword: str, store_id: str = None, book_ids=None) -> list:
+        """返回全部命中 [(score, book_id), ...]，按分数倒序、book_id 升序。
+
+        store_id 按索引内的 store_ids 过滤；book_ids 为候选集合（inventory 模式下的店铺书目）。
+        与 $text 一致，查询词之间为“或”关系。
+        """
+        terms = set(tokenize(keyword))
+        if not terms:
+            return []
+        with self._lock:
+            doc_count = len(self._doc_lengths)
+            if doc_count == 0:
+                return []
+            avg_lengths = [total / doc_count or 1.0 for total in self._length_sums]
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for book_id, freqs in postings.items():
+                    if store_id is not None and store_id not in self._store_ids.get(book_id, ()):
+                        continue
+                    if book_ids is not None and book_id not in book_ids:
+                        continue
+                    lengths = self._doc_lengths[book_id]
+                    # BM25F：各字段词频按长度归一化后加权求和，再做一次饱和
+                    tf = 0.0
+                    for i, freq in enumerate(freqs):
+                        if freq:
+                            norm = 1 - self.b + self.b * lengths[i] / avg_lengths[i]
+                            tf += FIELD_WEIGHTS[FIELDS[i]] * freq / norm
+                    scores[book_id] = scores.get(book_id, 0.0) + idf * tf / (self.k1 + tf)
+        hits = [(round(score, 6), book_id) for book_id, score in scores.items()]
+        hits.sort(key=lambda hit: (-hit[0], hit[1]))
+        return hits
+
+    def facet_counts(self, book_ids, limit: int) -> dict:
+        """命中集合的标签/出版社计数，各取前 limit 项（计数倒序、取值升序），格式同 $facet 结果。"""
+        tag_counts = Counter()
+        publisher_counts = Counter()
+        with self._lock:
+            for book_id in book_ids:
+                tags, publisher = self._facets.get(book_id, ((), None))
+                tag_counts.update(tags)
+                if publisher:
+                    publisher_counts[publisher] += 1
+
+        def top(counts):
+            ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+            return [{"value": value, "count": count} for value, count in ranked]
+
+        return {"tags": top(tag_counts), "publishers": top(publisher_counts)}
+
+
+def page_after(hits: list, after: list) -> int:
+    """有序命中列表中位于游标 (score, book_id) 之后的第一个位置。"""
+    keys = [(-score, book_id) for score, book_id in hits]
+    return bisect_right(keys, (-after[0], after[1]))
+
+
+book_index = InvertedIndex()
+_build_lock = threading.Lock()
+
+
+def get_index(db) -> InvertedIndex:
+    """首次使用时构建（阻塞等待）；超过 Search_Index_Refresh 秒后由一个请求重建，
+    重建期间其他请求继续使用旧索引。"""
+    if book_index.built_at is None:
+        with _build_lock:
+            if book_index.built_at is None:
+                _rebuild(db)
+        return book_index
+    refresh = conf.Search_Index_Refresh
+    if refresh > 0 and time.monotonic() - book_index.built_at > refresh and _build_lock.acquire(blocking=False):
+        try:
+            _rebuild(db)
+        finally:
+            _build_lock.release()
+    return book_index
+
+
+def _rebuild(db) -> None:
+    start = time.time()
+    count = book_index.build(db)
+    logging.info(f"搜索索引构建完成: {count} 本书, 用时 {time.time() - start:.2f}s")
+
+
+def index_store_book(db, book_id: str, store_id: str) -> None:
+    """add_book 之后同步索引：已登记的书只追加店铺归属，未收录的书从 Books 补录。"""
+    index_store_books(db, [book_id], store_id)
+
+
+def index_store_books(db, book_ids: list, store_id: str) -> None:
+    """批量上架后同步索引：未收录的书一次 $in 查询补录。"""
+    if book_index.built_at is None:
+        # 尚未构建，首次搜索时全量构建会包含这些书
+        return
+    missing = [book_id for book_id in book_ids if not book_index.add_store(book_id, store_id)]
+    if missing:
+        for doc in db["Books"].find({"_id": {"$in": missing}}, PROJECTION):
+            book_index.add(doc)
@@ -0,0 +1,39 @@
+"""
+Books.search_index 的归一化规则与前缀查询。
+
+search_index.title_lower / tags_lower 保存归一化后的书名与标签（NFKC 兼容分解 + casefold），
+查询条件必须经过同一套归一化才能命中索引；迁移脚本、上架写入与搜索共用这里的函数。
+规则变更后用 script/create_search_indexes.py 重新计算已有文档的 search_index。
+"""
+import unicodedata
+
+# 范围上界：UTF-8 编码最大的码点，MongoDB 按字节比较字符串，任何以前缀开头的值都小于 prefix + _MAX_CHAR
+_MAX_CHAR = "\U0010ffff"
+
+
+def fold(text) -> str:
+    """NFKC 归一化后做大小写折叠：全角/半角、兼容字符与 ß 等特殊大小写都折叠为同一形式。"""
+    return unicodedata.normalize("NFKC", text).casefold() if isinstance(text, str) else ""
+
+
+def fold_tags(tags) -> list:
+    """标签列表或换行/逗号分隔的标签串 -> 归一化后的标签列表。"""
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.replace("\n", ",").split(",")
+    return [fold(tag.strip()) for tag in tags if isinstance(tag, str) and tag.strip()]
+
+
+def build(title, tags) -> dict:
+    return {"title_lower": fold(title), "tags_lower": fold_tags(tags)}
+
+
+def prefix_range(prefix: str) -> dict:
+    """前缀 -> 索引区间 [prefix, prefix + 最大字符)。
+
+    按字面比较，不经过正则引擎：用户输入中的 .*( 等元字符没有特殊含义，
+    查询始终是 search_index.title_lower 索引上的一段连续区间扫描。
+    """
+    folded = fold(prefix)
+    return {"$gte": folded, "$lt": folded + _MAX_CHAR}
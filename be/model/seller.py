@@ -2,13 +2,39 @@ import json
 import pymongo
 import time
 
+from be import conf
 from be.model import db_conn
 from be.model import error
+from be.model import picture
+from be.model import search_cache
+from be.model import search_engine
+from be.model import search_index
+from be.model import suggest
 
 class Seller(db_conn.DBConn):
+    # 上架 JSON 中写入 Books 目录文档的字段（pictures 外置存储，只保存 picture_ids）
+    CATALOG_FIELDS = (
+        "title", "author", "publisher", "original_title", "translator", "pub_year", "pages", "price",
+        "currency_unit", "binding", "isbn", "author_intro", "book_intro", "content", "tags",
+    )
+
     def __init__(self):
         super().__init__()
 
+    @classmethod
+    def catalog_update(cls, store_id: str, info: dict, picture_ids: list) -> dict:
+        """上架 JSON -> Books upsert 的更新文档。
+
+        同一本书只有一份目录文档：目录字段与 search_index 仅在首次插入时写入，
+        之后其他店铺上架同一本书只追加 store_ids（店铺内搜索以此过滤）与 picture_ids。
+        """
+        on_insert = {field: info[field] for field in cls.CATALOG_FIELDS if field in info}
+        on_insert["search_index"] = search_index.build(info.get("title"), info.get("tags"))
+        add_to_set = {"store_ids": store_id}
+        if picture_ids:
+            add_to_set["picture_ids"] = {"$each": picture_ids}
+        return {"$setOnInsert": on_insert, "$addToSet": add_to_set}
+
     # 需要确定一下 book_json_str 的结构
     def add_book(
         self, user_id: str, store_id: str, book_id: str, book_json_str: str, stock_level: int):
@@ -18,11 +44,7 @@ class Seller(db_conn.DBConn):
             if not self.store_id_exist(store_id):
                 return error.error_non_exist_store_id(store_id)
             # 如果店铺库存中已存在该书，返回 exist_book_id
-            exists = self.db["Stores"].find_one({
-                "_id": store_id,
-                "inventory": {"$elemMatch": {"book_id": book_id}}
-            })
-            if exists is not None:
+            if self.inventory.get_item(store_id, book_id) is not None:
                 return error.error_exist_book_id(book_id)
             info = json.loads(book_json_str)
             # 参数类型归一化
@@ -51,15 +73,21 @@ class Seller(db_conn.DBConn):
             "pictures": ["<base64-1>", "<base64-2>"]
             }
             '''
-            book = {
-                "book_id": book_id,
-                "stock_level": stock_level,
-                "price": info.get("price"),
-            }
-            self.db["Stores"].update_one(
-                {"_id": store_id},
-                {"$push": {"inventory": book}}
-            )
+            # 图片按内容外置存储，Books 只记录图片 ID（见 be/model/picture.py）
+            try:
+                picture_ids = picture.save_base64_list(self.db, info.get("pictures"))
+            except ValueError:
+                return error.error_and_message(400, "图片数据无效")
+            # 先写 Books 再写库存：upsert 可重复执行（$setOnInsert/$addToSet），库存写入前失败时重试即可补齐；
+            # 反之库存已写而目录缺失时，重试会因书目已存在被拒绝，留下没有目录的库存项
+            self.db["Books"].update_one(
+                {"_id": book_id}, self.catalog_update(store_id, info, picture_ids), upsert=True)
+            if not self.inventory.add_item(store_id, book_id, stock_level, info.get("price")):
+                return error.error_exist_book_id(book_id)
+            if conf.Search_Backend == "memory":
+                search_engine.index_store_book(self.db, book_id, store_id)
+            suggest.index_store_book(self.db, book_id)
+            search_cache.bump(store_id)
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
             return code, msg
@@ -68,6 +96,136 @@ class Seller(db_conn.DBConn):
             return code, msg
         return 200, "ok"
     
+    def add_books(self, user_id: str, store_id: str, books: list) -> (int, str, dict):
+        """
+        批量上架：books 为 [{"book_info": {...}, "stock_level": n}, ...]
+        - 用户/店铺只校验一次，店铺中已有的书目一次查询取回
+        - 库存项一次写入，Books 目录 upsert（见 catalog_update）一次 bulk_write
+        - 单条失败不影响其他条目：errors 按请求下标给出 error.py 中的错误码与信息
+        """
+        try:
+            code, msg = self._check_bulk_request(user_id, store_id, books)
+            if code != 200:
+                return code, msg, {}
+
+            errors = []
+            candidates = []
+            seen = set()
+            for i, item in enumerate(books):
+                info = item.get("book_info") if isinstance(item, dict) else None
+                book_id = info.get("id") if isinstance(info, dict) else None
+                if not isinstance(book_id, str) or not book_id:
+                    errors.append(self._item_error(i, book_id, error.error_and_message(400, "书籍信息无效")))
+                elif book_id in seen:
+                    errors.append(self._item_error(i, book_id, error.error_exist_book_id(book_id)))
+                else:
+                    seen.add(book_id)
+                    candidates.append((i, book_id, info, self._to_int(item.get("stock_level", 0))))
+
+            existing = self.inventory.get_items(store_id, [book_id for _, book_id, _, _ in candidates])
+            pending = []
+            for i, book_id, info, stock_level in candidates:
+                if book_id in existing:
+                    errors.append(self._item_error(i, book_id, error.error_exist_book_id(book_id)))
+                    continue
+                try:
+                    picture_ids = picture.save_base64_list(self.db, info.get("pictures"))
+                except ValueError:
+                    errors.append(self._item_error(i, book_id, error.error_and_message(400, "图片数据无效")))
+                    continue
+                pending.append((i, book_id, info, stock_level, picture_ids))
+
+            # 同 add_book：先 upsert Books 目录再写库存，库存写入失败时整批重试即可补齐
+            if pending:
+                self.db["Books"].bulk_write([
+                    pymongo.UpdateOne({"_id": book_id}, self.catalog_update(store_id, info, picture_ids), upsert=True)
+                    for _, book_id, info, _, picture_ids in pending
+                ], ordered=False)
+            added = set(self.inventory.add_items(
+                store_id, [(book_id, stock_level, info.get("price")) for _, book_id, info, stock_level, _ in pending]))
+            added_ids = []
+            for i, book_id, _, _, _ in pending:
+                if book_id not in added:
+                    # 并发上架同一本书，唯一索引冲突
+                    errors.append(self._item_error(i, book_id, error.error_exist_book_id(book_id)))
+                    continue
+                added_ids.append(book_id)
+            if added_ids:
+                if conf.Search_Backend == "memory":
+                    search_engine.index_store_books(self.db, added_ids, store_id)
+                suggest.index_store_books(self.db, added_ids)
+                search_cache.bump(store_id)
+            errors.sort(key=lambda e: e["index"])
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg, {}
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg, {}
+        return 200, "ok", {"added": len(added_ids), "errors": errors}
+
+    def add_stock_levels(self, user_id: str, store_id: str, items: list) -> (int, str, dict):
+        """
+        批量补货：items 为 [{"book_id", "add_stock_level"}, ...]
+        店铺书目一次查询校验，库存调整一次 bulk_write；同一本书出现多次时累加。
+        """
+        try:
+            code, msg = self._check_bulk_request(user_id, store_id, items)
+            if code != 200:
+                return code, msg, {}
+
+            errors = []
+            requested = []
+            for i, item in enumerate(items):
+                book_id = item.get("book_id") if isinstance(item, dict) else None
+                if not isinstance(book_id, str) or not book_id:
+                    errors.append(self._item_error(i, book_id, error.error_and_message(400, "书籍ID不能为空")))
+                    continue
+                requested.append((i, book_id, self._to_int(item.get("add_stock_level", 0))))
+
+            existing = self.inventory.get_items(store_id, list({book_id for _, book_id, _ in requested}))
+            deltas = {}
+            updated = 0
+            for i, book_id, delta in requested:
+                if book_id not in existing:
+                    errors.append(self._item_error(i, book_id, error.error_non_exist_book_id(book_id)))
+                    continue
+                deltas[book_id] = deltas.get(book_id, 0) + delta
+                updated += 1
+            self.inventory.inc_stocks(store_id, deltas)
+        except pymongo.errors.PyMongoError as e:
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg, {}
+        except BaseException as e:
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg, {}
+        errors.sort(key=lambda e: e["index"])
+        return 200, "ok", {"updated": updated, "errors": errors}
+
+    def _check_bulk_request(self, user_id: str, store_id: str, items) -> (int, str):
+        if not self.user_id_exist(user_id):
+            return error.error_non_exist_user_id(user_id)
+        if not self.store_id_exist(store_id):
+            return error.error_non_exist_store_id(store_id)
+        if not isinstance(items, list) or not items:
+            return error.error_and_message(400, "批量条目不能为空")
+        if len(items) > conf.Bulk_Max_Items:
+            return error.error_and_message(400, "批量条目超过上限 {}".format(conf.Bulk_Max_Items))
+        return 200, "ok"
+
+    @staticmethod
+    def _item_error(index: int, book_id, code_message: tuple) -> dict:
+        code, message = code_message
+        return {"index": index, "book_id": book_id, "code": code, "message": message}
+
+    @staticmethod
+    def _to_int(value) -> int:
+        # 与单条接口一致：无法解析的数量按 0 处理
+        try:
+            return int(value)
+        except Exception:
+            return 0
+
     def add_stock_level(
         self, user_id: str, store_id: str, book_id: str, add_stock_level: int
     ):
@@ -80,18 +238,10 @@ class Seller(db_conn.DBConn):
                 add_stock_level = int(add_stock_level)
             except Exception:
                 add_stock_level = 0
-            # 检查店铺库存中是否存在该书：通过 $elemMatch 查询
-            store_doc = self.db["Stores"].find_one({
-                "_id": store_id,
-                "inventory": {"$elemMatch": {"book_id": book_id}}
-            })
-            if store_doc is None:
+            # 检查店铺库存中是否存在该书
+            if self.inventory.get_item(store_id, book_id) is None:
                 return error.error_non_exist_book_id(book_id)
-            # 使用位置操作符 $ 更新匹配的数组元素
-            self.db["Stores"].update_one(
-                {"_id": store_id, "inventory.book_id": book_id},
-                {"$inc": {"inventory.$.stock_level": add_stock_level}}
-            )
+            self.inventory.inc_stock(store_id, book_id, add_stock_level)
             
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
@@ -122,131 +272,108 @@ class Seller(db_conn.DBConn):
         return 200, "ok"
 
     def ship_order(self, user_id: str, order_id: str) -> (int, str):
-
-        store_id = None
-        deducted_items = []
-        order_status_updated = False
+        # 非事务模式下记录已完成的写入，出错时据此补偿
+        progress = {"store_id": None, "deducted_items": [], "order_status_updated": False}
         try:
-            if not self.user_id_exist(user_id):
-                return error.error_non_exist_user_id(user_id)
+            return self.run_in_transaction(
+                lambda session: self._ship_order(user_id, order_id, progress, session)
+            )
+        except pymongo.errors.PyMongoError as e:
+            self._undo_ship(order_id, progress)
+            code, msg, _ = error.exception_db_to_tuple3(e)
+            return code, msg
+        except BaseException as e:
+            self._undo_ship(order_id, progress)
+            code, msg, _ = error.exception_to_tuple3(e)
+            return code, msg
 
-            if not self.order_id_exist(order_id):
-                return error.error_invalid_order_id(order_id)
-                
-            order_doc = self.db["Orders"].find_one({"_id": order_id})
-            
-            store_doc = self.db["Stores"].find_one({
-                "_id": order_doc["store_id"], 
-                "user_id": user_id
-            })
-            if store_doc is None:
-                return error.error_authorization_fail()
-            
-            if order_doc.get("status") != "paid":
-                return error.error_order_status_mismatch(order_id)
-            
-            # 检查库存是否充足
-            store_id = order_doc["store_id"]
-            items = order_doc.get("items", [])
-            
+    def _ship_order(self, user_id: str, order_id: str, progress: dict, session=None) -> (int, str):
+        docs = self.loader(session)
+        if not docs.exists("Users", user_id):
+            return error.error_non_exist_user_id(user_id)
+
+        # 一次读取订单，同时完成存在性检查
+        order_doc = docs.get("Orders", order_id)
+        if order_doc is None:
+            return error.error_invalid_order_id(order_id)
+
+        # 只取店主字段做鉴权，不传输店铺的库存数组
+        store_doc = docs.get("Stores", order_doc["store_id"], ("user_id",))
+        if store_doc is None or store_doc.get("user_id") != user_id:
+            return error.error_authorization_fail()
+
+        if order_doc.get("status") != "paid":
+            return error.error_order_status_mismatch(order_id)
+
+        store_id = order_doc["store_id"]
+        items = order_doc.get("items", [])
+        # 下单时已预占库存的订单，发货只需确认状态
+        stock_reserved = order_doc.get("stock_reserved", False)
+
+        # 检查库存是否充足（一次取回订单涉及的全部库存项）
+        if not stock_reserved:
+            inventory = self.inventory.get_items(
+                store_id, list(dict.fromkeys(item["book_id"] for item in items)), session=session
+            )
             for item in items:
                 book_id = item["book_id"]
                 quantity = item["quantity"]
-                
-                # 获取当前库存
-                store_doc_check = self.db["Stores"].find_one(
-                    {"_id": store_id, "inventory": {"$elemMatch": {"book_id": book_id}}},
-                    {"inventory.$": 1}
-                )
-                
-                if store_doc_check is None or "inventory" not in store_doc_check or not store_doc_check["inventory"]:
+
+                inv_item = inventory.get(book_id)
+                if inv_item is None:
                     return error.error_non_exist_book_id(book_id)
-                
-                current_stock = store_doc_check["inventory"][0].get("stock_level", 0)
+
+                current_stock = inv_item.get("stock_level", 0)
                 if current_stock < quantity:
                     return error.error_stock_level_low(book_id)
-                    
-            result = self.db["Orders"].update_one(
-                {"_id": order_id, "status": "paid"},
-                {
-                    "$set": {
-                        "status": "shipped",
-                        "ship_time": time.time()
-                    }
+
+        result = self.col("Orders", session).update_one(
+            {"_id": order_id, "status": "paid"},
+            {
+                "$set": {
+                    "status": "shipped",
+                    "ship_time": time.time()
                 }
-            )
+            }
+        )
 
-            if result.modified_count == 0:
-                return error.error_order_status_mismatch(order_id)
-            order_status_updated = True
+        if result.modified_count == 0:
+            return error.error_order_status_mismatch(order_id)
+        # 事务模式下写入随事务回滚，无需记录补偿信息
+        if session is None:
+            progress["store_id"] = store_id
+            progress["order_status_updated"] = True
+        if stock_reserved:
+            return 200, "ok"
 
-            # 发货后库存减少
-            for item in items:
-                book_id = item["book_id"]
-                quantity = item["quantity"]
-                
-                stock_result = self.db["Stores"].update_one(
-                    {
-                        "_id": store_id,
-                        "inventory.book_id": book_id
-                    },
-                    {
-                        "$inc": {"inventory.$.stock_level": -quantity}
-                    }
-                )
-
-                # 库存减少失败，回滚订单状态
-                if stock_result.modified_count == 0:
-                    for deducted in deducted_items:
-                        self.db["Stores"].update_one(
-                            {"_id": store_id, "inventory.book_id": deducted["book_id"]},
-                            {"$inc": {"inventory.$.stock_level": deducted["quantity"]}}
-                        )
-                    if order_status_updated:
-                        self.db["Orders"].update_one(
-                            {"_id": order_id, "status": "shipped"},
-                            {
-                                "$set": {"status": "paid"},
-                                "$unset": {"ship_time": ""}
-                            }
-                        )
-                    return error.error_stock_level_low(book_id)
+        # 发货后库存减少
+        for item in items:
+            book_id = item["book_id"]
+            quantity = item["quantity"]
 
-                deducted_items.append({"book_id": book_id, "quantity": quantity})
+            # 库存减少失败，回滚订单状态
+            if not self.inventory.inc_stock(store_id, book_id, -quantity, session=session):
+                self._undo_ship(order_id, progress)
+                return self.abort(session, error.error_stock_level_low(book_id))
 
-        except pymongo.errors.PyMongoError as e:
-            if store_id is not None and deducted_items:
-                for deducted in deducted_items:
-                    self.db["Stores"].update_one(
-                        {"_id": store_id, "inventory.book_id": deducted["book_id"]},
-                        {"$inc": {"inventory.$.stock_level": deducted["quantity"]}}
-                    )
-            if order_status_updated:
-                self.db["Orders"].update_one(
-                    {"_id": order_id, "status": "shipped"},
-                    {
-                        "$set": {"status": "paid"},
-                        "$unset": {"ship_time": ""}
-                    }
-                )
-            code, msg, _ = error.exception_db_to_tuple3(e)
-            return code, msg
-        except BaseException as e:
-            if store_id is not None and deducted_items:
-                for deducted in deducted_items:
-                    self.db["Stores"].update_one(
-                        {"_id": store_id, "inventory.book_id": deducted["book_id"]},
-                        {"$inc": {"inventory.$.stock_level": deducted["quantity"]}}
-                    )
-            if order_status_updated:
-                self.db["Orders"].update_one(
-                    {"_id": order_id, "status": "shipped"},
-                    {
-                        "$set": {"status": "paid"},
-                        "$unset": {"ship_time": ""}
-                    }
-                )
-            code, msg, _ = error.exception_to_tuple3(e)
-            return code, msg
+            if session is None:
+                progress["deducted_items"].append({"book_id": book_id, "quantity": quantity})
 
         return 200, "ok"
+
+    def _undo_ship(self, order_id: str, progress: dict) -> None:
+        """补偿发货过程中已完成的库存扣减与订单状态变更（仅非事务模式会记录）。"""
+        store_id = progress["store_id"]
+        if store_id is not None:
+            for deducted in progress["deducted_items"]:
+                self.inventory.inc_stock(store_id, deducted["book_id"], deducted["quantity"])
+        if progress["order_status_updated"]:
+            self.db["Orders"].update_one(
+                {"_id": order_id, "status": "shipped"},
+                {
+                    "$set": {"status": "paid"},
+                    "$unset": {"ship_time": ""}
+                }
+            )
+        progress["deducted_items"] = []
+        progress["order_status_updated"] = False
@@ -1,4 +1,5 @@
 import logging
+import os
 import threading
 from typing import Optional
 
@@ -6,25 +7,31 @@ import pymongo
 from pymongo import ASCENDING
 from pymongo.errors import PyMongoError
 
+from be import conf
 
 
 class StoreMongoDB:
     """
     MongoDB 版本的 Store：负责初始化需要的集合与索引，并提供连接句柄。
 
-    - 集合：Users, Stores, Orders, Books
+    - 集合：Users, Stores, Orders, Books, Inventory, Ledger
     - 索引：
-        * Users.token (sparse)
+        * Users.token (sparse)；token_version (sparse)；ledger_batch_at (sparse)
         * Stores.user_id, Stores.inventory.book_id
-        * Orders (buyer_id, status, create_time) 复合索引；(status, create_time)；(status, timeout_at)
-        * Books 文本索引 + 前缀索引（title_lower、tags_lower）
+        * Inventory (store_id, book_id) 唯一复合索引（独立库存布局）
+        * Orders (buyer_id, status, create_time) 复合索引；(status, create_time)；(status, timeout_at)；release_pending (sparse)
+        * Ledger (applied, user_id)
+        * Books 文本索引 + 前缀索引（(title_lower, _id)、tags_lower）；(store_ids, title_lower, _id)
     """
 
-    def __init__(self, mongo_uri: str = "mongodb://localhost:27017/", db_name: str = "bookstore"):
+    def __init__(self, mongo_uri: str = "mongodb://localhost:27017/", db_name: str = "bookstore",
+                 init_indexes: bool = True):
         try:
             self.client = pymongo.MongoClient(mongo_uri)
             self.db = self.client[db_name]
-            self.init_collections_and_indexes()
+            # fork 后的工作进程只需重新建立连接，集合与索引已由主进程创建
+            if init_indexes:
+                self.init_collections_and_indexes()
         except pymongo.errors.PyMongoError as e:
             logging.error(f"初始化 MongoDB 连接失败: {e}")
             raise
@@ -33,7 +40,7 @@ class StoreMongoDB:
         """创建集合（如不存在）并建立常用索引。"""
         try:
             # 显式创建集合以确保存在
-            for name in ["Users", "Stores", "Orders", "Books"]:
+            for name in ["Users", "Stores", "Orders", "Books", "Inventory", "Ledger"]:
                 if name not in self.db.list_collection_names():
                     try:
                         self.db.create_collection(name)
@@ -44,6 +51,10 @@ class StoreMongoDB:
             # Users 索引
             try:
                 self.db.Users.create_index([("token", ASCENDING)], sparse=True)
+                # stateless 认证的版本表按 token_version 增量刷新
+                self.db.Users.create_index([("token_version", ASCENDING)], sparse=True)
+                # 余额流水物化中的批次记录（见 ledger），周期物化按时间查找中断的批次
+                self.db.Users.create_index([("ledger_batch_at", ASCENDING)], sparse=True)
             except PyMongoError as e:
                 logging.warning(f"Users.create_index(token) 失败: {e}")
 
@@ -55,17 +66,38 @@ class StoreMongoDB:
             except PyMongoError as e:
                 logging.warning(f"Stores.create_index(user_id) 失败: {e}")
 
+            # Inventory 索引：每个 (店铺, 书目) 只有一条库存记录
+            try:
+                self.db.Inventory.create_index(
+                    [("store_id", ASCENDING), ("book_id", ASCENDING)],
+                    name="inventory_store_book", unique=True
+                )
+            except PyMongoError as e:
+                logging.warning(f"Inventory.create_index 失败: {e}")
+
             # Orders 索引
             try:
                 # 复合索引：buyer_id + status + create_time（按时间倒序）
                 self.db.Orders.create_index([("buyer_id", ASCENDING), ("status", ASCENDING), ("create_time", -1)], name="orders_by_buyer_status_time")
+                # 键集分页索引：buyer_id + (create_time, _id) 倒序，游标条件与排序都落在索引上
+                self.db.Orders.create_index([("buyer_id", ASCENDING), ("create_time", -1), ("_id", -1)], name="orders_by_buyer_time")
                 # 未支付订单扫描索引
                 self.db.Orders.create_index([("status", ASCENDING), ("create_time", ASCENDING)], name="orders_status_create_time")
                 # 可选索引：状态超时扫描
                 self.db.Orders.create_index([("status", ASCENDING), ("timeout_at", ASCENDING)], name="orders_timeout_scan")
+                # 取消后库存尚未归还的订单（见 order_sweeper），只有这些订单带有该字段
+                self.db.Orders.create_index([("release_pending", ASCENDING)], name="orders_release_pending", sparse=True)
             except PyMongoError as e:
                 logging.warning(f"Orders.create_index 失败: {e}")
 
+            # Ledger 索引：待入账流水按用户查找/分组
+            try:
+                self.db.Ledger.create_index([("applied", ASCENDING), ("user_id", ASCENDING)], name="ledger_pending")
+                # 物化批次记录改存于 Users（见 ledger），按批次号查找流水的索引不再使用
+                self._drop_indexes(self.db.Ledger, ["ledger_batch"])
+            except PyMongoError as e:
+                logging.warning(f"Ledger.create_index 失败: {e}")
+
             # Books 索引（用于搜索优化）
             try:
                 # 单一文本索引，覆盖多个字段并设置权重
@@ -86,9 +118,18 @@ class StoreMongoDB:
                 except Exception:
                     # 如果已有文本索引则忽略
                     pass
-                # 前缀索引（题目与标签）
-                self.db.Books.create_index([("search_index.title_lower", ASCENDING)])
+                # 旧版本遗留的索引：单字段 title_lower 已被 (title_lower, _id) 覆盖；
+                # books_by_store_title 曾定义为不含 _id 的两字段索引，同名不同键无法重建（IndexKeySpecsConflict）
+                try:
+                    self._drop_indexes(self.db.Books, ["search_index.title_lower_1", "books_by_store_title"])
+                except PyMongoError as e:
+                    logging.warning(f"Books.drop_index 失败: {e}")
+                # 前缀索引（题目与标签）；题目索引附带 _id，前缀区间内按 (title_lower, _id) 有序，游标分页无需排序
+                self.db.Books.create_index([("search_index.title_lower", ASCENDING), ("_id", ASCENDING)])
                 self.db.Books.create_index([("search_index.tags_lower", ASCENDING)])
+                # 店铺内搜索：store_ids 等值在前，标题前缀在后
+                self.db.Books.create_index([("store_ids", ASCENDING), ("search_index.title_lower", ASCENDING),
+                                            ("_id", ASCENDING)], name="books_by_store_title_id")
             except PyMongoError as e:
                 logging.warning(f"Books.create_index(search_index.*) 失败: {e}")
 
@@ -96,6 +137,15 @@ class StoreMongoDB:
         except PyMongoError as e:
             logging.error(f"初始化集合/索引失败: {e}")
 
+    @staticmethod
+    def _drop_indexes(collection, names) -> None:
+        """删除已存在的同名索引（不存在时跳过）。"""
+        existing = collection.index_information()
+        for name in names:
+            if name in existing:
+                collection.drop_index(name)
+                logging.info(f"已删除旧索引 {collection.name}.{name}")
+
     def get_db_conn(self):
         """返回 MongoClient（连接句柄）。"""
         return self.client
@@ -107,28 +157,80 @@ class StoreMongoDB:
 
 # 与 sqlite 版本保持相似的全局接口
 database_instance: Optional[StoreMongoDB] = None
+# 创建 database_instance 的进程：MongoClient 不是 fork 安全的，子进程需自建连接
+database_pid: Optional[int] = None
 init_completed_event = threading.Event()
 
 
-def init_database(mongo_uri: str = "mongodb://localhost:27017/", db_name: str = "bookstore") -> None:
+def init_database(mongo_uri: str = "mongodb://localhost:27017/", db_name: str = "bookstore",
+                  init_indexes: bool = True) -> None:
     """初始化全局 MongoDB 实例。"""
-    global database_instance
-    database_instance = StoreMongoDB(mongo_uri=mongo_uri, db_name=db_name)
+    global database_instance, database_pid
+    database_instance = StoreMongoDB(mongo_uri=mongo_uri, db_name=db_name, init_indexes=init_indexes)
+    database_pid = os.getpid()
     init_completed_event.set()
 
 
-def get_db_conn():
-    """获取全局 MongoClient。"""
-    global database_instance
+def reset_after_fork() -> None:
+    """
+    在 fork 出的工作进程中调用：丢弃从父进程继承的 MongoClient
+    （不关闭，连接池仍属于父进程），下次访问时在本进程内重新连接。
+    """
+    global database_instance, database_pid
+    database_instance = None
+    database_pid = None
+
+
+def close_database() -> None:
+    """优雅退出时关闭本进程的连接池。"""
+    global database_instance, database_pid
+    if database_instance is not None and database_pid in (None, os.getpid()):
+        database_instance.client.close()
+    database_instance = None
+    database_pid = None
+
+
+# ASGI 服务使用的异步客户端：绑定创建它的事件循环与进程，集合与索引仍由同步实例初始化
+async_client = None
+async_client_pid: Optional[int] = None
+
+
+def get_async_db():
+    """获取异步 Database（仅在 ASGI 服务的事件循环内调用）。"""
+    global async_client, async_client_pid
+    if async_client is None or async_client_pid != os.getpid():
+        try:
+            from pymongo import AsyncMongoClient
+        except ImportError:
+            raise RuntimeError("pymongo>=4.13 is required for the async driver. Install with: pip install -U pymongo")
+        async_client = AsyncMongoClient(conf.Mongo_URI)
+        async_client_pid = os.getpid()
+    return async_client[conf.Mongo_DB]
+
+
+async def close_async_database() -> None:
+    global async_client, async_client_pid
+    if async_client is not None and async_client_pid == os.getpid():
+        await async_client.close()
+    async_client = None
+    async_client_pid = None
+
+
+def _get_instance() -> StoreMongoDB:
     if database_instance is None:
         # 惰性初始化以提升可用性
-        init_database()
-    return database_instance.get_db_conn()
+        init_database(conf.Mongo_URI, conf.Mongo_DB)
+    elif database_pid is not None and database_pid != os.getpid():
+        # 未经 reset_after_fork 的 fork 子进程：重建本进程自己的连接
+        init_database(conf.Mongo_URI, conf.Mongo_DB, init_indexes=False)
+    return database_instance
+
+
+def get_db_conn():
+    """获取全局 MongoClient。"""
+    return _get_instance().get_db_conn()
 
 
 def get_db():
     """获取全局 Database（bookstore）。"""
-    global database_instance
-    if database_instance is None:
-        init_database()
-    return database_instance.get_db()
\ No newline at end of file
+    return _get_instance().get_db()
@@ -0,0 +1,183 @@
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+
+from be import conf
+from be.model import search_index
+
+# 计入热度的订单状态（已付款及之后）
+_SOLD_STATUSES = ["paid", "shipped", "delivered"]
+
+
+class SuggestIndex:
+    """
+    输入联想索引：按 (归一化键, book_id) 排序的数组，前缀查找用二分定位区间。
+    - 键来自 search_index.title_lower、小写作者名与 tags_lower，命中任一键即返回该书书名
+    - 热度 = 已售数量 + 在售店铺数，同前缀下按热度取前 N
+    - 不超过 max_prefix_cache 个字符的短前缀命中区间很大，预先保存其前 N 名，查询不再扫描区间
+    - 条目数不超过 max_entries，构建时保留热度最高的书，之后的增量写入达到上限即不再收录
+    """
+
+    def __init__(self, max_entries: int = 200000, top_n: int = 20, max_prefix_cache: int = 2):
+        self.max_entries = max_entries
+        self.top_n = top_n
+        self.max_prefix_cache = max_prefix_cache
+        self._keys = []  # 有序 [(key, book_id)]
+        self._books = {}  # book_id -> [title, popularity, keys]
+        self._top = {}  # 短前缀 -> [(-popularity, book_id)]，升序即热度降序
+        self._lock = threading.RLock()
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def build(self, db) -> int:
+        """从 Books 与 Orders 全量重建，完成后原子替换。"""
+        sold = {}
+        pipeline = [
+            {"$match": {"status": {"$in": _SOLD_STATUSES}}},
+            {"$unwind": "$items"},
+            {"$group": {"_id": "$items.book_id", "sold": {"$sum": "$items.quantity"}}},
+        ]
+        for row in db["Orders"].aggregate(pipeline, allowDiskUse=True):
+            sold[row["_id"]] = row["sold"]
+
+        docs = []
+        projection = {"title": 1, "author": 1, "search_index": 1, "store_ids": 1}
+        for doc in db["Books"].find({}, projection).batch_size(1000):
+            popularity = sold.get(doc["_id"], 0) + len(doc.get("store_ids") or [])
+            docs.append((popularity, doc))
+        docs.sort(key=lambda item: -item[0])
+
+        fresh = SuggestIndex(self.max_entries, self.top_n, self.max_prefix_cache)
+        for popularity, doc in docs:
+            if not fresh._add(doc, popularity, keep_sorted=False):
+                break
+        fresh._keys.sort()
+        with self._lock:
+            self._keys = fresh._keys
+            self._books = fresh._books
+            self._top = fresh._top
+            self.built_at = time.monotonic()
+        return len(self._books)
+
+    def add_book(self, doc: dict, popularity: int = 0) -> bool:
+        """增量收录一本书；已收录时只更新热度。达到条目上限时返回 False。"""
+        with self._lock:
+            return self._add(doc, popularity, keep_sorted=True)
+
+    def bump(self, book_id: str, delta: int = 1) -> bool:
+        """已收录的书热度 +delta；未收录时返回 False。"""
+        with self._lock:
+            entry = self._books.get(book_id)
+            if entry is None:
+                return False
+            entry[1] += delta
+            self._refresh_top(book_id, entry)
+            return True
+
+    def _add(self, doc: dict, popularity: int, keep_sorted: bool) -> bool:
+        book_id = doc["_id"]
+        entry = self._books.get(book_id)
+        if entry is None:
+            keys = self._keys_of(doc)
+            if not keys:
+                return True
+            if len(self._keys) + len(keys) > self.max_entries:
+                return False
+            entry = self._books[book_id] = [doc.get("title") or "", popularity, tuple(keys)]
+            for key in keys:
+                if keep_sorted:
+                    insort(self._keys, (key, book_id))
+                else:
+                    self._keys.append((key, book_id))
+        else:
+            entry[1] = max(entry[1], popularity)
+        self._refresh_top(book_id, entry)
+        return True
+
+    def _refresh_top(self, book_id: str, entry: list) -> None:
+        prefixes = {key[:n] for key in entry[2] for n in range(1, self.max_prefix_cache + 1)}
+        for prefix in prefixes:
+            top = [item for item in self._top.get(prefix, []) if item[1] != book_id]
+            top.append((-entry[1], book_id))
+            top.sort()
+            self._top[prefix] = top[:self.top_n]
+
+    @staticmethod
+    def _keys_of(doc: dict) -> set:
+        index = doc.get("search_index") or {}
+        keys = {index.get("title_lower") or search_index.fold(doc.get("title"))}
+        keys.add(search_index.fold(doc.get("author")))
+        keys.update(index.get("tags_lower") or [])
+        keys.discard("")
+        return keys
+
+    def suggest(self, prefix: str, limit: int = 10) -> list:
+        """前缀 -> 按热度降序的 [{"book_id", "title"}]，最多 limit 条（不超过 top_n）。"""
+        prefix = search_index.fold(prefix).strip()
+        if not prefix:
+            return []
+        limit = min(limit, self.top_n)
+        with self._lock:
+            if len(prefix) <= self.max_prefix_cache:
+                ranked = self._top.get(prefix, [])[:limit]
+            else:
+                lo = bisect_left(self._keys, (prefix,))
+                hi = bisect_left(self._keys, (prefix + "\U0010ffff",))
+                candidates = {book_id: self._books[book_id][1] for _, book_id in self._keys[lo:hi]}
+                ranked = heapq.nsmallest(limit, ((-pop, book_id) for book_id, pop in candidates.items()))
+            return [{"book_id": book_id, "title": self._books[book_id][0]} for _, book_id in ranked]
+
+
+suggest_index = SuggestIndex(conf.Suggest_Max_Entries)
+_build_lock = threading.Lock()
+
+
+def needs_build() -> bool:
+    """get_index 是否会在本次调用中构建索引（异步接口据此把构建放到线程池）。"""
+    if suggest_index.built_at is None:
+        return True
+    refresh = conf.Search_Index_Refresh
+    return refresh > 0 and time.monotonic() - suggest_index.built_at > refresh and not _build_lock.locked()
+
+
+def get_index(db) -> SuggestIndex:
+    """首次使用时构建；超过 Search_Index_Refresh 秒后由一个请求重建，其间其他请求沿用旧数据。"""
+    if suggest_index.built_at is None:
+        with _build_lock:
+            if suggest_index.built_at is None:
+                _rebuild(db)
+        return suggest_index
+    refresh = conf.Search_Index_Refresh
+    if refresh > 0 and time.monotonic() - suggest_index.built_at > refresh and _build_lock.acquire(blocking=False):
+        try:
+            _rebuild(db)
+        finally:
+            _build_lock.release()
+    return suggest_index
+
+
+def _rebuild(db) -> None:
+    start = time.time()
+    count = suggest_index.build(db)
+    logging.info(f"联想索引构建完成: {count} 本书, {len(suggest_index)} 个键, 用时 {time.time() - start:.2f}s")
+
+
+def index_store_book(db, book_id: str) -> None:
+    """add_book 之后同步：已收录的书热度 +1（多一家店铺在售），未收录的从 Books 补录。"""
+    index_store_books(db, [book_id])
+
+
+def index_store_books(db, book_ids: list) -> None:
+    """批量上架后同步：未收录的书一次 $in 查询补录。"""
+    if suggest_index.built_at is None:
+        # 尚未构建，首次请求时全量构建会包含这些书
+        return
+    missing = [book_id for book_id in book_ids if not suggest_index.bump(book_id)]
+    if missing:
+        projection = {"title": 1, "author": 1, "search_index": 1, "store_ids": 1}
+        for doc in db["Books"].find({"_id": {"$in": missing}}, projection):
+            suggest_index.add_book(doc, len(doc.get("store_ids") or []))
@@ -0,0 +1,206 @@
+"""
+无状态 token（Auth_Mode = "stateless"）。
+
+token 用服务端密钥签名，载荷 {user_id, terminal, ver, iat, exp}：
+- 校验只做签名与 exp 检查，再对照进程内的版本表：ver 不小于该用户当前版本即有效，常规路径不读数据库
+- 登录不再改写 Users.token，同一用户可在多个终端同时持有有效 token
+- 吊销：登出/改密把 Users.token_version 推进到当前时间（微秒），该用户此前签发的全部 token 失效；
+  注册时同样写入，注销后重新注册的同名用户不会接受旧 token
+- 版本表首次使用时一次读取全部用户的 token_version；之后每 Auth_Version_Refresh 秒按 token_version 索引
+  增量拉取新推进的版本，每 Auth_Version_Reload 秒全量重载以移除已注销的用户。
+  其他进程的吊销最迟一个刷新周期后生效，本进程的吊销立即生效
+- 签名密钥取自 Auth_Secret；未配置时从 Settings 集合读取（不存在则生成），多进程/多实例共用
+"""
+import asyncio
+import math
+import secrets
+import threading
+import time
+
+import jwt
+import pymongo
+
+from be import conf
+from be.model import store
+
+# 已注销（数据库中查不到）的用户：任何 ver 都不满足
+_REVOKED = math.inf
+
+_secret = None
+_secret_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return conf.Auth_Mode == "stateless"
+
+
+def new_version() -> int:
+    return time.time_ns() // 1000
+
+
+def secret() -> str:
+    global _secret
+    if conf.Auth_Secret:
+        return conf.Auth_Secret
+    if _secret is None:
+        with _secret_lock:
+            if _secret is None:
+                _secret = _load_secret(store.get_db())
+    return _secret
+
+
+def _load_secret(db) -> str:
+    settings = db["Settings"]
+    try:
+        settings.update_one(
+            {"_id": "auth_secret"}, {"$setOnInsert": {"value": secrets.token_hex(32)}}, upsert=True
+        )
+    except pymongo.errors.DuplicateKeyError:
+        # 其他进程同时生成，以先写入的为准
+        pass
+    return settings.find_one({"_id": "auth_secret"})["value"]
+
+
+def encode(user_id: str, terminal: str, version: int, lifetime: int) -> str:
+    now = int(time.time())
+    return jwt.encode(
+        {"user_id": user_id, "terminal": terminal, "ver": version, "iat": now, "exp": now + lifetime},
+        key=secret(),
+        algorithm="HS256",
+    )
+
+
+def decode(user_id: str, token: str):
+    """签名、exp 与 user_id 均有效时返回载荷，否则返回 None。"""
+    try:
+        claims = jwt.decode(token, key=secret(), algorithms=["HS256"], options={"require": ["exp", "ver"]})
+    except jwt.exceptions.InvalidTokenError:
+        return None
+    if claims.get("user_id") != user_id:
+        return None
+    return claims
+
+
+class VersionMap:
+    """user_id -> 当前 token 版本；签发早于该版本的 token 无效。"""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loaded_at = None  # 上次全量重载（time.monotonic）
+        self._refreshed_at = None  # 上次增量刷新（time.monotonic）
+        self._seen_until = None  # 增量拉取的 token_version 下界（微秒）
+        self.refreshes = 0
+        self.lookups = 0
+
+    def __len__(self):
+        return len(self._versions)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._versions
+
+    def peek(self, user_id: str):
+        """不访问数据库：版本表需要刷新或没有该用户时返回 None。"""
+        if self.due():
+            return None
+        return self._versions.get(user_id)
+
+    def due(self) -> bool:
+        if self._loaded_at is None:
+            return True
+        refresh = conf.Auth_Version_Refresh
+        return refresh > 0 and time.monotonic() - self._refreshed_at > refresh and not self._refresh_lock.locked()
+
+    def current(self, db, user_id: str):
+        """当前版本；按需刷新版本表，表中没有该用户时查一次 Users。"""
+        self._maybe_refresh(db)
+        version = self._versions.get(user_id)
+        if version is None:
+            self.lookups += 1
+            doc = db["Users"].find_one({"_id": user_id}, {"token_version": 1})
+            version = _REVOKED if doc is None else doc.get("token_version", 0)
+            self.advance(user_id, version)
+            version = self._versions.get(user_id, version)
+        return version
+
+    def advance(self, user_id: str, version) -> None:
+        """记录本进程观察到的版本；版本只前进，已注销标记可被重新注册的版本覆盖。"""
+        with self._lock:
+            current = self._versions.get(user_id)
+            if current is None or current == _REVOKED or version > current:
+                self._versions[user_id] = version
+
+    def revoke(self, user_id: str) -> None:
+        with self._lock:
+            self._versions[user_id] = _REVOKED
+
+    def forget(self, user_id: str) -> None:
+        with self._lock:
+            self._versions.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._versions = {}
+            self._loaded_at = self._refreshed_at = self._seen_until = None
+            self.refreshes = self.lookups = 0
+
+    def _maybe_refresh(self, db) -> None:
+        if self._loaded_at is None:
+            with self._refresh_lock:
+                if self._loaded_at is None:
+                    self._reload(db)
+            return
+        # 已有版本表时只由一个线程刷新，其余线程沿用当前数据
+        if self.due() and self._refresh_lock.acquire(blocking=False):
+            try:
+                reload = conf.Auth_Version_Reload
+                if reload > 0 and time.monotonic() - self._loaded_at > reload:
+                    self._reload(db)
+                else:
+                    self._refresh(db)
+            finally:
+                self._refresh_lock.release()
+
+    def _reload(self, db) -> None:
+        started = new_version()
+        versions = {doc["_id"]: doc.get("token_version", 0)
+                    for doc in db["Users"].find({}, {"token_version": 1}).batch_size(10000)}
+        with self._lock:
+            self._versions = versions
+            self._loaded_at = self._refreshed_at = time.monotonic()
+            self._seen_until = started
+
+    def _refresh(self, db) -> None:
+        """拉取 token_version 不早于上次刷新的用户；窗口前移一个刷新周期，容忍写入与时钟的偏差。"""
+        started = new_version()
+        since = self._seen_until - int(conf.Auth_Version_Refresh * 1_000_000)
+        for doc in db["Users"].find({"token_version": {"$gte": since}}, {"token_version": 1}):
+            self.advance(doc["_id"], doc["token_version"])
+        self._refreshed_at = time.monotonic()
+        self._seen_until = started
+        self.refreshes += 1
+
+
+versions = VersionMap()
+
+
+def check(db, user_id: str, token: str) -> bool:
+    claims = decode(user_id, token)
+    if claims is None:
+        return False
+    version = versions.peek(user_id)
+    if version is None:
+        version = versions.current(db, user_id)
+    return claims["ver"] >= version
+
+
+async def check_async(user_id: str, token: str) -> bool:
+    """check 的异步版本：版本表需要刷新或未收录该用户时，在线程池中用同步连接查询。"""
+    claims = decode(user_id, token)
+    if claims is None:
+        return False
+    version = versions.peek(user_id)
+    if version is None:
+        version = await asyncio.get_running_loop().run_in_executor(None, versions.current, store.get_db(), user_id)
+    return claims["ver"] >= version
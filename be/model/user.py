@@ -2,8 +2,15 @@ import jwt
 import time
 import logging
 import pymongo
+from be import conf
 from be.model import error
 from be.model import db_conn
+from be.model import password_hash
+from be.model import token_auth
+from be.model.cache import TTLCache
+
+# 已验证 token 的缓存：(user_id, token) -> token 过期时间，按 user_id 分组失效
+token_cache = TTLCache(maxsize=conf.Token_Cache_Size, ttl=conf.Token_Cache_TTL)
 
 # encode a json string like:
 #   {
@@ -33,74 +40,144 @@ def jwt_decode(encoded_token, user_id: str) -> str:
     decoded = jwt.decode(encoded_token, key=user_id, algorithms=["HS256"])
     return decoded
 
+def token_expire_at(user_id: str, db_token: str, token: str, lifetime: int):
+    """校验 token，有效时返回其过期时间戳，否则返回 None（同步/异步模型共用）。"""
+    try:
+        if db_token != token:
+            return None
+        jwt_text = jwt_decode(encoded_token=token, user_id=user_id)
+        ts = jwt_text["timestamp"]
+        if ts is not None:
+            now = time.time()
+            if lifetime > now - ts >= 0:
+                return ts + lifetime
+    except jwt.exceptions.InvalidSignatureError as e:
+        logging.error(str(e))
+    return None
+
+
+def new_terminal_token(user_id: str) -> (str, str):
+    """生成新终端名及其 token -> (terminal, token)；注册、登出、改密时替换 Users.token（同步/异步模型共用）。"""
+    terminal = "terminal_{}".format(str(time.time()))
+    return terminal, jwt_encode(user_id, terminal)
+
+
+def new_user_doc(user_id: str, hashed_password: str) -> dict:
+    """注册时写入 Users 的文档，密码由调用方按同步/异步方式先行哈希。"""
+    terminal, token = new_terminal_token(user_id)
+    return {
+        "_id": user_id,
+        "password": hashed_password,
+        "balance": 0,
+        "token": token,
+        "terminal": terminal,
+        "token_version": token_auth.new_version()
+    }
+
+
+def revoke_update(update: dict = None) -> (dict, int):
+    """stateless 模式吊销 token 的 Users 更新 -> (update, 新版本号)，在 update 上追加版本推进。"""
+    version = token_auth.new_version()
+    update = dict(update or {})
+    update["$max"] = {"token_version": version}
+    return update, version
+
+
 class User(db_conn.DBConn):
     token_lifetime: int = 3600 # 3600 second
     def __init__(self):
         super().__init__()
     def __check_token__(self, user_id: str, db_token: str, token: str) -> bool:
-        try:
-            if db_token != token:
-                return False
-            jwt_text = jwt_decode(encoded_token=token, user_id=user_id)
-            ts = jwt_text["timestamp"]
-            if ts is not None:
-                now = time.time()
-                if self.token_lifetime > now - ts >= 0:
-                    return True
-        except jwt.exceptions.InvalidSignatureError as e:
-            logging.error(str(e))
-            return False
+        return self.__token_expire_at__(user_id, db_token, token) is not None
+
+    def __token_expire_at__(self, user_id: str, db_token: str, token: str):
+        return token_expire_at(user_id, db_token, token, self.token_lifetime)
     
     def register(self, user_id: str, password: str) -> (int, str):
         try:
-            terminal = "terminal_{}".format(str(time.time()))
-            token = jwt_encode(user_id, terminal)
-            user = {
-                "_id": user_id,
-                "password": password,
-                "balance": 0,
-                "token": token,
-                "terminal": terminal
-            }
-            self.db["Users"].insert_one(user)
+            self.db["Users"].insert_one(new_user_doc(user_id, password_hash.hash_password(password)))
+            # 同名用户注销后重新注册：丢弃本进程记录的注销标记
+            token_auth.versions.forget(user_id)
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
             return code, msg
         return 200, "ok"
     
     def check_token(self, user_id: str, token: str) -> (int, str):
-        user_doc = self.db["Users"].find_one({"_id": user_id})
+        if token_auth.enabled():
+            # 只验证签名并对照版本表，常规路径不查库
+            if not token_auth.check(self.db, user_id, token):
+                return error.error_authorization_fail()
+            return 200, "ok"
+
+        # 近期验证过的 token 直接放行，省去一次 Users 查询与 JWT 解码
+        key = (user_id, token)
+        expire_at = token_cache.get(key)
+        if expire_at is not None and time.time() < expire_at:
+            return 200, "ok"
+
+        # 读库前取分组代数：读取期间若有登出/登录/改密使缓存失效，本次结果不写回缓存
+        generation = token_cache.generation(user_id)
+        user_doc = self.db["Users"].find_one({"_id": user_id}, {"token": 1})
         if user_doc is None:
             # 认证相关场景统一返回 401
             return error.error_authorization_fail()
         db_token = user_doc.get("token")
-        if not self.__check_token__(user_id, db_token, token):
+        expire_at = self.__token_expire_at__(user_id, db_token, token)
+        if expire_at is None:
             return error.error_authorization_fail()
+        # 缓存有效期不超过 token 本身的剩余寿命
+        token_cache.set(key, expire_at, group=user_id, ttl=expire_at - time.time(), generation=generation)
         return 200, "ok"
     
-    def check_password(self, user_id: str, password: str) -> (int, str):
-        user_doc = self.db["Users"].find_one({"_id": user_id})
+    def check_password(self, user_id: str, password: str, rehash: bool = False) -> (int, str):
+        code, message, _ = self.__authenticate__(user_id, password, rehash)
+        return code, message
+
+    def __authenticate__(self, user_id: str, password: str, rehash: bool = False) -> (int, str, dict):
+        user_doc = self.db["Users"].find_one({"_id": user_id}, {"password": 1, "token_version": 1})
         if user_doc is None:
             # 认证相关场景统一返回 401
-            return error.error_authorization_fail()
+            return error.error_authorization_fail() + (None,)
         db_password = user_doc.get("password")
-        if db_password != password:
-            return error.error_authorization_fail()
-        return 200, "ok"
+        ok, needs_rehash = password_hash.verify(user_id, password, db_password)
+        if not ok:
+            return error.error_authorization_fail() + (None,)
+        if rehash and needs_rehash and conf.Password_Rehash_On_Login:
+            # 明文或参数过时的记录改写为当前 KDF；以旧记录为条件，不覆盖并发的改密
+            self.db["Users"].update_one(
+                {"_id": user_id, "password": db_password},
+                {"$set": {"password": password_hash.hash_password(password)}}
+            )
+        return 200, "ok", user_doc
+
+    def __revoke_tokens__(self, user_id: str, update: dict = None) -> None:
+        """stateless 模式：推进 token 版本，使该用户已签发的 token 全部失效。"""
+        update, version = revoke_update(update)
+        self.db["Users"].update_one({"_id": user_id}, update)
+        token_auth.versions.advance(user_id, version)
 
     def login(self, user_id: str, password: str, terminal: str) -> (int, str, str):
         token = ""
         try:
-            code, message = self.check_password(user_id, password)
+            code, message, user_doc = self.__authenticate__(user_id, password, rehash=True)
             if code != 200:
                 return code, message, ""
 
+            if token_auth.enabled():
+                # 不改写 Users.token，其他终端已签发的 token 继续有效
+                version = user_doc.get("token_version", 0)
+                token_auth.versions.advance(user_id, version)
+                return 200, "ok", token_auth.encode(user_id, terminal, version, self.token_lifetime)
+
             token = jwt_encode(user_id, terminal)
             self.db["Users"].update_one({
                 "_id": user_id
             },{
                 "$set":{"token": token}
             })
+            # 新 token 顶替旧 token，旧 token 的缓存结果随之作废
+            token_cache.invalidate_group(user_id)
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
             return code, msg, ""
@@ -115,8 +192,11 @@ class User(db_conn.DBConn):
             if code != 200:
                 return code, message
 
-            terminal = "terminal_{}".format(str(time.time()))
-            dummy_token = jwt_encode(user_id, terminal)
+            if token_auth.enabled():
+                self.__revoke_tokens__(user_id)
+                return 200, "ok"
+
+            terminal, dummy_token = new_terminal_token(user_id)
 
             self.db["Users"].update_one({
                 "_id": user_id
@@ -126,6 +206,7 @@ class User(db_conn.DBConn):
                     "terminal": terminal
                 }
             })
+            token_cache.invalidate_group(user_id)
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
             return code, msg
@@ -143,6 +224,9 @@ class User(db_conn.DBConn):
             self.db["Users"].delete_one({
                 "_id": user_id
             })
+            token_cache.invalidate_group(user_id)
+            password_hash.invalidate(user_id)
+            token_auth.versions.revoke(user_id)
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
             return code, msg
@@ -159,17 +243,25 @@ class User(db_conn.DBConn):
             if code != 200:
                 return code, message
 
-            terminal = "terminal_{}".format(str(time.time()))
-            token = jwt_encode(user_id, terminal)
+            if token_auth.enabled():
+                self.__revoke_tokens__(
+                    user_id, {"$set": {"password": password_hash.hash_password(new_password)}}
+                )
+                password_hash.invalidate(user_id)
+                return 200, "ok"
+
+            terminal, token = new_terminal_token(user_id)
             self.db["Users"].update_one({
                 "_id": user_id
             },{
                 "$set":{
-                    "password": new_password,
+                    "password": password_hash.hash_password(new_password),
                     "token": token,
                     "terminal": terminal
                 }
             })
+            token_cache.invalidate_group(user_id)
+            password_hash.invalidate(user_id)
         except pymongo.errors.PyMongoError as e:
             code, msg, _ = error.exception_db_to_tuple3(e)
             return code, msg
@@ -1,26 +1,44 @@
 import logging
 import os
+import signal
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(root_dir)
 
 from flask import Flask
 from flask import Blueprint
-from flask import request
+from flask import jsonify
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
 from be.view import auth
 from be.view import seller
 from be.view import buyer
-from be.model.store import init_database, init_completed_event
+from be.view import book
+from be import conf
+from be.model.store import init_database, reset_after_fork, close_database
+from be.model.order_timeout import scheduler as order_timeout_scheduler
+from be.model import ledger
+from be.model import search_cache
 
 bp_shutdown = Blueprint("shutdown", __name__)
 
+# 就绪信号：数据库已初始化且监听端口已打开，可以接受请求
+server_ready = threading.Event()
+# 当前服务模式的停止方式，由 _run_threaded / _run_asgi / gunicorn 钩子设置
+_shutdown_handler = None
+
+
+def set_shutdown_handler(handler) -> None:
+    global _shutdown_handler
+    _shutdown_handler = handler
+
 
 def shutdown_server():
-    func = request.environ.get("werkzeug.server.shutdown")
-    if func is None:
-        raise RuntimeError("Not running with the Werkzeug Server")
-    func()
+    if _shutdown_handler is None:
+        raise RuntimeError("Server is not running")
+    _shutdown_handler()
 
 
 @bp_shutdown.route("/shutdown")
@@ -29,12 +47,84 @@ def be_shutdown():
     return "Server shutting down..."
 
 
-def be_run():
+@bp_shutdown.route("/ready")
+def be_ready():
+    # 供外部探活/负载均衡使用的就绪检查
+    if not server_ready.is_set():
+        return "Server starting...", 503
+    return "ok"
+
+
+@bp_shutdown.route("/order_timeout_stats")
+def be_order_timeout_stats():
+    # 本进程订单超时调度器的状态与取消延迟；多进程时只有主节点的 pending/cancelled 有意义
+    return jsonify(order_timeout_scheduler.stats())
+
+
+@bp_shutdown.route("/search_cache_stats")
+def be_search_cache_stats():
+    # 本进程搜索结果缓存的命中/未命中计数；多进程时各工作进程分别计数，以负载均衡后的访问近似
+    return jsonify(search_cache.result_cache.stats())
+
+
+def _start_background_tasks():
+    # 订单超时调度器与余额流水物化线程：各服务进程启动后开启，退出前停止
+    if conf.Order_Timeout_Scheduler:
+        order_timeout_scheduler.start()
+    ledger.materializer.start()
+
+
+def _stop_background_tasks():
+    order_timeout_scheduler.stop()
+    ledger.materializer.stop()
+
+
+def create_app() -> Flask:
+    """应用工厂：每次调用返回注册好全部蓝图的新 Flask 应用。"""
+    app = Flask(__name__)
+    app.register_blueprint(bp_shutdown)
+    app.register_blueprint(auth.bp_auth)
+    app.register_blueprint(seller.bp_seller)
+    app.register_blueprint(buyer.bp_buyer)
+    app.register_blueprint(book.bp_book)
+    return app
+
+
+class _RequestHandler(WSGIRequestHandler):
+    # 每个连接只处理一个请求：keep-alive 连接会长期占住线程池中的线程
+    protocol_version = "HTTP/1.0"
+
+
+class _PooledWSGIServer(BaseWSGIServer):
+    """单进程 WSGI 服务器，请求交给固定大小的线程池处理。"""
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, threads: int):
+        super().__init__(host, port, app, handler=_RequestHandler)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="be-worker")
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        # 等待在途请求处理完毕
+        self._pool.shutdown(wait=True)
+
+
+def _setup_logging():
     this_path = os.path.dirname(__file__)
     parent_path = os.path.dirname(this_path)
     log_file = os.path.join(parent_path, "app.log")
-    # 切换到 MongoDB 初始化：使用默认连接参数或环境变量
-    init_database()
 
     logging.basicConfig(filename=log_file, level=logging.ERROR)
     handler = logging.StreamHandler()
@@ -44,14 +134,144 @@ def be_run():
     handler.setFormatter(formatter)
     logging.getLogger().addHandler(handler)
 
-    app = Flask(__name__)
-    app.register_blueprint(bp_shutdown)
-    app.register_blueprint(auth.bp_auth)
-    app.register_blueprint(seller.bp_seller)
-    app.register_blueprint(buyer.bp_buyer)
-    init_completed_event.set()
-    app.run()
+
+def _run_threaded(app: Flask, host: str, port: int, threads: int):
+    global _shutdown_handler
+    server = _PooledWSGIServer(host, port, app, threads)
+
+    def stop():
+        # server.shutdown() 会等待 serve_forever 退出，不能在请求线程里同步调用
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    _shutdown_handler = stop
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: stop())
+
+    logging.info(f"serving on http://{host}:{port} (1 process, {threads} threads)")
+    _start_background_tasks()
+    server_ready.set()
+    try:
+        server.serve_forever()
+    finally:
+        server_ready.clear()
+        server.server_close()
+        _shutdown_handler = None
+        _stop_background_tasks()
+        close_database()
+
+
+def _post_fork(server, worker):
+    # MongoClient 不是 fork 安全的：丢弃继承来的连接，由本进程首次访问时重建
+    reset_after_fork()
+
+
+def _post_worker_init(worker):
+    global _shutdown_handler
+    # 工作进程中的 /shutdown 请求主进程（gunicorn master）优雅退出
+    _shutdown_handler = lambda: os.kill(os.getppid(), signal.SIGTERM)
+    # 每个工作进程各自启动后台线程（不能在 master 中启动后再 fork）；调度器由租约选出一个执行取消
+    _start_background_tasks()
+    server_ready.set()
+
+
+def _worker_exit(server, worker):
+    _stop_background_tasks()
+    close_database()
+
+
+def _run_multi_worker(app: Flask, host: str, port: int, workers: int, threads: int):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise RuntimeError("gunicorn is not installed. Install with: pip install gunicorn")
+
+    class GunicornApplication(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    options = {
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "threads": threads,
+        "worker_class": "gthread",
+        "graceful_timeout": conf.Serve_Graceful_Timeout,
+        "post_fork": _post_fork,
+        "post_worker_init": _post_worker_init,
+        "worker_exit": _worker_exit,
+        "when_ready": lambda arbiter: server_ready.set(),
+        "on_exit": lambda arbiter: server_ready.clear(),
+    }
+    logging.info(f"serving on http://{host}:{port} ({workers} processes, {threads} threads each)")
+    GunicornApplication(app, options).run()
+
+
+def _run_asgi(host: str, port: int, workers: int, threads: int):
+    try:
+        import uvicorn
+    except ImportError:
+        raise RuntimeError("uvicorn is not installed. Install with: pip install uvicorn")
+
+    if workers > 1:
+        # 工作进程由 uvicorn 以 spawn 方式启动，按导入路径各自创建应用与异步客户端
+        os.environ["BOOKSTORE_ASGI_BRIDGE_THREADS"] = str(threads)
+        logging.info(f"serving ASGI on http://{host}:{port} ({workers} processes)")
+        uvicorn.run("be.asgi:create_asgi_app", factory=True, host=host, port=port, workers=workers,
+                    timeout_graceful_shutdown=conf.Serve_Graceful_Timeout)
+        return
+
+    from be.asgi import create_asgi_app
+
+    class ReadyServer(uvicorn.Server):
+        async def startup(self, sockets=None):
+            await super().startup(sockets=sockets)
+            if not self.should_exit:
+                server_ready.set()
+
+    config = uvicorn.Config(create_asgi_app(threads), host=host, port=port, lifespan="on",
+                            timeout_graceful_shutdown=conf.Serve_Graceful_Timeout)
+    server = ReadyServer(config)
+    set_shutdown_handler(lambda: setattr(server, "should_exit", True))
+    logging.info(f"serving ASGI on http://{host}:{port} (1 process, {threads} bridge threads)")
+    _start_background_tasks()
+    try:
+        server.run()
+    finally:
+        server_ready.clear()
+        set_shutdown_handler(None)
+        _stop_background_tasks()
+
+
+def be_run(host: str = None, port: int = None, workers: int = None, threads: int = None, mode: str = None):
+    host = host or conf.Serve_Host
+    port = port or conf.Serve_Port
+    workers = workers or conf.Serve_Workers
+    mode = mode or conf.Serve_Mode
+    # asgi 模式下 threads 是 WSGI 桥接线程数，默认取 Asgi_Bridge_Threads
+    threads = threads or (conf.Asgi_Bridge_Threads if mode == "asgi" else conf.Serve_Threads)
+
+    _setup_logging()
+    # 主进程完成集合与索引初始化；多进程模式下各工作进程 fork 后自建连接
+    init_database(conf.Mongo_URI, conf.Mongo_DB)
+
+    if mode == "asgi":
+        _run_asgi(host, port, workers, threads)
+        return
+    app = create_app()
+    if workers > 1:
+        _run_multi_worker(app, host, port, workers, threads)
+    else:
+        _run_threaded(app, host, port, threads)
 
 
 if __name__ == "__main__":
-    be_run()
\ No newline at end of file
+    be_run()
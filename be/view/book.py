@@ -0,0 +1,29 @@
+from flask import Blueprint
+from flask import request
+from flask import jsonify
+from flask import Response
+from werkzeug.wsgi import wrap_file
+from be import conf
+from be.model.buyer import Buyer
+
+bp_book = Blueprint("book", __name__, url_prefix="/book")
+
+
+@bp_book.route("/picture/<picture_id>", methods=["GET"])
+def get_picture(picture_id: str):
+    variant: str = request.args.get("size", "original")
+
+    b = Buyer()
+    code, message, found = b.get_picture(picture_id, variant)
+    if code != 200:
+        return jsonify({"message": message}), code
+
+    # 流式返回：ETag 为内容哈希，If-None-Match 命中返回 304，Range 请求返回 206 片段
+    fileobj, length, mimetype, etag = found
+    response = Response(wrap_file(request.environ, fileobj), mimetype=mimetype, direct_passthrough=True)
+    response.content_length = length
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = conf.Picture_Max_Age
+    response.cache_control.immutable = True
+    return response.make_conditional(request, accept_ranges=True, complete_length=length)
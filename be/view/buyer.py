@@ -56,9 +56,11 @@ def query_orders():
     user_id: str = request.json.get("user_id")
     status: str = request.json.get("status")
     page: int = request.json.get("page", 1)
+    cursor: str = request.json.get("cursor")
+    with_total: bool = request.json.get("with_total")
     
     b = Buyer()
-    code, message, result = b.query_orders(user_id, status, page)
+    code, message, result = b.query_orders(user_id, status, page, cursor, with_total)
     return jsonify({"message": message, "result": result}), code
 @bp_buyer.route("/cancel_order", methods=["POST"])
 def cancel_order():
@@ -71,8 +73,9 @@ def cancel_order():
 
 @bp_buyer.route("/auto_cancel_timeout", methods=["POST"])
 def auto_cancel_timeout_orders():
-    code, message, cancelled_count = Buyer.auto_cancel_timeout_orders()
-    return jsonify({"message": message, "cancelled_count": cancelled_count}), code
+    limit = (request.get_json(silent=True) or {}).get("limit")
+    code, message, stats = Buyer.sweep_timeout_orders(limit)
+    return jsonify({"message": message, "cancelled_count": stats.get("cancelled", 0), "result": stats}), code
 
 
 @bp_buyer.route("/search_books", methods=["POST"])
@@ -80,9 +83,13 @@ def search_books():
     keyword: str = request.json.get("keyword")
     store_id: str = request.json.get("store_id")
     page: int = request.json.get("page", 1)
+    cursor: str = request.json.get("cursor")
+    with_total: bool = request.json.get("with_total")
+    facets: bool = bool(request.json.get("facets", False))
+    fields = request.json.get("fields")
     
     b = Buyer()
-    code, message, result = b.search_books(keyword, store_id, page)
+    code, message, result = b.search_books(keyword, store_id, page, cursor, with_total, facets, fields)
     return jsonify({"message": message, "result": result}), code
 
 
@@ -92,9 +99,24 @@ def search_books_advanced():
     tags: list = request.json.get("tags")
     store_id: str = request.json.get("store_id")
     page: int = request.json.get("page", 1)
+    cursor: str = request.json.get("cursor")
+    with_total: bool = request.json.get("with_total")
+    facets: bool = bool(request.json.get("facets", False))
+    fields = request.json.get("fields")
     
     b = Buyer()
-    code, message, result = b.search_books_advanced(title_prefix, tags, store_id, page)
+    code, message, result = b.search_books_advanced(title_prefix, tags, store_id, page, cursor, with_total, facets,
+                                                    fields)
+    return jsonify({"message": message, "result": result}), code
+
+
+@bp_buyer.route("/suggest", methods=["POST"])
+def suggest():
+    prefix: str = request.json.get("prefix")
+    limit: int = request.json.get("limit", 10)
+
+    b = Buyer()
+    code, message, result = b.suggest(prefix, limit)
     return jsonify({"message": message, "result": result}), code
 
 
@@ -31,6 +31,18 @@ def seller_add_book():
     return jsonify({"message": message}), code
 
 
+@bp_seller.route("/add_books", methods=["POST"])
+def seller_add_books():
+    user_id: str = request.json.get("user_id")
+    store_id: str = request.json.get("store_id")
+    books: list = request.json.get("books")
+
+    s = seller.Seller()
+    code, message, result = s.add_books(user_id, store_id, books)
+
+    return jsonify({"message": message, "result": result}), code
+
+
 @bp_seller.route("/add_stock_level", methods=["POST"])
 def add_stock_level():
     user_id: str = request.json.get("user_id")
@@ -44,6 +56,18 @@ def add_stock_level():
     return jsonify({"message": message}), code
 
 
+@bp_seller.route("/add_stock_levels", methods=["POST"])
+def add_stock_levels():
+    user_id: str = request.json.get("user_id")
+    store_id: str = request.json.get("store_id")
+    items: list = request.json.get("items")
+
+    s = seller.Seller()
+    code, message, result = s.add_stock_levels(user_id, store_id, items)
+
+    return jsonify({"message": message, "result": result}), code
+
+
 @bp_seller.route("/ship", methods=["POST"])
 def ship_order():
     user_id: str = request.json.get("user_id")
@@ -60,12 +60,17 @@ class Buyer:
         return r.status_code
 
 
-    def query_orders(self, status: str = None, page: int = 1) -> (int, dict):
+    def query_orders(self, status: str = None, page: int = 1, cursor: str = None,
+                     with_total: bool = None) -> (int, dict):
         json = {
             "user_id": self.user_id,
             "status": status,
             "page": page,
         }
+        if cursor is not None:
+            json["cursor"] = cursor
+        if with_total is not None:
+            json["with_total"] = with_total
         url = urljoin(self.url_prefix, "orders")
         headers = {"token": self.token}
         r = requests.post(url, headers=headers, json=json)
@@ -83,38 +88,70 @@ class Buyer:
         return r.status_code
 
     @staticmethod
-    def auto_cancel_timeout_orders(url_prefix: str) -> (int, int):
+    def auto_cancel_timeout_orders(url_prefix: str, limit: int = None) -> (int, int):
         json = {}
+        if limit is not None:
+            json["limit"] = limit
         url = urljoin(urljoin(url_prefix, "buyer/"), "auto_cancel_timeout")
         r = requests.post(url, json=json)
         response_json = r.json()
         return r.status_code, response_json.get("cancelled_count", 0)
 
-    def search_books(self, keyword: str, store_id: str = None, page: int = 1) -> (int, dict):
+    def search_books(self, keyword: str, store_id: str = None, page: int = 1, cursor: str = None,
+                     with_total: bool = None, facets: bool = False, fields=None) -> (int, dict):
         json = {
             "keyword": keyword,
             "store_id": store_id,
             "page": page,
         }
+        if cursor is not None:
+            json["cursor"] = cursor
+        if with_total is not None:
+            json["with_total"] = with_total
+        if facets:
+            json["facets"] = True
+        if fields is not None:
+            json["fields"] = fields
         url = urljoin(self.url_prefix, "search_books")
         headers = {"token": self.token}
         r = requests.post(url, headers=headers, json=json)
         response_json = r.json()
         return r.status_code, response_json.get("result", {})
 
-    def search_books_advanced(self, title_prefix: str = None, tags: list = None, store_id: str = None, page: int = 1) -> (int, dict):
+    def search_books_advanced(self, title_prefix: str = None, tags: list = None, store_id: str = None, page: int = 1,
+                              cursor: str = None, with_total: bool = None, facets: bool = False,
+                              fields=None) -> (int, dict):
         json = {
             "title_prefix": title_prefix,
             "tags": tags,
             "store_id": store_id,
             "page": page,
         }
+        if cursor is not None:
+            json["cursor"] = cursor
+        if with_total is not None:
+            json["with_total"] = with_total
+        if facets:
+            json["facets"] = True
+        if fields is not None:
+            json["fields"] = fields
         url = urljoin(self.url_prefix, "search_books_advanced")
         headers = {"token": self.token}
         r = requests.post(url, headers=headers, json=json)
         response_json = r.json()
         return r.status_code, response_json.get("result", {})
 
+    def suggest(self, prefix: str, limit: int = 10) -> (int, dict):
+        json = {
+            "prefix": prefix,
+            "limit": limit,
+        }
+        url = urljoin(self.url_prefix, "suggest")
+        headers = {"token": self.token}
+        r = requests.post(url, headers=headers, json=json)
+        response_json = r.json()
+        return r.status_code, response_json.get("result", {})
+
     def get_book_detail(self, book_id: str) -> (int, dict):
         json = {
             "book_id": book_id,
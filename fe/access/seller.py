@@ -38,6 +38,31 @@ class Seller:
         r = requests.post(url, headers=headers, json=json)
         return r.status_code
 
+    def add_books(self, store_id: str, books: list) -> (int, dict):
+        """books: [(book.Book, stock_level), ...]"""
+        json = {
+            "user_id": self.seller_id,
+            "store_id": store_id,
+            "books": [{"book_info": book_info.__dict__, "stock_level": stock_level}
+                      for book_info, stock_level in books],
+        }
+        url = urljoin(self.url_prefix, "add_books")
+        headers = {"token": self.token}
+        r = requests.post(url, headers=headers, json=json)
+        return r.status_code, r.json().get("result")
+
+    def add_stock_levels(self, store_id: str, items: list) -> (int, dict):
+        """items: [(book_id, add_stock_num), ...]"""
+        json = {
+            "user_id": self.seller_id,
+            "store_id": store_id,
+            "items": [{"book_id": book_id, "add_stock_level": num} for book_id, num in items],
+        }
+        url = urljoin(self.url_prefix, "add_stock_levels")
+        headers = {"token": self.token}
+        r = requests.post(url, headers=headers, json=json)
+        return r.status_code, r.json().get("result")
+
     def add_stock_level(
         self, seller_id: str, store_id: str, book_id: str, add_stock_num: int
     ) -> int:
@@ -237,6 +237,977 @@ def run_snapshot_query_test(use_redundant: bool):
     logging.info(f"  TPS: {tps:.1f}")
 
 
+def run_transaction_mode_comparison():
+    """资金/库存流程对比: 手写补偿 vs 多文档事务"""
+    logging.info("资金/库存流程对比")
+
+    logging.info("1.补偿模式")
+    run_transaction_contention_test(use_transaction=False)
+
+    logging.info("2.事务模式")
+    run_transaction_contention_test(use_transaction=True)
+
+
+def run_transaction_contention_test(use_transaction: bool, thread_num: int = 8, orders_per_thread: int = 100):
+    """并发争用测试: 所有线程共用一个买家与同一本书，payment/cancel/ship/receive 在相同文档上竞争"""
+    import json
+    import threading
+    from be import conf as be_conf
+    from be.model.store import get_db
+    from be.model.user import User
+    from be.model.seller import Seller
+    from be.model.buyer import Buyer
+
+    mode = "事务模式" if use_transaction else "补偿模式"
+    if use_transaction and not get_db().client.admin.command("hello").get("setName"):
+        logging.info(f"{mode}: 当前 MongoDB 不是副本集，无法使用事务，跳过")
+        return
+
+    previous = be_conf.Use_Transaction
+    be_conf.Use_Transaction = use_transaction
+    try:
+        tag = uuid.uuid1()
+        seller_id = f"txn_seller_{tag}"
+        buyer_id = f"txn_buyer_{tag}"
+        store_id = f"txn_store_{tag}"
+        book_id = f"txn_book_{tag}"
+        User().register(seller_id, seller_id)
+        User().register(buyer_id, buyer_id)
+        Seller().create_store(seller_id, store_id)
+        Seller().add_book(seller_id, store_id, book_id, json.dumps({"id": book_id, "price": 1}), 10 ** 9)
+        Buyer().add_funds(buyer_id, buyer_id, 10 ** 9)
+
+        latencies = {"payment": [], "cancel_order": [], "ship_order": [], "receive_order": []}
+        failures = {op: 0 for op in latencies}
+        lock = threading.Lock()
+
+        def timed(op, fn):
+            start_time = time.time()
+            code = fn()[0]
+            elapsed = time.time() - start_time
+            with lock:
+                latencies[op].append(elapsed)
+                if code != 200:
+                    failures[op] += 1
+
+        def worker():
+            buyer = Buyer()
+            seller = Seller()
+            for i in range(orders_per_thread):
+                code, _, order_id = buyer.new_order(buyer_id, store_id, [(book_id, 1)])
+                if code != 200:
+                    continue
+                timed("payment", lambda: buyer.payment(buyer_id, buyer_id, order_id))
+                if i % 2 == 0:
+                    timed("cancel_order", lambda: buyer.cancel_order(buyer_id, order_id))
+                else:
+                    timed("ship_order", lambda: seller.ship_order(seller_id, order_id))
+                    timed("receive_order", lambda: buyer.receive_order(buyer_id, order_id))
+
+        logging.info(f"开始{mode}争用测试: {thread_num} 线程 x {orders_per_thread} 单")
+        workers = [threading.Thread(target=worker) for _ in range(thread_num)]
+        test_start = time.time()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        wall_time = time.time() - test_start
+
+        logging.info(f"{mode}结果:")
+        total_ops = 0
+        for op, values in latencies.items():
+            if not values:
+                continue
+            values.sort()
+            total_ops += len(values)
+            avg_latency = sum(values) / len(values)
+            p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+            logging.info(f"  {op}: 平均延迟={avg_latency:.4f}s P99={p99:.4f}s 失败={failures[op]}")
+        logging.info(f"  吞吐量: {total_ops / wall_time:.1f} ops/s")
+    finally:
+        be_conf.Use_Transaction = previous
+
+
+def run_inventory_layout_comparison():
+    """库存布局对比: Stores.inventory 内嵌数组 vs 独立 Inventory 集合"""
+    logging.info("库存布局对比")
+
+    logging.info("1.内嵌数组布局")
+    run_inventory_contention_test("embedded")
+
+    logging.info("2.独立集合布局")
+    run_inventory_contention_test("collection")
+
+
+def run_inventory_contention_test(layout: str, book_num: int = 2000, thread_num: int = 8, ops_per_thread: int = 500):
+    """同一店铺内并发补货(写)与下单(读)，观察热点店铺文档上的争用"""
+    import json
+    import random
+    import threading
+    from be import conf as be_conf
+    from be.model.user import User
+    from be.model.seller import Seller
+    from be.model.buyer import Buyer
+
+    previous = be_conf.Inventory_Layout
+    be_conf.Inventory_Layout = layout
+    try:
+        tag = uuid.uuid1()
+        seller_id = f"inv_seller_{tag}"
+        buyer_id = f"inv_buyer_{tag}"
+        store_id = f"inv_store_{tag}"
+        User().register(seller_id, seller_id)
+        User().register(buyer_id, buyer_id)
+        seller = Seller()
+        seller.create_store(seller_id, store_id)
+        book_ids = [f"inv_book_{tag}_{i}" for i in range(book_num)]
+        seed_start = time.time()
+        for book_id in book_ids:
+            seller.add_book(seller_id, store_id, book_id, json.dumps({"id": book_id, "price": 1}), 1000)
+        logging.info(f"{layout}: 上架 {book_num} 本书耗时 {time.time() - seed_start:.1f}s")
+
+        latencies = {"add_stock_level": [], "new_order": []}
+        lock = threading.Lock()
+
+        def worker():
+            s, b = Seller(), Buyer()
+            for i in range(ops_per_thread):
+                book_id = random.choice(book_ids)
+                op_start = time.time()
+                if i % 2 == 0:
+                    s.add_stock_level(seller_id, store_id, book_id, 1)
+                    op = "add_stock_level"
+                else:
+                    b.new_order(buyer_id, store_id, [(book_id, 1)])
+                    op = "new_order"
+                elapsed = time.time() - op_start
+                with lock:
+                    latencies[op].append(elapsed)
+
+        workers = [threading.Thread(target=worker) for _ in range(thread_num)]
+        test_start = time.time()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        wall_time = time.time() - test_start
+
+        logging.info(f"{layout} 结果:")
+        for op, values in latencies.items():
+            values.sort()
+            avg_latency = sum(values) / len(values)
+            p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+            logging.info(f"  {op}: 平均延迟={avg_latency:.4f}s P99={p99:.4f}s")
+        logging.info(f"  吞吐量: {thread_num * ops_per_thread / wall_time:.1f} ops/s")
+    finally:
+        be_conf.Inventory_Layout = previous
+
+
+def run_token_cache_comparison(thread_num: int = 8, checks_per_thread: int = 2000):
+    """token 校验缓存对比: 每次查库+JWT解码 vs 进程内 TTL 缓存"""
+    logging.info("token 校验缓存对比")
+
+    logging.info("1.关闭缓存")
+    run_token_check_test(False, thread_num, checks_per_thread)
+
+    logging.info("2.开启缓存")
+    run_token_check_test(True, thread_num, checks_per_thread)
+
+
+def run_token_check_test(use_cache: bool, thread_num: int = 8, checks_per_thread: int = 2000,
+                         auth_mode: str = "session"):
+    """多线程重复校验一批活跃用户的 token，统计延迟、吞吐与缓存命中率"""
+    import random
+    import threading
+    from be import conf as be_conf
+    from be.model import token_auth
+    from be.model import user as user_module
+
+    cache = user_module.token_cache
+    previous_ttl = cache.ttl
+    previous_mode = be_conf.Auth_Mode
+    cache.ttl = previous_ttl if use_cache else 0
+    cache.clear()
+    be_conf.Auth_Mode = auth_mode
+    token_auth.versions.clear()
+    try:
+        tag = uuid.uuid1()
+        sessions = []
+        for i in range(50):
+            user_id = f"token_user_{tag}_{i}"
+            u = user_module.User()
+            u.register(user_id, user_id)
+            _, _, token = u.login(user_id, user_id, f"terminal_{i}")
+            sessions.append((user_id, token))
+
+        latencies = []
+        lock = threading.Lock()
+
+        def worker():
+            u = user_module.User()
+            local = []
+            for _ in range(checks_per_thread):
+                user_id, token = random.choice(sessions)
+                op_start = time.time()
+                u.check_token(user_id, token)
+                local.append(time.time() - op_start)
+            with lock:
+                latencies.extend(local)
+
+        workers = [threading.Thread(target=worker) for _ in range(thread_num)]
+        test_start = time.time()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        wall_time = time.time() - test_start
+
+        latencies.sort()
+        avg_latency = sum(latencies) / len(latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        stats = cache.stats()
+        mode = "stateless" if auth_mode == "stateless" else "缓存" if use_cache else "无缓存"
+        logging.info(f"{mode} 结果:")
+        logging.info(f"  平均延迟={avg_latency * 1000:.3f}ms P99={p99 * 1000:.3f}ms")
+        logging.info(f"  吞吐量: {len(latencies) / wall_time:.1f} checks/s")
+        if auth_mode == "stateless":
+            versions = token_auth.versions
+            logging.info(f"  版本表用户数={len(versions)} 增量刷新={versions.refreshes} 单用户查库={versions.lookups}")
+        else:
+            logging.info(f"  命中={stats['hits']} 未命中={stats['misses']} 命中率={stats['hit_rate']:.2%}")
+    finally:
+        cache.ttl = previous_ttl
+        cache.clear()
+        be_conf.Auth_Mode = previous_mode
+        token_auth.versions.clear()
+
+
+def run_auth_mode_comparison(thread_num: int = 8, checks_per_thread: int = 2000):
+    """认证模式对比: session（查库，无缓存/有缓存）vs stateless（服务端密钥 + 进程内版本表）"""
+    logging.info("认证模式对比")
+
+    logging.info("1.session 无缓存")
+    run_token_check_test(False, thread_num, checks_per_thread)
+
+    logging.info("2.session + 校验缓存")
+    run_token_check_test(True, thread_num, checks_per_thread)
+
+    logging.info("3.stateless")
+    run_token_check_test(False, thread_num, checks_per_thread, auth_mode="stateless")
+
+
+def run_serving_mode_comparison(port: int = 5100, client_threads: int = 32, requests_per_thread: int = 200):
+    """服务模式对比: 单进程单线程 / 单进程线程池 / gunicorn 多进程"""
+    logging.info("服务模式吞吐量对比")
+
+    modes = [
+        ("单进程单线程", 1, 1),
+        ("单进程线程池", 1, 8),
+        ("多进程(4x8)", 4, 8),
+    ]
+    for index, (name, workers, threads) in enumerate(modes, start=1):
+        logging.info(f"{index}.{name}")
+        run_serving_throughput_test(workers, threads, port + index, client_threads, requests_per_thread)
+
+
+def _start_backend(port: int, *args: str):
+    """以子进程启动后端（python -m be.app），轮询 /ready 直到就绪；失败时返回 None"""
+    import subprocess
+    import requests
+
+    server = subprocess.Popen([sys.executable, "-m", "be.app", "--port", str(port), *args], cwd=project_root)
+    deadline = time.time() + 60
+    while True:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/ready", timeout=1).status_code == 200:
+                return server
+        except requests.RequestException:
+            pass
+        if server.poll() is not None or time.time() > deadline:
+            logging.error(f"后端启动失败: {' '.join(args)}")
+            _stop_backend(server)
+            return None
+        time.sleep(0.2)
+
+
+def _stop_backend(server):
+    """SIGTERM 触发优雅退出，超时后强制结束"""
+    import subprocess
+
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def run_serving_throughput_test(workers: int, threads: int, port: int,
+                                client_threads: int = 32, requests_per_thread: int = 200):
+    """以子进程启动后端，多线程通过 HTTP 发起登录与书籍详情请求，统计延迟与吞吐"""
+    import random
+    import threading
+    import requests
+
+    base_url = f"http://127.0.0.1:{port}/"
+    server = _start_backend(port, "--workers", str(workers), "--threads", str(threads))
+    if server is None:
+        return
+    try:
+        tag = uuid.uuid1()
+        user_ids = [f"serve_user_{tag}_{i}" for i in range(20)]
+        for user_id in user_ids:
+            requests.post(base_url + "auth/register", json={"user_id": user_id, "password": user_id})
+
+        latencies = []
+        failures = [0]
+        lock = threading.Lock()
+
+        def worker():
+            local = []
+            local_failures = 0
+            for i in range(requests_per_thread):
+                user_id = random.choice(user_ids)
+                op_start = time.time()
+                if i % 2 == 0:
+                    r = requests.post(base_url + "auth/login",
+                                      json={"user_id": user_id, "password": user_id, "terminal": "bench"})
+                else:
+                    r = requests.post(base_url + "buyer/book_detail", json={"book_id": "bench_missing_book"})
+                local.append(time.time() - op_start)
+                if r.status_code >= 500:
+                    local_failures += 1
+            with lock:
+                latencies.extend(local)
+                failures[0] += local_failures
+
+        clients = [threading.Thread(target=worker) for _ in range(client_threads)]
+        test_start = time.time()
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        wall_time = time.time() - test_start
+
+        latencies.sort()
+        avg_latency = sum(latencies) / len(latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        logging.info(f"workers={workers} threads={threads} 结果:")
+        logging.info(f"  平均延迟={avg_latency * 1000:.2f}ms P99={p99 * 1000:.2f}ms 失败={failures[0]}")
+        logging.info(f"  吞吐量: {len(latencies) / wall_time:.1f} req/s")
+    finally:
+        _stop_backend(server)
+
+
+def run_async_serving_comparison(port: int = 5200, concurrency_levels=(64, 512, 2048), requests_per_level: int = 4096):
+    """WSGI 线程池 vs ASGI 异步驱动: 逐级提高在途请求数，观察吞吐与尾延迟；
+    分别压测 ASGI 原生异步的只读接口与经 WSGI 桥接的写入接口"""
+    logging.info("同步/异步服务并发对比")
+
+    routes = [
+        ("原生异步 /buyer/book_detail", "/buyer/book_detail", {"book_id": "bench_missing_book"}),
+        ("WSGI 桥接 /buyer/add_funds", "/buyer/add_funds",
+         {"user_id": "bench_missing_user", "password": "password", "add_value": 1}),
+    ]
+
+    modes = [
+        ("WSGI 单进程 8 线程", ["--mode", "wsgi", "--threads", "8"]),
+        ("ASGI 单进程", ["--mode", "asgi"]),
+    ]
+    for index, (name, args) in enumerate(modes, start=1):
+        logging.info(f"{index}.{name}")
+        server = _start_backend(port + index, *args)
+        if server is None:
+            continue
+        try:
+            for route_name, path, payload in routes:
+                logging.info(f"  {route_name}")
+                for concurrency in concurrency_levels:
+                    run_http_concurrency_test(port + index, concurrency, requests_per_level, path, payload)
+        finally:
+            _stop_backend(server)
+
+
+def run_http_concurrency_test(port: int, concurrency: int, total_requests: int,
+                              path: str = "/buyer/book_detail", payload: dict = None):
+    """asyncio 原生 HTTP/1.0 客户端，保持 concurrency 个在途的 POST path 请求"""
+    import asyncio
+    import json
+
+    if payload is None:
+        payload = {"book_id": "bench_missing_book"}
+    body = json.dumps(payload).encode()
+    request = (
+        f"POST {path} HTTP/1.0\r\nHost: 127.0.0.1:{port}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    ).encode() + body
+
+    async def one_request(latencies: list, failures: list):
+        op_start = time.time()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(request)
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            status = int(response.split(b" ", 2)[1])
+        except (OSError, ValueError, IndexError):
+            status = 599
+        latencies.append(time.time() - op_start)
+        if status >= 500:
+            failures.append(status)
+
+    async def run_all():
+        latencies, failures = [], []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded():
+            async with semaphore:
+                await one_request(latencies, failures)
+
+        test_start = time.time()
+        await asyncio.gather(*(bounded() for _ in range(total_requests)))
+        return latencies, failures, time.time() - test_start
+
+    latencies, failures, wall_time = asyncio.run(run_all())
+    latencies.sort()
+    avg_latency = sum(latencies) / len(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    logging.info(f"  并发={concurrency}: 平均延迟={avg_latency * 1000:.2f}ms P99={p99 * 1000:.2f}ms "
+                 f"失败={len(failures)} 吞吐量={len(latencies) / wall_time:.1f} req/s")
+
+
+def run_order_pagination_comparison(order_num: int = 20000, pages=(1, 10, 100, 1000), repeats: int = 50):
+    """订单分页对比: 页码分页(skip + count_documents) vs 键集游标分页，考察深翻页的延迟"""
+    from be.model.buyer import Buyer
+    from be.model.store import get_db
+
+    db = get_db()
+    buyer_id = f"pagination_buyer_{uuid.uuid1()}"
+    db["Users"].insert_one({"_id": buyer_id, "password": buyer_id, "balance": 0, "token": "", "terminal": ""})
+    base = time.time()
+    batch = []
+    for i in range(order_num):
+        batch.append({"_id": f"{buyer_id}_{i}", "buyer_id": buyer_id, "store_id": "pagination_store",
+                      "status": "unpaid", "total_amount": 100, "create_time": base - i, "items": []})
+        if len(batch) == 1000:
+            db["Orders"].insert_many(batch)
+            batch = []
+    if batch:
+        db["Orders"].insert_many(batch)
+    logging.info(f"订单分页对比: 单个买家 {order_num} 笔订单，每页 10 条")
+
+    b = Buyer()
+    try:
+        # 顺序翻页一次，记录每页的游标，游标模式直接从对应位置继续
+        cursors = {1: None}
+        _, _, result = b.query_orders(buyer_id, page=1, with_total=False)
+        page = 1
+        while result["pagination"]["next_cursor"] and page < max(pages):
+            page += 1
+            cursors[page] = result["pagination"]["next_cursor"]
+            _, _, result = b.query_orders(buyer_id, cursor=cursors[page])
+
+        for page in pages:
+            if page not in cursors:
+                continue
+            for mode in ("页码分页", "游标分页"):
+                latencies = []
+                for _ in range(repeats):
+                    op_start = time.time()
+                    if mode == "页码分页":
+                        b.query_orders(buyer_id, page=page)
+                    else:
+                        b.query_orders(buyer_id, page=1, cursor=cursors[page])
+                    latencies.append(time.time() - op_start)
+                latencies.sort()
+                avg_latency = sum(latencies) / len(latencies)
+                p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+                logging.info(f"第 {page} 页 {mode}: 平均延迟={avg_latency * 1000:.3f}ms P99={p99 * 1000:.3f}ms")
+    finally:
+        db["Orders"].delete_many({"buyer_id": buyer_id})
+        db["Users"].delete_one({"_id": buyer_id})
+
+
+def run_store_search_comparison(store_sizes=(2000, 50000), repeats: int = 50):
+    """店铺内搜索对比: 读取店铺书目拼 $in 列表 vs Books.store_ids 索引谓词"""
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be.model.buyer import Buyer
+    from be.model.store import get_db
+
+    db = get_db()
+    for size in store_sizes:
+        tag = uuid.uuid1().hex
+        store_id = f"search_store_{tag}"
+        book_ids = [f"search_book_{tag}_{i}" for i in range(size)]
+        for start in range(0, size, 1000):
+            db["Books"].insert_many([{
+                "_id": book_id,
+                "title": f"storebench {tag} {book_id}",
+                "store_ids": [store_id],
+                "search_index": {"title_lower": f"storebench {tag} {book_id}", "tags_lower": ["storebench"]},
+            } for book_id in book_ids[start:start + 1000]])
+        db["Stores"].insert_one({"_id": store_id, "user_id": "search_bench", "inventory": [
+            {"book_id": book_id, "stock_level": 1, "price": 100} for book_id in book_ids
+        ]})
+        logging.info(f"店铺内搜索对比: 店铺书目 {size} 本")
+
+        b = Buyer()
+        try:
+            for store_filter in ("inventory", "store_ids"):
+                with patch.object(be_conf, "Search_Store_Filter", store_filter):
+                    for name, search in (
+                        ("全文", lambda: b.search_books(tag, store_id, with_total=False)),
+                        ("前缀", lambda: b.search_books_advanced(f"storebench {tag}", None, store_id, with_total=False)),
+                    ):
+                        latencies = []
+                        for _ in range(repeats):
+                            op_start = time.time()
+                            code, _, _ = search()
+                            latencies.append(time.time() - op_start)
+                            assert code == 200
+                        latencies.sort()
+                        avg_latency = sum(latencies) / len(latencies)
+                        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+                        logging.info(f"  {store_filter} {name}搜索: 平均延迟={avg_latency * 1000:.3f}ms P99={p99 * 1000:.3f}ms")
+        finally:
+            db["Books"].delete_many({"store_ids": store_id})
+            db["Stores"].delete_one({"_id": store_id})
+
+
+def run_search_backend_comparison(query_num: int = 200, top_n: int = 10):
+    """关键字搜索后端对比: MongoDB $text vs 进程内倒排索引（CJK 二元组 + BM25），统计延迟与召回率"""
+    import random
+    import re
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be.model import search_engine
+    from be.model.buyer import Buyer
+    from be.model.store import get_db
+
+    db = get_db()
+    titles = [doc.get("title") or "" for doc in db["Books"].aggregate([
+        {"$sample": {"size": query_num * 5}}, {"$project": {"title": 1}}])]
+    # 从书名中截取 2~4 个连续汉字作为查询词，模拟用户输入的中文片段
+    queries = []
+    for title in titles:
+        runs = [run for run in re.findall(r"[\u4e00-\u9fff]+", title) if len(run) >= 2]
+        if runs:
+            run = random.choice(runs)
+            length = random.randint(2, min(4, len(run)))
+            start = random.randint(0, len(run) - length)
+            queries.append(run[start:start + length])
+        if len(queries) >= query_num:
+            break
+    if not queries:
+        logging.info("Books 中没有可用的中文书名，跳过")
+        return
+    # 以“书名包含查询词”作为相关性标准（全表正则扫描，不计入延迟）
+    relevant = {q: {doc["_id"] for doc in db["Books"].find({"title": {"$regex": re.escape(q)}}, {"_id": 1})}
+                for q in set(queries)}
+    logging.info(f"关键字搜索后端对比: {len(queries)} 个查询, 召回率按前 {top_n} 条计算")
+
+    start = time.time()
+    build_count = search_engine.book_index.build(db)
+    logging.info(f"倒排索引构建: {build_count} 本书, 用时 {time.time() - start:.2f}s")
+
+    b = Buyer()
+    for backend in ("mongo", "memory"):
+        latencies = []
+        recalls = []
+        with patch.object(be_conf, "Search_Backend", backend):
+            for q in queries:
+                op_start = time.time()
+                code, _, result = b.search_books(q, with_total=False)
+                latencies.append(time.time() - op_start)
+                if code != 200 or not relevant[q]:
+                    continue
+                found = {book["id"] for book in result["books"][:top_n]}
+                recalls.append(len(found & relevant[q]) / min(top_n, len(relevant[q])))
+        latencies.sort()
+        avg_latency = sum(latencies) / len(latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        recall = sum(recalls) / len(recalls) if recalls else 0.0
+        logging.info(f"{backend} 结果:")
+        logging.info(f"  平均延迟={avg_latency * 1000:.3f}ms P99={p99 * 1000:.3f}ms")
+        logging.info(f"  Recall@{top_n}: {recall:.2%}")
+
+
+def run_suggest_latency_test(query_num: int = 20000, limit: int = 10):
+    """输入联想延迟测试: 模拟逐字输入，统计 /buyer/suggest 查询的延迟与索引规模"""
+    import random
+    from be.model import suggest
+    from be.model.store import get_db
+
+    db = get_db()
+    start = time.time()
+    book_count = suggest.suggest_index.build(db)
+    logging.info(f"联想索引构建: {book_count} 本书, {len(suggest.suggest_index)} 个键, 用时 {time.time() - start:.2f}s")
+
+    titles = [doc.get("title") or "" for doc in db["Books"].aggregate([
+        {"$sample": {"size": 500}}, {"$project": {"title": 1}}])]
+    titles = [title for title in titles if title]
+    if not titles:
+        logging.info("Books 为空，跳过")
+        return
+    # 逐字输入：同一书名的 1~6 字前缀依次查询
+    prefixes = []
+    while len(prefixes) < query_num:
+        title = random.choice(titles)
+        prefixes.extend(title[:n] for n in range(1, min(6, len(title)) + 1))
+
+    for name, selector in (("短前缀(<=2字)", lambda p: len(p) <= 2), ("长前缀(>2字)", lambda p: len(p) > 2)):
+        latencies = []
+        for prefix in (p for p in prefixes if selector(p)):
+            op_start = time.perf_counter()
+            suggest.suggest_index.suggest(prefix, limit)
+            latencies.append(time.perf_counter() - op_start)
+        if not latencies:
+            continue
+        latencies.sort()
+        avg_latency = sum(latencies) / len(latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        logging.info(f"{name}: {len(latencies)} 次, 平均延迟={avg_latency * 1e6:.1f}us P99={p99 * 1e6:.1f}us")
+
+
+def run_search_cache_comparison(thread_num: int = 8, queries_per_thread: int = 500, invalidate_ratio: float = 0.01):
+    """搜索结果缓存对比: 热门关键字重复查询，关闭/开启结果缓存，按比例模拟上架导致的版本失效"""
+    logging.info("搜索结果缓存对比")
+
+    logging.info("1.关闭缓存")
+    run_search_cache_test(False, thread_num, queries_per_thread, invalidate_ratio)
+
+    logging.info("2.开启缓存")
+    run_search_cache_test(True, thread_num, queries_per_thread, invalidate_ratio)
+
+
+def run_search_cache_test(use_cache: bool, thread_num: int = 8, queries_per_thread: int = 500,
+                          invalidate_ratio: float = 0.01):
+    """多线程按综合负载的关键字分布搜索，统计命中/未命中延迟、吞吐与命中率"""
+    import random
+    import threading
+    from be.model import search_cache
+    from be.model.buyer import Buyer
+    from be.model.store import get_db
+
+    # 与 enhanced_workload 的 search_basic 相同的关键字表，前 3 页
+    keywords = ['小说', '文学', '历史', '科学', '技术']
+    store_ids = [doc["_id"] for doc in get_db()["Stores"].find({}, {"_id": 1}).limit(20)]
+
+    cache = search_cache.result_cache
+    previous_ttl = cache.ttl
+    cache.ttl = previous_ttl if use_cache else 0
+    cache.clear()
+    try:
+        latencies = {"hit": [], "miss": []}
+        lock = threading.Lock()
+
+        def worker():
+            b = Buyer()
+            local = {"hit": [], "miss": []}
+            for _ in range(queries_per_thread):
+                if store_ids and random.random() < invalidate_ratio:
+                    search_cache.bump(random.choice(store_ids))
+                hits_before = cache.hits
+                op_start = time.time()
+                b.search_books(random.choice(keywords), page=random.randint(1, 3))
+                elapsed = time.time() - op_start
+                # 多线程下按计数差判定命中仅为近似，足够区分两类延迟分布
+                local["hit" if cache.hits > hits_before else "miss"].append(elapsed)
+            with lock:
+                for kind in local:
+                    latencies[kind].extend(local[kind])
+
+        workers = [threading.Thread(target=worker) for _ in range(thread_num)]
+        test_start = time.time()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        wall_time = time.time() - test_start
+
+        mode = "缓存" if use_cache else "无缓存"
+        logging.info(f"{mode} 结果:")
+        all_latencies = sorted(latencies["hit"] + latencies["miss"])
+        for kind, values in (("全部", all_latencies), ("命中", latencies["hit"]), ("未命中", latencies["miss"])):
+            if not values:
+                continue
+            values = sorted(values)
+            avg_latency = sum(values) / len(values)
+            p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+            logging.info(f"  {kind}: {len(values)} 次 平均延迟={avg_latency * 1000:.3f}ms P99={p99 * 1000:.3f}ms")
+        logging.info(f"  吞吐量: {len(all_latencies) / wall_time:.1f} queries/s")
+        stats = cache.stats()
+        logging.info(f"  命中={stats['hits']} 未命中={stats['misses']} 命中率={stats['hit_rate']:.2%} 条目={stats['size']}")
+    finally:
+        cache.ttl = previous_ttl
+        cache.clear()
+
+
+def run_search_payload_comparison(query_num: int = 200):
+    """搜索结果负载对比: 读取整篇 Books 文档 vs 按 full/card 视图投影，统计每次响应的读取字节、响应字节与编码耗时"""
+    import json
+    import random
+    import bson
+    from be.model import search_cache
+    from be.model.buyer import Buyer
+    from be.model.store import get_db
+
+    db = get_db()
+    keywords = ['小说', '文学', '历史', '科学', '技术']
+    queries = [(random.choice(keywords), random.randint(1, 3)) for _ in range(query_num)]
+    page_size = Buyer.SEARCH_PAGE_SIZE
+    logging.info(f"搜索结果负载对比: {query_num} 个查询")
+
+    cache = search_cache.result_cache
+    previous_ttl = cache.ttl
+    cache.ttl = 0
+    try:
+        # 改造前：$text 命中后读取整篇文档（含 content、author_intro、pictures）
+        db_bytes = []
+        latencies = []
+        for keyword, page in queries:
+            op_start = time.time()
+            docs = list(db["Books"].find({"$text": {"$search": keyword}}, {"score": {"$meta": "textScore"}})
+                        .sort([("score", {"$meta": "textScore"}), ("_id", 1)])
+                        .skip((page - 1) * page_size).limit(page_size + 1))
+            latencies.append(time.time() - op_start)
+            db_bytes.append(sum(len(bson.encode(doc)) for doc in docs))
+        _log_payload_stats("无投影(整篇文档)", latencies, db_bytes)
+
+        b = Buyer()
+        for view in ("full", "card"):
+            projection = b._search_projection(Buyer.SEARCH_VIEWS[view], [("score", -1), ("_id", 1)])
+            projection["score"] = {"$meta": "textScore"}
+            db_bytes = []
+            response_bytes = []
+            encode_times = []
+            latencies = []
+            for keyword, page in queries:
+                docs = db["Books"].find({"$text": {"$search": keyword}}, projection) \
+                    .sort([("score", {"$meta": "textScore"}), ("_id", 1)]) \
+                    .skip((page - 1) * page_size).limit(page_size + 1)
+                db_bytes.append(sum(len(bson.encode(doc)) for doc in docs))
+
+                op_start = time.time()
+                code, _, result = b.search_books(keyword, page=page, with_total=False, fields=view)
+                latencies.append(time.time() - op_start)
+                encode_start = time.time()
+                body = json.dumps({"message": "ok", "result": result}).encode("utf-8")
+                encode_times.append(time.time() - encode_start)
+                response_bytes.append(len(body))
+            _log_payload_stats(f"{view} 视图", latencies, db_bytes, response_bytes, encode_times)
+    finally:
+        cache.ttl = previous_ttl
+        cache.clear()
+
+
+def _log_payload_stats(mode: str, latencies: list, db_bytes: list, response_bytes: list = None,
+                       encode_times: list = None):
+    latencies = sorted(latencies)
+    avg_latency = sum(latencies) / len(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    logging.info(f"{mode} 结果:")
+    logging.info(f"  平均延迟={avg_latency * 1000:.3f}ms P99={p99 * 1000:.3f}ms")
+    logging.info(f"  Mongo->应用 字节/响应: {sum(db_bytes) / len(db_bytes):.0f}B")
+    if response_bytes:
+        logging.info(f"  响应 JSON 字节/响应: {sum(response_bytes) / len(response_bytes):.0f}B "
+                     f"编码耗时={sum(encode_times) / len(encode_times) * 1e6:.1f}us")
+
+
+def run_balance_mode_comparison(buyer_num: int = 32, orders_per_buyer: int = 50):
+    """余额记账对比: 直接 $inc 卖家余额 vs 追加 Ledger 流水（多个买家向同一卖家付款）"""
+    logging.info("余额记账对比")
+
+    logging.info("1.直接 $inc")
+    run_balance_contention_test("direct", buyer_num, orders_per_buyer)
+
+    logging.info("2.流水组提交")
+    run_balance_contention_test("ledger", buyer_num, orders_per_buyer)
+
+
+def run_balance_contention_test(mode: str, buyer_num: int = 32, orders_per_buyer: int = 50):
+    """每个线程一个买家，payment → ship → receive 全部给同一个卖家入账；结束后物化并核对卖家余额"""
+    import json
+    import threading
+    from be import conf as be_conf
+    from be.model import ledger
+    from be.model.store import get_db
+    from be.model.user import User
+    from be.model.seller import Seller
+    from be.model.buyer import Buyer
+
+    previous = be_conf.Balance_Mode
+    be_conf.Balance_Mode = mode
+    try:
+        tag = uuid.uuid1()
+        seller_id = f"ledger_seller_{tag}"
+        store_id = f"ledger_store_{tag}"
+        book_id = f"ledger_book_{tag}"
+        User().register(seller_id, seller_id)
+        Seller().create_store(seller_id, store_id)
+        Seller().add_book(seller_id, store_id, book_id, json.dumps({"id": book_id, "price": 1}), 10 ** 9)
+        buyer_ids = [f"ledger_buyer_{tag}_{i}" for i in range(buyer_num)]
+        for buyer_id in buyer_ids:
+            User().register(buyer_id, buyer_id)
+            Buyer().add_funds(buyer_id, buyer_id, orders_per_buyer)
+
+        latencies = {"payment": [], "receive_order": []}
+        failures = {op: 0 for op in latencies}
+        lock = threading.Lock()
+        flushes_before = ledger.writer.flushes
+
+        def timed(op, fn):
+            start_time = time.time()
+            code = fn()[0]
+            elapsed = time.time() - start_time
+            with lock:
+                latencies[op].append(elapsed)
+                if code != 200:
+                    failures[op] += 1
+
+        def worker(buyer_id):
+            buyer = Buyer()
+            seller = Seller()
+            for _ in range(orders_per_buyer):
+                code, _, order_id = buyer.new_order(buyer_id, store_id, [(book_id, 1)])
+                if code != 200:
+                    continue
+                timed("payment", lambda: buyer.payment(buyer_id, buyer_id, order_id))
+                seller.ship_order(seller_id, order_id)
+                timed("receive_order", lambda: buyer.receive_order(buyer_id, order_id))
+
+        logging.info(f"开始 {mode} 模式测试: {buyer_num} 个买家 x {orders_per_buyer} 单，同一卖家入账")
+        workers = [threading.Thread(target=worker, args=(buyer_id,)) for buyer_id in buyer_ids]
+        test_start = time.time()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        wall_time = time.time() - test_start
+
+        materialize_start = time.time()
+        if mode == "ledger":
+            # 单批流水条数有上限，物化到没有待入账流水为止
+            while ledger.materialize(Seller(), seller_id):
+                pass
+        materialize_time = time.time() - materialize_start
+        balance = get_db()["Users"].find_one({"_id": seller_id}, {"balance": 1})["balance"]
+        expected = len(latencies["receive_order"]) - failures["receive_order"]
+
+        logging.info(f"{mode} 模式结果:")
+        total_ops = 0
+        for op, values in latencies.items():
+            if not values:
+                continue
+            values.sort()
+            total_ops += len(values)
+            avg_latency = sum(values) / len(values)
+            p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+            logging.info(f"  {op}: 平均延迟={avg_latency:.4f}s P99={p99:.4f}s 失败={failures[op]}")
+        logging.info(f"  吞吐量: {total_ops / wall_time:.1f} ops/s")
+        if mode == "ledger":
+            flushes = ledger.writer.flushes - flushes_before
+            logging.info(f"  insert_many 次数={flushes} 平均每批流水={expected / flushes if flushes else 0:.1f} "
+                         f"收尾物化耗时={materialize_time * 1000:.1f}ms")
+        logging.info(f"  卖家余额={balance} 预期={expected} {'一致' if balance == expected else '不一致'}")
+    finally:
+        be_conf.Balance_Mode = previous
+
+
+def run_password_kdf_comparison(thread_num: int = 8, ops_per_thread: int = 100):
+    """密码哈希对比: 明文 vs PBKDF2 vs scrypt（无缓存）vs scrypt + 校验缓存，统计登录与支付吞吐"""
+    logging.info("密码哈希对比")
+    modes = [
+        ("明文", "plaintext", False),
+        ("PBKDF2", "pbkdf2_sha256", False),
+        ("scrypt", "scrypt", False),
+        ("scrypt + 校验缓存", "scrypt", True),
+    ]
+    for i, (name, kdf, use_cache) in enumerate(modes, 1):
+        logging.info(f"{i}.{name}")
+        run_password_kdf_test(kdf, use_cache, thread_num, ops_per_thread)
+
+
+def run_password_kdf_test(kdf: str, use_cache: bool, thread_num: int = 8, ops_per_thread: int = 100):
+    """每个线程一个买家：先重复登录，再逐单 new_order → payment（只计 payment 耗时）"""
+    import json
+    import threading
+    from be import conf as be_conf
+    from be.model import password_hash
+    from be.model.store import get_db
+    from be.model.user import User
+    from be.model.seller import Seller
+    from be.model.buyer import Buyer
+
+    cache = password_hash.verified_cache
+    previous = (be_conf.Password_KDF, be_conf.Password_Rehash_On_Login, cache.ttl)
+    if kdf != "plaintext":
+        be_conf.Password_KDF = kdf
+    # 明文基线：保持旧记录不被登录改写
+    be_conf.Password_Rehash_On_Login = kdf != "plaintext"
+    cache.ttl = previous[2] if use_cache else 0
+    cache.clear()
+    try:
+        tag = uuid.uuid1()
+        seller_id = f"kdf_seller_{tag}"
+        store_id = f"kdf_store_{tag}"
+        book_id = f"kdf_book_{tag}"
+        User().register(seller_id, seller_id)
+        Seller().create_store(seller_id, store_id)
+        Seller().add_book(seller_id, store_id, book_id, json.dumps({"id": book_id, "price": 1}), 10 ** 9)
+        buyer_ids = [f"kdf_buyer_{tag}_{i}" for i in range(thread_num)]
+        for buyer_id in buyer_ids:
+            User().register(buyer_id, buyer_id)
+            if kdf == "plaintext":
+                get_db()["Users"].update_one({"_id": buyer_id}, {"$set": {"password": buyer_id}})
+            Buyer().add_funds(buyer_id, buyer_id, ops_per_thread)
+
+        latencies = {"login": [], "payment": []}
+        failures = {op: 0 for op in latencies}
+        lock = threading.Lock()
+
+        def timed(op, fn):
+            start_time = time.time()
+            code = fn()[0]
+            elapsed = time.time() - start_time
+            with lock:
+                latencies[op].append(elapsed)
+                if code != 200:
+                    failures[op] += 1
+
+        def worker(buyer_id):
+            user = User()
+            buyer = Buyer()
+            for i in range(ops_per_thread):
+                timed("login", lambda: user.login(buyer_id, buyer_id, f"terminal_{i}"))
+            for _ in range(ops_per_thread):
+                code, _, order_id = buyer.new_order(buyer_id, store_id, [(book_id, 1)])
+                if code == 200:
+                    timed("payment", lambda: buyer.payment(buyer_id, buyer_id, order_id))
+
+        workers = [threading.Thread(target=worker, args=(buyer_id,)) for buyer_id in buyer_ids]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+
+        stats = cache.stats()
+        for op, values in latencies.items():
+            if not values:
+                continue
+            values.sort()
+            avg_latency = sum(values) / len(values)
+            p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+            # 各线程串行执行同一操作，按平均延迟折算总吞吐
+            logging.info(f"  {op}: 平均延迟={avg_latency * 1000:.2f}ms P99={p99 * 1000:.2f}ms "
+                         f"吞吐量={thread_num / avg_latency:.1f} TPS 失败={failures[op]}")
+        logging.info(f"  校验缓存 命中={stats['hits']} 未命中={stats['misses']}")
+    finally:
+        be_conf.Password_KDF, be_conf.Password_Rehash_On_Login, cache.ttl = previous
+        cache.clear()
+
+
 if __name__ == "__main__":
     logging.basicConfig(
         level=logging.INFO,
@@ -249,8 +1220,22 @@ if __name__ == "__main__":
     print("2.书籍搜索索引对比")
     print("3.订单索引查询对比")
     print("4.订单快照查询对比")
+    print("5.补偿/事务模式对比")
+    print("6.库存布局对比")
+    print("7.token校验缓存对比")
+    print("8.服务模式吞吐量对比")
+    print("9.同步/异步服务并发对比")
+    print("10.订单分页对比")
+    print("11.店铺内搜索对比")
+    print("12.关键字搜索后端对比")
+    print("13.输入联想延迟测试")
+    print("14.搜索结果缓存对比")
+    print("15.搜索结果负载对比")
+    print("16.余额记账对比")
+    print("17.密码哈希对比")
+    print("18.认证模式对比")
     
-    choice = input("选择(1-4):").strip()
+    choice = input("选择(1-18):").strip()
     
     if choice == "1":
         run_enhanced_bench()
@@ -260,6 +1245,34 @@ if __name__ == "__main__":
         run_order_index_query_comparison()
     elif choice == "4":
         run_order_snapshot_query_comparison()
+    elif choice == "5":
+        run_transaction_mode_comparison()
+    elif choice == "6":
+        run_inventory_layout_comparison()
+    elif choice == "7":
+        run_token_cache_comparison()
+    elif choice == "8":
+        run_serving_mode_comparison()
+    elif choice == "9":
+        run_async_serving_comparison()
+    elif choice == "10":
+        run_order_pagination_comparison()
+    elif choice == "11":
+        run_store_search_comparison()
+    elif choice == "12":
+        run_search_backend_comparison()
+    elif choice == "13":
+        run_suggest_latency_test()
+    elif choice == "14":
+        run_search_cache_comparison()
+    elif choice == "15":
+        run_search_payload_comparison()
+    elif choice == "16":
+        run_balance_mode_comparison()
+    elif choice == "17":
+        run_password_kdf_comparison()
+    elif choice == "18":
+        run_auth_mode_comparison()
     else:
         print("默认运行综合测试")
         run_enhanced_bench()
\ No newline at end of file
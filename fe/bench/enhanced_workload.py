@@ -10,6 +10,9 @@ import uuid
 import random
 import threading
 import time
+from urllib.parse import urljoin
+
+import requests
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.join(current_dir, '..', '..')
@@ -421,6 +424,7 @@ class EnhancedWorkload:
             'add_funds': {'count': 0, 'success': 0, 'time': 0},
         }
         self.lock = threading.Lock()
+        self.cache_stats_before = None
 
     def gen_database(self):
         """生成测试数据"""
@@ -442,10 +446,10 @@ class EnhancedWorkload:
                     books = self.book_db.get_book_info(row_no, self.batch_size)
                     if len(books) == 0:
                         break
-                    for bk in books:
-                        code = seller.add_book(store_id, self.stock_level, bk)
-                        assert code == 200
-                        self.book_ids[store_id].append(bk.id)
+                    # 每批一次 /seller/add_books 请求，服务端一次 bulk_write 写入
+                    code, result = seller.add_books(store_id, [(bk, self.stock_level) for bk in books])
+                    assert code == 200 and not result["errors"], result
+                    self.book_ids[store_id].extend(bk.id for bk in books)
                     row_no += len(books)
         
         for k in range(1, self.buyer_num + 1):
@@ -454,8 +458,19 @@ class EnhancedWorkload:
             buyer.add_funds(self.user_funds)
             self.buyer_ids.append(user_id)
         
+        # 服务端计数是累计值：记下压测开始前的快照，统计时取差值
+        self.cache_stats_before = self.fetch_search_cache_stats()
         logging.info("数据加载完成")
 
+    @staticmethod
+    def fetch_search_cache_stats():
+        """读取服务端（/search_cache_stats）的搜索结果缓存计数；服务端不可达时返回 None"""
+        try:
+            r = requests.get(urljoin(conf.URL, "search_cache_stats"), timeout=5)
+            return r.json() if r.status_code == 200 else None
+        except requests.RequestException:
+            return None
+
     def to_seller_id_and_password(self, no: int) -> (str, str):
         return f"seller_{no}_{self.uuid}", f"password_seller_{no}_{self.uuid}"
 
@@ -671,3 +686,12 @@ class EnhancedWorkload:
                     avg_latency = stat['time'] / stat['count']
                     tps = stat['success'] / stat['time'] if stat['time'] > 0 else 0
                     logging.info(f"{op_type}: 成功率={success_rate:.1f}% 延迟={avg_latency:.3f}s TPS={tps:.1f}")
+            # 附带服务端搜索结果缓存在本次压测期间的命中情况
+            cache_stats = self.fetch_search_cache_stats()
+            if cache_stats is not None:
+                before = self.cache_stats_before or {"hits": 0, "misses": 0}
+                hits = cache_stats["hits"] - before["hits"]
+                misses = cache_stats["misses"] - before["misses"]
+                if hits + misses > 0:
+                    logging.info(f"搜索结果缓存: 命中率={hits / (hits + misses):.2%} "
+                                 f"命中={hits} 未命中={misses} 条目={cache_stats['size']}")
@@ -2,7 +2,6 @@ import requests
 import threading
 from urllib.parse import urljoin
 from be import serve
-from be.model.store import init_completed_event
 from fe import conf
 
 thread: threading.Thread = None
@@ -20,7 +19,8 @@ def pytest_configure(config):
     # Run backend in a daemon thread to avoid teardown hang
     thread = threading.Thread(target=run_backend, daemon=True)
     thread.start()
-    init_completed_event.wait()
+    # 等待数据库初始化完成且端口开始监听
+    serve.server_ready.wait()
 
 
 def pytest_unconfigure(config):
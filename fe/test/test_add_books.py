@@ -0,0 +1,61 @@
+import pytest
+
+from fe import conf
+from fe.access.new_seller import register_new_seller
+from fe.access import book
+import uuid
+
+
+class TestAddBooks:
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self):
+        self.seller_id = "test_add_books_bulk_seller_id_{}".format(str(uuid.uuid1()))
+        self.store_id = "test_add_books_bulk_store_id_{}".format(str(uuid.uuid1()))
+        self.password = self.seller_id
+        self.seller = register_new_seller(self.seller_id, self.password)
+
+        code = self.seller.create_store(self.store_id)
+        assert code == 200
+        book_db = book.BookDB(conf.Use_Large_DB)
+        self.books = book_db.get_book_info(0, 3)
+        yield
+
+    def test_ok(self):
+        code, result = self.seller.add_books(self.store_id, [(b, 5) for b in self.books])
+        assert code == 200
+        assert result["added"] == len(self.books) and result["errors"] == []
+
+        code, result = self.seller.add_stock_levels(self.store_id, [(b.id, 2) for b in self.books])
+        assert code == 200
+        assert result["updated"] == len(self.books) and result["errors"] == []
+
+    def test_per_item_errors(self):
+        code = self.seller.add_book(self.store_id, 0, self.books[0])
+        assert code == 200
+
+        code, result = self.seller.add_books(self.store_id, [(b, 1) for b in self.books])
+        assert code == 200
+        assert result["added"] == len(self.books) - 1
+        assert [(e["index"], e["book_id"]) for e in result["errors"]] == [(0, self.books[0].id)]
+        assert result["errors"][0]["code"] != 200
+
+        code, result = self.seller.add_stock_levels(
+            self.store_id, [(self.books[1].id, 1), (self.books[1].id + "_x", 1)])
+        assert code == 200
+        assert result["updated"] == 1
+        assert [e["index"] for e in result["errors"]] == [1]
+
+    def test_error_non_exist_store_id(self):
+        code, _ = self.seller.add_books(self.store_id + "x", [(b, 0) for b in self.books])
+        assert code != 200
+        code, _ = self.seller.add_stock_levels(self.store_id + "x", [(b.id, 1) for b in self.books])
+        assert code != 200
+
+    def test_error_non_exist_user_id(self):
+        self.seller.seller_id = self.seller.seller_id + "_x"
+        code, _ = self.seller.add_books(self.store_id, [(b, 0) for b in self.books])
+        assert code != 200
+
+    def test_error_empty(self):
+        code, _ = self.seller.add_books(self.store_id, [])
+        assert code != 200
@@ -73,6 +73,32 @@ class TestCancelOrder:
         balance_after_cancel = user_doc.get("balance", 0)
         assert balance_after_cancel == balance_before_cancel + self.total_price
 
+    def test_cancel_releases_reserved_stock(self):
+        db = get_db()
+        order_doc = db["Orders"].find_one({"_id": self.order_id})
+        if not order_doc.get("stock_reserved"):
+            pytest.skip("stock reservation disabled")
+
+        def stock_levels():
+            levels = {}
+            for item in order_doc["items"]:
+                store_doc = db["Stores"].find_one(
+                    {"_id": self.store_id, "inventory": {"$elemMatch": {"book_id": item["book_id"]}}},
+                    {"inventory.$": 1}
+                )
+                levels[item["book_id"]] = store_doc["inventory"][0].get("stock_level", 0)
+            return levels
+
+        before_cancel = stock_levels()
+        code = self.buyer.cancel_order(self.order_id)
+        assert code == 200
+
+        # 取消后预占的库存全部归还
+        after_cancel = stock_levels()
+        for item in order_doc["items"]:
+            before_cancel[item["book_id"]] += item["quantity"]
+        assert after_cancel == before_cancel
+
     def test_cancel_shipped_order(self):
         code = self.buyer.add_funds(self.total_price)
         assert code == 200
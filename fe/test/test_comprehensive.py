@@ -1,4 +1,5 @@
 import json
+import math
 import copy
 import time
 from contextlib import contextmanager
@@ -8,6 +9,8 @@ from pymongo import ReturnDocument
 from pymongo import errors as pymongo_errors
 
 from be.model import error
+from be.model import pagination
+from be.model import search_cache
 from be.model.seller import Seller
 from be.model.buyer import Buyer
 from be.model import store as store_module
@@ -32,16 +35,25 @@ class FakeCursor:
                     # 文本搜索的 score 排序，这里不做特殊处理
                     continue
                 reverse = order == -1
-                self._documents.sort(key=lambda d: d.get(field), reverse=reverse)
+                self._documents.sort(key=lambda d: self._value(d, field), reverse=reverse)
         else:
             reverse = direction == -1
             self._documents.sort(key=lambda d: d.get(key), reverse=reverse)
         return self
 
+    @staticmethod
+    def _value(doc, field):
+        for part in field.split("."):
+            doc = doc.get(part) if isinstance(doc, dict) else None
+        return doc
+
     def skip(self, count: int):
         self._documents = self._documents[count:]
         return self
 
+    def batch_size(self, count: int):
+        return self
+
     def limit(self, count: int):
         if count:
             self._documents = self._documents[:count]
@@ -52,15 +64,52 @@ class FakeCursor:
             yield copy.deepcopy(doc)
 
 
+def fake_bulk_write(collection, requests, ordered=True):
+    """逐条回放 UpdateOne 请求，并记录往返次数供用例断言“一次写入”。"""
+    collection.bulk_writes = getattr(collection, "bulk_writes", 0) + 1
+    for op in requests:
+        kwargs = {"upsert": True} if op._upsert else {}
+        collection.update_one(op._filter, op._doc, **kwargs)
+
+
 class UsersCollection:
     def __init__(self, documents):
         self.documents = {doc["_id"]: copy.deepcopy(doc) for doc in documents}
 
-    def find_one(self, query):
+    def find_one(self, query, projection=None):
         user_id = query.get("_id")
         doc = self.documents.get(user_id)
         return copy.deepcopy(doc) if doc is not None else None
 
+    def insert_one(self, document):
+        if document["_id"] in self.documents:
+            raise pymongo_errors.DuplicateKeyError("duplicate user")
+        self.documents[document["_id"]] = copy.deepcopy(document)
+
+    def delete_one(self, query):
+        self.documents.pop(query.get("_id"), None)
+
+    def find(self, query, projection=None):
+        cond = query.get("token_version", {})
+        stale = query.get("ledger_batch_at", {})
+        return FakeCursor([copy.deepcopy(doc) for doc in self.documents.values()
+                           if ("$gte" not in cond or doc.get("token_version", 0) >= cond["$gte"])
+                           and ("$lt" not in stale or doc.get("ledger_batch_at", math.inf) < stale["$lt"])])
+
+    @staticmethod
+    def _batch_match(doc, query):
+        # 余额流水物化的批次记录条件：等值或 $exists
+        for field in ("ledger_batch", "ledger_batch_ids"):
+            if field not in query:
+                continue
+            cond = query[field]
+            if isinstance(cond, dict):
+                if (field in doc) != cond["$exists"]:
+                    return False
+            elif doc.get(field) != cond:
+                return False
+        return True
+
     def update_one(self, query, update):
         user_id = query.get("_id")
         doc = self.documents.get(user_id)
@@ -71,6 +120,10 @@ class UsersCollection:
         if isinstance(balance_cond, dict) and "$gte" in balance_cond:
             if doc.get("balance", 0) < balance_cond["$gte"]:
                 return FakeUpdateResult(0, 0)
+        if not self._batch_match(doc, query):
+            return FakeUpdateResult(0, 0)
+        if "password" in query and doc.get("password") != query["password"]:
+            return FakeUpdateResult(0, 0)
 
         modified = False
         if "$inc" in update:
@@ -78,6 +131,17 @@ class UsersCollection:
                 doc[field] = doc.get(field, 0) + delta
                 modified = True
 
+        if "$push" in update:
+            for field, value in update["$push"].items():
+                doc[field] = (doc.get(field, []) + value["$each"])[value["$slice"]:]
+                modified = True
+
+        if "$max" in update:
+            for field, value in update["$max"].items():
+                if field not in doc or value > doc[field]:
+                    doc[field] = value
+                    modified = True
+
         if "$set" in update:
             for field, value in update["$set"].items():
                 doc[field] = value
@@ -122,9 +186,25 @@ class StoresCollection:
 
         return copy.deepcopy(store)
 
+    def find(self, query, projection=None):
+        # 仅模拟 list_book_ids 的按 _id 查询
+        store = self.find_one(query, projection)
+        return FakeCursor([store] if store is not None else [])
+
     def insert_one(self, document):
         self.documents[document["_id"]] = copy.deepcopy(document)
 
+    def aggregate(self, pipeline):
+        # 仅模拟 new_order 使用的 $match(_id) + $project($filter inventory) 管道
+        store_id = pipeline[0]["$match"]["_id"]
+        store = self.documents.get(store_id)
+        if store is None:
+            return iter([])
+        cond = pipeline[1]["$project"]["inventory"]["$filter"]["cond"]["$in"]
+        wanted = cond[1]
+        items = [copy.deepcopy(item) for item in store.get("inventory", []) if item.get("book_id") in wanted]
+        return iter([{"inventory": items}])
+
     def update_one(self, query, update):
         store_id = query.get("_id")
         store = self.documents.get(store_id)
@@ -141,6 +221,18 @@ class StoresCollection:
             if inventory_item is None:
                 return FakeUpdateResult(0, 0)
 
+        elem_match = (query.get("inventory") or {}).get("$elemMatch")
+        if elem_match is not None:
+            # 模拟预占库存的 {"book_id", "stock_level": {"$gte"}} 条件
+            for item in store.get("inventory", []):
+                if item.get("book_id") != elem_match.get("book_id"):
+                    continue
+                if item.get("stock_level", 0) >= elem_match.get("stock_level", {}).get("$gte", 0):
+                    inventory_item = item
+                break
+            if inventory_item is None:
+                return FakeUpdateResult(0, 0)
+
         stock_filter = query.get("inventory.stock_level")
         if isinstance(stock_filter, dict) and inventory_item is not None:
             if inventory_item.get("stock_level", 0) < stock_filter.get("$gte", 0):
@@ -149,7 +241,8 @@ class StoresCollection:
         modified = False
         if "$push" in update:
             for field, value in update["$push"].items():
-                store.setdefault(field, []).append(copy.deepcopy(value))
+                values = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                store.setdefault(field, []).extend(copy.deepcopy(values))
                 modified = True
 
         if "$inc" in update:
@@ -173,12 +266,14 @@ class StoresCollection:
 
         return FakeUpdateResult(1, 1 if modified else 0)
 
+    bulk_write = fake_bulk_write
+
 
 class OrdersCollection:
     def __init__(self, documents):
         self.documents = {doc["_id"]: copy.deepcopy(doc) for doc in documents}
 
-    def find_one(self, query):
+    def find_one(self, query, projection=None):
         for order in self.documents.values():
             if all(order.get(k) == v for k, v in query.items()):
                 return copy.deepcopy(order)
@@ -202,6 +297,14 @@ class OrdersCollection:
                 return FakeUpdateResult(1, 1 if modified else 0)
         return FakeUpdateResult(0, 0)
 
+    def update_many(self, query, update):
+        matched = [order for order in self.documents.values() if self._match(order, query)]
+        for order in matched:
+            order.update(copy.deepcopy(update.get("$set", {})))
+            for field in update.get("$unset", {}):
+                order.pop(field, None)
+        return FakeUpdateResult(len(matched), len(matched))
+
     def find_one_and_update(self, query, update, return_document=None):
         for order_id, order in self.documents.items():
             if all(order.get(k) == v for k, v in query.items() if not isinstance(v, dict)):
@@ -225,18 +328,43 @@ class OrdersCollection:
 
     def _filter(self, query):
         for order in self.documents.values():
-            match = True
-            for key, value in query.items():
-                if isinstance(value, dict) and "$lt" in value:
-                    if not order.get(key, 0) < value["$lt"]:
-                        match = False
-                        break
-                elif order.get(key) != value:
-                    match = False
-                    break
-            if match:
+            if self._match(order, query):
                 yield copy.deepcopy(order)
 
+    def _match(self, order, query):
+        for key, value in query.items():
+            if key == "$or":
+                if not any(self._match(order, branch) for branch in value):
+                    return False
+            elif isinstance(value, dict) and "$lt" in value:
+                if key not in order or not order[key] < value["$lt"]:
+                    return False
+            elif isinstance(value, dict) and "$gte" in value:
+                if key not in order or not order[key] >= value["$gte"]:
+                    return False
+            elif isinstance(value, dict) and "$in" in value:
+                if order.get(key) not in value["$in"]:
+                    return False
+            elif order.get(key) != value:
+                return False
+        return True
+
+    def aggregate(self, pipeline, **kwargs):
+        # 仅支持热度统计用到的 $match / $unwind:"$items" / $group 按 items.book_id 求和
+        docs = list(self.documents.values())
+        for stage in pipeline:
+            if "$match" in stage:
+                docs = [doc for doc in docs if self._match(doc, stage["$match"])]
+            elif "$unwind" in stage:
+                docs = [dict(doc, items=item) for doc in docs for item in doc.get("items", [])]
+            elif "$group" in stage:
+                groups = {}
+                for doc in docs:
+                    book_id = doc["items"]["book_id"]
+                    groups[book_id] = groups.get(book_id, 0) + doc["items"]["quantity"]
+                docs = [{"_id": book_id, "sold": total} for book_id, total in groups.items()]
+        return iter(docs)
+
 
 class BooksCollection:
     def __init__(self, documents):
@@ -246,8 +374,25 @@ class BooksCollection:
         doc = self.documents.get(query.get("_id"))
         return copy.deepcopy(doc) if doc else None
 
-    def count_documents(self, query):
-        return len(list(self._filter(query)))
+    def update_one(self, query, update, upsert=False):
+        doc = self.documents.get(query.get("_id"))
+        if doc is None:
+            if not upsert:
+                return FakeUpdateResult(0, 0)
+            doc = self.documents[query["_id"]] = {"_id": query["_id"]}
+            doc.update(copy.deepcopy(update.get("$setOnInsert", {})))
+        for field, value in update.get("$addToSet", {}).items():
+            values = doc.setdefault(field, [])
+            for item in value["$each"] if isinstance(value, dict) and "$each" in value else [value]:
+                if item not in values:
+                    values.append(item)
+        return FakeUpdateResult(1, 1)
+
+    bulk_write = fake_bulk_write
+
+    def count_documents(self, query, limit=None):
+        count = len(list(self._filter(query)))
+        return min(count, limit) if limit else count
 
     def find(self, query, projection=None):
         docs = list(self._filter(query))
@@ -257,11 +402,49 @@ class BooksCollection:
                 doc["score"] = 1.0
         return FakeCursor(docs)
 
-    def _filter(self, query):
-        if not query:
-            yield from []
-            return
+    def aggregate(self, pipeline):
+        # 仅支持搜索用到的 $match / $addFields(textScore) / $sort / $skip / $limit，
+        # 以及分面用到的 $facet / $unwind / $group(计数) / $count
+        return iter(self._run_pipeline(None, pipeline))
+
+    def _run_pipeline(self, docs, pipeline):
+        for stage in pipeline:
+            if "$match" in stage:
+                if docs is None:
+                    docs = list(self._filter(stage["$match"]))
+                else:
+                    docs = [doc for doc in docs if self._matches(doc, stage["$match"])]
+            elif "$addFields" in stage:
+                for doc in docs:
+                    doc["score"] = 1.0
+            elif "$sort" in stage:
+                docs = list(FakeCursor(docs).sort(list(stage["$sort"].items())))
+            elif "$skip" in stage:
+                docs = docs[stage["$skip"]:]
+            elif "$limit" in stage:
+                docs = docs[:stage["$limit"]]
+            elif "$facet" in stage:
+                docs = [{name: self._run_pipeline(copy.deepcopy(docs), sub)
+                         for name, sub in stage["$facet"].items()}]
+            elif "$unwind" in stage:
+                path = stage["$unwind"].lstrip("$")
+                unwound = []
+                for doc in docs:
+                    for item in FakeCursor._value(doc, path) or []:
+                        unwound.append({**doc, path: item})
+                docs = unwound
+            elif "$group" in stage:
+                path = stage["$group"]["_id"].lstrip("$")
+                counts = {}
+                for doc in docs:
+                    value = doc[path] if path in doc else FakeCursor._value(doc, path)
+                    counts[value] = counts.get(value, 0) + 1
+                docs = [{"_id": value, "count": count} for value, count in counts.items()]
+            elif "$count" in stage:
+                docs = [{stage["$count"]: len(docs)}] if docs else []
+        return docs
 
+    def _filter(self, query):
         for book in self.documents.values():
             if self._matches(book, query):
                 yield copy.deepcopy(book)
@@ -272,6 +455,21 @@ class BooksCollection:
                 continue
             if key == "$and":
                 return all(self._matches(book, cond) for cond in value)
+            if key == "$or":
+                if not any(self._matches(book, cond) for cond in value):
+                    return False
+                continue
+            if isinstance(value, dict) and ("$lt" in value or "$gt" in value) and "." not in key:
+                field_value = book.get(key)
+                if "$lt" in value and not field_value < value["$lt"]:
+                    return False
+                if "$gt" in value and not field_value > value["$gt"]:
+                    return False
+                continue
+            if isinstance(value, dict) and "$nin" in value:
+                if book.get(key) in value["$nin"]:
+                    return False
+                continue
             if key == "_id" and isinstance(value, dict) and "$in" in value:
                 if book.get("_id") not in value["$in"]:
                     return False
@@ -283,6 +481,15 @@ class BooksCollection:
                     pattern = value["$regex"].lstrip("^")
                     if not (isinstance(field_value, str) and field_value.startswith(pattern)):
                         return False
+                elif isinstance(value, dict) and ({"$gte", "$lt", "$gt"} & set(value)):
+                    if not isinstance(field_value, str):
+                        return False
+                    if "$gte" in value and not field_value >= value["$gte"]:
+                        return False
+                    if "$gt" in value and not field_value > value["$gt"]:
+                        return False
+                    if "$lt" in value and not field_value < value["$lt"]:
+                        return False
                 elif isinstance(value, dict) and "$in" in value:
                     if isinstance(field_value, list):
                         if not any(item in value["$in"] for item in field_value):
@@ -290,19 +497,178 @@ class BooksCollection:
                     else:
                         if field_value not in value["$in"]:
                             return False
+                elif field_value != value:
+                    return False
+                continue
+            if isinstance(book.get(key), list) and not isinstance(value, (dict, list)):
+                if value not in book[key]:
+                    return False
                 continue
             if book.get(key) != value:
                 return False
         return True
 
 
+class InventoryCollection:
+    """独立库存布局：以 (store_id, book_id) 为键的文档集合。"""
+
+    def __init__(self, documents=()):
+        self.documents = {(doc["store_id"], doc["book_id"]): copy.deepcopy(doc) for doc in documents}
+
+    def _match(self, doc, query):
+        for key, value in query.items():
+            if isinstance(value, dict) and "$in" in value:
+                if doc.get(key) not in value["$in"]:
+                    return False
+            elif isinstance(value, dict) and "$gte" in value:
+                if doc.get(key, 0) < value["$gte"]:
+                    return False
+            elif doc.get(key) != value:
+                return False
+        return True
+
+    def find_one(self, query, projection=None):
+        for doc in self.documents.values():
+            if self._match(doc, query):
+                return copy.deepcopy(doc)
+        return None
+
+    def find(self, query, projection=None):
+        return FakeCursor([doc for doc in self.documents.values() if self._match(doc, query)])
+
+    def insert_one(self, document):
+        key = (document["store_id"], document["book_id"])
+        if key in self.documents:
+            raise pymongo_errors.DuplicateKeyError("duplicate (store_id, book_id)")
+        self.documents[key] = copy.deepcopy(document)
+
+    def insert_many(self, documents, ordered=True):
+        write_errors = []
+        for index, document in enumerate(documents):
+            try:
+                self.insert_one(document)
+            except pymongo_errors.DuplicateKeyError:
+                write_errors.append({"index": index, "code": 11000})
+                if ordered:
+                    break
+        if write_errors:
+            raise pymongo_errors.BulkWriteError({"writeErrors": write_errors})
+
+    def update_one(self, query, update):
+        for doc in self.documents.values():
+            if self._match(doc, query):
+                for field, delta in update.get("$inc", {}).items():
+                    doc[field] = doc.get(field, 0) + delta
+                return FakeUpdateResult(1, 1 if update.get("$inc") else 0)
+        return FakeUpdateResult(0, 0)
+
+    bulk_write = fake_bulk_write
+
+
+class LedgerCollection:
+    """余额流水：支持 ledger 模块用到的等值/$exists/$lt 条件与按字段分组求和。"""
+
+    def __init__(self):
+        self.documents = []
+        self.insert_calls = 0
+
+    @staticmethod
+    def _match(doc, query):
+        for key, value in query.items():
+            if isinstance(value, dict) and "$exists" in value:
+                if (key in doc) != value["$exists"]:
+                    return False
+            elif isinstance(value, dict) and "$lt" in value:
+                if key not in doc or not doc[key] < value["$lt"]:
+                    return False
+            elif isinstance(value, dict) and "$in" in value:
+                if doc.get(key) not in value["$in"]:
+                    return False
+            elif doc.get(key) != value:
+                return False
+        return True
+
+    def insert_one(self, document):
+        self.insert_many([document])
+
+    def insert_many(self, documents, ordered=True):
+        self.insert_calls += 1
+        for document in documents:
+            document.setdefault("_id", len(self.documents))
+            self.documents.append(copy.deepcopy(document))
+
+    def update_many(self, query, update):
+        matched = [doc for doc in self.documents if self._match(doc, query)]
+        for doc in matched:
+            doc.update(copy.deepcopy(update["$set"]))
+        return FakeUpdateResult(len(matched), len(matched))
+
+    def find(self, query, projection=None):
+        return FakeCursor([doc for doc in self.documents if self._match(doc, query)])
+
+    def aggregate(self, pipeline):
+        docs = [doc for doc in self.documents if self._match(doc, pipeline[0]["$match"])]
+        group = pipeline[1]["$group"]
+        key = group["_id"]
+        rows = {}
+        for doc in docs:
+            if isinstance(key, dict):
+                value = tuple((name, doc.get(path.lstrip("$"))) for name, path in key.items())
+            else:
+                value = doc.get(key.lstrip("$")) if key else None
+            row = rows.setdefault(value, {"_id": dict(value) if isinstance(key, dict) else value})
+            if "total" in group:
+                row["total"] = row.get("total", 0) + doc["amount"]
+        result = list(rows.values())
+        if len(pipeline) > 2:
+            result = result[:pipeline[2]["$limit"]]
+        return iter(result)
+
+
+class LeasesCollection:
+    """租约文档：只模拟 Lease 用到的条件 upsert 与按持有者删除。"""
+
+    def __init__(self):
+        self.documents = {}
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        doc = self.documents.get(query["_id"])
+        if doc is None:
+            doc = self.documents[query["_id"]] = {"_id": query["_id"]}
+        elif not any(doc.get("owner") == branch.get("owner") if "owner" in branch
+                     else doc.get("expires_at", 0) < branch["expires_at"]["$lt"] for branch in query["$or"]):
+            raise pymongo_errors.DuplicateKeyError("lease held")
+        doc.update(update["$set"])
+        return copy.deepcopy(doc)
+
+    def delete_one(self, query):
+        if all(self.documents.get(query["_id"], {}).get(k) == v for k, v in query.items()):
+            self.documents.pop(query["_id"], None)
+
+
+class SettingsCollection:
+    def __init__(self):
+        self.documents = {}
+
+    def update_one(self, query, update, upsert=False):
+        if query["_id"] not in self.documents and upsert:
+            self.documents[query["_id"]] = dict(update.get("$setOnInsert", {}), _id=query["_id"])
+
+    def find_one(self, query, projection=None):
+        return copy.deepcopy(self.documents.get(query["_id"]))
+
+
 class FakeDB:
-    def __init__(self, *, users, stores, orders, books):
+    def __init__(self, *, users, stores, orders, books, inventory=()):
         self.collections = {
             "Users": UsersCollection(users),
             "Stores": StoresCollection(stores),
             "Orders": OrdersCollection(orders),
             "Books": BooksCollection(books),
+            "Inventory": InventoryCollection(inventory),
+            "Leases": LeasesCollection(),
+            "Ledger": LedgerCollection(),
+            "Settings": SettingsCollection(),
         }
 
     def __getitem__(self, name):
@@ -310,12 +676,20 @@ class FakeDB:
 
 
 class MockCollection:
-    def __init__(self):
+    def __init__(self, name=""):
+        self.name = name
         self.created_indexes = []
+        self.existing_indexes = {}
 
     def create_index(self, keys, **kwargs):
         self.created_indexes.append((tuple(keys), kwargs))
 
+    def index_information(self):
+        return dict(self.existing_indexes)
+
+    def drop_index(self, name):
+        del self.existing_indexes[name]
+
 
 class MockDatabase:
     def __init__(self):
@@ -325,11 +699,11 @@ class MockDatabase:
         return list(self.collections.keys())
 
     def create_collection(self, name):
-        self.collections[name] = MockCollection()
+        self.collections[name] = MockCollection(name)
 
     def __getattr__(self, name):
         if name not in self.collections:
-            self.collections[name] = MockCollection()
+            self.collections[name] = MockCollection(name)
         return self.collections[name]
 
     __getitem__ = __getattr__
@@ -363,6 +737,7 @@ def create_fake_db():
             "_id": "book_existing",
             "title": "Existing Book",
             "tags": ["fiction"],
+            "store_ids": ["store_1"],
             "content": "Sample content",
             "search_index": {"title_lower": "existing", "tags_lower": ["fiction"]},
         },
@@ -378,6 +753,13 @@ def create_fake_db():
     return FakeDB(users=users, stores=stores, orders=orders, books=books)
 
 
+@pytest.fixture(autouse=True)
+def clear_search_cache():
+    # 搜索结果缓存是进程级的，而每个用例使用各自的假库
+    search_cache.result_cache.clear()
+    yield
+
+
 @contextmanager
 def patched_db(fake_db):
     from unittest.mock import patch
@@ -412,6 +794,56 @@ def test_add_book_success():
     assert (code, msg) == (200, "ok")
     inventory = fake_db["Stores"].documents["store_1"]["inventory"]
     assert any(item["book_id"] == "book_new" and item["stock_level"] == 3 for item in inventory)
+    # 店铺归属同步冗余到 Books.store_ids
+    assert fake_db["Books"].documents["book_new"]["store_ids"] == ["store_1"]
+
+
+def test_add_book_upserts_catalog_once_across_stores():
+    fake_db = create_fake_db()
+    fake_db["Stores"].documents["store_2"] = {"_id": "store_2", "user_id": "seller_1", "inventory": []}
+    seller, buyer = instantiate_seller_and_buyer(fake_db)
+
+    book_info = {
+        "id": "book_fresh",
+        "title": "Fresh Title",
+        "author": "Someone",
+        "price": 500,
+        "tags": ["Poetry", "Classic"],
+        "content": "sample",
+    }
+    with patched_db(fake_db):
+        assert seller.add_book("seller_1", "store_1", "book_fresh", json.dumps(book_info), 2) == (200, "ok")
+        changed = dict(book_info, title="Other Title")
+        assert seller.add_book("seller_1", "store_2", "book_fresh", json.dumps(changed), 1) == (200, "ok")
+
+    doc = fake_db["Books"].documents["book_fresh"]
+    # 目录字段与派生的 search_index 只在首次上架时写入，其后只追加店铺归属
+    assert doc["title"] == "Fresh Title" and doc["price"] == 500 and doc["tags"] == ["Poetry", "Classic"]
+    assert doc["search_index"] == {"title_lower": "fresh title", "tags_lower": ["poetry", "classic"]}
+    assert doc["store_ids"] == ["store_1", "store_2"]
+    assert "id" not in doc
+
+    code, msg, result = buyer.search_books_advanced(title_prefix="FRESH", store_id="store_2")
+    assert (code, msg) == (200, "ok")
+    assert [book["id"] for book in result["books"]] == ["book_fresh"]
+    assert buyer.get_book_detail("book_fresh")[2]["author"] == "Someone"
+
+
+def test_add_book_retry_completes_after_inventory_write_failure():
+    from unittest.mock import patch
+
+    fake_db = create_fake_db()
+    seller, buyer = instantiate_seller_and_buyer(fake_db)
+    book_json = json.dumps({"id": "book_retry", "title": "Retry Title", "price": 120})
+
+    # Books 先写入，库存写入失败：重试时不会因书目已存在被拒绝
+    with patch.object(seller.inventory, "add_item", side_effect=pymongo_errors.PyMongoError("down")):
+        assert seller.add_book("seller_1", "store_1", "book_retry", book_json, 2)[0] == 528
+    assert fake_db["Books"].documents["book_retry"]["store_ids"] == ["store_1"]
+    assert seller.add_book("seller_1", "store_1", "book_retry", book_json, 2) == (200, "ok")
+    assert fake_db["Books"].documents["book_retry"]["store_ids"] == ["store_1"]
+    assert seller.inventory.get_item("store_1", "book_retry")["stock_level"] == 2
+    assert buyer.get_book_detail("book_retry")[2]["title"] == "Retry Title"
 
 
 def test_add_book_rejects_duplicate():
@@ -506,6 +938,105 @@ def test_add_operations_handle_invalid_numbers_and_db_errors():
     fake_db["Stores"].update_one = original_update
 
 
+def test_add_books_bulk_with_per_item_errors():
+    fake_db = create_fake_db()
+    seller, buyer = instantiate_seller_and_buyer(fake_db)
+
+    books = [
+        {"book_info": {"id": "bulk_1", "title": "Bulk One", "price": 10, "tags": ["Poetry"]}, "stock_level": 3},
+        {"book_info": {"id": "book_existing", "price": 100}, "stock_level": 1},
+        {"book_info": {"title": "no id"}, "stock_level": 1},
+        {"book_info": {"id": "bulk_1", "price": 10}, "stock_level": 1},
+        {"book_info": {"id": "bulk_2", "title": "Bulk Two", "pictures": ["not base64!"]}, "stock_level": 1},
+        {"book_info": {"id": "bulk_3", "title": "Bulk Three", "price": 30}, "stock_level": "bad"},
+    ]
+    with patched_db(fake_db):
+        code, msg, result = seller.add_books("seller_1", "store_1", books)
+
+    assert (code, msg) == (200, "ok")
+    assert result["added"] == 2
+    assert [(e["index"], e["book_id"], e["code"]) for e in result["errors"]] == [
+        (1, "book_existing", error.error_exist_book_id("book_existing")[0]),
+        (2, None, 400),
+        (3, "bulk_1", error.error_exist_book_id("bulk_1")[0]),
+        (4, "bulk_2", 400),
+    ]
+    inventory = {item["book_id"]: item for item in fake_db["Stores"].documents["store_1"]["inventory"]}
+    assert inventory["bulk_1"]["stock_level"] == 3 and inventory["bulk_3"]["stock_level"] == 0
+    assert "bulk_2" not in inventory
+    # 目录 upsert 一次往返
+    assert fake_db["Books"].bulk_writes == 1
+    assert fake_db["Books"].documents["bulk_1"]["store_ids"] == ["store_1"]
+    assert fake_db["Books"].documents["bulk_1"]["search_index"]["tags_lower"] == ["poetry"]
+
+    code, _, result = buyer.search_books_advanced(title_prefix="bulk", store_id="store_1")
+    assert code == 200 and [book["id"] for book in result["books"]] == ["bulk_1", "bulk_3"]
+
+
+def test_add_books_retry_completes_after_inventory_write_failure():
+    from unittest.mock import patch
+
+    fake_db = create_fake_db()
+    seller, _ = instantiate_seller_and_buyer(fake_db)
+    books = [{"book_info": {"id": "bulk_retry_{}".format(i), "title": "Retry", "price": 10}, "stock_level": 2}
+             for i in range(2)]
+
+    # 目录已 upsert、库存写入失败：整批重试补齐库存，不会被判为已存在
+    with patch.object(seller.inventory, "add_items", side_effect=pymongo_errors.PyMongoError("down")):
+        assert seller.add_books("seller_1", "store_1", books)[0] == 528
+    assert all(fake_db["Books"].documents[book["book_info"]["id"]]["store_ids"] == ["store_1"] for book in books)
+    code, _, result = seller.add_books("seller_1", "store_1", books)
+    assert code == 200 and result == {"added": 2, "errors": []}
+    assert all(seller.inventory.get_item("store_1", book["book_info"]["id"])["stock_level"] == 2 for book in books)
+
+
+def test_add_stock_levels_bulk():
+    fake_db = create_fake_db()
+    fake_db["Stores"].documents["store_1"]["inventory"].append({"book_id": "book_other", "stock_level": 1, "price": 5})
+    seller, _ = instantiate_seller_and_buyer(fake_db)
+
+    items = [
+        {"book_id": "book_existing", "add_stock_level": 2},
+        {"book_id": "ghost", "add_stock_level": 2},
+        {"book_id": "book_other", "add_stock_level": 4},
+        {"book_id": "book_existing", "add_stock_level": 3},
+        {"add_stock_level": 1},
+    ]
+    code, msg, result = seller.add_stock_levels("seller_1", "store_1", items)
+
+    assert (code, msg) == (200, "ok")
+    assert result["updated"] == 3
+    assert [(e["index"], e["code"]) for e in result["errors"]] == [
+        (1, error.error_non_exist_book_id("ghost")[0]),
+        (4, 400),
+    ]
+    inventory = {item["book_id"]: item for item in fake_db["Stores"].documents["store_1"]["inventory"]}
+    assert inventory["book_existing"]["stock_level"] == 5 + 2 + 3
+    assert inventory["book_other"]["stock_level"] == 5
+    assert fake_db["Stores"].bulk_writes == 1
+
+
+def test_bulk_requests_validate_once():
+    from unittest.mock import patch
+    from be import conf as be_conf
+
+    fake_db = create_fake_db()
+    seller, _ = instantiate_seller_and_buyer(fake_db)
+
+    assert seller.add_books("ghost", "store_1", [{}])[:2] == error.error_non_exist_user_id("ghost")
+    assert seller.add_stock_levels("seller_1", "ghost", [{}])[:2] == error.error_non_exist_store_id("ghost")
+    assert seller.add_books("seller_1", "store_1", [])[0] == 400
+    assert seller.add_stock_levels("seller_1", "store_1", "bad")[0] == 400
+    with patch.object(be_conf, "Bulk_Max_Items", 1):
+        assert seller.add_books("seller_1", "store_1", [{}, {}])[0] == 400
+
+    def raise_error(*args, **kwargs):
+        raise pymongo_errors.PyMongoError("boom")
+
+    fake_db["Stores"].bulk_write = raise_error
+    assert seller.add_stock_levels("seller_1", "store_1", [{"book_id": "book_existing", "add_stock_level": 1}])[0] == 528
+
+
 def test_create_store_requires_unique_id():
     fake_db = create_fake_db()
     seller, _ = instantiate_seller_and_buyer(fake_db)
@@ -729,6 +1260,95 @@ def test_new_order_success_snapshot_and_total():
     assert order_doc["items"][0]["book_snapshot"]["title"] == "Existing Book"
 
 
+def test_new_order_batches_lookups_for_multi_line_cart():
+    fake_db = create_fake_db()
+    fake_db["Stores"].documents["store_1"]["inventory"].append({
+        "book_id": "book_new", "stock_level": 3, "price": 30,
+    })
+    _, buyer = instantiate_seller_and_buyer(fake_db)
+
+    # 逐项 $elemMatch 查询不应再出现，店铺文档只通过一次聚合读取
+    original_find = fake_db["Stores"].find_one
+    elem_match_calls = []
+
+    def tracking_find(query, projection=None):
+        if "inventory" in query:
+            elem_match_calls.append(query)
+        return original_find(query, projection)
+
+    fake_db["Stores"].find_one = tracking_find
+    code, msg, order_id = buyer.new_order(
+        "buyer_1",
+        "store_1",
+        [("book_existing", 2), ("book_new", 1), ("book_existing", 1)],
+    )
+
+    assert (code, msg) == (200, "ok")
+    assert elem_match_calls == []
+    order_doc = fake_db["Orders"].find_one({"_id": order_id})
+    assert order_doc["total_amount"] == 2 * 100 + 30 + 100
+    assert [item["book_id"] for item in order_doc["items"]] == ["book_existing", "book_new", "book_existing"]
+    assert order_doc["items"][1]["book_snapshot"] == {"title": "New Arrival", "tag": "novel", "content": "Preview"}
+
+
+def count_reads(fake_db):
+    """统计各集合 find_one 调用次数及投影，返回 {集合名: [projection, ...]}。"""
+    reads = {}
+    for name in ("Users", "Stores", "Orders"):
+        collection = fake_db[name]
+        original = collection.find_one
+
+        def tracking(query, projection=None, _name=name, _original=original):
+            reads.setdefault(_name, []).append(projection)
+            return _original(query, projection)
+
+        collection.find_one = tracking
+    return reads
+
+
+def test_order_flows_read_each_document_once():
+    fake_db = create_fake_db()
+    seller, buyer = instantiate_seller_and_buyer(fake_db)
+    _, _, order_id = buyer.new_order("buyer_1", "store_1", [("book_existing", 1)])
+
+    reads = count_reads(fake_db)
+    assert buyer.payment("buyer_1", "buyer_pass", order_id) == (200, "ok")
+    # 订单读取一次（不再先做存在性探测），用户只取余额与密码
+    assert reads == {"Orders": [None], "Users": [{"balance": 1, "password": 1}]}
+
+    reads.clear()
+    assert seller.ship_order("seller_1", order_id) == (200, "ok")
+    assert reads == {"Users": [{"_id": 1}], "Orders": [None], "Stores": [{"user_id": 1}]}
+
+    reads.clear()
+    assert buyer.receive_order("buyer_1", order_id) == (200, "ok")
+    assert reads == {"Users": [{"_id": 1}], "Orders": [None], "Stores": [{"user_id": 1}]}
+
+
+def test_document_loader_memoizes_per_call():
+    fake_db = create_fake_db()
+    _, buyer = instantiate_seller_and_buyer(fake_db)
+    reads = count_reads(fake_db)
+
+    docs = buyer.loader()
+    assert docs.exists("Users", "buyer_1")
+    assert docs.get("Users", "buyer_1", ("_id",))["_id"] == "buyer_1"
+    assert docs.get("Users", "buyer_1")["balance"] == 10_000
+    assert docs.get("Users", "buyer_1", ("balance",))["balance"] == 10_000
+    assert docs.exists("Users", "buyer_1")
+    assert not docs.exists("Users", "ghost")
+    assert docs.get("Users", "ghost") is None
+    # 存在性探测 + 完整文档各一次，ghost 只查询一次
+    assert reads["Users"] == [{"_id": 1}, None, {"_id": 1}]
+
+    docs.forget("Users", "buyer_1")
+    docs.get("Users", "buyer_1")
+    assert len(reads["Users"]) == 4
+    # 新的加载器不共享缓存
+    assert buyer.loader().exists("Users", "buyer_1")
+    assert len(reads["Users"]) == 5
+
+
 def test_new_order_requires_existing_user_and_store():
     fake_db = create_fake_db()
     fake_db["Users"].documents.pop("buyer_1")
@@ -1027,6 +1647,8 @@ def test_receive_order_validations():
 
 def test_get_and_query_orders_with_pagination():
     fake_db = create_fake_db()
+    # 下单即预占库存，库存需覆盖全部 12 笔订单
+    fake_db["Stores"].documents["store_1"]["inventory"][0]["stock_level"] = 12
     _, buyer = instantiate_seller_and_buyer(fake_db)
 
     order_ids = []
@@ -1050,6 +1672,50 @@ def test_get_and_query_orders_with_pagination():
     assert len(result["orders"]) == 2  # 12 条数据，page_size=10
 
 
+def test_query_orders_cursor_walks_all_orders():
+    fake_db = create_fake_db()
+    fake_db["Stores"].documents["store_1"]["inventory"][0]["stock_level"] = 25
+    _, buyer = instantiate_seller_and_buyer(fake_db)
+
+    order_ids = []
+    for _ in range(25):
+        _, _, order_id = buyer.new_order("buyer_1", "store_1", [("book_existing", 1)])
+        order_ids.append(order_id)
+    # 让相邻订单的 create_time 相同，游标需要以 _id 区分
+    for i, order_id in enumerate(order_ids):
+        fake_db["Orders"].documents[order_id]["create_time"] = 1000.0 + i // 2
+
+    code, msg, result = buyer.query_orders("buyer_1", page=1)
+    assert (code, msg) == (200, "ok")
+    assert result["pagination"]["total_count"] == 25
+    cursor = result["pagination"]["next_cursor"]
+    seen = [order["order_id"] for order in result["orders"]]
+    pages = 1
+    while cursor:
+        code, msg, result = buyer.query_orders("buyer_1", cursor=cursor)
+        assert (code, msg) == (200, "ok")
+        # 游标模式默认不统计总数
+        assert "total_count" not in result["pagination"]
+        seen.extend(order["order_id"] for order in result["orders"])
+        cursor = result["pagination"]["next_cursor"]
+        pages += 1
+    assert pages == 3
+    assert not result["pagination"]["has_next"]
+    assert len(seen) == len(set(seen)) == 25
+    assert set(seen) == set(order_ids)
+
+    code, msg, result = buyer.query_orders("buyer_1", cursor=pagination.encode_cursor([1005.0, order_ids[10]]),
+                                           with_total=True)
+    assert (code, msg) == (200, "ok")
+    assert result["pagination"]["total_count"] == 25
+    assert len(result["orders"]) == 10
+    assert all((o["create_time"], o["order_id"]) < (1005.0, order_ids[10]) for o in result["orders"])
+
+    assert buyer.query_orders("buyer_1", cursor="not-a-cursor")[0:2] == error.error_and_message(400, "游标参数无效")
+    assert buyer.query_orders("buyer_1", cursor=pagination.encode_cursor([1.0]))[0:2] == \
+        error.error_and_message(400, "游标参数无效")
+
+
 def test_query_orders_validations():
     fake_db = create_fake_db()
     _, buyer = instantiate_seller_and_buyer(fake_db)
@@ -1164,39 +1830,864 @@ def test_auto_cancel_timeout_orders():
 
     from unittest.mock import patch
 
-    with patch("be.model.store.get_db", side_effect=pymongo_errors.PyMongoError("boom")):
+    with patch("be.model.db_conn.get_db", side_effect=pymongo_errors.PyMongoError("boom")):
         assert Buyer.auto_cancel_timeout_orders()[0] == 528
 
-    with patch("be.model.store.get_db", return_value=fake_db):
+    with patched_db(fake_db):
         fake_db["Orders"].find = lambda *args, **kwargs: (_ for _ in ()).throw(ValueError("boom"))
         assert Buyer.auto_cancel_timeout_orders()[0] == 530
 
 
-def test_store_mongodb_initialization():
+def _add_stale_orders(fake_db, count, reserved_quantity=0):
+    base = time.time() - 25 * 3600
+    for i in range(count):
+        order = {
+            "_id": f"stale_{i:03d}",
+            "buyer_id": "buyer_1",
+            "store_id": "store_1",
+            "status": "unpaid",
+            "create_time": base + i,
+            "items": [{"book_id": "book_existing", "quantity": reserved_quantity}] if reserved_quantity else [],
+        }
+        if reserved_quantity:
+            order["stock_reserved"] = True
+        fake_db["Orders"].insert_one(order)
+
+
+def test_sweep_timeout_orders_in_bounded_batches():
     from unittest.mock import patch
+    from be import conf as be_conf
 
-    mock_client = MockMongoClient()
-    with patch("pymongo.MongoClient", return_value=mock_client):
-        store_db = store_module.StoreMongoDB(mongo_uri="mongodb://fake", db_name="testdb")
+    fake_db = create_fake_db()
+    _add_stale_orders(fake_db, 7, reserved_quantity=1)
+    fake_db["Orders"].insert_one({"_id": "fresh", "buyer_id": "buyer_1", "store_id": "store_1",
+                                  "status": "unpaid", "create_time": time.time(), "items": []})
+    inventory = fake_db["Stores"].documents["store_1"]["inventory"][0]
+    calls = {"update_many": 0}
+    original = fake_db["Orders"].update_many
+
+    def counting_update_many(query, update):
+        # 只统计状态迁移；归还库存后清除 release_pending 的写入另计
+        if "status" in update.get("$set", {}):
+            calls["update_many"] += 1
+        return original(query, update)
+
+    fake_db["Orders"].update_many = counting_update_many
+    with patched_db(fake_db), patch.object(be_conf, "Auto_Cancel_Batch_Size", 3):
+        code, msg, stats = Buyer.sweep_timeout_orders(limit=5)
+        assert (code, msg) == (200, "ok")
+        assert (stats["cancelled"], stats["batches"], stats["has_more"]) == (5, 2, True)
+        assert stats["released_items"] == 5 and "orders_per_sec" in stats
+        assert calls["update_many"] == 2
+        # 最早的订单先取消；未超时的订单不受影响
+        statuses = {order_id: doc["status"] for order_id, doc in fake_db["Orders"].documents.items()}
+        assert [order_id for order_id, status in sorted(statuses.items()) if status == "unpaid"] == \
+            ["fresh", "stale_005", "stale_006"]
+        # 预占库存按店铺汇总后一次归还
+        assert inventory["stock_level"] == 5 + 5
+
+        # 再次运行从剩余的超时订单继续
+        code, _, stats = Buyer.sweep_timeout_orders(limit=5)
+        assert (stats["cancelled"], stats["has_more"]) == (2, False)
+        assert fake_db["Orders"].documents["fresh"]["status"] == "unpaid"
+        assert inventory["stock_level"] == 5 + 7
+        assert not any("release_pending" in doc for doc in fake_db["Orders"].documents.values())
+
+    # limit 须为正整数，不存在“0 表示不限”
+    for limit in ("5", 0, -1, 2.5, True):
+        assert Buyer.sweep_timeout_orders(limit) == (400, "limit 参数无效", {})
+
+    # 配置的默认上限无效时拒绝执行，而不是退化为全量扫描
+    _add_stale_orders(fake_db, 2)
+    with patched_db(fake_db), patch.object(be_conf, "Auto_Cancel_Max_Orders", 0):
+        assert Buyer.sweep_timeout_orders()[0] == 530
+    assert sum(doc["status"] == "unpaid" for doc in fake_db["Orders"].documents.values()) == 3
+
+
+def test_sweep_finishes_releases_interrupted_by_a_crash():
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be.model.order_sweeper import OrderSweeper
 
-    test_db = mock_client.databases["testdb"]
-    assert test_db.Users.created_indexes
-    assert test_db.Stores.created_indexes
-    assert test_db.Orders.created_indexes
-    assert test_db.Books.created_indexes
-    assert store_db.get_db() is test_db
-    assert store_db.get_db_conn() is mock_client
+    fake_db = create_fake_db()
+    _add_stale_orders(fake_db, 3, reserved_quantity=2)
+    inventory = fake_db["Stores"].documents["store_1"]["inventory"][0]
 
+    with patched_db(fake_db):
+        # 取消已写入、归还库存前进程中断
+        with patch("be.model.inventory.EmbeddedInventory.inc_stocks", side_effect=RuntimeError("crash")):
+            with pytest.raises(RuntimeError):
+                OrderSweeper().sweep()
+        pending = [doc for doc in fake_db["Orders"].documents.values() if "release_pending" in doc]
+        assert len(pending) == 3 and all(doc["status"] == "cancelled" for doc in pending)
+        assert inventory["stock_level"] == 5
+
+        # 宽限期内视为仍在进行中的归还，不补做
+        assert OrderSweeper().sweep()["recovered_items"] == 0
+        assert inventory["stock_level"] == 5
+
+        with patch.object(be_conf, "Auto_Cancel_Release_Grace", -1):
+            stats = OrderSweeper().sweep()
+            assert (stats["recovered_items"], stats["cancelled"]) == (3, 0)
+            assert inventory["stock_level"] == 5 + 3 * 2
+            assert not any("release_pending" in doc for doc in fake_db["Orders"].documents.values())
+            # 已补做的订单不会再次归还
+            assert OrderSweeper().sweep()["recovered_items"] == 0
+        assert inventory["stock_level"] == 5 + 3 * 2
+
+    # 补做同样受单次上限约束，剩余的留给下一次运行
+    _add_stale_orders(fake_db, 3, reserved_quantity=1)
+    for doc in fake_db["Orders"].documents.values():
+        if doc["status"] == "unpaid":
+            doc.update(status="cancelled", release_pending=time.time() - 3600)
+    with patched_db(fake_db):
+        assert OrderSweeper().finish_pending_releases(batch_size=5, limit=2) == 2
+        assert OrderSweeper().finish_pending_releases(limit=2) == 1
+        with pytest.raises(ValueError):
+            OrderSweeper().finish_pending_releases(limit=0)
 
-def test_store_global_helpers():
-    from unittest.mock import patch
 
-    store_module.database_instance = None
-    store_module.init_completed_event.clear()
+def test_sweep_skips_orders_paid_concurrently():
+    fake_db = create_fake_db()
+    _add_stale_orders(fake_db, 3, reserved_quantity=2)
+    original_find = fake_db["Orders"].find
 
-    first_client = MockMongoClient()
-    with patch("pymongo.MongoClient", return_value=first_client):
-        store_module.init_database("mongodb://fake", "globaldb")
+    def racing_find(query, projection=None):
+        cursor = original_find(query, projection)
+        if query.get("status") == "unpaid":
+            # 读取之后、状态迁移之前，stale_001 被买家支付
+            fake_db["Orders"].documents["stale_001"]["status"] = "paid"
+        return cursor
+
+    fake_db["Orders"].find = racing_find
+    with patched_db(fake_db):
+        code, _, stats = Buyer.sweep_timeout_orders()
+    assert code == 200 and stats["cancelled"] == 2 and stats["released_items"] == 2
+    assert fake_db["Orders"].documents["stale_001"]["status"] == "paid"
+    assert fake_db["Stores"].documents["store_1"]["inventory"][0]["stock_level"] == 5 + 2 * 2
+
+
+@contextmanager
+def reservation_mode():
+    from unittest.mock import patch
+    from be import conf as be_conf
+
+    with patch.object(be_conf, "Stock_Reservation", True):
+        yield
+
+
+def test_stock_reservation_off_by_default():
+    fake_db = create_fake_db()
+    seller, buyer = instantiate_seller_and_buyer(fake_db)
+    inventory = fake_db["Stores"].documents["store_1"]["inventory"][0]
+
+    # 默认沿用发货时校验并扣减：下单不动库存，订单不带预占标记
+    code, _, order_id = buyer.new_order("buyer_1", "store_1", [("book_existing", 3)])
+    assert code == 200 and inventory["stock_level"] == 5
+    assert "stock_reserved" not in fake_db["Orders"].find_one({"_id": order_id})
+    assert buyer.payment("buyer_1", "buyer_pass", order_id) == (200, "ok")
+    assert seller.ship_order("seller_1", order_id) == (200, "ok")
+    assert inventory["stock_level"] == 2
+
+
+@reservation_mode()
+def test_stock_reserved_at_order_time_and_released_on_cancel():
+    fake_db = create_fake_db()
+    seller, buyer = instantiate_seller_and_buyer(fake_db)
+    inventory = fake_db["Stores"].documents["store_1"]["inventory"][0]
+
+    code, _, order_id = buyer.new_order("buyer_1", "store_1", [("book_existing", 3)])
+    assert code == 200
+    assert fake_db["Orders"].find_one({"_id": order_id})["stock_reserved"] is True
+    assert inventory["stock_level"] == 2
+
+    # 剩余库存不足时第二笔订单被拒绝，不会超卖
+    assert buyer.new_order("buyer_1", "store_1", [("book_existing", 3)]) == \
+        error.error_stock_level_low("book_existing") + ("",)
+    assert inventory["stock_level"] == 2
+
+    assert buyer.cancel_order("buyer_1", order_id) == (200, "ok")
+    assert inventory["stock_level"] == 5
+
+    # 发货仅确认，不再重复扣减
+    code, _, order_id = buyer.new_order("buyer_1", "store_1", [("book_existing", 4)])
+    assert buyer.payment("buyer_1", "buyer_pass", order_id) == (200, "ok")
+    assert seller.ship_order("seller_1", order_id) == (200, "ok")
+    assert inventory["stock_level"] == 1
+
+
+@reservation_mode()
+def test_new_order_releases_partial_reservation():
+    fake_db = create_fake_db()
+    fake_db["Stores"].documents["store_1"]["inventory"].append({
+        "book_id": "book_new", "stock_level": 1, "price": 30,
+    })
+    _, buyer = instantiate_seller_and_buyer(fake_db)
+    original_update = fake_db["Stores"].update_one
+
+    def racing_update(query, update):
+        # 模拟并发：预占 book_new 前库存已被其他订单占用
+        if (query.get("inventory") or {}).get("$elemMatch", {}).get("book_id") == "book_new":
+            return FakeUpdateResult(0, 0)
+        return original_update(query, update)
+
+    fake_db["Stores"].update_one = racing_update
+    result = buyer.new_order("buyer_1", "store_1", [("book_existing", 2), ("book_new", 1)])
+    assert result == error.error_stock_level_low("book_new") + ("",)
+    assert fake_db["Stores"].documents["store_1"]["inventory"][0]["stock_level"] == 5
+    assert fake_db["Orders"].documents == {}
+
+
+@reservation_mode()
+def test_auto_cancel_releases_reserved_stock():
+    fake_db = create_fake_db()
+    _, buyer = instantiate_seller_and_buyer(fake_db)
+    _, _, order_id = buyer.new_order("buyer_1", "store_1", [("book_existing", 2)])
+    fake_db["Orders"].documents[order_id]["create_time"] = time.time() - 25 * 3600
+
+    with patched_db(fake_db):
+        assert Buyer.auto_cancel_timeout_orders() == (200, "ok", 1)
+    assert fake_db["Stores"].documents["store_1"]["inventory"][0]["stock_level"] == 5
+
+
+def test_order_timeout_lease_single_leader():
+    from be.model.order_timeout import Lease
+
+    fake_db = create_fake_db()
+    first, second = Lease(fake_db, "order_timeout", 10), Lease(fake_db, "order_timeout", 10)
+    assert first.acquire() and first.acquire()
+    assert not second.acquire()
+
+    # 持有者停止续约，租约过期后由其他进程接管
+    fake_db["Leases"].documents["order_timeout"]["expires_at"] = time.time() - 1
+    assert second.acquire()
+    assert not first.acquire()
+    second.release()
+    assert first.acquire()
+
+
+@contextmanager
+def patched_scheduler(fake_db, timeout):
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be.model import order_timeout
+
+    scheduler = order_timeout.TimeoutScheduler()
+    with patched_db(fake_db), \
+            patch("be.model.order_timeout.get_db", return_value=fake_db), \
+            patch.object(order_timeout, "scheduler", scheduler), \
+            patch.object(be_conf, "Order_Unpaid_Timeout", timeout), \
+            patch.object(be_conf, "Order_Timeout_Lease_TTL", 3), \
+            patch.object(be_conf, "Order_Timeout_Refresh", 60):
+        yield scheduler
+
+
+def test_order_timeout_scheduler_heap_and_lag():
+    from unittest.mock import patch
+
+    fake_db = create_fake_db()
+    now = time.time()
+    for order_id, age in (("backlog", 120), ("soon", 50), ("later", 10)):
+        fake_db["Orders"].insert_one({"_id": order_id, "buyer_id": "buyer_1", "store_id": "store_1",
+                                      "status": "unpaid", "create_time": now - age, "items": []})
+
+    with patched_scheduler(fake_db, 60) as scheduler:
+        _, buyer = instantiate_seller_and_buyer(fake_db)
+        # 非主节点不维护堆
+        code, _, ignored = buyer.new_order("buyer_1", "store_1", [("book_existing", 1)])
+        assert code == 200 and scheduler.stats()["pending"] == 0
+
+        # 取得租约后先清理积压，完成后才成为主节点；积压的超时订单直接清理，其余按到期时间建堆
+        scheduler._renew()
+        assert scheduler.stats()["seeding"] and not scheduler.is_leader
+        assert not scheduler._seed_step()
+        assert scheduler.is_leader and not scheduler.stats()["seeding"]
+        assert fake_db["Orders"].documents["backlog"]["status"] == "cancelled"
+        assert scheduler.stats()["pending"] == 3
+        assert scheduler.stats()["next_deadline"] == pytest.approx(now - 50 + 60)
+
+        # 增量刷新只拉取其他进程新建的订单，不再做全量 sweep
+        fake_db["Orders"].insert_one({"_id": "other_worker", "buyer_id": "buyer_1", "store_id": "store_1",
+                                      "status": "unpaid", "create_time": time.time(), "items": []})
+        with patch("be.model.order_sweeper.OrderSweeper.sweep", side_effect=AssertionError("full sweep")):
+            scheduler._refresh(time.time())
+        assert scheduler.stats()["pending"] == 4
+        scheduler.discard("other_worker")
+
+        code, _, paid = buyer.new_order("buyer_1", "store_1", [("book_existing", 1)])
+        assert buyer.payment("buyer_1", "buyer_pass", paid) == (200, "ok")
+        code, _, open_order = buyer.new_order("buyer_1", "store_1", [("book_existing", 1)])
+        assert scheduler.stats()["pending"] == 4
+
+        # 未到期时不做任何写入
+        assert not scheduler._expire(now)
+        assert scheduler._expire(now + 12)
+        assert fake_db["Orders"].documents["soon"]["status"] == "cancelled"
+        assert fake_db["Orders"].documents["later"]["status"] == "unpaid"
+        stats = scheduler.stats()
+        assert stats["cancelled"] == 1 and stats["lag_last"] == pytest.approx(2, abs=0.5)
+
+        # 到期前已支付的订单出堆，不会被取消
+        assert scheduler._expire(time.time() + 61)
+        assert fake_db["Orders"].documents[paid]["status"] == "paid"
+        assert fake_db["Orders"].documents[open_order]["status"] == "cancelled"
+        assert scheduler.stats()["pending"] == 0
+
+        scheduler.stop()
+        assert not scheduler.is_leader
+        assert fake_db["Leases"].documents == {}
+
+
+def test_order_timeout_scheduler_seeds_backlog_one_batch_at_a_time():
+    from unittest.mock import patch
+    from be import conf as be_conf
+
+    fake_db = create_fake_db()
+    _add_stale_orders(fake_db, 5)
+    with patched_scheduler(fake_db, 60) as scheduler, patch.object(be_conf, "Auto_Cancel_Batch_Size", 2):
+        scheduler._renew()
+        # 每步只取消一批，续约在步与步之间进行
+        assert scheduler._seed_step()
+        assert sum(doc["status"] == "cancelled" for doc in fake_db["Orders"].documents.values()) == 2
+        assert scheduler._seed_step()
+        scheduler._renew()
+        assert scheduler.stats()["seeding"]
+
+        # 清理期间租约过期并被其他进程接管：清理结束后不会成为主节点
+        fake_db["Leases"].documents["order_timeout"].update(owner="other", expires_at=time.time() + 60)
+        assert not scheduler._seed_step()
+        assert not scheduler.is_leader and not scheduler.stats()["seeding"]
+        assert all(doc["status"] == "cancelled" for doc in fake_db["Orders"].documents.values())
+
+
+@reservation_mode()
+def test_order_timeout_scheduler_thread_cancels_on_expiry():
+    fake_db = create_fake_db()
+    inventory = fake_db["Stores"].documents["store_1"]["inventory"][0]
+
+    with patched_scheduler(fake_db, 0.3) as scheduler:
+        _, buyer = instantiate_seller_and_buyer(fake_db)
+        scheduler.start()
+        try:
+            deadline = time.time() + 3
+            while not scheduler.is_leader and time.time() < deadline:
+                time.sleep(0.01)
+            code, _, order_id = buyer.new_order("buyer_1", "store_1", [("book_existing", 2)])
+            assert code == 200 and inventory["stock_level"] == 3
+            while fake_db["Orders"].documents[order_id]["status"] == "unpaid" and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            scheduler.stop()
+
+    assert fake_db["Orders"].documents[order_id]["status"] == "cancelled"
+    assert inventory["stock_level"] == 5
+    stats = scheduler.stats()
+    assert stats["cancelled"] == 1 and stats["lag_max"] < 1 and not stats["running"]
+
+
+@contextmanager
+def ledger_mode(fake_db):
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be.model import ledger
+
+    with patched_db(fake_db), \
+            patch.object(be_conf, "Balance_Mode", "ledger"), \
+            patch.object(be_conf, "Ledger_Materialize_Interval", 0), \
+            patch.object(ledger, "writer", ledger.LedgerWriter()):
+        yield ledger
+
+
+def test_ledger_credits_append_and_materialize_on_debit():
+    fake_db = create_fake_db()
+    with ledger_mode(fake_db) as ledger:
+        seller, buyer = instantiate_seller_and_buyer(fake_db)
+        users = fake_db["Users"].documents
+
+        _, _, order_id = buyer.new_order("buyer_1", "store_1", [("book_existing", 1)])
+        assert buyer.payment("buyer_1", "buyer_pass", order_id) == (200, "ok")
+        assert seller.ship_order("seller_1", order_id) == (200, "ok")
+        assert buyer.receive_order("buyer_1", order_id) == (200, "ok")
+
+        # 卖家入账只追加流水，不写用户文档
+        assert users["seller_1"]["balance"] == 0
+        assert [(e["user_id"], e["amount"], e["kind"], e["ref"]) for e in fake_db["Ledger"].documents] == \
+            [("seller_1", 100, "payout", order_id)]
+        assert users["seller_1"]["balance"] + ledger.pending(fake_db, "seller_1") == 100
+
+        # 扣款时余额不足先物化待入账流水
+        assert buyer.add_funds("seller_1", "seller_pass", -60) == (200, "ok")
+        assert users["seller_1"]["balance"] == 40
+        assert ledger.pending(fake_db, "seller_1") == 0
+        assert buyer.add_funds("seller_1", "seller_pass", -60) == (400, "余额不足，扣款失败")
+
+        # 退款与充值同样走流水；支付时的余额检查计入未物化的入账
+        _, _, order_id = buyer.new_order("buyer_1", "store_1", [("book_existing", 2)])
+        assert buyer.payment("buyer_1", "buyer_pass", order_id) == (200, "ok")
+        assert buyer.cancel_order("buyer_1", order_id) == (200, "ok")
+        assert buyer.add_funds("buyer_1", "buyer_pass", 50) == (200, "ok")
+        assert users["buyer_1"]["balance"] == 10_000 - 100 - 200
+        users["buyer_1"]["balance"] = 0
+        _, _, order_id = buyer.new_order("buyer_1", "store_1", [("book_existing", 2)])
+        assert buyer.payment("buyer_1", "buyer_pass", order_id) == (200, "ok")
+        assert users["buyer_1"]["balance"] == 250 - 200
+
+
+def test_ledger_materialize_is_idempotent_and_recovers_claims():
+    fake_db = create_fake_db()
+    users = fake_db["Users"].documents
+    with ledger_mode(fake_db) as ledger:
+        _, buyer = instantiate_seller_and_buyer(fake_db)
+        for amount in (10, 20, 30):
+            ledger.credit(buyer, "seller_1", amount, "payout")
+        assert fake_db["Ledger"].insert_calls == 3
+
+        # 模拟物化在 $inc 之后、标记入账之前中断：批次记录留在用户文档上
+        ids = [entry["_id"] for entry in fake_db["Ledger"].documents]
+        users["seller_1"].update(balance=60, ledger_batch="b1", ledger_batch_ids=ids,
+                                 ledger_batch_at=time.time() - 120)
+        # 批次未完成前不开始新批次；期间的大量入账不会让中断的批次被再计一次
+        for _ in range(25):
+            ledger.credit(buyer, "seller_1", 1, "payout")
+        assert ledger.materialize(buyer, "seller_1") == 0
+        assert users["seller_1"]["balance"] == 60
+
+        assert ledger.materialize_pending(buyer) == (1, 25)
+        assert users["seller_1"]["balance"] == 85
+        assert all(entry["applied"] for entry in fake_db["Ledger"].documents)
+        assert "ledger_batch" not in users["seller_1"]
+        assert ledger.materialize(buyer, "seller_1") == 0
+
+        # $inc 之前中断：删除批次记录，流水由下一次物化计入一次
+        ledger.credit(buyer, "seller_1", 5, "payout")
+        users["seller_1"].update(ledger_batch="b2", ledger_batch_at=time.time() - 120)
+        assert ledger.materialize_pending(buyer) == (1, 5)
+        assert users["seller_1"]["balance"] == 90 and "ledger_batch" not in users["seller_1"]
+        assert ledger.pending(fake_db, "seller_1") == 0
+
+
+def test_ledger_materializer_runs_without_the_writer():
+    from unittest.mock import patch
+    from be import conf as be_conf
+
+    fake_db = create_fake_db()
+    with ledger_mode(fake_db) as ledger:
+        # 事务模式下的入账随事务 insert_one，写入线程从未启动
+        fake_db["Ledger"].insert_one({"user_id": "seller_1", "amount": 30, "kind": "payout", "ref": None,
+                                      "time": time.time(), "applied": False})
+        materializer = ledger.LedgerMaterializer()
+        materializer.start()
+        assert materializer._thread is None  # Ledger_Materialize_Interval = 0：只在扣款时物化
+
+        with patch.object(be_conf, "Ledger_Materialize_Interval", 0.01):
+            materializer.start()
+            try:
+                deadline = time.time() + 3
+                while fake_db["Users"].documents["seller_1"]["balance"] == 0 and time.time() < deadline:
+                    time.sleep(0.01)
+            finally:
+                materializer.stop()
+        assert ledger.writer._thread is None
+        assert fake_db["Users"].documents["seller_1"]["balance"] == 30
+        assert ledger.pending(fake_db, "seller_1") == 0 and materializer.runs >= 1
+
+
+def test_ledger_writer_group_commits_concurrent_credits():
+    import threading
+
+    fake_db = create_fake_db()
+    original_insert_many = fake_db["Ledger"].insert_many
+
+    def slow_insert_many(documents, ordered=True):
+        time.sleep(0.02)
+        original_insert_many(documents, ordered)
+
+    fake_db["Ledger"].insert_many = slow_insert_many
+    with ledger_mode(fake_db) as ledger:
+        _, buyer = instantiate_seller_and_buyer(fake_db)
+        threads = [threading.Thread(target=buyer._credit, args=("seller_1", 1, "payout")) for _ in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(fake_db["Ledger"].documents) == 20
+        assert fake_db["Ledger"].insert_calls < 20
+        assert fake_db["Users"].documents["seller_1"]["balance"] + ledger.pending(fake_db, "seller_1") == 20
+
+        def failing_insert_many(documents, ordered=True):
+            raise pymongo_errors.PyMongoError("boom")
+
+        fake_db["Ledger"].insert_many = failing_insert_many
+        assert buyer.add_funds("buyer_1", "buyer_pass", 10)[0] == 528
+
+
+def test_ttl_cache_lru_expiry_and_groups():
+    from be.model.cache import TTLCache
+
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, group="u1")
+    cache.set("b", 2, group="u1")
+    assert cache.get("a") == 1
+    cache.set("c", 3, group="u2")  # 淘汰最久未用的 b
+    assert cache.get("b") is None
+    cache.invalidate_group("u1")
+    assert cache.get("a") is None
+    assert cache.get("c") == 3
+    cache.set("d", 4, ttl=-1)  # 剩余寿命已耗尽的条目不缓存
+    assert cache.get("d") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 3
+    assert cache.stats()["size"] == 1
+
+
+def test_check_token_cache_hits_and_invalidation():
+    from be.model import user as user_module
+
+    fake_db = create_fake_db()
+    with patched_db(fake_db):
+        user = user_module.User()
+    user_module.token_cache.clear()
+    assert user.register("reader", "pw") == (200, "ok")
+    code, _, token = user.login("reader", "pw", "terminal_1")
+    assert code == 200
+
+    lookups = []
+    original_find = fake_db["Users"].find_one
+
+    def tracking_find(query, projection=None):
+        lookups.append(query)
+        return original_find(query, projection)
+
+    fake_db["Users"].find_one = tracking_find
+    assert user.check_token("reader", token) == (200, "ok")
+    assert user.check_token("reader", token) == (200, "ok")
+    assert len(lookups) == 1
+    assert user_module.token_cache.stats()["hits"] == 1
+
+    # 重新登录使旧 token 失效，缓存不能继续放行
+    code, _, new_token = user.login("reader", "pw", "terminal_2")
+    assert code == 200
+    assert user.check_token("reader", token) == error.error_authorization_fail()
+
+    assert user.check_token("reader", new_token) == (200, "ok")
+    assert user.logout("reader", new_token) == (200, "ok")
+    assert user.check_token("reader", new_token) == error.error_authorization_fail()
+    user_module.token_cache.clear()
+
+
+def test_check_token_cache_fill_does_not_outlive_invalidation():
+    from be.model import user as user_module
+
+    fake_db = create_fake_db()
+    with patched_db(fake_db):
+        user = user_module.User()
+    user_module.token_cache.clear()
+    assert user.register("reader", "pw") == (200, "ok")
+    _, _, token = user.login("reader", "pw", "terminal_1")
+
+    # 缓存未命中读到旧 token 之后、写回缓存之前，并发请求登出了该用户
+    original_find = fake_db["Users"].find_one
+
+    def racing_find(query, projection=None):
+        doc = original_find(query, projection)
+        fake_db["Users"].find_one = original_find
+        assert user.logout("reader", token) == (200, "ok")
+        return doc
+
+    fake_db["Users"].find_one = racing_find
+    assert user.check_token("reader", token) == (200, "ok")
+    assert user_module.token_cache.stats()["size"] == 0
+    assert user.check_token("reader", token) == error.error_authorization_fail()
+    user_module.token_cache.clear()
+
+
+@contextmanager
+def fast_kdf(kdf="scrypt"):
+    """缩小 KDF 参数，测试只关心格式与流程。"""
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be.model import password_hash
+
+    with patch.object(be_conf, "Password_KDF", kdf), \
+            patch.object(be_conf, "Password_Scrypt_N", 2 ** 4), \
+            patch.object(be_conf, "Password_PBKDF2_Iterations", 1000):
+        password_hash.verified_cache.clear()
+        yield password_hash
+        password_hash.verified_cache.clear()
+
+
+def test_password_hash_formats_and_upgrade():
+    from unittest.mock import patch
+    from be import conf as be_conf
+
+    with fast_kdf("pbkdf2_sha256") as password_hash:
+        stored = password_hash.hash_password("pw")
+        assert stored.startswith("pbkdf2_sha256$1000$")
+        assert stored != password_hash.hash_password("pw")  # 随机 salt
+        assert password_hash.verify("u", "pw", stored) == (True, False)
+        assert password_hash.verify("u", "bad", stored) == (False, False)
+
+    with fast_kdf("scrypt") as password_hash:
+        # 旧算法的记录仍可校验，但需要按当前配置重算
+        assert password_hash.verify("u", "pw", stored) == (True, True)
+        stored = password_hash.hash_password("pw")
+        assert stored.startswith("scrypt$16$8$1$")
+        assert password_hash.verify("u", "pw", stored) == (True, False)
+        with patch.object(be_conf, "Password_Scrypt_N", 2 ** 5):
+            assert password_hash.verify("u2", "pw", stored) == (True, True)
+
+        # 历史明文与异常记录
+        assert password_hash.verify("u", "pw", "pw") == (True, True)
+        assert password_hash.verify("u", "pw", "other") == (False, False)
+        assert password_hash.verify("u", "pw", None) == (False, False)
+        assert password_hash.verify("u", "pw", "scrypt$x$8$1$a$b") == (False, False)
+
+
+def test_login_rehashes_plaintext_password():
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be.model import user as user_module
+
+    fake_db = create_fake_db()
+    users = fake_db["Users"].documents
+    with fast_kdf(), patched_db(fake_db):
+        user = user_module.User()
+        assert users["buyer_1"]["password"] == "buyer_pass"
+
+        with patch.object(be_conf, "Password_Rehash_On_Login", False):
+            assert user.login("buyer_1", "buyer_pass", "t")[0] == 200
+        assert users["buyer_1"]["password"] == "buyer_pass"
+
+        assert user.login("buyer_1", "wrong", "t")[0] == 401
+        assert users["buyer_1"]["password"] == "buyer_pass"
+        assert user.login("buyer_1", "buyer_pass", "t")[0] == 200
+        assert users["buyer_1"]["password"].startswith("scrypt$")
+        assert user.login("buyer_1", "buyer_pass", "t")[0] == 200
+
+        # 改写后的记录继续用于支付校验
+        _, buyer = instantiate_seller_and_buyer(fake_db)
+        code, _, order_id = buyer.new_order("buyer_1", "store_1", [("book_existing", 1)])
+        assert buyer.payment("buyer_1", "wrong", order_id) == error.error_authorization_fail()
+        assert buyer.payment("buyer_1", "buyer_pass", order_id) == (200, "ok")
+        assert buyer.add_funds("buyer_1", "buyer_pass", 10) == (200, "ok")
+
+        assert user.register("fresh", "pw") == (200, "ok")
+        assert users["fresh"]["password"].startswith("scrypt$")
+
+
+def test_verified_password_cache_and_invalidation():
+    from be.model import user as user_module
+
+    fake_db = create_fake_db()
+    with fast_kdf() as password_hash, patched_db(fake_db):
+        user = user_module.User()
+        assert user.register("reader", "pw") == (200, "ok")
+        stored = fake_db["Users"].documents["reader"]["password"]
+
+        checks = []
+        original_check = password_hash._check
+
+        def counting_check(password, stored):
+            checks.append(password)
+            return original_check(password, stored)
+
+        password_hash._check = counting_check
+        try:
+            for _ in range(3):
+                assert user.check_password("reader", "pw") == (200, "ok")
+            assert len(checks) == 1
+            # 错误密码不缓存
+            for _ in range(2):
+                assert user.check_password("reader", "bad") == error.error_authorization_fail()
+            assert len(checks) == 3
+
+            code, _, token = user.login("reader", "pw", "t")
+            assert user.change_password("reader", "pw", "pw2") == (200, "ok")
+            assert fake_db["Users"].documents["reader"]["password"] != stored
+            assert user.check_password("reader", "pw") == error.error_authorization_fail()
+            assert user.check_password("reader", "pw2") == (200, "ok")
+            assert len(checks) == 5
+
+            # 缓存键包含记录本身：被其他进程改写后不再命中旧条目
+            fake_db["Users"].documents["reader"]["password"] = stored
+            assert user.check_password("reader", "pw2") == error.error_authorization_fail()
+        finally:
+            password_hash._check = original_check
+
+
+@contextmanager
+def stateless_auth(secret="s" * 32):
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be.model import token_auth
+
+    with patch.object(be_conf, "Auth_Mode", "stateless"), patch.object(be_conf, "Auth_Secret", secret):
+        token_auth.versions.clear()
+        yield token_auth
+        token_auth.versions.clear()
+
+
+def test_stateless_tokens_allow_multiple_terminals_without_db_reads():
+    from unittest.mock import patch
+    from be.model import user as user_module
+
+    fake_db = create_fake_db()
+    with fast_kdf(), stateless_auth() as token_auth, patched_db(fake_db):
+        user = user_module.User()
+        assert user.register("reader", "pw") == (200, "ok")
+        _, _, token_1 = user.login("reader", "pw", "terminal_1")
+        _, _, token_2 = user.login("reader", "pw", "terminal_2")
+        assert fake_db["Users"].documents["reader"]["token"] not in (token_1, token_2)
+
+        lookups = []
+        original_find = fake_db["Users"].find_one
+
+        def tracking_find(query, projection=None):
+            lookups.append(query)
+            return original_find(query, projection)
+
+        fake_db["Users"].find_one = tracking_find
+        # 首次校验一次读取全部用户版本，此后不再查库
+        for _ in range(3):
+            assert user.check_token("reader", token_1) == (200, "ok")
+            assert user.check_token("reader", token_2) == (200, "ok")
+        assert lookups == []
+        fake_db["Users"].find_one = original_find
+
+        # 签名、用户与 exp 任一不符均拒绝
+        assert user.check_token("buyer_1", token_1) == error.error_authorization_fail()
+        assert user.check_token("reader", user_module.jwt_encode("reader", "t")) == error.error_authorization_fail()
+        with patch.object(user_module.User, "token_lifetime", -1):
+            _, _, expired = user.login("reader", "pw", "terminal_3")
+        assert user.check_token("reader", expired) == error.error_authorization_fail()
+
+        # 登出使该用户全部终端的 token 失效
+        assert user.logout("reader", token_1) == (200, "ok")
+        assert user.check_token("reader", token_2) == error.error_authorization_fail()
+        _, _, token_3 = user.login("reader", "pw", "terminal_1")
+        assert user.check_token("reader", token_3) == (200, "ok")
+
+        assert user.change_password("reader", "pw", "pw2") == (200, "ok")
+        assert user.check_token("reader", token_3) == error.error_authorization_fail()
+        assert user.login("reader", "pw", "t")[0] == 401
+        _, _, token_4 = user.login("reader", "pw2", "t")
+        assert user.check_token("reader", token_4) == (200, "ok")
+
+        assert user.unregister("reader", "pw2") == (200, "ok")
+        assert user.check_token("reader", token_4) == error.error_authorization_fail()
+        assert user.register("reader", "pw") == (200, "ok")
+        assert user.check_token("reader", token_4) == error.error_authorization_fail()
+        assert token_auth.versions.lookups == 1
+
+
+def test_stateless_version_map_picks_up_other_processes():
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be.model import user as user_module
+
+    fake_db = create_fake_db()
+    with fast_kdf(), stateless_auth("") as token_auth, patched_db(fake_db), \
+            patch.object(be_conf, "Auth_Version_Refresh", 60), patch.object(be_conf, "Auth_Version_Reload", 600):
+        # 未配置密钥时从 Settings 集合读取，各进程共用
+        secret = token_auth.secret()
+        assert fake_db["Settings"].documents["auth_secret"]["value"] == secret
+        token_auth._secret = None
+        assert token_auth.secret() == secret
+
+        user = user_module.User()
+        assert user.register("reader", "pw") == (200, "ok")
+        _, _, token = user.login("reader", "pw", "t")
+        assert user.check_token("reader", token) == (200, "ok")
+        versions = token_auth.versions
+
+        # 其他进程登出：刷新之前沿用本地版本，增量刷新后拒绝
+        users = fake_db["Users"].documents
+        users["reader"]["token_version"] = token_auth.new_version()
+        assert user.check_token("reader", token) == (200, "ok")
+        versions._refreshed_at -= 61
+        assert user.check_token("reader", token) == error.error_authorization_fail()
+        assert versions.refreshes == 1
+
+        # 其他进程注册并登录的用户：本地未收录时查一次
+        users["other"] = {"_id": "other", "password": "pw", "balance": 0, "token_version": 1}
+        other_token = token_auth.encode("other", "t", 1, 60)
+        assert user.check_token("other", other_token) == (200, "ok")
+        assert versions.lookups == 1
+
+        # 其他进程注销：全量重载后移除，再查库得到注销标记
+        users.pop("other")
+        assert user.check_token("other", other_token) == (200, "ok")
+        versions._loaded_at -= 601
+        versions._refreshed_at -= 61
+        assert user.check_token("other", other_token) == error.error_authorization_fail()
+        assert "other" in versions and versions.lookups == 2
+    token_auth._secret = None
+
+
+def test_asgi_stateless_auth():
+    from unittest.mock import patch
+    from be import asgi, serve
+    from be.model import user as user_module
+
+    fake_db = create_fake_db()
+    with fast_kdf(), stateless_auth(), patched_db(fake_db), \
+            patch("be.model.async_db_conn.get_async_db", return_value=AsyncFakeDB(fake_db)):
+        app = asgi.AsgiApp(serve.create_app(), threads=2)
+        assert call_asgi(app, "POST", "/auth/register", {"user_id": "async_u", "password": "pw"})[0] == 200
+        tokens = [call_asgi(app, "POST", "/auth/login",
+                            {"user_id": "async_u", "password": "pw", "terminal": t})[1]["token"] for t in ("t1", "t2")]
+        assert user_module.User().check_token("async_u", tokens[0]) == (200, "ok")
+        assert call_asgi(app, "POST", "/auth/logout", {"user_id": "async_u"},
+                         headers={"token": tokens[1]}) == (200, {"message": "ok"})
+        assert call_asgi(app, "POST", "/auth/logout", {"user_id": "async_u"}, headers={"token": tokens[0]})[0] == 401
+        assert user_module.User().check_token("async_u", tokens[0]) == error.error_authorization_fail()
+        app._executor.shutdown()
+
+
+def test_store_mongodb_initialization():
+    from unittest.mock import patch
+
+    mock_client = MockMongoClient()
+    with patch("pymongo.MongoClient", return_value=mock_client):
+        store_db = store_module.StoreMongoDB(mongo_uri="mongodb://fake", db_name="testdb")
+
+    test_db = mock_client.databases["testdb"]
+    assert test_db.Users.created_indexes
+    assert test_db.Stores.created_indexes
+    assert test_db.Orders.created_indexes
+    assert test_db.Books.created_indexes
+    assert store_db.get_db() is test_db
+    assert store_db.get_db_conn() is mock_client
+
+
+def test_store_mongodb_replaces_retired_book_indexes():
+    from unittest.mock import patch
+
+    mock_client = MockMongoClient()
+    books = mock_client["testdb"].Books
+    # 旧版本创建的索引：同名不同键的 books_by_store_title 与冗余的单字段 title_lower
+    books.existing_indexes = {
+        "_id_": {"key": [("_id", 1)]},
+        "search_index.title_lower_1": {"key": [("search_index.title_lower", 1)]},
+        "books_by_store_title": {"key": [("store_ids", 1), ("search_index.title_lower", 1)]},
+    }
+    with patch("pymongo.MongoClient", return_value=mock_client):
+        store_module.StoreMongoDB(mongo_uri="mongodb://fake", db_name="testdb")
+
+    assert list(books.existing_indexes) == ["_id_"]
+    store_index = [kwargs for keys, kwargs in books.created_indexes if keys[0] == ("store_ids", 1)]
+    assert store_index == [{"name": "books_by_store_title_id"}]
+
+
+def test_store_global_helpers():
+    from unittest.mock import patch
+
+    store_module.database_instance = None
+    store_module.init_completed_event.clear()
+
+    first_client = MockMongoClient()
+    with patch("pymongo.MongoClient", return_value=first_client):
+        store_module.init_database("mongodb://fake", "globaldb")
 
     assert isinstance(store_module.database_instance, store_module.StoreMongoDB)
     assert store_module.init_completed_event.is_set()
@@ -1218,6 +2709,233 @@ def test_store_global_helpers():
     store_module.init_completed_event.clear()
 
 
+def test_store_reconnects_in_forked_worker():
+    from unittest.mock import patch
+
+    parent_client = MockMongoClient()
+    with patch("pymongo.MongoClient", return_value=parent_client):
+        store_module.init_database("mongodb://fake", "forkdb")
+    parent_instance = store_module.database_instance
+
+    # 模拟 fork 后的子进程：pid 变化时重建本进程连接，且不重复建索引
+    child_client = MockMongoClient()
+    with patch("pymongo.MongoClient", return_value=child_client), \
+            patch("os.getpid", return_value=store_module.database_pid + 1):
+        assert store_module.get_db_conn() is child_client
+    assert store_module.database_instance is not parent_instance
+    assert not child_client.databases["bookstore"].Users.created_indexes
+
+    store_module.reset_after_fork()
+    assert store_module.database_instance is None
+    store_module.init_completed_event.clear()
+
+
+def test_app_factory_and_readiness():
+    from be import serve
+
+    app = serve.create_app()
+    rules = {rule.rule for rule in app.url_map.iter_rules()}
+    assert {"/auth/login", "/buyer/new_order", "/seller/ship", "/ready"} <= rules
+    assert serve.create_app() is not app
+
+    was_ready = serve.server_ready.is_set()
+    serve.server_ready.clear()
+    client = app.test_client()
+    assert client.get("/ready").status_code == 503
+    serve.server_ready.set()
+    assert client.get("/ready").status_code == 200
+    if not was_ready:
+        serve.server_ready.clear()
+
+    # 压测进程通过 HTTP 读取服务端的搜索缓存计数
+    search_cache.result_cache.clear()
+    search_cache.result_cache.get("missing")
+    stats = client.get("/search_cache_stats").get_json()
+    assert (stats["hits"], stats["misses"]) == (0, 1) and "size" in stats
+
+
+class AsyncFakeDB:
+    """把同步 FakeDB 的集合方法包装成协程，模拟 AsyncMongoClient 的数据库句柄。"""
+
+    class _Cursor:
+        """find 同步返回游标、链式设置排序/分页，to_list 时才等待结果（同 AsyncCursor）。"""
+
+        def __init__(self, cursor):
+            self._cursor = cursor
+
+        def __getattr__(self, name):
+            method = getattr(self._cursor, name)
+
+            def chain(*args, **kwargs):
+                return AsyncFakeDB._Cursor(method(*args, **kwargs))
+            return chain
+
+        async def to_list(self, length=None):
+            return list(self._cursor)[:length]
+
+    class _Collection:
+        def __init__(self, collection):
+            self._collection = collection
+
+        def find(self, *args, **kwargs):
+            return AsyncFakeDB._Cursor(self._collection.find(*args, **kwargs))
+
+        async def aggregate(self, *args, **kwargs):
+            return AsyncFakeDB._Cursor(iter(self._collection.aggregate(*args, **kwargs)))
+
+        def __getattr__(self, name):
+            method = getattr(self._collection, name)
+
+            async def call(*args, **kwargs):
+                return method(*args, **kwargs)
+            return call
+
+    def __init__(self, fake_db):
+        self._fake_db = fake_db
+
+    def __getitem__(self, name):
+        return self._Collection(self._fake_db[name])
+
+
+def call_asgi(app, method, path, payload=None, headers=None, content_type="application/json"):
+    import asyncio
+
+    body = json.dumps(payload).encode() if payload is not None else b""
+    raw_headers = [(b"content-type", content_type.encode())]
+    for key, value in (headers or {}).items():
+        raw_headers.append((key.encode(), value.encode()))
+    scope = {"type": "http", "method": method, "path": path, "headers": raw_headers, "query_string": b""}
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"], json.loads(sent[1]["body"]) if sent[1]["body"].startswith(b"{") else sent[1]["body"]
+
+
+def test_asgi_native_auth_routes_and_wsgi_bridge():
+    from unittest.mock import patch
+    from be import asgi, serve
+    from be.model import user as user_module
+
+    fake_db = create_fake_db()
+    user_module.token_cache.clear()
+    with patched_db(fake_db), \
+            patch("be.model.async_db_conn.get_async_db", return_value=AsyncFakeDB(fake_db)):
+        app = asgi.AsgiApp(serve.create_app(), threads=2)
+
+        assert call_asgi(app, "POST", "/auth/register", {"user_id": "async_u", "password": "pw"}) == \
+            (200, {"message": "ok"})
+        status, body = call_asgi(app, "POST", "/auth/login",
+                                 {"user_id": "async_u", "password": "pw", "terminal": "t1"})
+        assert status == 200 and body["token"]
+        # 异步与同步实现写入同一份数据，token 可被同步模型校验
+        with patched_db(fake_db):
+            assert user_module.User().check_token("async_u", body["token"]) == (200, "ok")
+        assert call_asgi(app, "POST", "/auth/logout", {"user_id": "async_u"},
+                         headers={"token": body["token"]}) == (200, {"message": "ok"})
+        assert call_asgi(app, "POST", "/auth/login",
+                         {"user_id": "async_u", "password": "bad", "terminal": "t1"})[0] == 401
+
+        status, body = call_asgi(app, "POST", "/buyer/book_detail", {"book_id": "book_existing"})
+        assert status == 200 and body["result"]["title"] == "Existing Book"
+        assert call_asgi(app, "POST", "/buyer/book_detail", {"book_id": "ghost"})[0] == 404
+        assert call_asgi(app, "POST", "/auth/login", None, content_type="text/plain")[0] == 415
+
+        # 未原生异步化的路由经 WSGI 桥接交给 Flask 应用
+        status, body = call_asgi(app, "POST", "/buyer/new_order",
+                                 {"user_id": "buyer_1", "store_id": "store_1",
+                                  "books": [{"id": "book_existing", "count": 1}]})
+        assert status == 200 and body["order_id"]
+        app._executor.shutdown()
+    user_module.token_cache.clear()
+
+
+def test_asgi_read_routes_match_sync_buyer():
+    from unittest.mock import patch
+    from be import asgi, conf as be_conf, serve
+
+    fake_db = create_fake_db()
+    _add_search_books(fake_db, 23)
+    fake_db["Stores"].documents["store_1"]["inventory"][0]["stock_level"] = 15
+    _, buyer = instantiate_seller_and_buyer(fake_db)
+    for _ in range(15):
+        buyer.new_order("buyer_1", "store_1", [("book_existing", 1)])
+
+    requests = [
+        ("/buyer/search_books", {"keyword": "search"}, lambda b: b.search_books("search")),
+        ("/buyer/search_books", {"keyword": "search", "page": 3, "fields": "card"},
+         lambda b: b.search_books("search", page=3, fields="card")),
+        ("/buyer/search_books", {"keyword": "search", "facets": True}, lambda b: b.search_books("search", facets=True)),
+        ("/buyer/search_books", {"keyword": "existing", "store_id": "store_1"},
+         lambda b: b.search_books("existing", "store_1")),
+        ("/buyer/search_books", {"keyword": "existing", "store_id": "ghost"},
+         lambda b: b.search_books("existing", "ghost")),
+        ("/buyer/search_books", {"keyword": " "}, lambda b: b.search_books(" ")),
+        ("/buyer/search_books_advanced", {"title_prefix": "search", "tags": ["Novel"]},
+         lambda b: b.search_books_advanced("search", ["Novel"])),
+        ("/buyer/search_books_advanced", {"tags": ["novel"], "store_id": "store_1", "with_total": False},
+         lambda b: b.search_books_advanced(tags=["novel"], store_id="store_1", with_total=False)),
+        ("/buyer/orders", {"user_id": "buyer_1", "page": 2}, lambda b: b.query_orders("buyer_1", page=2)),
+        ("/buyer/orders", {"user_id": "buyer_1", "status": "unpaid", "page": "x"},
+         lambda b: b.query_orders("buyer_1", "unpaid", "x")),
+        ("/buyer/orders", {"user_id": "ghost"}, lambda b: b.query_orders("ghost")),
+        ("/buyer/suggest", {"prefix": "sea", "limit": 3}, lambda b: b.suggest("sea", 3)),
+    ]
+    with patched_db(fake_db), \
+            patch("be.model.async_db_conn.get_async_db", return_value=AsyncFakeDB(fake_db)):
+        app = asgi.AsgiApp(serve.create_app(), threads=2)
+        # 原生异步路由不经过 WSGI 桥接
+        app._call_wsgi = None
+        for store_filter in ("store_ids", "inventory"):
+            with patch.object(be_conf, "Search_Store_Filter", store_filter):
+                for path, payload, sync_call in requests:
+                    search_cache.result_cache.clear()
+                    code, message, result = sync_call(buyer)
+                    search_cache.result_cache.clear()
+                    assert call_asgi(app, "POST", path, payload) == (code, {"message": message, "result": result})
+
+        # memory 后端的检索在线程池中执行
+        with patch.object(be_conf, "Search_Backend", "memory"):
+            search_cache.result_cache.clear()
+            code, message, result = buyer.search_books("search", page=2)
+            search_cache.result_cache.clear()
+            assert call_asgi(app, "POST", "/buyer/search_books", {"keyword": "search", "page": 2}) == \
+                (code, {"message": message, "result": result})
+
+        # 游标续读
+        status, body = call_asgi(app, "POST", "/buyer/orders", {"user_id": "buyer_1", "cursor": None})
+        cursor = body["result"]["pagination"]["next_cursor"]
+        status, body = call_asgi(app, "POST", "/buyer/orders", {"user_id": "buyer_1", "cursor": cursor})
+        assert status == 200 and len(body["result"]["orders"]) == 5 and not body["result"]["pagination"]["has_next"]
+        app._executor.shutdown()
+
+
+def test_asgi_native_route_errors_map_to_model_error_codes():
+    from be import asgi
+
+    async def db_failure(request):
+        raise pymongo_errors.PyMongoError("async boom")
+
+    async def bug(request):
+        raise KeyError("missing")
+
+    app = asgi.AsgiApp(None, threads=1)
+    app.routes[("POST", "/db_failure")] = db_failure
+    app.routes[("POST", "/bug")] = bug
+
+    status, body = call_asgi(app, "POST", "/db_failure", {})
+    assert status == 528 and "async boom" in body["message"]
+    status, body = call_asgi(app, "POST", "/bug", {})
+    assert status == 530 and "missing" in body["message"]
+    app._executor.shutdown()
+
+
 def test_store_handles_connection_and_init_errors():
     from unittest.mock import patch
 
@@ -1239,13 +2957,18 @@ def test_store_handles_connection_and_init_errors():
 
 
 def test_search_books_in_store_scope():
+    from unittest.mock import patch
+    from be import conf as be_conf
+
     fake_db = create_fake_db()
     _, buyer = instantiate_seller_and_buyer(fake_db)
 
-    code, msg, result = buyer.search_books("Existing", store_id="store_1")
-    assert (code, msg) == (200, "ok")
-    assert result["pagination"]["total_count"] == 1
-    assert result["books"][0]["id"] == "book_existing"
+    for store_filter in ("store_ids", "inventory"):
+        with patch.object(be_conf, "Search_Store_Filter", store_filter):
+            code, msg, result = buyer.search_books("Existing", store_id="store_1")
+        assert (code, msg) == (200, "ok")
+        assert result["pagination"]["total_count"] == 1
+        assert result["books"][0]["id"] == "book_existing"
 
     code, msg, result = buyer.search_books("Existing")
     assert (code, msg) == (200, "ok")
@@ -1253,14 +2976,26 @@ def test_search_books_in_store_scope():
 
 
 def test_search_books_validations():
+    from unittest.mock import patch
+    from be import conf as be_conf
+
     fake_db = create_fake_db()
     _, buyer = instantiate_seller_and_buyer(fake_db)
 
     assert buyer.search_books("   ")[0:2] == error.error_and_message(400, "搜索关键字不能为空")
     assert buyer.search_books("keyword", store_id="ghost")[0:2] == error.error_non_exist_store_id("ghost")
 
+    # inventory 模式：店铺无书时不再查询 Books
     fake_db["Stores"].documents["store_1"]["inventory"] = []
-    code, msg, result = buyer.search_books("keyword", store_id="store_1")
+    with patch.object(be_conf, "Search_Store_Filter", "inventory"):
+        code, msg, result = buyer.search_books("keyword", store_id="store_1")
+    assert (code, msg) == (200, "ok")
+    assert result["pagination"]["total_count"] == 0
+
+    # store_ids 模式：以 Books.store_ids 过滤，不读取店铺书目
+    fake_db["Books"].documents["book_existing"]["store_ids"] = []
+    with patch.object(be_conf, "Search_Store_Filter", "store_ids"):
+        code, msg, result = buyer.search_books("keyword", store_id="store_1")
     assert (code, msg) == (200, "ok")
     assert result["pagination"]["total_count"] == 0
 
@@ -1284,6 +3019,407 @@ def test_search_books_advanced_with_store_filter():
     assert result["pagination"]["total_count"] == 0
 
 
+def _add_search_books(fake_db, count):
+    for i in range(count):
+        book_id = "book_search_{:02d}".format(i)
+        fake_db["Books"].documents[book_id] = {
+            "_id": book_id,
+            "title": "Search Book {}".format(i),
+            "tags": ["novel"],
+            "search_index": {"title_lower": "search book {}".format(i), "tags_lower": ["novel"]},
+        }
+
+
+def test_search_books_cursor_pagination():
+    fake_db = create_fake_db()
+    _add_search_books(fake_db, 23)
+    _, buyer = instantiate_seller_and_buyer(fake_db)
+
+    # 假库不解析 $text，关键字搜索会命中全部 25 本书
+    for search, expected in ((lambda **kw: buyer.search_books("search", **kw), 25),
+                             (lambda **kw: buyer.search_books_advanced(title_prefix="search", **kw), 23)):
+        code, msg, result = search(page=1)
+        assert (code, msg) == (200, "ok")
+        assert result["pagination"]["total_count"] == expected
+        assert result["pagination"]["has_next"] is True
+        seen = [book["id"] for book in result["books"]]
+        cursor = result["pagination"]["next_cursor"]
+        while cursor:
+            code, msg, result = search(cursor=cursor)
+            assert (code, msg) == (200, "ok")
+            # 游标模式默认不计数
+            assert "total_count" not in result["pagination"]
+            seen.extend(book["id"] for book in result["books"])
+            cursor = result["pagination"]["next_cursor"]
+        assert len(seen) == len(set(seen)) == expected
+
+        assert search(cursor="???")[0:2] == error.error_and_message(400, "游标参数无效")
+
+
+def test_search_books_count_modes():
+    from unittest.mock import patch
+    from be import conf as be_conf
+
+    fake_db = create_fake_db()
+    _add_search_books(fake_db, 23)
+    _, buyer = instantiate_seller_and_buyer(fake_db)
+
+    code, msg, result = buyer.search_books("search", with_total=False)
+    assert (code, msg) == (200, "ok")
+    assert "total_count" not in result["pagination"]
+    assert len(result["books"]) == 10 and result["pagination"]["has_next"] is True
+
+    # 超过计数上限时只返回下限，不给出精确总数与总页数
+    with patch.object(be_conf, "Search_Count_Limit", 20):
+        code, msg, result = buyer.search_books_advanced(tags=["novel"])
+        assert (code, msg) == (200, "ok")
+        assert result["pagination"]["total_count_at_least"] == 21
+        assert "total_count" not in result["pagination"]
+        assert "total_pages" not in result["pagination"]
+
+    # 计数上限不在缓存键中，切换配置后清空结果缓存
+    search_cache.result_cache.clear()
+    with patch.object(be_conf, "Search_Count_Limit", 0):
+        code, msg, result = buyer.search_books_advanced(tags=["novel"])
+        assert result["pagination"]["total_count"] == 24
+        assert result["pagination"]["total_pages"] == 3
+        assert "total_count_at_least" not in result["pagination"]
+
+
+def test_search_engine_tokenize_and_rank():
+    from be.model.search_engine import InvertedIndex, tokenize
+
+    assert tokenize("三体 Python编程") == ["三体", "python", "编程"]
+    assert tokenize("科幻小说") == ["科幻", "幻小", "小说"]
+    assert tokenize(["文学", "书"]) == ["文学", "书"]
+
+    index = InvertedIndex()
+    index.add({"_id": "b1", "title": "三体", "author": "刘慈欣", "store_ids": ["s1"]})
+    index.add({"_id": "b2", "title": "编程入门", "book_intro": "写给三体迷的编程书"})
+    index.add({"_id": "b3", "title": "红楼梦", "tags": ["古典", "小说"]})
+    hits = index.search("三体")
+    # 标题命中的权重高于简介命中
+    assert [book_id for _, book_id in hits] == ["b1", "b2"]
+    assert [book_id for _, book_id in index.search("三体", store_id="s1")] == ["b1"]
+    assert index.add_store("b2", "s1") is True
+    assert [book_id for _, book_id in index.search("三体", store_id="s1")] == ["b1", "b2"]
+
+    # 覆盖与删除会撤销旧词条
+    index.add({"_id": "b2", "title": "数据库系统"})
+    assert [book_id for _, book_id in index.search("三体")] == ["b1"]
+    index.remove("b1")
+    assert index.search("三体") == []
+    assert index.add_store("b1", "s1") is False
+
+
+def test_search_books_memory_backend():
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be.model import search_engine
+
+    fake_db = create_fake_db()
+    _add_search_books(fake_db, 23)
+    fake_db["Books"].documents["book_existing"]["book_intro"] = "search"
+    seller, buyer = instantiate_seller_and_buyer(fake_db)
+
+    with patch.object(be_conf, "Search_Backend", "memory"), \
+            patch.object(search_engine, "book_index", search_engine.InvertedIndex()):
+        code, msg, result = buyer.search_books("search")
+        assert (code, msg) == (200, "ok")
+        assert result["pagination"]["total_count"] == 24
+        # 标题命中排在简介命中之前
+        assert result["books"][0]["id"].startswith("book_search_")
+        seen = [book["id"] for book in result["books"]]
+        cursor = result["pagination"]["next_cursor"]
+        while cursor:
+            code, msg, result = buyer.search_books("search", cursor=cursor)
+            assert (code, msg) == (200, "ok")
+            seen.extend(book["id"] for book in result["books"])
+            cursor = result["pagination"]["next_cursor"]
+        assert len(seen) == len(set(seen)) == 24
+        assert seen[-1] == "book_existing"
+
+        code, msg, result = buyer.search_books("search", store_id="store_1")
+        assert (code, msg) == (200, "ok")
+        assert [book["id"] for book in result["books"]] == ["book_existing"]
+
+        # 上架后增量登记店铺归属，无需重建
+        fake_db["Books"].documents["book_search_00"]["store_ids"] = []
+        with patched_db(fake_db):
+            code, msg = seller.add_book("seller_1", "store_1", "book_search_00", json.dumps({"price": 10}), 1)
+        assert (code, msg) == (200, "ok")
+        code, msg, result = buyer.search_books("search", store_id="store_1")
+        assert [book["id"] for book in result["books"]] == ["book_search_00", "book_existing"]
+
+        code, msg, result = buyer.search_books("不存在的词")
+        assert (code, msg) == (200, "ok")
+        assert result["books"] == [] and result["pagination"]["total_count"] == 0
+
+
+def test_search_books_facets():
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be.model import search_engine
+
+    fake_db = create_fake_db()
+    _add_search_books(fake_db, 12)
+    for book_id in ("book_existing", "book_new"):
+        fake_db["Books"].documents.pop(book_id)
+    for i, doc in enumerate(sorted(fake_db["Books"].documents.values(), key=lambda d: d["_id"])):
+        doc["publisher"] = "出版社A" if i < 8 else "出版社B"
+        if i % 3 == 0:
+            doc["search_index"]["tags_lower"].append("classic")
+    fake_db["Books"].documents["book_search_11"].pop("publisher")
+    _, buyer = instantiate_seller_and_buyer(fake_db)
+
+    expected = {
+        "tags": [{"value": "novel", "count": 12}, {"value": "classic", "count": 4}],
+        "publishers": [{"value": "出版社A", "count": 8}, {"value": "出版社B", "count": 3}],
+    }
+    searches = (
+        lambda **kw: buyer.search_books("search", **kw),
+        lambda **kw: buyer.search_books_advanced(title_prefix="search", **kw),
+    )
+    for search in searches:
+        code, msg, result = search(page=2, with_total=True, facets=True)
+        assert (code, msg) == (200, "ok")
+        # 分面统计整个命中集合，不受分页影响；总数随同一次聚合给出
+        assert result["facets"] == expected
+        assert len(result["books"]) == 2 and result["pagination"]["has_next"] is False
+        assert result["pagination"]["total_count"] == 12
+        assert "total_count_at_least" not in result["pagination"]
+
+        code, msg, result = search(facets=True)
+        assert result["pagination"]["has_next"] is True
+        code, msg, result = search(cursor=result["pagination"]["next_cursor"], facets=True)
+        assert (code, msg) == (200, "ok")
+        assert len(result["books"]) == 2 and result["facets"] == expected
+
+        code, msg, result = search()
+        assert "facets" not in result
+
+    search_cache.result_cache.clear()
+    with patch.object(be_conf, "Search_Facet_Limit", 1):
+        code, msg, result = buyer.search_books("search", facets=True)
+    assert result["facets"] == {"tags": [expected["tags"][0]], "publishers": [expected["publishers"][0]]}
+
+    with patch.object(be_conf, "Search_Backend", "memory"), \
+            patch.object(search_engine, "book_index", search_engine.InvertedIndex()):
+        code, msg, result = buyer.search_books("search", facets=True)
+        assert (code, msg) == (200, "ok")
+        assert result["facets"] == expected
+
+    code, msg, result = buyer.search_books("search", store_id="store_1", facets=True)
+    assert (code, msg) == (200, "ok")
+    assert result["books"] == [] and result["facets"] == {"tags": [], "publishers": []}
+
+
+def test_search_books_result_cache():
+    fake_db = create_fake_db()
+    _add_search_books(fake_db, 5)
+    seller, buyer = instantiate_seller_and_buyer(fake_db)
+    cache = search_cache.result_cache
+
+    code, msg, first = buyer.search_books("Search", store_id="store_1")
+    assert (code, msg) == (200, "ok")
+    assert [book["id"] for book in first["books"]] == ["book_existing"]
+    # 关键字归一化后命中同一条目，命中时不再查库
+    fake_db["Books"].documents["book_existing"]["title"] = "Renamed"
+    code, msg, result = buyer.search_books("  search ", store_id="store_1")
+    assert (code, msg) == (200, "ok")
+    assert result == first and result is not first
+    assert cache.stats()["hits"] == 1
+    # 命中返回副本：调用方修改结果不会污染缓存条目
+    result["books"].clear()
+    first["pagination"] = None
+    code, msg, result = buyer.search_books("search", store_id="store_1")
+    assert [book["id"] for book in result["books"]] == ["book_existing"] and result["pagination"]
+    assert cache.stats()["hits"] == 2
+
+    # 上架使该店铺与全站的结果失效，其他店铺的条目不受影响
+    code, msg, global_result = buyer.search_books_advanced(tags=["novel"])
+    assert len(global_result["books"]) == 6
+    fake_db["Books"].documents["book_search_00"]["store_ids"] = []
+    with patched_db(fake_db):
+        code, msg = seller.add_book("seller_1", "store_1", "book_search_00", json.dumps({"price": 10}), 1)
+    assert (code, msg) == (200, "ok")
+    code, msg, result = buyer.search_books("search", store_id="store_1")
+    assert [book["id"] for book in result["books"]] == ["book_existing", "book_search_00"]
+    code, msg, result = buyer.search_books_advanced(tags=["novel"])
+    assert result is not global_result
+
+    # 条目数有界，按 LRU 淘汰
+    previous = cache.maxsize
+    cache.maxsize = 2
+    try:
+        cache.clear()
+        for keyword in ("a", "b", "a", "c"):
+            buyer.search_books(keyword)
+        buyer.search_books("a")
+        buyer.search_books("b")
+        assert cache.stats()["size"] == 2
+        assert (cache.stats()["hits"], cache.stats()["misses"]) == (2, 4)
+    finally:
+        cache.maxsize = previous
+
+
+def test_search_books_fields_and_projection():
+    fake_db = create_fake_db()
+    _add_search_books(fake_db, 3)
+    for doc in fake_db["Books"].documents.values():
+        doc.update({"publisher": "出版社", "author_intro": "x" * 100, "pictures": ["<base64>"]})
+    _, buyer = instantiate_seller_and_buyer(fake_db)
+
+    projections = []
+    find = fake_db["Books"].find
+
+    def recording_find(query, projection=None):
+        projections.append(projection)
+        return find(query, projection)
+
+    fake_db["Books"].find = recording_find
+
+    code, msg, result = buyer.search_books("search")
+    assert (code, msg) == (200, "ok")
+    assert set(result["books"][0]) == {"id", "title", "author", "book_intro", "tags", "text_score"}
+    # 只从 Books 读取结果字段，不再拉取简介/样章/图片
+    assert set(projections[-1]) == {"title", "author", "book_intro", "tags", "score"}
+
+    code, msg, result = buyer.search_books_advanced(title_prefix="search", fields="card")
+    assert (code, msg) == (200, "ok")
+    assert set(result["books"][0]) == {"id", "title", "author", "tags"}
+    # 游标需要排序键，一并投影
+    assert projections[-1] == {"title": 1, "author": 1, "tags": 1, "search_index.title_lower": 1}
+
+    code, msg, result = buyer.search_books_advanced(tags=["novel"], fields=["title", "publisher", "title"])
+    assert (code, msg) == (200, "ok")
+    assert result["books"][0] == {"id": "book_new", "title": "New Arrival", "publisher": "出版社"}
+
+    for fields in ("compact", ["title", "pictures"], [], 1):
+        assert buyer.search_books("search", fields=fields)[:2] == (400, "返回字段参数无效")
+        assert buyer.search_books_advanced(title_prefix="search", fields=fields)[:2] == (400, "返回字段参数无效")
+
+
+def test_search_index_prefix_range():
+    from be.model import search_index
+
+    assert search_index.prefix_range("Py.*") == {"$gte": "py.*", "$lt": "py.*\U0010ffff"}
+    assert search_index.fold_tags("文学\nNovel, ") == ["文学", "novel"]
+    assert search_index.build("Hello", ["A"]) == {"title_lower": "hello", "tags_lower": ["a"]}
+
+
+def test_search_index_folds_width_and_case_on_both_sides():
+    from be.model import search_index
+
+    # 全角字母、兼容字符与特殊大小写在写入与查询两侧折叠为同一形式
+    assert search_index.fold("Ｐython") == search_index.fold("python") == "python"
+    assert search_index.fold("Straße") == search_index.fold("STRASSE") == "strasse"
+    assert search_index.build("Ｐython ｉｎ Action", ["ＮＯＶＥＬ"]) == \
+        {"title_lower": "python in action", "tags_lower": ["novel"]}
+
+    fake_db = create_fake_db()
+    seller, buyer = instantiate_seller_and_buyer(fake_db)
+    with patched_db(fake_db):
+        assert seller.add_book("seller_1", "store_1", "book_fw", json.dumps(
+            {"id": "book_fw", "title": "Ｐython Cookbook", "tags": ["Ｎovel"]}), 1) == (200, "ok")
+    for title_prefix, tags in (("python", None), ("ＰＹＴＨ", None), (None, ["NOVEL"])):
+        code, _, result = buyer.search_books_advanced(title_prefix=title_prefix, tags=tags)
+        assert code == 200 and "book_fw" in [book["id"] for book in result["books"]]
+
+
+def test_search_books_advanced_prefix_range_order():
+    fake_db = create_fake_db()
+    _add_search_books(fake_db, 23)
+    fake_db["Books"].documents["book_regex"] = {
+        "_id": "book_regex",
+        "title": "(a+)+ Regex",
+        "search_index": {"title_lower": "(a+)+ regex", "tags_lower": []},
+    }
+    _, buyer = instantiate_seller_and_buyer(fake_db)
+
+    # 元字符按字面匹配
+    code, msg, result = buyer.search_books_advanced(title_prefix="(A+)+")
+    assert (code, msg) == (200, "ok")
+    assert [book["id"] for book in result["books"]] == ["book_regex"]
+    code, msg, result = buyer.search_books_advanced(title_prefix=".*")
+    assert result["pagination"]["total_count"] == 0
+
+    # 结果按 (title_lower, _id) 索引顺序返回，游标续读不重不漏
+    code, msg, result = buyer.search_books_advanced(title_prefix="SEARCH book")
+    assert result["pagination"]["total_count"] == 23
+    titles = [book["title"].lower() for book in result["books"]]
+    assert titles == sorted(titles)
+    seen = [book["id"] for book in result["books"]]
+    cursor = result["pagination"]["next_cursor"]
+    while cursor:
+        code, msg, result = buyer.search_books_advanced(title_prefix="SEARCH book", cursor=cursor)
+        assert (code, msg) == (200, "ok")
+        seen.extend(book["id"] for book in result["books"])
+        cursor = result["pagination"]["next_cursor"]
+    expected = sorted(fake_db["Books"].documents[book_id]["search_index"]["title_lower"] for book_id in seen)
+    assert [fake_db["Books"].documents[book_id]["search_index"]["title_lower"] for book_id in seen] == expected
+    assert len(set(seen)) == 23
+
+
+def test_suggest_index_prefix_and_popularity():
+    from be.model.suggest import SuggestIndex
+
+    index = SuggestIndex(max_entries=100, top_n=5, max_prefix_cache=2)
+    index.add_book({"_id": "b1", "title": "Python Cookbook", "author": "David",
+                    "search_index": {"title_lower": "python cookbook", "tags_lower": ["编程"]}}, 3)
+    index.add_book({"_id": "b2", "title": "Python 入门", "author": "张三",
+                    "search_index": {"title_lower": "python 入门", "tags_lower": ["编程", "入门"]}}, 8)
+    index.add_book({"_id": "b3", "title": "Pyramid", "author": "Pyotr",
+                    "search_index": {"title_lower": "pyramid", "tags_lower": []}}, 1)
+
+    # 短前缀走预计算的前 N 名，长前缀走二分区间
+    assert [s["book_id"] for s in index.suggest("py")] == ["b2", "b1", "b3"]
+    assert [s["book_id"] for s in index.suggest("PYTH")] == ["b2", "b1"]
+    assert [s["book_id"] for s in index.suggest("编程")] == ["b2", "b1"]
+    # 作者名同样可联想，同一本书只出现一次
+    assert [s["book_id"] for s in index.suggest("pyo")] == ["b3"]
+    assert index.suggest("pyr", limit=1) == [{"book_id": "b3", "title": "Pyramid"}]
+    assert index.suggest("") == []
+
+    assert index.bump("b3", 10) is True
+    assert [s["book_id"] for s in index.suggest("py")] == ["b3", "b2", "b1"]
+    assert index.bump("missing") is False
+
+    # 条目数达到上限后不再收录
+    small = SuggestIndex(max_entries=2)
+    assert small.add_book({"_id": "x", "title": "A", "author": "B"}) is True
+    assert small.add_book({"_id": "y", "title": "C", "author": "D"}) is False
+
+
+def test_buyer_suggest_builds_from_books_and_orders():
+    from unittest.mock import patch
+    from be.model import suggest
+
+    fake_db = create_fake_db()
+    fake_db["Books"].documents["book_new"]["search_index"]["title_lower"] = "existing sequel"
+    fake_db["Books"].documents["book_new"]["title"] = "Existing Sequel"
+    seller, buyer = instantiate_seller_and_buyer(fake_db)
+
+    with patch.object(suggest, "suggest_index", suggest.SuggestIndex()):
+        # book_new 卖出 5 本，热度高于只在一家店铺在售的 book_existing
+        fake_db["Orders"].documents["o1"] = {"_id": "o1", "status": "paid",
+                                             "items": [{"book_id": "book_new", "quantity": 5}]}
+        code, msg, result = buyer.suggest("exist")
+        assert (code, msg) == (200, "ok")
+        assert [s["book_id"] for s in result["suggestions"]] == ["book_new", "book_existing"]
+
+        assert buyer.suggest("  ")[0:2] == error.error_and_message(400, "搜索前缀不能为空")
+        assert buyer.suggest("ex", limit="x")[0:2] == error.error_and_message(400, "数量参数无效")
+
+        # 上架增量更新热度
+        for store in ("store_2", "store_3", "store_4", "store_5", "store_6"):
+            fake_db["Stores"].documents[store] = {"_id": store, "user_id": "seller_1", "inventory": []}
+            with patched_db(fake_db):
+                assert seller.add_book("seller_1", store, "book_existing", json.dumps({"price": 1}), 1) == (200, "ok")
+        code, msg, result = buyer.suggest("ex")
+        assert [s["book_id"] for s in result["suggestions"]] == ["book_existing", "book_new"]
+
+
 def test_get_book_detail_success():
     fake_db = create_fake_db()
     _, buyer = instantiate_seller_and_buyer(fake_db)
@@ -1293,6 +3429,64 @@ def test_get_book_detail_success():
     assert detail["title"] == "Existing Book"
 
 
+def test_book_pictures_stored_out_of_line(tmp_path):
+    import base64
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be import serve
+    from be.model import picture
+
+    fake_db = create_fake_db()
+    seller, buyer = instantiate_seller_and_buyer(fake_db)
+    cover = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+    back = b"\xff\xd8\xff" + b"back cover"
+    encoded = [base64.b64encode(data).decode("ascii") for data in (cover, cover, back, cover)]
+    cover_id, back_id = picture.content_id(cover), picture.content_id(back)
+
+    with patch.object(be_conf, "Picture_Store", "filesystem"), \
+            patch.object(be_conf, "Picture_Dir", str(tmp_path)), \
+            patched_db(fake_db):
+        code, msg = seller.add_book("seller_1", "store_1", "book_new", json.dumps({"pictures": encoded}), 1)
+        assert (code, msg) == (200, "ok")
+        # 内容寻址去重：重复的图片只存一份，Books 只保存 ID
+        assert fake_db["Books"].documents["book_new"]["picture_ids"] == [cover_id, back_id]
+        assert "pictures" not in fake_db["Books"].documents["book_new"]
+        assert len(list(tmp_path.glob("original/*/*"))) == 2
+
+        code, msg, detail = buyer.get_book_detail("book_new")
+        assert detail["pictures"] == ["/book/picture/" + cover_id, "/book/picture/" + back_id]
+        assert detail["thumbnails"] == ["/book/picture/" + cover_id + "?size=thumb",
+                                        "/book/picture/" + back_id + "?size=thumb"]
+
+        client = serve.create_app().test_client()
+        response = client.get("/book/picture/" + cover_id)
+        assert response.status_code == 200
+        assert response.data == cover and response.mimetype == "image/png"
+        etag = response.headers["ETag"]
+        assert response.headers["Accept-Ranges"] == "bytes"
+
+        assert client.get("/book/picture/" + cover_id, headers={"If-None-Match": etag}).status_code == 304
+        response = client.get("/book/picture/" + cover_id, headers={"Range": "bytes=8-15"})
+        assert response.status_code == 206
+        assert response.data == cover[8:16]
+        assert response.headers["Content-Range"] == "bytes 8-15/{}".format(len(cover))
+
+        if picture.Image is None:
+            # 未安装 Pillow 时没有缩略图，返回原图
+            assert client.get("/book/picture/" + back_id + "?size=thumb").data == back
+        assert client.get("/book/picture/" + "0" * 64).status_code == 404
+        assert client.get("/book/picture/../secret").status_code == 404
+        assert client.get("/book/picture/" + cover_id + "?size=huge").status_code == 400
+
+        code, msg = seller.add_book("seller_1", "store_1", "book_other", json.dumps({"pictures": ["@@@"]}), 1)
+        assert (code, msg) == error.error_and_message(400, "图片数据无效")
+
+    # 尚未迁出的旧文档原样返回内嵌图片
+    fake_db["Books"].documents["book_existing"]["pictures"] = ["aGVsbG8="]
+    code, msg, detail = buyer.get_book_detail("book_existing")
+    assert detail["pictures"] == ["aGVsbG8="] and detail["thumbnails"] == []
+
+
 def test_search_books_advanced_validations():
     fake_db = create_fake_db()
     _, buyer = instantiate_seller_and_buyer(fake_db)
@@ -1317,3 +3511,88 @@ def test_get_book_detail_errors():
     fake_db["Books"].find_one = lambda *args, **kwargs: (_ for _ in ()).throw(pymongo_errors.PyMongoError("boom"))
     assert buyer.get_book_detail("book_existing")[0] == 528
 
+
+
+def test_run_in_transaction_modes():
+    from unittest.mock import patch
+    from be import conf as be_conf
+    from be.model.db_conn import DBConn
+
+    class FakeSession:
+        def __init__(self):
+            self.aborted = False
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def with_transaction(self, callback):
+            try:
+                return callback(self)
+            except BaseException:
+                self.aborted = True
+                raise
+
+    class FakeClient:
+        def __init__(self):
+            self.sessions = []
+
+        def start_session(self):
+            session = FakeSession()
+            self.sessions.append(session)
+            return session
+
+    fake_db = create_fake_db()
+    fake_db.client = FakeClient()
+    with patched_db(fake_db):
+        conn = DBConn()
+
+    # 默认关闭事务：session 为 None，abort 直接返回结果
+    assert conn.run_in_transaction(lambda session: session) is None
+    assert conn.abort(None, (518, "x")) == (518, "x")
+    assert fake_db.client.sessions == []
+
+    with patch.object(be_conf, "Use_Transaction", True):
+        result = conn.run_in_transaction(lambda session: conn.abort(session, error.error_stock_level_low("b")))
+        assert result == error.error_stock_level_low("b")
+        assert fake_db.client.sessions[-1].aborted
+
+        assert conn.run_in_transaction(lambda session: (200, "ok")) == (200, "ok")
+        assert not fake_db.client.sessions[-1].aborted
+
+
+def test_collection_inventory_layout_flow():
+    from unittest.mock import patch
+    from be import conf as be_conf
+
+    fake_db = create_fake_db()
+    fake_db["Stores"].documents["store_1"]["inventory"] = []
+    with patch.object(be_conf, "Inventory_Layout", "collection"):
+        seller, buyer = instantiate_seller_and_buyer(fake_db)
+
+        assert seller.add_book("seller_1", "store_1", "book_existing", json.dumps({"price": 100}), 5) == (200, "ok")
+        assert seller.add_book("seller_1", "store_1", "book_existing", json.dumps({"price": 100}), 5) == \
+            error.error_exist_book_id("book_existing")
+        assert seller.add_stock_level("seller_1", "store_1", "book_existing", 2) == (200, "ok")
+        assert seller.add_stock_level("seller_1", "store_1", "ghost", 2) == error.error_non_exist_book_id("ghost")
+
+        code, _, order_id = buyer.new_order("buyer_1", "store_1", [("book_existing", 3)])
+        assert code == 200
+        assert buyer.payment("buyer_1", "buyer_pass", order_id) == (200, "ok")
+        assert seller.ship_order("seller_1", order_id) == (200, "ok")
+
+        code, _, result = seller.add_books("seller_1", "store_1", [
+            {"book_info": {"id": "book_existing", "price": 100}, "stock_level": 1},
+            {"book_info": {"id": "book_bulk", "price": 20}, "stock_level": 4},
+        ])
+        assert code == 200 and result["added"] == 1
+        assert [e["book_id"] for e in result["errors"]] == ["book_existing"]
+        code, _, result = seller.add_stock_levels("seller_1", "store_1", [{"book_id": "book_bulk", "add_stock_level": 1}])
+        assert code == 200 and result == {"updated": 1, "errors": []}
+        assert fake_db["Inventory"].documents[("store_1", "book_bulk")]["stock_level"] == 5
+
+    # 库存只写入独立集合，店铺文档保持不变
+    assert fake_db["Stores"].documents["store_1"]["inventory"] == []
+    assert fake_db["Inventory"].documents[("store_1", "book_existing")]["stock_level"] == 5 + 2 - 3
@@ -85,6 +85,30 @@ class TestQueryOrders:
             page2_ids = [order["order_id"] for order in result2["orders"]]
             assert len(set(page1_ids) & set(page2_ids)) == 0
 
+    def test_buyer_query_orders_cursor(self):
+        code, result = self.buyer.query_orders()
+        assert code == 200
+        cursor = result["pagination"]["next_cursor"]
+        assert cursor
+        page1_ids = [order["order_id"] for order in result["orders"]]
+
+        code, result2 = self.buyer.query_orders(cursor=cursor)
+        assert code == 200
+        page2_ids = [order["order_id"] for order in result2["orders"]]
+        assert len(page2_ids) == 2
+        assert set(page1_ids + page2_ids) == set(self.order_ids)
+        assert result2["pagination"]["has_next"] is False
+        assert result2["pagination"]["next_cursor"] is None
+        assert "total_count" not in result2["pagination"]
+
+        code, result3 = self.buyer.query_orders(cursor=cursor, with_total=True)
+        assert code == 200
+        assert result3["pagination"]["total_count"] == 12
+
+    def test_buyer_query_orders_invalid_cursor(self):
+        code, result = self.buyer.query_orders(cursor="###")
+        assert code == 400
+
     def test_buyer_query_orders_invalid_page_type(self):
         # 非数字页码
         code, result = self.buyer.query_orders(page="not_number")
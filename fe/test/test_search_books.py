@@ -1,4 +1,8 @@
+import base64
+from urllib.parse import urljoin
+
 import pytest
+import requests
 
 from fe import conf
 from fe.test.gen_book_data import GenBook
@@ -161,6 +165,66 @@ class TestSearchBooks:
                 assert last_page_result["pagination"]["has_next"] == False
                 assert len(last_page_result["books"]) <= 10
 
+    def test_search_books_cursor(self):
+        code, result = self.buyer.search_books("小说", store_id=self.store_id)
+        assert code == 200
+        total_count = result["pagination"]["total_count"]
+        seen = [book["id"] for book in result["books"]]
+        cursor = result["pagination"]["next_cursor"]
+        while cursor:
+            code, result = self.buyer.search_books("小说", store_id=self.store_id, cursor=cursor)
+            assert code == 200
+            assert "total_count" not in result["pagination"]
+            seen.extend(book["id"] for book in result["books"])
+            cursor = result["pagination"]["next_cursor"]
+        assert len(seen) == len(set(seen)) == total_count
+
+    def test_search_books_without_total(self):
+        code, result = self.buyer.search_books("小说", with_total=False)
+        assert code == 200
+        assert "total_count" not in result["pagination"]
+        assert len(result["books"]) <= 10
+
+    def test_search_books_invalid_cursor(self):
+        code, result = self.buyer.search_books("小说", cursor="###")
+        assert code == 400
+        code, result = self.buyer.search_books_advanced(tags=["小说"], cursor="###")
+        assert code == 400
+
+    def test_search_books_facets(self):
+        code, result = self.buyer.search_books("小说", store_id=self.store_id, facets=True)
+        assert code == 200
+        facets = result["facets"]
+        assert set(facets) == {"tags", "publishers"}
+        total_count = result["pagination"]["total_count"]
+        for name in ("tags", "publishers"):
+            counts = [item["count"] for item in facets[name]]
+            assert counts == sorted(counts, reverse=True)
+            assert all(0 < count <= total_count for count in counts)
+
+        code, result = self.buyer.search_books_advanced(tags=["小说"], store_id=self.store_id, facets=True)
+        assert code == 200
+        if result["books"]:
+            assert {"value": "小说", "count": result["pagination"]["total_count"]} in result["facets"]["tags"]
+
+        code, result = self.buyer.search_books("小说")
+        assert code == 200
+        assert "facets" not in result
+
+    def test_search_books_card_view(self):
+        code, result = self.buyer.search_books("小说", fields="card")
+        assert code == 200
+        for book in result["books"]:
+            assert set(book) <= {"id", "title", "author", "tags", "text_score"}
+
+        code, result = self.buyer.search_books_advanced(tags=["小说"], fields=["title", "publisher"])
+        assert code == 200
+        for book in result["books"]:
+            assert set(book) == {"id", "title", "publisher"}
+
+        code, result = self.buyer.search_books("小说", fields=["content"])
+        assert code == 400
+
     def test_search_books_advanced_title_prefix(self):
         # 标题前缀
         code, result = self.buyer.search_books_advanced(title_prefix="小")
@@ -168,6 +232,14 @@ class TestSearchBooks:
         assert "books" in result
         assert "pagination" in result
 
+    def test_search_books_advanced_title_prefix_literal(self):
+        # 正则元字符按字面匹配，不会报错也不会退化为全表扫描
+        for prefix in ["(", ".*", "[a-", "a+)+$"]:
+            code, result = self.buyer.search_books_advanced(title_prefix=prefix)
+            assert code == 200
+            for book in result["books"]:
+                assert book["title"].lower().startswith(prefix.lower())
+
     def test_search_books_advanced_tags(self):
         # 标签
         code, result = self.buyer.search_books_advanced(tags=["小说", "文学"])
@@ -285,6 +357,24 @@ class TestSearchBooks:
             for field in required_fields:
                 assert field in detail
 
+    def test_get_book_pictures(self):
+        book = self.buy_book_info_list[0][0]
+        code, detail = self.buyer.get_book_detail(book.id)
+        assert code == 200
+        if not book.pictures:
+            return
+        assert len(detail["pictures"]) == len(set(book.pictures))
+        assert len(detail["thumbnails"]) == len(detail["pictures"])
+
+        url = urljoin(conf.URL, detail["pictures"][0])
+        r = requests.get(url)
+        assert r.status_code == 200
+        assert r.content in [base64.b64decode(p) for p in book.pictures]
+        assert requests.get(url, headers={"If-None-Match": r.headers["ETag"]}).status_code == 304
+        r = requests.get(url, headers={"Range": "bytes=0-9"})
+        assert r.status_code == 206 and len(r.content) == 10
+        assert requests.get(urljoin(conf.URL, detail["thumbnails"][0])).status_code == 200
+
     def test_get_book_detail_empty_id(self):
         code, detail = self.buyer.get_book_detail("")
         assert code != 200
@@ -37,4 +37,11 @@ class TestStoreIndexes:
         keys = [list(i.get("key", {}).keys()) for i in indexes]
         flat_keys = {k for sub in keys for k in sub}
         assert "search_index.title_lower" in flat_keys
-        assert "search_index.tags_lower" in flat_keys
\ No newline at end of file
+        assert "search_index.tags_lower" in flat_keys
+
+    def test_inventory_unique_store_book_index(self):
+        indexes = {i.get("name"): i for i in self.db["Inventory"].list_indexes()}
+        # 独立库存布局：(store_id, book_id) 唯一复合索引
+        assert "inventory_store_book" in indexes
+        assert indexes["inventory_store_book"].get("unique")
+        assert list(indexes["inventory_store_book"]["key"].keys()) == ["store_id", "book_id"]
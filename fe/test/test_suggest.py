@@ -0,0 +1,38 @@
+import uuid
+
+import pytest
+
+from fe.test.gen_book_data import GenBook
+from fe.access.new_buyer import register_new_buyer
+
+
+class TestSuggest:
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self):
+        self.seller_id = "test_suggest_seller_id_{}".format(str(uuid.uuid1()))
+        self.store_id = "test_suggest_store_id_{}".format(str(uuid.uuid1()))
+        self.buyer_id = "test_suggest_buyer_id_{}".format(str(uuid.uuid1()))
+        gen_book = GenBook(self.seller_id, self.store_id)
+        ok, _ = gen_book.gen(non_exist_book_id=False, low_stock_level=False, max_book_count=5)
+        assert ok
+        self.books = [book for book, _ in gen_book.buy_book_info_list]
+        self.buyer = register_new_buyer(self.buyer_id, self.buyer_id)
+        yield
+
+    def test_suggest_title_prefix(self):
+        book = self.books[0]
+        prefix = book.title[:2]
+        code, result = self.buyer.suggest(prefix, limit=20)
+        assert code == 200
+        suggestions = result["suggestions"]
+        assert 0 < len(suggestions) <= 20
+        assert all(set(s) == {"book_id", "title"} for s in suggestions)
+
+    def test_suggest_limit(self):
+        code, result = self.buyer.suggest(self.books[0].title[:1], limit=1)
+        assert code == 200
+        assert len(result["suggestions"]) <= 1
+
+    def test_suggest_empty_prefix(self):
+        code, _ = self.buyer.suggest("  ")
+        assert code == 400
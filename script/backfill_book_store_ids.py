@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Books.store_ids backfill script
+- Denormalizes store membership onto Books: store_ids lists every store selling the book
+- Reads membership from Stores.inventory (embedded layout) or the Inventory collection
+- Creates the books_by_store_title_id index used by store-scoped search
+- Idempotent ($addToSet) - safe to run multiple times
+- Dry-run mode to preview changes without writing
+
+Run once before opting store-scoped search into BOOKSTORE_SEARCH_STORE_FILTER=store_ids
+(the default, inventory, needs no backfill);
+afterwards Seller.add_book keeps store_ids up to date.
+
+Usage:
+  python3 script/backfill_book_store_ids.py \
+    --mongo-uri mongodb://localhost:27017 \
+    --mongo-db bookstore \
+    --layout embedded \
+    --dry-run
+"""
+
+import argparse
+import logging
+
+try:
+    from pymongo import MongoClient, ASCENDING, UpdateMany
+    from pymongo.errors import PyMongoError
+except Exception:
+    MongoClient = None  # type: ignore
+    PyMongoError = Exception  # type: ignore
+
+
+logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Backfill Books.store_ids from store inventory")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017", help="MongoDB connection URI")
+    parser.add_argument("--mongo-db", default="bookstore", help="MongoDB database name")
+    parser.add_argument("--layout", choices=["embedded", "collection"], default="embedded",
+                        help="Inventory layout to read membership from")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Bulk write batch size")
+    parser.add_argument("--dry-run", action="store_true", help="Preview only, no writes")
+    return parser.parse_args()
+
+
+def connect_mongo(uri: str, db_name: str):
+    if MongoClient is None:
+        raise RuntimeError("pymongo is not installed. Install with: pip install pymongo")
+    client = MongoClient(uri)
+    return client[db_name]
+
+
+def ensure_store_index(mongo_db, dry_run: bool) -> None:
+    if dry_run:
+        logging.info("[DRY-RUN] Would create index Books(store_ids, search_index.title_lower, _id)")
+        return
+    # books_by_store_title was the earlier (store_ids, search_index.title_lower) definition
+    if "books_by_store_title" in mongo_db.Books.index_information():
+        mongo_db.Books.drop_index("books_by_store_title")
+    mongo_db.Books.create_index(
+        [("store_ids", ASCENDING), ("search_index.title_lower", ASCENDING), ("_id", ASCENDING)],
+        name="books_by_store_title_id"
+    )
+
+
+def flush(collection, ops: list, dry_run: bool) -> int:
+    if not ops:
+        return 0
+    if dry_run:
+        return len(ops)
+    collection.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def iter_memberships(mongo_db, layout: str):
+    """Yield (store_id, [book_id, ...]) groups."""
+    if layout == "collection":
+        pipeline = [{"$group": {"_id": "$store_id", "book_ids": {"$push": "$book_id"}}}]
+        for group in mongo_db.Inventory.aggregate(pipeline, allowDiskUse=True):
+            yield group["_id"], group["book_ids"]
+        return
+    for store in mongo_db.Stores.find({"inventory.0": {"$exists": True}}, {"inventory.book_id": 1}):
+        yield store["_id"], [item["book_id"] for item in store.get("inventory", [])]
+
+
+def backfill(mongo_db, layout: str, batch_size: int, dry_run: bool) -> int:
+    """One UpdateMany per batch of books in a store: $addToSet the store id."""
+    ops = []
+    linked = 0
+    for store_id, book_ids in iter_memberships(mongo_db, layout):
+        for start in range(0, len(book_ids), batch_size):
+            chunk = book_ids[start:start + batch_size]
+            ops.append(UpdateMany({"_id": {"$in": chunk}}, {"$addToSet": {"store_ids": store_id}}))
+            linked += len(chunk)
+            if len(ops) >= 100:
+                flush(mongo_db.Books, ops, dry_run)
+                ops = []
+    flush(mongo_db.Books, ops, dry_run)
+    return linked
+
+
+def main():
+    args = parse_args()
+    try:
+        mongo_db = connect_mongo(args.mongo_uri, args.mongo_db)
+        ensure_store_index(mongo_db, args.dry_run)
+        count = backfill(mongo_db, args.layout, args.batch_size, args.dry_run)
+    except PyMongoError as e:
+        logging.error(f"store_ids backfill failed: {e}")
+        return
+    logging.info(f"Summary: layout={args.layout}, store-book links={count}, dry_run={args.dry_run}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,15 @@
 """
 MongoDB search indexes creation script
 - Creates search_index.title_lower and search_index.tags_lower indexes for Books collection
-- Updates existing Books documents to include search_index fields
+- Updates existing Books documents whose search_index fields are missing or were built
+  by an older normalization rule (see be/model/search_index.py)
 - Idempotent operations - safe to run multiple times
 - Dry-run mode to preview changes without writing
 
+Seller.add_book upserts the catalog document with search_index already filled in,
+so this backfill is needed for Books imported by other means and after the
+normalization rule changes.
+
 Usage:
   python3 script/create_search_indexes.py \
     --mongo-uri mongodb://localhost:27017 \
@@ -15,15 +20,21 @@ Usage:
 
 import argparse
 import logging
+import os
+import sys
 from typing import Optional
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
 try:
-    from pymongo import MongoClient, ASCENDING
+    from pymongo import MongoClient, ASCENDING, UpdateOne
     from pymongo.errors import PyMongoError
 except Exception:
     MongoClient = None  # type: ignore
     PyMongoError = Exception  # type: ignore
 
+from be.model import search_index
+
 
 logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 
@@ -44,25 +55,10 @@ def connect_mongo(uri: str, db_name: str):
     return client[db_name]
 
 
-def to_lower(s: Optional[str]) -> str:
-    """Convert string to lowercase, handle None values"""
-    return s.lower() if isinstance(s, str) else ""
-
-
-def tags_to_lower(tags) -> list:
-    """Convert tags to lowercase list, handle various input formats"""
-    if not tags:
-        return []
-    
-    if isinstance(tags, list):
-        return [tag.lower() for tag in tags if isinstance(tag, str)]
-    
-    if isinstance(tags, str):
-        # Handle newline-separated or comma-separated tags
-        parts = [t.strip().lower() for t in tags.replace("\n", ",").split(",") if t.strip()]
-        return parts
-    
-    return []
+def stale_search_index(doc: dict) -> Optional[dict]:
+    """Recomputed search_index when the stored one is missing or was folded by an older rule"""
+    expected = search_index.build(doc.get("title"), doc.get("tags"))
+    return None if doc.get("search_index") == expected else expected
 
 
 def check_existing_indexes(mongo_db, dry_run: bool) -> dict:
@@ -90,14 +86,15 @@ def create_search_indexes(mongo_db, dry_run: bool) -> bool:
     """Create search_index.title_lower and search_index.tags_lower indexes"""
     if dry_run:
         logging.info("DRY-RUN: Would create search indexes:")
-        logging.info("  - search_index.title_lower (ASCENDING)")
+        logging.info("  - search_index.title_lower, _id (ASCENDING)")
         logging.info("  - search_index.tags_lower (ASCENDING)")
         return True
     
     try:
         # Create title_lower index
         try:
-            mongo_db.Books.create_index([("search_index.title_lower", ASCENDING)])
+            # _id 作为第二键：前缀区间内按 (title_lower, _id) 有序，分页结果稳定
+            mongo_db.Books.create_index([("search_index.title_lower", ASCENDING), ("_id", ASCENDING)])
             logging.info("Created index: search_index.title_lower")
         except PyMongoError as e:
             if "already exists" in str(e).lower():
@@ -123,76 +120,46 @@ def create_search_indexes(mongo_db, dry_run: bool) -> bool:
 
 
 def update_search_index_fields(mongo_db, batch_size: int, dry_run: bool) -> int:
-    """Update Books documents to include search_index fields"""
+    """Recompute search_index for Books documents whose field is missing or stale
+
+    Every document is compared against be/model/search_index.build, so the script also
+    backfills existing fields after the normalization rule changes (e.g. lower -> NFKC + casefold).
+    """
     try:
-        # Count total documents
         total_docs = mongo_db.Books.count_documents({})
         logging.info(f"Total Books documents: {total_docs}")
-        
-        # Count documents missing search_index field
-        missing_search_index = mongo_db.Books.count_documents({"search_index": {"$exists": False}})
-        logging.info(f"Documents missing search_index field: {missing_search_index}")
-        
-        if dry_run:
-            if missing_search_index > 0:
-                # Show sample documents that would be updated
-                sample_docs = list(mongo_db.Books.find(
-                    {"search_index": {"$exists": False}}, 
-                    {"_id": 1, "title": 1, "tags": 1}
-                ).limit(3))
-                
-                logging.info("DRY-RUN: Sample documents that would be updated:")
-                for doc in sample_docs:
-                    search_index = {
-                        "title_lower": to_lower(doc.get("title")),
-                        "tags_lower": tags_to_lower(doc.get("tags"))
-                    }
-                    logging.info(f"  {doc['_id']}: {search_index}")
-            
-            return missing_search_index
-        
-        if missing_search_index == 0:
-            logging.info("All documents already have search_index field")
-            return 0
-        
-        # Update documents in batches
+
+        cursor = mongo_db.Books.find({}, {"_id": 1, "title": 1, "tags": 1, "search_index": 1}).batch_size(batch_size)
+        stale_count = 0
         updated_count = 0
-        cursor = mongo_db.Books.find(
-            {"search_index": {"$exists": False}}, 
-            {"_id": 1, "title": 1, "tags": 1}
-        )
-        
         batch_updates = []
         for doc in cursor:
-            search_index = {
-                "title_lower": to_lower(doc.get("title")),
-                "tags_lower": tags_to_lower(doc.get("tags"))
-            }
-            
-            batch_updates.append({
-                "filter": {"_id": doc["_id"]},
-                "update": {"$set": {"search_index": search_index}}
-            })
-            
+            expected = stale_search_index(doc)
+            if expected is None:
+                continue
+            stale_count += 1
+            if dry_run:
+                if stale_count <= 3:
+                    logging.info(f"DRY-RUN: {doc['_id']}: {doc.get('search_index')} -> {expected}")
+                continue
+
+            batch_updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"search_index": expected}}))
             # Execute batch when it reaches batch_size
             if len(batch_updates) >= batch_size:
-                result = mongo_db.Books.bulk_write([
-                    {"updateOne": update} for update in batch_updates
-                ])
-                updated_count += result.modified_count
-                logging.info(f"Updated {updated_count}/{missing_search_index} documents")
+                updated_count += mongo_db.Books.bulk_write(batch_updates, ordered=False).modified_count
+                logging.info(f"Updated {updated_count} documents")
                 batch_updates = []
-        
+
         # Execute remaining updates
         if batch_updates:
-            result = mongo_db.Books.bulk_write([
-                {"updateOne": update} for update in batch_updates
-            ])
-            updated_count += result.modified_count
-        
+            updated_count += mongo_db.Books.bulk_write(batch_updates, ordered=False).modified_count
+
+        if dry_run:
+            logging.info(f"DRY-RUN: documents with missing or stale search_index: {stale_count}")
+            return stale_count
         logging.info(f"search_index fields updated: {updated_count}")
         return updated_count
-    
+
     except PyMongoError as e:
         logging.error(f"Failed to update search_index fields: {e}")
         return 0
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Inventory layout migration script
+- to-collection: copy embedded Stores.inventory entries into the Inventory collection
+- to-embedded: copy Inventory documents back into Stores.inventory arrays
+- Idempotent upserts - safe to run multiple times
+- Dry-run mode to preview changes without writing
+
+Switch the backend with BOOKSTORE_INVENTORY_LAYOUT=collection (or embedded)
+after the migration has finished.
+
+Usage:
+  python3 script/migrate_inventory_layout.py \
+    --mongo-uri mongodb://localhost:27017 \
+    --mongo-db bookstore \
+    --direction to-collection \
+    --dry-run
+"""
+
+import argparse
+import logging
+
+try:
+    from pymongo import MongoClient, ASCENDING, UpdateOne
+    from pymongo.errors import PyMongoError
+except Exception:
+    MongoClient = None  # type: ignore
+    PyMongoError = Exception  # type: ignore
+
+
+logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Migrate store inventory between embedded and collection layouts")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017", help="MongoDB connection URI")
+    parser.add_argument("--mongo-db", default="bookstore", help="MongoDB database name")
+    parser.add_argument("--direction", choices=["to-collection", "to-embedded"], default="to-collection",
+                        help="Migration direction")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Bulk write batch size")
+    parser.add_argument("--clear-source", action="store_true",
+                        help="Clear the source layout after copying (empties Stores.inventory or drops Inventory docs)")
+    parser.add_argument("--dry-run", action="store_true", help="Preview only, no writes")
+    return parser.parse_args()
+
+
+def connect_mongo(uri: str, db_name: str):
+    if MongoClient is None:
+        raise RuntimeError("pymongo is not installed. Install with: pip install pymongo")
+    client = MongoClient(uri)
+    return client[db_name]
+
+
+def ensure_inventory_index(mongo_db, dry_run: bool) -> None:
+    if dry_run:
+        logging.info("[DRY-RUN] Would create unique index Inventory(store_id, book_id)")
+        return
+    mongo_db.Inventory.create_index(
+        [("store_id", ASCENDING), ("book_id", ASCENDING)],
+        name="inventory_store_book", unique=True
+    )
+
+
+def flush(collection, ops: list, dry_run: bool) -> int:
+    if not ops:
+        return 0
+    if dry_run:
+        return len(ops)
+    collection.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def migrate_to_collection(mongo_db, batch_size: int, clear_source: bool, dry_run: bool) -> int:
+    """Stores.inventory -> Inventory: one upsert per (store_id, book_id)."""
+    ops = []
+    migrated = 0
+    for store in mongo_db.Stores.find({"inventory.0": {"$exists": True}}, {"inventory": 1}):
+        for item in store.get("inventory", []):
+            ops.append(UpdateOne(
+                {"store_id": store["_id"], "book_id": item["book_id"]},
+                {"$set": {
+                    "stock_level": item.get("stock_level", 0),
+                    "price": item.get("price"),
+                }},
+                upsert=True,
+            ))
+            if len(ops) >= batch_size:
+                migrated += flush(mongo_db.Inventory, ops, dry_run)
+                ops = []
+    migrated += flush(mongo_db.Inventory, ops, dry_run)
+
+    if clear_source:
+        if dry_run:
+            logging.info("[DRY-RUN] Would empty Stores.inventory arrays")
+        else:
+            mongo_db.Stores.update_many({}, {"$set": {"inventory": []}})
+    return migrated
+
+
+def migrate_to_embedded(mongo_db, clear_source: bool, dry_run: bool) -> int:
+    """Inventory -> Stores.inventory: rebuild each store's array in one write."""
+    migrated = 0
+    pipeline = [
+        {"$group": {
+            "_id": "$store_id",
+            "inventory": {"$push": {
+                "book_id": "$book_id",
+                "stock_level": "$stock_level",
+                "price": "$price",
+            }},
+        }},
+    ]
+    for group in mongo_db.Inventory.aggregate(pipeline, allowDiskUse=True):
+        migrated += len(group["inventory"])
+        if dry_run:
+            continue
+        mongo_db.Stores.update_one({"_id": group["_id"]}, {"$set": {"inventory": group["inventory"]}})
+
+    if clear_source:
+        if dry_run:
+            logging.info("[DRY-RUN] Would delete all Inventory documents")
+        else:
+            mongo_db.Inventory.delete_many({})
+    return migrated
+
+
+def main():
+    args = parse_args()
+    try:
+        mongo_db = connect_mongo(args.mongo_uri, args.mongo_db)
+        ensure_inventory_index(mongo_db, args.dry_run)
+        if args.direction == "to-collection":
+            count = migrate_to_collection(mongo_db, args.batch_size, args.clear_source, args.dry_run)
+        else:
+            count = migrate_to_embedded(mongo_db, args.clear_source, args.dry_run)
+    except PyMongoError as e:
+        logging.error(f"inventory migration failed: {e}")
+        return
+    logging.info(f"Summary: direction={args.direction}, items={count}, dry_run={args.dry_run}")
+
+
+if __name__ == "__main__":
+    main()
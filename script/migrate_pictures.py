@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Book picture migration script
+- Moves inline pictures out of Books documents into the picture store
+  (GridFS bucket "pictures" or a local directory, see be/model/picture.py)
+- Reads both legacy layouts: base64 strings in `pictures` and the raw
+  `picture` blob written by migrate_sqlite_to_mongo.py
+- Content-addressed: identical pictures are stored once; Books keeps only picture_ids
+- Idempotent - documents that already have picture_ids and no inline data are skipped
+- Dry-run mode to preview changes without writing
+
+The store backend follows the server configuration, so run it with the same
+BOOKSTORE_PICTURE_STORE / BOOKSTORE_PICTURE_DIR as the server.
+
+Usage:
+  python3 script/migrate_pictures.py \
+    --mongo-uri mongodb://localhost:27017 \
+    --mongo-db bookstore \
+    --dry-run
+"""
+
+import argparse
+import base64
+import binascii
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+try:
+    from pymongo import MongoClient, UpdateOne
+    from pymongo.errors import PyMongoError
+except Exception:
+    MongoClient = None  # type: ignore
+    PyMongoError = Exception  # type: ignore
+
+from be.model import picture
+
+
+logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Move inline Books pictures into the picture store")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017", help="MongoDB connection URI")
+    parser.add_argument("--mongo-db", default="bookstore", help="MongoDB database name")
+    parser.add_argument("--batch-size", type=int, default=100, help="Books documents per bulk write")
+    parser.add_argument("--dry-run", action="store_true", help="Preview only, no writes")
+    return parser.parse_args()
+
+
+def connect_mongo(uri: str, db_name: str):
+    if MongoClient is None:
+        raise RuntimeError("pymongo is not installed. Install with: pip install pymongo")
+    client = MongoClient(uri)
+    return client[db_name]
+
+
+def inline_pictures(doc: dict) -> list:
+    """Raw bytes of every inline picture in a Books document (invalid base64 is skipped)."""
+    blobs = []
+    if doc.get("picture"):
+        blobs.append(bytes(doc["picture"]))
+    for encoded in doc.get("pictures") or []:
+        try:
+            blobs.append(base64.b64decode(encoded, validate=True))
+        except (binascii.Error, TypeError):
+            logging.warning(f"book {doc['_id']}: skipping invalid base64 picture")
+    return blobs
+
+
+def flush(collection, ops: list, dry_run: bool) -> int:
+    if not ops:
+        return 0
+    if not dry_run:
+        collection.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def migrate(mongo_db, batch_size: int, dry_run: bool) -> (int, int):
+    """Returns (books updated, distinct pictures)."""
+    query = {"$or": [{"pictures.0": {"$exists": True}}, {"picture": {"$exists": True}}]}
+    ops = []
+    updated = 0
+    seen = set()
+    for doc in mongo_db.Books.find(query, {"picture": 1, "pictures": 1}).batch_size(batch_size):
+        picture_ids = []
+        for data in inline_pictures(doc):
+            picture_id = picture.content_id(data) if dry_run else picture.save(mongo_db, data)
+            picture_ids.append(picture_id)
+            seen.add(picture_id)
+        update = {"$unset": {"picture": "", "pictures": ""}}
+        if picture_ids:
+            update["$addToSet"] = {"picture_ids": {"$each": list(dict.fromkeys(picture_ids))}}
+        ops.append(UpdateOne({"_id": doc["_id"]}, update))
+        if len(ops) >= batch_size:
+            updated += flush(mongo_db.Books, ops, dry_run)
+            ops = []
+    updated += flush(mongo_db.Books, ops, dry_run)
+    return updated, len(seen)
+
+
+def main():
+    args = parse_args()
+    try:
+        mongo_db = connect_mongo(args.mongo_uri, args.mongo_db)
+        books, pictures = migrate(mongo_db, args.batch_size, args.dry_run)
+    except PyMongoError as e:
+        logging.error(f"picture migration failed: {e}")
+        return
+    logging.info(f"Summary: books={books}, distinct pictures={pictures}, dry_run={args.dry_run}")
+
+
+if __name__ == "__main__":
+    main()
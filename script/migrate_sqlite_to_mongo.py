@@ -21,9 +21,12 @@ import json
 import logging
 import os
 import sqlite3
+import sys
 import time
 from typing import Dict, List, Optional, Tuple
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
 try:
     from pymongo import MongoClient, ASCENDING
     from pymongo.errors import PyMongoError
@@ -31,6 +34,8 @@ except Exception:
     MongoClient = None  # type: ignore
     PyMongoError = Exception  # type: ignore
 
+from be.model import search_index
+
 
 logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 
@@ -285,15 +290,6 @@ def migrate_books(book_conn: Optional[sqlite3.Connection], mongo_db, dry_run: bo
     total = row_count(book_conn, "book")
     logging.info(f"books: {total} rows")
 
-    def to_lower(s: Optional[str]) -> Optional[str]:
-        return s.lower() if isinstance(s, str) else None
-
-    def tags_lower(tags: Optional[str]) -> List[str]:
-        if not tags:
-            return []
-        parts = [t.strip().lower() for t in tags.replace("\n", ",").split(",") if t.strip()]
-        return parts
-
     if dry_run:
         sample = book_conn.execute(
             "SELECT id, title, author, tags FROM book LIMIT 3"
@@ -325,10 +321,8 @@ def migrate_books(book_conn: Optional[sqlite3.Connection], mongo_db, dry_run: bo
             "content": r["content"],
             "tags": r["tags"],
             "picture": r["picture"],
-            "search_index": {
-                "title_lower": to_lower(r["title"]),
-                "tags_lower": tags_lower(r["tags"]),
-            },
+            # 与上架写入、搜索查询使用同一套归一化（be/model/search_index.py）
+            "search_index": search_index.build(r["title"], r["tags"]),
         }
         mongo_db.Books.update_one({"_id": doc["_id"]}, {"$set": doc}, upsert=True)
         count += 1
@@ -343,6 +337,7 @@ def create_indexes(mongo_db):
         mongo_db.Stores.create_index([("inventory.book_id", ASCENDING)])
         # Orders 复合索引 + 超时索引
         mongo_db.Orders.create_index([("buyer_id", ASCENDING), ("status", ASCENDING), ("create_time", -1)], name="orders_by_buyer_status_time")
+        mongo_db.Orders.create_index([("buyer_id", ASCENDING), ("create_time", -1), ("_id", -1)], name="orders_by_buyer_time")
         mongo_db.Orders.create_index([("status", ASCENDING), ("create_time", ASCENDING)], name="orders_status_create_time")
         mongo_db.Orders.create_index([("status", ASCENDING), ("timeout_at", ASCENDING)], name="orders_timeout_scan")
         # Books 文本索引（集合只能有一个 text 索引）
@@ -363,8 +358,10 @@ def create_indexes(mongo_db):
         except Exception:
             pass
         # 前缀索引：title/tags
-        mongo_db.Books.create_index([("search_index.title_lower", ASCENDING)])
+        mongo_db.Books.create_index([("search_index.title_lower", ASCENDING), ("_id", ASCENDING)])
         mongo_db.Books.create_index([("search_index.tags_lower", ASCENDING)])
+        mongo_db.Books.create_index([("store_ids", ASCENDING), ("search_index.title_lower", ASCENDING),
+                                     ("_id", ASCENDING)], name="books_by_store_title_id")
         logging.info("indexes created/verified")
     except PyMongoError as e:
         logging.error(f"create_indexes failed: {e}")